@@ -1 +1 @@
-# Backend application package
\ No newline at end of file
+# Backend application package
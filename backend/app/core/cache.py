@@ -0,0 +1,406 @@
+import itertools
+import json
+import math
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Set
+
+import numpy as np
+
+from app.config import settings
+from app.core.metrics import metrics
+
+
+class TTLCache:
+    """In-process LRU map whose entries also expire after a fixed TTL."""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.pop(key, None)
+        return entry[1] if entry is not None else None
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class SemanticCache(ABC):
+    """Per-user cache of answers keyed by question embedding.
+
+    A lookup hits when a cached question is at least `threshold` cosine
+    similar to the new one. Each entry records the documents its answer was
+    built from, so reprocessing or deleting any of them drops the entry.
+
+    Invalidation also bumps the user's generation. Callers read it before
+    retrieving context and pass it to store(), which drops the answer if the
+    generation moved on meanwhile: it may have been built from documents
+    that were invalidated while it was being generated.
+    """
+
+    def __init__(
+        self,
+        threshold: float = None,
+        ttl_seconds: int = None,
+        max_entries_per_user: int = None,
+    ):
+        self.threshold = threshold or settings.ANSWER_CACHE_SIMILARITY
+        self.ttl_seconds = ttl_seconds or settings.REDIS_CACHE_TTL
+        self.max_entries_per_user = (
+            max_entries_per_user or settings.ANSWER_CACHE_MAX_ENTRIES
+        )
+
+    def lookup(self, user_id: str, vector: np.ndarray) -> Optional[Dict[str, Any]]:
+        """Return the cached payload for the closest question, if close enough."""
+        payload = self._lookup(user_id, _unit(vector))
+        metrics.incr(
+            "answer_cache.hits" if payload is not None else "answer_cache.misses"
+        )
+        return payload
+
+    def generation(self, user_id: str) -> int:
+        """The user's current generation, to pass to store() later."""
+        return self._generation(user_id)
+
+    def store(
+        self,
+        user_id: str,
+        vector: np.ndarray,
+        payload: Dict[str, Any],
+        document_ids: Sequence[str],
+        generation: int,
+    ) -> bool:
+        """Cache an answer unless the user's documents were invalidated since
+        `generation`; returns whether it was.
+        """
+        stored = self._store(
+            user_id,
+            _unit(vector),
+            payload,
+            list(dict.fromkeys(document_ids)),
+            generation,
+        )
+        if not stored:
+            metrics.incr("answer_cache.stale_stores")
+        return stored
+
+    def invalidate_documents(self, user_id: str, document_ids: Sequence[str]) -> int:
+        """Drop every entry built from any of the given documents."""
+        dropped = self._invalidate_documents(user_id, list(document_ids))
+        if dropped:
+            metrics.incr("answer_cache.invalidations", dropped)
+        return dropped
+
+    @abstractmethod
+    def _lookup(self, user_id: str, vector: np.ndarray) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def _generation(self, user_id: str) -> int: ...
+
+    @abstractmethod
+    def _store(
+        self,
+        user_id: str,
+        vector: np.ndarray,
+        payload: Dict[str, Any],
+        document_ids: List[str],
+        generation: int,
+    ) -> bool: ...
+
+    @abstractmethod
+    def _invalidate_documents(self, user_id: str, document_ids: List[str]) -> int: ...
+
+
+class _UserAnswers:
+    """Answers cached for one user, least recently used first."""
+
+    def __init__(self, generation: int):
+        self.generation = generation
+        # id -> (vector, payload, document_ids, expires_at)
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.by_document: Dict[str, Set[str]] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_ids: List[str] = []
+
+    def matrix(self):
+        if self._matrix is None:
+            self._matrix_ids = list(self.entries)
+            self._matrix = (
+                np.stack([self.entries[entry_id][0] for entry_id in self._matrix_ids])
+                if self.entries
+                else None
+            )
+        return self._matrix, self._matrix_ids
+
+    def remove(self, entry_id: str) -> None:
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for document_id in entry[2]:
+            ids = self.by_document.get(document_id)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self.by_document[document_id]
+        self._matrix = None
+
+
+class InMemorySemanticCache(SemanticCache):
+    """Semantic cache held in this process; for single-process deployments.
+
+    At most `max_users` users are kept, least recently used evicted first.
+    Generations come from one process-wide counter, so a user evicted and
+    seen again never gets back a generation an in-flight store still holds.
+    """
+
+    def __init__(self, max_users: int = None, **kwargs):
+        super().__init__(**kwargs)
+        self.max_users = max_users or settings.ANSWER_CACHE_MAX_USERS
+        self._users: "OrderedDict[str, _UserAnswers]" = OrderedDict()
+        self._generations = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _user(self, user_id: str) -> _UserAnswers:
+        """The user's answers, created if needed; call with the lock held."""
+        answers = self._users.get(user_id)
+        if answers is None:
+            answers = self._users[user_id] = _UserAnswers(next(self._generations))
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return answers
+
+    def _generation(self, user_id):
+        with self._lock:
+            return self._user(user_id).generation
+
+    def _lookup(self, user_id, vector):
+        with self._lock:
+            answers = self._users.get(user_id)
+            if answers is None or not answers.entries:
+                return None
+            self._users.move_to_end(user_id)
+
+            matrix, entry_ids = answers.matrix()
+            similarities = matrix @ vector
+            now = time.time()
+            for index in np.argsort(-similarities):
+                if similarities[index] < self.threshold:
+                    return None
+                entry_id = entry_ids[index]
+                _, payload, _, expires_at = answers.entries[entry_id]
+                if expires_at < now:
+                    answers.remove(entry_id)
+                    continue
+                answers.entries.move_to_end(entry_id)
+                return payload
+            return None
+
+    def _store(self, user_id, vector, payload, document_ids, generation):
+        with self._lock:
+            answers = self._user(user_id)
+            if answers.generation != generation:
+                return False
+            entry_id = uuid.uuid4().hex
+            answers.entries[entry_id] = (
+                vector,
+                payload,
+                document_ids,
+                time.time() + self.ttl_seconds,
+            )
+            for document_id in document_ids:
+                answers.by_document.setdefault(document_id, set()).add(entry_id)
+            answers._matrix = None
+            while len(answers.entries) > self.max_entries_per_user:
+                answers.remove(next(iter(answers.entries)))
+            return True
+
+    def _invalidate_documents(self, user_id, document_ids):
+        with self._lock:
+            answers = self._users.get(user_id)
+            if answers is None:
+                return 0
+            answers.generation = next(self._generations)
+            entry_ids = set()
+            for document_id in document_ids:
+                entry_ids |= answers.by_document.get(document_id, set())
+            for entry_id in entry_ids:
+                answers.remove(entry_id)
+            return len(entry_ids)
+
+
+class RedisSemanticCache(SemanticCache):
+    """Semantic cache shared by every API and worker process through Redis.
+
+    Per user: a hash of float16 question vectors, a hash of JSON entries, a
+    sorted set ordering entries by last use, one set per source document
+    listing the entries built from it, and a generation counter. Keys expire
+    REDIS_CACHE_TTL after the user's last cache write; stores WATCH the
+    generation, so an invalidation landing mid-store aborts it.
+    """
+
+    def __init__(self, url: str = None, prefix: str = "answers:", **kwargs):
+        super().__init__(**kwargs)
+        import redis
+
+        self.redis = redis.Redis.from_url(url or settings.REDIS_URL)
+        self.prefix = prefix
+        self._watch_error = redis.WatchError
+
+    def _key(self, user_id: str, name: str) -> str:
+        return f"{self.prefix}{user_id}:{name}"
+
+    def _lookup(self, user_id, vector):
+        stored = self.redis.hgetall(self._key(user_id, "vectors"))
+        if not stored:
+            return None
+
+        # Skip vectors from a previous embedding backend with another dimension
+        entry_ids = [
+            entry_id for entry_id, raw in stored.items() if len(raw) == 2 * vector.size
+        ]
+        if not entry_ids:
+            return None
+        matrix = np.stack(
+            [
+                np.frombuffer(stored[entry_id], dtype=np.float16)
+                for entry_id in entry_ids
+            ]
+        ).astype(np.float32)
+        similarities = matrix @ vector
+        now = time.time()
+        for index in np.argsort(-similarities):
+            if similarities[index] < self.threshold:
+                return None
+            entry_id = entry_ids[index].decode()
+            raw = self.redis.hget(self._key(user_id, "entries"), entry_id)
+            if raw is None:
+                continue
+            entry = json.loads(raw)
+            if entry["expires_at"] < now:
+                self._remove(user_id, [entry_id])
+                continue
+            self.redis.zadd(self._key(user_id, "lru"), {entry_id: now})
+            return entry["payload"]
+        return None
+
+    def _generation(self, user_id):
+        return int(self.redis.get(self._key(user_id, "generation")) or 0)
+
+    def _store(self, user_id, vector, payload, document_ids, generation):
+        entry_id = uuid.uuid4().hex
+        now = time.time()
+        entry = {
+            "payload": payload,
+            "documents": document_ids,
+            "expires_at": now + self.ttl_seconds,
+        }
+        keys = [self._key(user_id, name) for name in ("vectors", "entries", "lru")]
+        key_ttl = max(1, math.ceil(self.ttl_seconds))
+
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(self._key(user_id, "generation"))
+                if int(pipe.get(self._key(user_id, "generation")) or 0) != generation:
+                    return False
+                pipe.multi()
+                pipe.hset(keys[0], entry_id, vector.astype(np.float16).tobytes())
+                pipe.hset(keys[1], entry_id, json.dumps(entry))
+                pipe.zadd(keys[2], {entry_id: now})
+                for document_id in document_ids:
+                    document_key = self._key(user_id, f"doc:{document_id}")
+                    pipe.sadd(document_key, entry_id)
+                    pipe.expire(document_key, key_ttl)
+                for key in keys:
+                    pipe.expire(key, key_ttl)
+                pipe.zcard(keys[2])
+                size = pipe.execute()[-1]
+            except self._watch_error:
+                return False
+
+        if size > self.max_entries_per_user:
+            evicted = self.redis.zrange(
+                keys[2], 0, size - self.max_entries_per_user - 1
+            )
+            self._remove(user_id, [entry_id.decode() for entry_id in evicted])
+        return True
+
+    def _remove(self, user_id: str, entry_ids: List[str]) -> None:
+        if not entry_ids:
+            return
+        entries = self.redis.hmget(self._key(user_id, "entries"), entry_ids)
+        pipe = self.redis.pipeline()
+        for entry_id, raw in zip(entry_ids, entries):
+            if raw is not None:
+                for document_id in json.loads(raw)["documents"]:
+                    pipe.srem(self._key(user_id, f"doc:{document_id}"), entry_id)
+        pipe.hdel(self._key(user_id, "vectors"), *entry_ids)
+        pipe.hdel(self._key(user_id, "entries"), *entry_ids)
+        pipe.zrem(self._key(user_id, "lru"), *entry_ids)
+        pipe.execute()
+
+    def _invalidate_documents(self, user_id, document_ids):
+        pipe = self.redis.pipeline()
+        pipe.incr(self._key(user_id, "generation"))
+        # Outlives the entries, so a generation never returns to one a store still holds
+        pipe.expire(
+            self._key(user_id, "generation"), max(1, math.ceil(self.ttl_seconds)) * 2
+        )
+        pipe.execute()
+        entry_ids = set()
+        for document_id in document_ids:
+            entry_ids |= {
+                entry_id.decode()
+                for entry_id in self.redis.smembers(
+                    self._key(user_id, f"doc:{document_id}")
+                )
+            }
+        self._remove(user_id, list(entry_ids))
+        return len(entry_ids)
+
+
+@lru_cache()
+def get_answer_cache() -> Optional[SemanticCache]:
+    """Return the process-wide answer cache selected by ANSWER_CACHE_BACKEND, or None if
+    disabled.
+    """
+    if settings.ANSWER_CACHE_BACKEND == "none":
+        return None
+    if settings.ANSWER_CACHE_BACKEND == "memory":
+        return InMemorySemanticCache()
+    if settings.ANSWER_CACHE_BACKEND == "redis":
+        return RedisSemanticCache()
+    raise ValueError(f"Unknown answer cache backend: {settings.ANSWER_CACHE_BACKEND}")
@@ -0,0 +1,31 @@
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock; run a single writer process there
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path: Path, exclusive: bool = True) -> Iterator[None]:
+    """Hold an advisory flock on `path` for the duration of the block.
+
+    Writers take it exclusively; readers take it shared while they load, so
+    they never see a writer's half-replaced files. A shared lock on a
+    directory that does not exist yet is a no-op: there is nothing to read.
+    """
+    if fcntl is None or (not exclusive and not path.parent.exists()):
+        yield
+        return
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
@@ -0,0 +1,435 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.core.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+SearchHit = Tuple[str, float]
+
+# Words, plus compound identifiers such as "user-004", "v1.2.3" or "app/main.py"
+_TOKEN_PATTERN = re.compile(r"\b\w+(?:[-./:]\w+)+")
+_WORD_PATTERN = re.compile(r"\w+")
+_MAX_TOKEN_LENGTH = 64
+_MAX_TF = 65535
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased terms for indexing and querying.
+
+    A compound identifier is kept whole as well as split into its words, so
+    "user-004" matches both an exact lookup and a search for "user".
+    """
+    text = text.lower()
+    terms = _WORD_PATTERN.findall(text) + _TOKEN_PATTERN.findall(text)
+    return [term for term in terms if len(term) <= _MAX_TOKEN_LENGTH]
+
+
+class Postings:
+    """Row ordinals and term frequencies for one term, in two growable arrays."""
+
+    __slots__ = ("rows", "tfs")
+
+    def __init__(self, rows: array = None, tfs: array = None):
+        self.rows = rows if rows is not None else array("I")
+        self.tfs = tfs if tfs is not None else array("H")
+
+
+class LexicalPartition:
+    """BM25 inverted index over the chunks of a single user.
+
+    Postings are array-backed and scored with vectorised NumPy, so a query
+    only touches the postings of its own terms. Additions are appended to a
+    log and deletes are tombstones; once the log grows past
+    LEXICAL_SNAPSHOT_ROWS rows, or tombstones pile up, the live index is
+    written to a compact snapshot and a new log generation is started.
+
+    Several processes may share a partition: mutations run under an
+    exclusive flock on its lock file (see writing()), and reloads under a
+    shared one.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.key = directory.name
+        self.state_path = directory / "state.json"
+        self.lock_path = directory / ".lock"
+        self.lock = threading.RLock()
+        self._stamp = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self.generation = 0
+        self.snapshot_rows = 0  # rows [0, snapshot_rows) were loaded from the snapshot
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._lengths = array("I")
+        self._deleted = np.zeros(0, dtype=bool)
+        self._live_length = 0
+        self._postings: Dict[str, Postings] = {}
+
+    # Persistence
+
+    def _path(self, name: str, generation: int = None) -> Path:
+        generation = self.generation if generation is None else generation
+        return self.directory / f"{name}-{generation}"
+
+    @property
+    def log_path(self) -> Path:
+        return self._path("postings.log")
+
+    @property
+    def deleted_path(self) -> Path:
+        return self._path("deleted.txt")
+
+    @property
+    def snapshot_path(self) -> Path:
+        return self._path("snapshot.npz")
+
+    def _file_stamp(self):
+        def size(path: Path) -> int:
+            try:
+                return path.stat().st_size
+            except FileNotFoundError:
+                return -1
+
+        try:
+            # compact() swaps in a new state.json of the same length, so compare its
+            # identity: another process's compaction moves us to files we don't watch
+            state = self.state_path.stat()
+            state_stamp = state.st_ino, state.st_mtime_ns
+        except FileNotFoundError:
+            state_stamp = None
+
+        return state_stamp, size(self.log_path), size(self.deleted_path)
+
+    def load(self) -> None:
+        """(Re)load the partition from its snapshot and log."""
+        self._reset()
+        if self.state_path.exists():
+            self.generation = json.loads(self.state_path.read_text()).get(
+                "generation", 0
+            )
+
+        if self.snapshot_path.exists():
+            self._load_snapshot()
+
+        if self.log_path.exists():
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A crash mid-append can leave a torn last line
+                        break
+                    self._append(entry["id"], entry["tf"])
+
+        self._deleted = np.zeros(len(self._ids), dtype=bool)
+        if self.deleted_path.exists():
+            for row in self.deleted_path.read_text().split():
+                self._tombstone(int(row))
+
+        self._rows = {
+            chunk_id: row
+            for row, chunk_id in enumerate(self._ids)
+            if not self._deleted[row]
+        }
+        self._stamp = self._file_stamp()
+
+    def _load_snapshot(self) -> None:
+        with np.load(self.snapshot_path, allow_pickle=False) as snapshot:
+            self._ids = snapshot["ids"].tolist()
+            self._lengths = array("I", snapshot["lengths"].tobytes())
+            offsets = snapshot["offsets"]
+            rows = snapshot["rows"]
+            tfs = snapshot["tfs"]
+            for i, term in enumerate(snapshot["terms"].tolist()):
+                start, end = offsets[i], offsets[i + 1]
+                self._postings[term] = Postings(
+                    array("I", rows[start:end].tobytes()),
+                    array("H", tfs[start:end].tobytes()),
+                )
+        self._live_length = int(
+            np.frombuffer(self._lengths, dtype=np.uint32).sum(dtype=np.int64)
+        )
+        self.snapshot_rows = len(self._ids)
+
+    def _write_snapshot(self, generation: int) -> None:
+        terms = list(self._postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(self._postings[term].rows) for term in terms])
+
+        tmp_path = self._path("snapshot.tmp", generation)
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                ids=np.asarray(self._ids, dtype=str),
+                lengths=np.frombuffer(self._lengths, dtype=np.uint32),
+                terms=np.asarray(terms, dtype=str),
+                offsets=offsets,
+                rows=np.frombuffer(
+                    b"".join(self._postings[term].rows.tobytes() for term in terms),
+                    dtype=np.uint32,
+                ),
+                tfs=np.frombuffer(
+                    b"".join(self._postings[term].tfs.tobytes() for term in terms),
+                    dtype=np.uint16,
+                ),
+            )
+        os.replace(tmp_path, self._path("snapshot.npz", generation))
+
+    def refresh(self) -> None:
+        """Reload if another process has changed the partition on disk."""
+        if self._file_stamp() != self._stamp:
+            with file_lock(self.lock_path, exclusive=False):
+                self.load()
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        """Hold the partition's exclusive file lock, brought up to date, for a
+        mutation."""
+        with file_lock(self.lock_path):
+            # Another process may have appended or compacted since our last look
+            if self._file_stamp() != self._stamp:
+                self.load()
+            yield
+
+    # Mutations
+
+    @property
+    def live_count(self) -> int:
+        return len(self._rows)
+
+    def _append(self, chunk_id: str, term_counts: Dict[str, int]) -> int:
+        row = len(self._ids)
+        self._ids.append(chunk_id)
+        length = sum(term_counts.values())
+        self._lengths.append(length)
+        self._live_length += length
+
+        postings = self._postings
+        for term, count in term_counts.items():
+            entry = postings.get(term)
+            if entry is None:
+                entry = postings[term] = Postings()
+            entry.rows.append(row)
+            entry.tfs.append(count if count < _MAX_TF else _MAX_TF)
+        return row
+
+    def _tombstone(self, row: int) -> None:
+        if row < len(self._deleted) and not self._deleted[row]:
+            self._deleted[row] = True
+            self._live_length -= self._lengths[row]
+
+    def add(self, ids: Sequence[str], texts: Sequence[str]) -> None:
+        # Re-adding an ID replaces its old entry
+        self.delete([chunk_id for chunk_id in ids if chunk_id in self._rows])
+
+        entries = [
+            (chunk_id, dict(Counter(tokenize(text))))
+            for chunk_id, text in zip(ids, texts)
+        ]
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(
+                "".join(
+                    json.dumps({"id": chunk_id, "tf": tf}) + "\n"
+                    for chunk_id, tf in entries
+                )
+            )
+
+        for chunk_id, tf in entries:
+            self._rows[chunk_id] = self._append(chunk_id, tf)
+        self._deleted = np.concatenate(
+            [self._deleted, np.zeros(len(entries), dtype=bool)]
+        )
+
+        if len(self._ids) - self.snapshot_rows > max(
+            settings.LEXICAL_SNAPSHOT_ROWS, self.snapshot_rows // 10
+        ):
+            self.compact()
+
+        self._stamp = self._file_stamp()
+
+    def delete(self, ids: Iterable[str]) -> None:
+        rows = [self._rows.pop(chunk_id) for chunk_id in ids if chunk_id in self._rows]
+        if not rows:
+            return
+
+        with open(self.deleted_path, "a") as f:
+            f.write("".join(f"{row}\n" for row in rows))
+        for row in rows:
+            self._tombstone(row)
+
+        deleted = int(self._deleted.sum())
+        if deleted > 1000 and deleted > len(self._ids) * 0.3:
+            self.compact()
+
+        self._stamp = self._file_stamp()
+
+    def compact(self) -> None:
+        """Snapshot the live index under a new generation and drop the old files."""
+        live = ~self._deleted
+        # New ordinal for each live row
+        remap = (np.cumsum(live) - 1).astype(np.uint32)
+
+        postings = {}
+        for term, entry in self._postings.items():
+            rows = np.frombuffer(entry.rows, dtype=np.uint32)
+            keep = live[rows]
+            if keep.any():
+                tfs = np.frombuffer(entry.tfs, dtype=np.uint16)
+                postings[term] = Postings(
+                    array("I", remap[rows[keep]].tobytes()),
+                    array("H", tfs[keep].tobytes()),
+                )
+
+        live_rows = np.flatnonzero(live)
+        self._ids = [self._ids[row] for row in live_rows]
+        self._lengths = array(
+            "I", np.frombuffer(self._lengths, dtype=np.uint32)[live_rows].tobytes()
+        )
+        self._postings = postings
+
+        old_generation = self.generation
+        new_generation = old_generation + 1
+        self._write_snapshot(new_generation)
+
+        tmp_path = self.state_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"generation": new_generation}))
+        os.replace(tmp_path, self.state_path)
+
+        for name in ("postings.log", "deleted.txt", "snapshot.npz"):
+            path = self._path(name, old_generation)
+            if path.exists():
+                path.unlink()
+
+        self.generation = new_generation
+        self.snapshot_rows = len(self._ids)
+        self._deleted = np.zeros(len(self._ids), dtype=bool)
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+
+    # Queries
+
+    def search(self, query: str, k: int) -> List[SearchHit]:
+        live_count = self.live_count
+        if live_count == 0 or k <= 0:
+            return []
+
+        k1, b = settings.BM25_K1, settings.BM25_B
+        average_length = max(self._live_length / live_count, 1.0)
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32)
+        scores = np.zeros(len(self._ids), dtype=np.float32)
+        has_deletes = live_count < len(self._ids)
+
+        for term, query_count in Counter(tokenize(query)).items():
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            rows = np.frombuffer(postings.rows, dtype=np.uint32)
+            tfs = np.frombuffer(postings.tfs, dtype=np.uint16).astype(np.float32)
+            if has_deletes:
+                live = ~self._deleted[rows]
+                rows, tfs = rows[live], tfs[live]
+            document_frequency = len(rows)
+            if document_frequency == 0:
+                continue
+
+            idf = math.log(
+                1 + (live_count - document_frequency + 0.5) / (document_frequency + 0.5)
+            )
+            norm = k1 * (1 - b + b * lengths[rows] / average_length)
+            # Rows are unique within a posting list, so plain fancy-index add is safe
+            scores[rows] += query_count * idf * tfs * (k1 + 1) / (tfs + norm)
+
+        candidates = np.flatnonzero(scores)
+        if k < candidates.size:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(self._ids[row], float(scores[row])) for row in candidates]
+
+    def destroy(self) -> None:
+        for path in self.directory.glob("*"):
+            # The lock file stays: another process may be waiting on it
+            if path != self.lock_path:
+                path.unlink()
+        self._reset()
+
+
+class LexicalIndex:
+    """Per-user BM25 index with lazily opened, LRU-bounded partitions."""
+
+    def __init__(self, root: Path = None, max_open_partitions: int = None):
+        self.root = Path(root or settings.VECTOR_STORE_PATH) / "lexical"
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_open_partitions = (
+            max_open_partitions or settings.VECTOR_MAX_OPEN_PARTITIONS
+        )
+        self._partitions: "OrderedDict[str, LexicalPartition]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _partition(self, user_id: str) -> LexicalPartition:
+        key = re.sub(r"[^A-Za-z0-9_-]", "_", user_id)
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is None:
+                partition = LexicalPartition(self.root / key)
+                partition.refresh()
+                self._partitions[key] = partition
+                while len(self._partitions) > self.max_open_partitions:
+                    self._partitions.popitem(last=False)
+            else:
+                self._partitions.move_to_end(key)
+        return partition
+
+    def add(self, user_id: str, ids: Sequence[str], texts: Sequence[str]) -> None:
+        """Index or re-index the given chunks."""
+        if not len(ids):
+            return
+        partition = self._partition(user_id)
+        with partition.lock, partition.writing():
+            partition.add(list(ids), list(texts))
+
+    def delete(self, user_id: str, ids: Iterable[str]) -> None:
+        """Remove the given chunks from the index."""
+        partition = self._partition(user_id)
+        with partition.lock, partition.writing():
+            partition.delete(ids)
+
+    def search(self, user_id: str, query: str, k: int) -> List[SearchHit]:
+        """Return up to k (chunk_id, bm25_score) pairs, best first."""
+        partition = self._partition(user_id)
+        with partition.lock:
+            partition.refresh()
+            return partition.search(query, k)
+
+    def count(self, user_id: str) -> int:
+        partition = self._partition(user_id)
+        with partition.lock:
+            partition.refresh()
+            return partition.live_count
+
+    def drop_user(self, user_id: str) -> None:
+        """Delete a user's whole partition."""
+        partition = self._partition(user_id)
+        with partition.lock, file_lock(partition.lock_path):
+            partition.destroy()
+
+
+@lru_cache()
+def get_lexical_index() -> LexicalIndex:
+    """Return the process-wide lexical index."""
+    return LexicalIndex()
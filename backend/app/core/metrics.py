@@ -0,0 +1,46 @@
+import threading
+from collections import defaultdict
+from typing import Dict
+
+
+class Metrics:
+    """Process-wide counters and timing summaries, exposed on /admin/metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._timings: Dict[str, Dict[str, float]] = {}
+
+    def incr(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, value: float) -> None:
+        """Record one sample (e.g. a latency in milliseconds)."""
+        with self._lock:
+            summary = self._timings.get(name)
+            if summary is None:
+                summary = self._timings[name] = {"count": 0, "sum": 0.0, "max": 0.0}
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+
+    def counter(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            timings = {
+                name: {
+                    **summary,
+                    "avg": (
+                        summary["sum"] / summary["count"] if summary["count"] else 0.0
+                    ),
+                }
+                for name, summary in self._timings.items()
+            }
+            return {"counters": dict(self._counters), "timings": timings}
+
+
+metrics = Metrics()
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Optional, Tuple, TypeVar
+
+from app.config import settings
+from app.core.metrics import metrics
+from app.core.security import get_password_hash, verify_and_update_password
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop, in a bounded pool.
+
+    At most `workers` operations run at once and `queue_limit` more may
+    wait; beyond that calls fail fast with PasswordHasherBusy, so a login
+    storm is turned away instead of queueing without bound. bcrypt releases
+    the GIL while hashing, so the default thread pool runs hashes in
+    parallel. The process pool is there for hash schemes that do not
+    release it.
+    """
+
+    def __init__(
+        self, executor: str = None, workers: int = None, queue_limit: int = None
+    ):
+        self.mode = executor or settings.PASSWORD_HASH_EXECUTOR
+        self.workers = workers or settings.PASSWORD_HASH_WORKERS
+        self.capacity = self.workers + (
+            queue_limit
+            if queue_limit is not None
+            else settings.PASSWORD_HASH_QUEUE_LIMIT
+        )
+        self._executor: Optional[Executor] = None
+        if self.mode == "thread":
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="password-hash"
+            )
+        elif self.mode == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        elif self.mode != "inline":
+            raise ValueError(f"Unknown password hash executor: {self.mode}")
+        self._inflight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+    async def verify_and_update(
+        self, password: str, hashed: str
+    ) -> Tuple[bool, Optional[str]]:
+        """Verify a password; the second value is a replacement hash when the stored one
+        is outdated.
+        """
+        return await self._run(verify_and_update_password, password, hashed)
+
+    async def _run(self, fn: Callable[..., T], *args) -> T:
+        with self._lock:
+            if self._inflight >= self.capacity:
+                metrics.incr("password_hash.rejected")
+                raise PasswordHasherBusy("Too many password operations in progress")
+            self._inflight += 1
+        start = time.perf_counter()
+        try:
+            if self._executor is None:
+                return fn(*args)
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, fn, *args
+            )
+        finally:
+            with self._lock:
+                self._inflight -= 1
+            metrics.observe(
+                "password_hash.latency_ms", (time.perf_counter() - start) * 1000
+            )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+@lru_cache()
+def get_password_hasher() -> PasswordHasher:
+    """Return the process-wide password hasher configured by PASSWORD_HASH_EXECUTOR."""
+    return PasswordHasher()
@@ -0,0 +1,252 @@
+import asyncio
+import json
+import logging
+import threading
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from functools import lru_cache
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.core.cache import TTLCache
+from app.core.metrics import metrics
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+# Session.info key holding the token subjects to drop once the transaction commits
+_PENDING = "principal_cache_invalidations"
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Immutable snapshot of an authenticated user, enough for routes that only need who
+    is calling.
+    """
+
+    id: str
+    email: str
+    username: str
+    is_active: bool
+    is_verified: bool
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            id=user.id,
+            email=user.email,
+            username=user.username,
+            is_active=user.is_active,
+            is_verified=user.is_verified,
+            created_at=user.created_at,
+            updated_at=user.updated_at,
+        )
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        for name in ("created_at", "updated_at"):
+            data[name] = data[name].isoformat() if data[name] else None
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "Principal":
+        data = json.loads(raw)
+        for name in ("created_at", "updated_at"):
+            data[name] = datetime.fromisoformat(data[name]) if data[name] else None
+        return cls(**data)
+
+
+class PrincipalCache:
+    """Authenticated users by token subject, so a request can skip the user lookup.
+
+    The in-process LRU answers most requests. With a Redis URL, a shared
+    tier sits behind it and the in-process TTL is cut to
+    PRINCIPAL_CACHE_LOCAL_TTL_SECONDS. That bounds how long another process
+    keeps serving a user after an update; the process making the change
+    and Redis are invalidated at once. A lookup that started before an
+    invalidation does not store its (possibly stale) result.
+    """
+
+    def __init__(
+        self,
+        max_size: int = None,
+        ttl_seconds: int = None,
+        redis_url: str = None,
+        prefix: str = "principal:",
+    ):
+        self.ttl_seconds = ttl_seconds or settings.PRINCIPAL_CACHE_TTL_SECONDS
+        self.prefix = prefix
+        self.redis = None
+        local_ttl = self.ttl_seconds
+        if redis_url:
+            import redis.asyncio as redis
+
+            self.redis = redis.Redis.from_url(redis_url, decode_responses=True)
+            local_ttl = min(local_ttl, settings.PRINCIPAL_CACHE_LOCAL_TTL_SECONDS)
+        self._local = TTLCache(max_size or settings.PRINCIPAL_CACHE_SIZE, local_ttl)
+        self._lock = threading.Lock()
+        self.generation = 0  # bumped by every invalidation
+        # the loop the Redis client runs on
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending_deletes: Set[asyncio.Future] = set()
+
+    async def get(self, subject: str) -> Optional[Principal]:
+        with self._lock:
+            principal = self._local.get(subject)
+        if principal is not None:
+            metrics.incr("principal_cache.local_hits")
+            return principal
+
+        if self.redis is not None:
+            self._loop = asyncio.get_running_loop()
+            try:
+                raw = await self.redis.get(self.prefix + subject)
+            except Exception as e:
+                logger.warning(f"Principal cache lookup failed: {str(e)}")
+                raw = None
+            if raw is not None:
+                principal = Principal.from_json(raw)
+                with self._lock:
+                    self._local.put(subject, principal)
+                metrics.incr("principal_cache.redis_hits")
+                return principal
+
+        metrics.incr("principal_cache.misses")
+        return None
+
+    async def put(self, principal: Principal, generation: int) -> None:
+        """Cache a principal read from the database, unless anything was invalidated
+        since `generation`.
+        """
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._local.put(principal.email, principal)
+        if self.redis is not None:
+            try:
+                await self.redis.set(
+                    self.prefix + principal.email,
+                    principal.to_json(),
+                    ex=self.ttl_seconds,
+                )
+            except Exception as e:
+                logger.warning(f"Principal cache store failed: {str(e)}")
+
+    async def invalidate(self, subjects: Iterable[str]) -> None:
+        """Drop users from both tiers; call after committing a change to them."""
+        subjects = self._invalidate_local(subjects)
+        if subjects and self.redis is not None:
+            await self._delete_shared(subjects)
+
+    def invalidate_soon(self, subjects: Iterable[str]) -> None:
+        """Drop users from this process now and from Redis in the background.
+
+        For callers that cannot await, such as ORM hooks. Outside the event
+        loop's thread, and before the cache has been used on a loop, the
+        Redis entries are left to expire after PRINCIPAL_CACHE_TTL_SECONDS.
+        """
+        subjects = self._invalidate_local(subjects)
+        if not subjects or self.redis is None:
+            return
+        try:
+            future = asyncio.get_running_loop().create_task(
+                self._delete_shared(subjects)
+            )
+        except RuntimeError:
+            if self._loop is None or self._loop.is_closed():
+                return
+            future = asyncio.run_coroutine_threadsafe(
+                self._delete_shared(subjects), self._loop
+            )
+        self._pending_deletes.add(future)
+        future.add_done_callback(self._pending_deletes.discard)
+
+    def _invalidate_local(self, subjects: Iterable[str]) -> List[str]:
+        subjects = [subject for subject in subjects if subject]
+        if not subjects:
+            return subjects
+        with self._lock:
+            self.generation += 1
+            for subject in subjects:
+                self._local.pop(subject)
+        metrics.incr("principal_cache.invalidations", len(subjects))
+        return subjects
+
+    async def _delete_shared(self, subjects: List[str]) -> None:
+        try:
+            await self.redis.delete(*(self.prefix + subject for subject in subjects))
+        except Exception as e:
+            logger.error(f"Principal cache invalidation failed: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        local_hits = metrics.counter("principal_cache.local_hits")
+        redis_hits = metrics.counter("principal_cache.redis_hits")
+        misses = metrics.counter("principal_cache.misses")
+        lookups = local_hits + redis_hits + misses
+        with self._lock:
+            size = len(self._local)
+        return {
+            "entries": size,
+            "local_hits": local_hits,
+            "redis_hits": redis_hits,
+            "misses": misses,
+            "hit_rate": (local_hits + redis_hits) / lookups if lookups else 0.0,
+        }
+
+
+@lru_cache()
+def get_principal_cache() -> Optional[PrincipalCache]:
+    """Return the process-wide principal cache selected by PRINCIPAL_CACHE_BACKEND, or
+    None if disabled.
+    """
+    if settings.PRINCIPAL_CACHE_BACKEND == "none":
+        return None
+    if settings.PRINCIPAL_CACHE_BACKEND == "memory":
+        return PrincipalCache()
+    if settings.PRINCIPAL_CACHE_BACKEND == "redis":
+        return PrincipalCache(redis_url=settings.REDIS_URL)
+    raise ValueError(
+        f"Unknown principal cache backend: {settings.PRINCIPAL_CACHE_BACKEND}"
+    )
+
+
+async def invalidate_principals(*subjects: str) -> None:
+    """Drop users from the principal cache after committing a change to them.
+
+    Changes made through ORM objects are picked up by the hooks below, but
+    bulk UPDATE statements are not, so code issuing them must call this.
+    """
+    cache = get_principal_cache()
+    if cache is not None:
+        await cache.invalidate(subjects)
+
+
+# Users changed through ORM objects leave the cache once their transaction commits
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, User):
+            pending = session.info.setdefault(_PENDING, set())
+            pending.add(obj.email)
+            pending.update(inspect(obj).attrs.email.history.deleted or ())
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session):
+    subjects = session.info.pop(_PENDING, None)
+    cache = get_principal_cache()
+    if subjects and cache is not None:
+        cache.invalidate_soon(subjects)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_users(session):
+    session.info.pop(_PENDING, None)
@@ -0,0 +1,89 @@
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.config import settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RequestQueries:
+    """Statements one request issued, across every engine and session it used."""
+
+    count: int = 0
+    total_ms: float = 0.0
+    statements: Counter = field(default_factory=Counter)
+
+    def record(self, statement: str, elapsed_ms: float) -> None:
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.statements[statement] += 1
+
+
+_current: ContextVar[Optional[RequestQueries]] = ContextVar(
+    "request_queries", default=None
+)
+
+
+def begin_request() -> Token:
+    """Start counting statements for the current request."""
+    return _current.set(RequestQueries())
+
+
+def end_request(token: Token, route: str) -> RequestQueries:
+    """Stop counting, record the request's totals under `route` and flag likely N+1
+    patterns.
+    """
+    queries = _current.get()
+    _current.reset(token)
+    if queries is None or not queries.count:
+        return queries
+
+    metrics.observe(f"db.route.{route}.queries", queries.count)
+    metrics.observe(f"db.route.{route}.query_ms", queries.total_ms)
+    if queries.count > settings.DATABASE_QUERY_WARN_COUNT:
+        metrics.incr("db.chatty_requests")
+        logger.warning(
+            f"{route} issued {queries.count} statements ({queries.total_ms:.0f} ms)"
+        )
+    statement, repeats = queries.statements.most_common(1)[0]
+    if repeats >= settings.DATABASE_REPEATED_QUERY_WARN:
+        metrics.incr("db.repeated_query_requests")
+        logger.warning(
+            f"{route} ran the same statement {repeats} times, likely an N+1: "
+            f"{statement[:300]}"
+        )
+    return queries
+
+
+def instrument_engine(engine: Engine, role: str) -> None:
+    """Time every statement `engine` executes; pass `async_engine.sync_engine` for async
+    engines.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _finish(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - context._query_started) * 1000
+        metrics.incr("db.queries")
+        metrics.incr(f"db.queries.{role}")
+        metrics.observe("db.query_ms", elapsed_ms)
+        queries = _current.get()
+        if queries is not None:
+            queries.record(statement, elapsed_ms)
+        if elapsed_ms >= settings.DATABASE_SLOW_QUERY_MS:
+            metrics.incr("db.slow_queries")
+            logger.warning(
+                f"Slow query on {role} ({elapsed_ms:.0f} ms): {statement[:500]}"
+            )
@@ -0,0 +1,234 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from app.config import settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """`requests` per `window_seconds`, all of which may arrive as a burst."""
+
+    requests: int
+    window_seconds: float
+
+    @classmethod
+    def parse(cls, rule: str) -> "RateLimit":
+        """Parse a "requests/seconds" rule such as "20/60"."""
+        try:
+            requests, window = rule.split("/")
+            limit = cls(int(requests), float(window))
+        except ValueError:
+            raise ValueError(
+                f"Invalid rate limit {rule!r}; expected requests/seconds, e.g. 20/60"
+            )
+        if limit.requests < 1 or limit.window_seconds <= 0:
+            raise ValueError(
+                f"Invalid rate limit {rule!r}; requests and seconds must be positive"
+            )
+        return limit
+
+    @property
+    def interval_ms(self) -> float:
+        return self.window_seconds * 1000 / self.requests
+
+    @property
+    def window_ms(self) -> float:
+        return self.window_seconds * 1000
+
+
+@dataclass
+class RateLimitDecision:
+    allowed: bool
+    limit: RateLimit  # the most constraining limit checked
+    remaining: int  # further requests allowed right now under that limit
+    retry_after: float  # seconds until a rejected request would be allowed
+    reset_after: float  # seconds until that limit is fully replenished
+
+
+class RateLimitPolicy:
+    """Which limits a request counts against.
+
+    Every caller, a user when the request carries a valid token and an IP
+    address otherwise, has the default limit. Requests whose path starts
+    with a RATE_LIMIT_ROUTES prefix also count against that route's limit,
+    separately per caller; the longest matching prefix wins.
+    """
+
+    def __init__(self, default: RateLimit, routes: Dict[str, RateLimit]):
+        self.default = default
+        self.routes = sorted(
+            routes.items(), key=lambda item: len(item[0]), reverse=True
+        )
+
+    @classmethod
+    def from_settings(cls) -> "RateLimitPolicy":
+        return cls(
+            RateLimit(settings.RATE_LIMIT_REQUESTS, settings.RATE_LIMIT_WINDOW),
+            {
+                prefix: RateLimit.parse(rule)
+                for prefix, rule in settings.RATE_LIMIT_ROUTES.items()
+            },
+        )
+
+    def checks(self, identity: str, path: str) -> List[Tuple[str, RateLimit]]:
+        checks = [(identity, self.default)]
+        for prefix, limit in self.routes:
+            if path.startswith(prefix):
+                checks.append((f"{identity}|{prefix}", limit))
+                break
+        return checks
+
+
+def _decide(
+    checks: List[Tuple[str, RateLimit]], tats: List[float], now: float
+) -> Tuple[RateLimitDecision, List[float]]:
+    """GCRA over several limits: allowed only if every limit allows it. Returns the
+    decision and new arrival times.
+    """
+    new_tats, retry_after, tightest = [], 0.0, None
+    for (_, limit), tat in zip(checks, tats):
+        new_tat = max(tat, now) + limit.interval_ms
+        retry_after = max(retry_after, new_tat - limit.window_ms - now)
+        remaining = int((now + limit.window_ms - new_tat) // limit.interval_ms)
+        if tightest is None or remaining < tightest[1]:
+            tightest = (limit, remaining, new_tat)
+        new_tats.append(new_tat)
+
+    limit, remaining, new_tat = tightest
+    if retry_after > 0:
+        reset_after = new_tat - limit.interval_ms - now
+        return (
+            RateLimitDecision(False, limit, 0, retry_after / 1000, reset_after / 1000),
+            [],
+        )
+    return (
+        RateLimitDecision(True, limit, max(0, remaining), 0.0, (new_tat - now) / 1000),
+        new_tats,
+    )
+
+
+class InMemoryRateLimiter:
+    """Per-process GCRA limiter: one float (the theoretical arrival time) per key.
+
+    A key whose arrival time has passed is fully replenished and carries no
+    state, so idle keys are dropped as they reach the front of the LRU
+    order. At most RATE_LIMIT_MAX_KEYS keys are held; beyond that the
+    least recently seen is dropped, which only forgives its history.
+    """
+
+    def __init__(self, max_keys: int = None):
+        self.max_keys = max_keys or settings.RATE_LIMIT_MAX_KEYS
+        self._tats: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def hit(self, checks: List[Tuple[str, RateLimit]]) -> RateLimitDecision:
+        now = time.monotonic() * 1000
+        with self._lock:
+            decision, new_tats = _decide(
+                checks, [self._tats.get(key, 0.0) for key, _ in checks], now
+            )
+            for (key, _), tat in zip(checks, new_tats):
+                self._tats[key] = tat
+                self._tats.move_to_end(key)
+            self._evict(now)
+        return decision
+
+    def _evict(self, now: float) -> None:
+        while self._tats:
+            key, tat = next(iter(self._tats.items()))
+            if tat > now and len(self._tats) <= self.max_keys:
+                break
+            del self._tats[key]
+
+    def __len__(self) -> int:
+        return len(self._tats)
+
+
+class RedisRateLimiter:
+    """GCRA limiter shared by every worker through Redis.
+
+    One Lua script checks and updates all of a request's limits atomically,
+    using the Redis clock so workers' clocks need not agree. Keys expire
+    once fully replenished. If Redis is unreachable requests are let
+    through rather than failing the whole API.
+    """
+
+    # KEYS: one per limit | ARGV: interval_ms, window_ms per limit
+    # Returns {allowed, retry_after_ms, index of the tightest limit, remaining,
+    #          reset_after_ms}
+    _HIT = """
+        local clock = redis.call('TIME')
+        local now = tonumber(clock[1]) * 1000 + tonumber(clock[2]) / 1000
+        local tats, new_tats, retry, tightest, tightest_remaining = {}, {}, 0, 1, nil
+        for i, key in ipairs(KEYS) do
+            local interval, window = tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])
+            local tat = math.max(tonumber(redis.call('GET', key) or 0), now)
+            local new_tat = tat + interval
+            retry = math.max(retry, new_tat - window - now)
+            local remaining = math.floor((now + window - new_tat) / interval)
+            if tightest_remaining == nil or remaining < tightest_remaining then
+                tightest, tightest_remaining = i, remaining
+            end
+            tats[i], new_tats[i] = tat, new_tat
+        end
+        if retry > 0 then
+            return {0, tostring(retry), tightest, 0, tostring(tats[tightest] - now)}
+        end
+        for i, key in ipairs(KEYS) do
+            local ttl = math.ceil(new_tats[i] - now)
+            redis.call('SET', key, tostring(new_tats[i]), 'PX', ttl)
+        end
+        local reset = tostring(new_tats[tightest] - now)
+        return {1, '0', tightest, math.max(tightest_remaining, 0), reset}
+    """
+
+    def __init__(self, url: str = None, prefix: str = "ratelimit:"):
+        import redis.asyncio as redis
+
+        self.redis = redis.Redis.from_url(
+            url or settings.REDIS_URL, decode_responses=True
+        )
+        self.prefix = prefix
+        self._hit_script = self.redis.register_script(self._HIT)
+
+    async def hit(self, checks: List[Tuple[str, RateLimit]]) -> RateLimitDecision:
+        args = []
+        for _, limit in checks:
+            args.extend([limit.interval_ms, limit.window_ms])
+        try:
+            allowed, retry_ms, tightest, remaining, reset_ms = await self._hit_script(
+                keys=[self.prefix + key for key, _ in checks], args=args
+            )
+        except Exception as e:
+            metrics.incr("rate_limit.backend_errors")
+            logger.warning(f"Rate limit check failed, allowing request: {e}")
+            return RateLimitDecision(
+                True, checks[0][1], checks[0][1].requests, 0.0, 0.0
+            )
+        limit = checks[int(tightest) - 1][1]
+        return RateLimitDecision(
+            bool(allowed),
+            limit,
+            int(remaining),
+            math.ceil(float(retry_ms)) / 1000,
+            float(reset_ms) / 1000,
+        )
+
+
+@lru_cache()
+def get_rate_limiter():
+    """Return the process-wide rate limiter selected by RATE_LIMIT_BACKEND."""
+    if settings.RATE_LIMIT_BACKEND == "memory":
+        return InMemoryRateLimiter()
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        return RedisRateLimiter()
+    raise ValueError(f"Unknown rate limit backend: {settings.RATE_LIMIT_BACKEND}")
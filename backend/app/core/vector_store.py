@@ -0,0 +1,603 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.core.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+SearchHit = Tuple[str, float]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first."""
+    if k <= 0 or scores.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < scores.size:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class AnnIndex(ABC):
+    """Approximate nearest-neighbour index over the rows of one partition."""
+
+    # Whether add/remove can be applied in place; otherwise new rows are
+    # brute-forced until the next rebuild and deleted rows are filtered out.
+    incremental = False
+
+    def __init__(self, partition: "UserPartition"):
+        self.partition = partition
+
+    @abstractmethod
+    def open(self) -> bool:
+        """Load a previously built index. Returns False if there is none."""
+
+    @abstractmethod
+    def build(self, vectors: np.ndarray, rows: np.ndarray) -> None:
+        """Index the given rows of `vectors`, replacing any previous build."""
+
+    def add(self, vectors: np.ndarray, rows: np.ndarray) -> None:
+        """Index new rows in place; only called on incremental indexes."""
+        raise NotImplementedError(f"{type(self).__name__} is not incremental")
+
+    def remove(self, rows: Sequence[int]) -> None:
+        """Drop rows in place; only called on incremental indexes."""
+        raise NotImplementedError(f"{type(self).__name__} is not incremental")
+
+    @abstractmethod
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (rows, scores) for the k best matches."""
+
+    @abstractmethod
+    def destroy(self) -> None:
+        """Delete the index and whatever it stored."""
+
+
+class FaissAnnIndex(AnnIndex):
+    """FAISS HNSW or IVF index, memory-mapped from disk where FAISS supports it."""
+
+    def __init__(self, partition: "UserPartition"):
+        super().__init__(partition)
+        self.path = partition.directory / "faiss.index"
+        self.index = None
+
+    def open(self) -> bool:
+        import faiss
+
+        if not self.path.exists():
+            return False
+        self.index = faiss.read_index(
+            str(self.path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        )
+        self._configure(self.index)
+        return True
+
+    def _configure(self, index) -> None:
+        import faiss
+
+        inner = faiss.downcast_index(index.index) if hasattr(index, "index") else index
+        if isinstance(inner, faiss.IndexIVF):
+            inner.nprobe = settings.FAISS_IVF_NPROBE
+        elif isinstance(inner, faiss.IndexHNSW):
+            inner.hnsw.efSearch = max(64, settings.FAISS_HNSW_M * 2)
+
+    def build(self, vectors: np.ndarray, rows: np.ndarray) -> None:
+        import faiss
+
+        dimension = vectors.shape[1]
+        if settings.FAISS_INDEX_TYPE == "ivf":
+            # ~4*sqrt(n) lists, but never fewer than 39 training points per list
+            nlist = int(max(1, min(4 * math.sqrt(len(rows)), len(rows) // 39, 65536)))
+            quantizer = faiss.IndexFlatIP(dimension)
+            inner = faiss.IndexIVFFlat(
+                quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT
+            )
+            sample = np.random.default_rng(0).choice(
+                len(rows), min(len(rows), nlist * 64), replace=False
+            )
+            inner.train(np.ascontiguousarray(vectors[rows[np.sort(sample)]]))
+        elif settings.FAISS_INDEX_TYPE == "hnsw":
+            inner = faiss.IndexHNSWFlat(
+                dimension, settings.FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT
+            )
+        else:
+            raise ValueError(f"Unknown FAISS index type: {settings.FAISS_INDEX_TYPE}")
+
+        index = faiss.IndexIDMap(inner)
+        for start in range(0, len(rows), 50000):
+            batch = rows[start : start + 50000]
+            index.add_with_ids(
+                np.ascontiguousarray(vectors[batch]), batch.astype(np.int64)
+            )
+
+        tmp_path = self.path.with_suffix(".tmp")
+        faiss.write_index(index, str(tmp_path))
+        os.replace(tmp_path, self.path)
+
+        # Re-open from disk so the built index is served memory-mapped
+        del index
+        self.open()
+
+    def search(self, query, k):
+        scores, rows = self.index.search(query.reshape(1, -1), k)
+        keep = rows[0] >= 0
+        return rows[0][keep], scores[0][keep]
+
+    def destroy(self) -> None:
+        self.index = None
+        if self.path.exists():
+            self.path.unlink()
+
+
+class ChromaAnnIndex(AnnIndex):
+    """One Chroma collection per user, updated in place."""
+
+    incremental = True
+
+    def __init__(self, partition: "UserPartition"):
+        super().__init__(partition)
+        self.collection_name = f"{settings.COLLECTION_NAME}-{partition.key}"[:63]
+        self.collection = None
+
+    @staticmethod
+    @lru_cache()
+    def _client():
+        import chromadb
+
+        return chromadb.PersistentClient(
+            path=str(settings.VECTOR_STORE_PATH / "chroma")
+        )
+
+    def _collection(self, create: bool):
+        if self.collection is None:
+            client = self._client()
+            if create:
+                self.collection = client.get_or_create_collection(
+                    self.collection_name, metadata={"hnsw:space": "ip"}
+                )
+            else:
+                try:
+                    self.collection = client.get_collection(self.collection_name)
+                except Exception:
+                    return None
+        return self.collection
+
+    def open(self) -> bool:
+        return self._collection(create=False) is not None
+
+    def build(self, vectors, rows):
+        self._collection(create=True)
+        self.add(vectors[rows], rows)
+
+    def add(self, vectors, rows):
+        collection = self._collection(create=True)
+        for start in range(0, len(rows), 5000):
+            collection.upsert(
+                ids=[str(row) for row in rows[start : start + 5000]],
+                embeddings=np.asarray(vectors[start : start + 5000]).tolist(),
+            )
+
+    def remove(self, rows):
+        if rows:
+            self._collection(create=True).delete(ids=[str(row) for row in rows])
+
+    def search(self, query, k):
+        collection = self._collection(create=True)
+        k = min(k, collection.count())
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        result = collection.query(query_embeddings=[query.tolist()], n_results=k)
+        rows = np.asarray([int(row) for row in result["ids"][0]], dtype=np.int64)
+        # Chroma reports inner-product distance as 1 - score
+        scores = 1.0 - np.asarray(result["distances"][0], dtype=np.float32)
+        return rows, scores
+
+    def destroy(self) -> None:
+        try:
+            self._client().delete_collection(self.collection_name)
+        except Exception:
+            pass
+        self.collection = None
+
+
+ANN_ENGINES = {
+    "faiss": FaissAnnIndex,
+    "chroma": ChromaAnnIndex,
+}
+
+
+class UserPartition:
+    """The vectors of a single user.
+
+    Vectors live in an append-only float32 file that is memory-mapped rather
+    than read into RAM, with a parallel file of chunk IDs. Deletes are
+    tombstones until the partition is compacted. Small partitions are
+    searched by brute force; once a partition holds more than
+    VECTOR_ANN_THRESHOLD live vectors an ANN index is built over it.
+
+    Several processes may share a partition: mutations run under an
+    exclusive flock on its lock file (see writing()), and reloads under a
+    shared one.
+    """
+
+    def __init__(self, directory: Path, engine: Optional[type], ann_threshold: int):
+        self.directory = directory
+        self.key = directory.name
+        self.engine = engine
+        self.ann_threshold = ann_threshold
+        self.vectors_path = directory / "vectors.f32"
+        self.ids_path = directory / "ids.txt"
+        self.deleted_path = directory / "deleted.txt"
+        self.meta_path = directory / "meta.json"
+        self.lock_path = directory / ".lock"
+        self.lock = threading.RLock()
+        self._stamp = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self.dimension: Optional[int] = None
+        self.ann_rows = 0  # rows [0, ann_rows) are covered by the ANN index
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._deleted = np.zeros(0, dtype=bool)
+        self._vectors: Optional[np.ndarray] = None
+        self._ann: Optional[AnnIndex] = None
+
+    # Persistence
+
+    def _file_stamp(self):
+        def size(path: Path) -> int:
+            try:
+                return path.stat().st_size
+            except FileNotFoundError:
+                return -1
+
+        return (
+            size(self.ids_path),
+            size(self.deleted_path),
+            size(self.meta_path),
+            size(self.vectors_path),
+        )
+
+    def _write_meta(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.meta_path.with_suffix(".tmp")
+        tmp_path.write_text(
+            json.dumps({"dimension": self.dimension, "ann_rows": self.ann_rows})
+        )
+        os.replace(tmp_path, self.meta_path)
+
+    def _map_vectors(self) -> None:
+        rows = len(self._ids)
+        if rows == 0 or self.dimension is None:
+            self._vectors = None
+            return
+        self._vectors = np.memmap(
+            self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dimension)
+        )
+
+    def load(self) -> None:
+        """(Re)load the partition from disk; cheap because vectors are memory-mapped."""
+        self._reset()
+        if self.meta_path.exists():
+            meta = json.loads(self.meta_path.read_text())
+            self.dimension = meta.get("dimension")
+            self.ann_rows = meta.get("ann_rows", 0)
+
+        if self.ids_path.exists() and self.dimension:
+            self._ids = self.ids_path.read_text().split()
+            stored_rows = self.vectors_path.stat().st_size // (4 * self.dimension)
+            # A crash between the two appends can leave trailing IDs without vectors
+            del self._ids[stored_rows:]
+
+        self._deleted = np.zeros(len(self._ids), dtype=bool)
+        if self.deleted_path.exists():
+            deleted = [int(row) for row in self.deleted_path.read_text().split()]
+            deleted = [row for row in deleted if row < len(self._ids)]
+            self._deleted[deleted] = True
+
+        self._rows = {
+            chunk_id: row
+            for row, chunk_id in enumerate(self._ids)
+            if not self._deleted[row]
+        }
+        self._map_vectors()
+
+        if self.engine and self.ann_rows:
+            ann = self.engine(self)
+            if ann.open():
+                self._ann = ann
+            else:
+                self.ann_rows = 0
+
+        self._stamp = self._file_stamp()
+
+    def refresh(self) -> None:
+        """Reload if another process has changed the partition on disk."""
+        if self._file_stamp() != self._stamp:
+            with file_lock(self.lock_path, exclusive=False):
+                self.load()
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        """Hold the partition's exclusive file lock, brought up to date, for a
+        mutation."""
+        with file_lock(self.lock_path):
+            # Another process may have appended or compacted since our last look
+            if self._file_stamp() != self._stamp:
+                self.load()
+            yield
+
+    # Mutations
+
+    @property
+    def live_count(self) -> int:
+        return len(self._rows)
+
+    def add(self, ids: Sequence[str], vectors: np.ndarray) -> None:
+        vectors = _normalize(vectors)
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+            self._write_meta()
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(
+                f"Vector dimension {vectors.shape[1]} does not match index dimension "
+                f"{self.dimension}"
+            )
+
+        # Re-adding an ID replaces its old vector
+        self.delete([chunk_id for chunk_id in ids if chunk_id in self._rows])
+
+        start = len(self._ids)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self.ids_path, "a") as f:
+            f.write("".join(f"{chunk_id}\n" for chunk_id in ids))
+
+        self._ids.extend(ids)
+        self._deleted = np.concatenate([self._deleted, np.zeros(len(ids), dtype=bool)])
+        new_rows = np.arange(start, start + len(ids))
+        self._rows.update(zip(ids, new_rows.tolist()))
+        self._map_vectors()
+
+        if self._ann is not None and self._ann.incremental:
+            self._ann.add(vectors, new_rows)
+            self.ann_rows = len(self._ids)
+            self._write_meta()
+        elif self.engine and self.live_count > self.ann_threshold:
+            delta = len(self._ids) - self.ann_rows
+            if self._ann is None or delta > max(
+                settings.VECTOR_ANN_DELTA_ROWS, self.ann_rows // 10
+            ):
+                self._build_ann()
+
+        self._stamp = self._file_stamp()
+
+    def delete(self, ids: Iterable[str]) -> None:
+        rows = [self._rows.pop(chunk_id) for chunk_id in ids if chunk_id in self._rows]
+        if not rows:
+            return
+
+        with open(self.deleted_path, "a") as f:
+            f.write("".join(f"{row}\n" for row in rows))
+        self._deleted[rows] = True
+        if self._ann is not None and self._ann.incremental:
+            self._ann.remove(rows)
+
+        deleted = int(self._deleted.sum())
+        if deleted > 1000 and deleted > len(self._ids) * 0.3:
+            self.compact()
+
+        self._stamp = self._file_stamp()
+
+    def _build_ann(self) -> None:
+        live_rows = np.flatnonzero(~self._deleted)
+        logger.info(
+            f"Building {self.engine.__name__} for partition {self.key} "
+            f"({len(live_rows)} vectors)"
+        )
+        if self._ann is not None:
+            self._ann.destroy()
+        ann = self.engine(self)
+        ann.build(self._vectors, live_rows)
+        self._ann = ann
+        self.ann_rows = len(self._ids)
+        self._write_meta()
+
+    def compact(self) -> None:
+        """Rewrite the partition without tombstoned rows."""
+        live_rows = np.flatnonzero(~self._deleted)
+        live_ids = [self._ids[row] for row in live_rows]
+
+        tmp_vectors = self.vectors_path.with_suffix(".tmp")
+        with open(tmp_vectors, "wb") as f:
+            for start in range(0, len(live_rows), 50000):
+                f.write(
+                    np.ascontiguousarray(
+                        self._vectors[live_rows[start : start + 50000]]
+                    ).tobytes()
+                )
+        tmp_ids = self.ids_path.with_suffix(".tmp")
+        tmp_ids.write_text("".join(f"{chunk_id}\n" for chunk_id in live_ids))
+
+        self._vectors = None
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_ids, self.ids_path)
+        if self.deleted_path.exists():
+            self.deleted_path.unlink()
+
+        had_ann = self._ann is not None
+        if had_ann:
+            self._ann.destroy()
+        self.ann_rows = 0
+        self._write_meta()
+        self.load()
+        if had_ann and self.live_count > self.ann_threshold:
+            self._build_ann()
+
+    # Queries
+
+    def get(self, ids: Sequence[str]) -> Dict[str, np.ndarray]:
+        found = [
+            (chunk_id, self._rows[chunk_id])
+            for chunk_id in ids
+            if chunk_id in self._rows
+        ]
+        if not found:
+            return {}
+        vectors = np.asarray(self._vectors[[row for _, row in found]])
+        return {chunk_id: vectors[i] for i, (chunk_id, _) in enumerate(found)}
+
+    def search(self, query: np.ndarray, k: int) -> List[SearchHit]:
+        if self.live_count == 0:
+            return []
+        query = _normalize(query.reshape(-1))
+        total = len(self._ids)
+
+        rows_parts, score_parts = [], []
+        brute_from = 0
+        if self._ann is not None:
+            # Over-fetch so tombstoned rows can be dropped without running short
+            ann_rows, ann_scores = self._ann.search(query, min(k * 2 + 10, total))
+            live = ~self._deleted[ann_rows]
+            rows_parts.append(ann_rows[live])
+            score_parts.append(ann_scores[live])
+            brute_from = self.ann_rows
+
+        if brute_from < total:
+            scores = np.asarray(self._vectors[brute_from:total] @ query)
+            scores[self._deleted[brute_from:total]] = -np.inf
+            best = _top_k(scores, k)
+            best = best[np.isfinite(scores[best])]
+            rows_parts.append(best + brute_from)
+            score_parts.append(scores[best])
+
+        rows = np.concatenate(rows_parts)
+        scores = np.concatenate(score_parts)
+        order = _top_k(scores, k)
+        return [(self._ids[int(rows[i])], float(scores[i])) for i in order]
+
+    def destroy(self) -> None:
+        if self._ann is not None:
+            self._ann.destroy()
+        for path in (
+            self.vectors_path,
+            self.ids_path,
+            self.deleted_path,
+            self.meta_path,
+        ):
+            if path.exists():
+                path.unlink()
+        self._reset()
+
+
+class VectorStore:
+    """Per-user vector index with lazily opened, LRU-bounded partitions.
+
+    Nothing is loaded at startup: a partition is opened on first use, kept
+    in a bounded LRU and re-read only if another process has changed it.
+    """
+
+    def __init__(
+        self,
+        root: Path = None,
+        engine: Optional[str] = None,
+        ann_threshold: int = None,
+        max_open_partitions: int = None,
+    ):
+        self.root = Path(root or settings.VECTOR_STORE_PATH) / "partitions"
+        self.root.mkdir(parents=True, exist_ok=True)
+        engine = engine or settings.VECTOR_STORE_TYPE
+        if engine not in ANN_ENGINES and engine != "numpy":
+            raise ValueError(f"Unknown vector store type: {engine}")
+        self.engine = ANN_ENGINES.get(engine)
+        self.ann_threshold = ann_threshold or settings.VECTOR_ANN_THRESHOLD
+        self.max_open_partitions = (
+            max_open_partitions or settings.VECTOR_MAX_OPEN_PARTITIONS
+        )
+        self._partitions: "OrderedDict[str, UserPartition]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _partition(self, user_id: str) -> UserPartition:
+        key = re.sub(r"[^A-Za-z0-9_-]", "_", user_id)
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is None:
+                partition = UserPartition(
+                    self.root / key, self.engine, self.ann_threshold
+                )
+                partition.refresh()
+                self._partitions[key] = partition
+                while len(self._partitions) > self.max_open_partitions:
+                    self._partitions.popitem(last=False)
+            else:
+                self._partitions.move_to_end(key)
+        return partition
+
+    def add(self, user_id: str, ids: Sequence[str], vectors: np.ndarray) -> None:
+        """Add or replace vectors for the given chunk IDs."""
+        if not len(ids):
+            return
+        partition = self._partition(user_id)
+        with partition.lock, partition.writing():
+            partition.add(list(ids), vectors)
+
+    def delete(self, user_id: str, ids: Iterable[str]) -> None:
+        """Remove vectors for the given chunk IDs."""
+        partition = self._partition(user_id)
+        with partition.lock, partition.writing():
+            partition.delete(ids)
+
+    def get(self, user_id: str, ids: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Return the stored (normalized) vectors of those chunk IDs that have one."""
+        partition = self._partition(user_id)
+        with partition.lock:
+            partition.refresh()
+            return partition.get(ids)
+
+    def search(self, user_id: str, query: np.ndarray, k: int) -> List[SearchHit]:
+        """Return up to k (chunk_id, score) pairs, best first."""
+        partition = self._partition(user_id)
+        with partition.lock:
+            partition.refresh()
+            return partition.search(query, k)
+
+    def count(self, user_id: str) -> int:
+        partition = self._partition(user_id)
+        with partition.lock:
+            partition.refresh()
+            return partition.live_count
+
+    def drop_user(self, user_id: str) -> None:
+        """Delete a user's whole partition."""
+        partition = self._partition(user_id)
+        with partition.lock, file_lock(partition.lock_path):
+            partition.destroy()
+
+
+@lru_cache()
+def get_vector_store() -> VectorStore:
+    """Return the process-wide vector store selected by VECTOR_STORE_TYPE."""
+    return VectorStore()
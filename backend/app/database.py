@@ -1,21 +1,199 @@
-from sqlalchemy import create_engine, MetaData
+import random
+import threading
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Optional
+
+from sqlalchemy import MetaData, create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.pool import StaticPool
+from sqlalchemy.sql import Select
 
 from app.config import settings
+from app.core.cache import TTLCache
+from app.core.query_metrics import instrument_engine
+
+# Async drivers for the sync URLs the app is configured with
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_database_url(url: str) -> str:
+    """The async-driver form of a database URL, e.g. postgresql:// ->
+    postgresql+asyncpg://.
+    """
+    parsed = make_url(url)
+    if parsed.drivername in ASYNC_DRIVERS.values():
+        return url
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for database backend: {backend}")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(
+        hide_password=False
+    )
+
+
+def engine_options(url: str) -> Dict[str, Any]:
+    """Pool and connection options shared by the sync and async engines."""
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite":
+        options: Dict[str, Any] = {"connect_args": {"check_same_thread": False}}
+        # An in-memory database lives in its connection, so every session must share it
+        if parsed.database in (None, "", ":memory:"):
+            options["poolclass"] = StaticPool
+        return options
+    return {
+        "pool_size": settings.DATABASE_POOL_SIZE,
+        "max_overflow": settings.DATABASE_MAX_OVERFLOW,
+        "pool_timeout": settings.DATABASE_POOL_TIMEOUT,
+        "pool_recycle": settings.DATABASE_POOL_RECYCLE,
+        "pool_pre_ping": settings.DATABASE_POOL_PRE_PING,
+    }
 
-# Create engine
+
+# Create engine (background workers, scripts and routes not yet ported to async)
 engine = create_engine(
     settings.DATABASE_URL,
-    poolclass=StaticPool,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {},
     echo=settings.DEBUG,
+    **engine_options(settings.DATABASE_URL),
 )
 
+# Async engine for request handlers; queries wait on the event loop, not block it
+async_engine = create_async_engine(
+    settings.DATABASE_ASYNC_URL or async_database_url(settings.DATABASE_URL),
+    echo=settings.DEBUG,
+    **engine_options(settings.DATABASE_URL),
+)
+
+# Read replicas, used only by sessions from get_async_read_db
+replica_engines = [
+    create_async_engine(
+        async_database_url(url), echo=settings.DEBUG, **engine_options(url)
+    )
+    for url in settings.DATABASE_REPLICA_URLS
+]
+
+instrument_engine(engine, "primary")
+instrument_engine(async_engine.sync_engine, "primary")
+for replica in replica_engines:
+    instrument_engine(replica.sync_engine, "replica")
+
+
+@dataclass
+class ReadScope:
+    """Read-your-writes state of one request."""
+
+    subject: Optional[str] = None  # the authenticated user, if any
+    wrote: bool = False  # a session in this request committed a write
+
+
+_read_scope: ContextVar[Optional[ReadScope]] = ContextVar("read_scope", default=None)
+
+# Users who wrote recently; their reads stay on the primary until replicas catch up
+_recent_writers = TTLCache(100000, settings.DATABASE_REPLICA_STICKY_SECONDS)
+_recent_writers_lock = threading.Lock()
+
+
+def begin_read_scope() -> Token:
+    return _read_scope.set(ReadScope())
+
+
+def end_read_scope(token: Token) -> None:
+    _read_scope.reset(token)
+
+
+def set_request_subject(subject: str) -> None:
+    """Tie the current request to a user, so their writes pin their later requests to
+    the primary.
+    """
+    scope = _read_scope.get()
+    if scope is not None:
+        scope.subject = subject
+
+
+def _reads_need_primary() -> bool:
+    scope = _read_scope.get()
+    if scope is None:
+        return False
+    if scope.wrote:
+        return True
+    if scope.subject is None:
+        return False
+    with _recent_writers_lock:
+        return _recent_writers.get(scope.subject) is not None
+
+
+class RoutingSession(Session):
+    """Session that can send reads to a replica.
+
+    Only sessions opened with info={"replica": True} (get_async_read_db) use
+    replicas, and only for plain SELECTs. Such a session moves to the primary
+    for good once it flushes, writes or locks a row, so a read-modify-write
+    never mixes a replica's view with the primary's. Reads also go to the
+    primary once the request has committed a write, and for
+    DATABASE_REPLICA_STICKY_SECONDS after the same user last wrote.
+    """
+
+    def get_bind(self, mapper=None, *, clause=None, bind=None, **kw):
+        if bind is not None:
+            return bind
+        primary = async_engine.sync_engine
+        if self._flushing or (clause is not None and clause.is_dml):
+            self.info["pinned"] = self.info["wrote"] = True
+            return primary
+        if clause is not None and (
+            not isinstance(clause, Select) or clause._for_update_arg is not None
+        ):
+            # Locking reads, raw SQL and the like
+            self.info["pinned"] = True
+            return primary
+        if (
+            clause is None
+            or not replica_engines
+            or not self.info.get("replica")
+            or self.info.get("pinned")
+            or _reads_need_primary()
+        ):
+            return primary
+        if "replica_bind" not in self.info:
+            self.info["replica_bind"] = random.choice(replica_engines).sync_engine
+        return self.info["replica_bind"]
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _note_committed_write(session):
+    if not session.info.pop("wrote", False):
+        return
+    scope = _read_scope.get()
+    if scope is None:
+        return
+    scope.wrote = True
+    if scope.subject is not None:
+        with _recent_writers_lock:
+            _recent_writers.put(scope.subject, True)
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _discard_rolled_back_write(session):
+    session.info.pop("wrote", None)
+
+
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Objects stay readable after commit; lazy loads would need an await
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    sync_session_class=RoutingSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 # Create Base class for models
 Base = declarative_base()
 
@@ -29,4 +207,16 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# Dependency to get an async DB session
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# Dependency to get an async DB session that reads from a replica when one is configured
+async def get_async_read_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal(info={"replica": True}) as db:
+        yield db
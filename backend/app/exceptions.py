@@ -1,15 +1,16 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+import logging
+
+from fastapi import FastAPI, Request
 from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
 from starlette.exceptions import HTTPException as StarletteHTTPException
-import logging
 
 logger = logging.getLogger(__name__)
 
 
 def setup_exception_handlers(app: FastAPI):
     """Setup exception handlers for the FastAPI application."""
-    
+
     @app.exception_handler(StarletteHTTPException)
     async def http_exception_handler(request: Request, exc: StarletteHTTPException):
         logger.warning(f"HTTP exception: {exc.status_code} - {exc.detail}")
@@ -20,15 +21,18 @@ def setup_exception_handlers(app: FastAPI):
                 "error": {
                     "code": f"HTTP_{exc.status_code}",
                     "message": exc.detail,
-                    "details": {}
+                    "details": {},
                 },
                 "timestamp": str(exc.status_code),
-                "request_id": getattr(request.state, "request_id", None)
-            }
+                "request_id": getattr(request.state, "request_id", None),
+            },
+            headers=getattr(exc, "headers", None),
         )
-    
+
     @app.exception_handler(RequestValidationError)
-    async def validation_exception_handler(request: Request, exc: RequestValidationError):
+    async def validation_exception_handler(
+        request: Request, exc: RequestValidationError
+    ):
         logger.warning(f"Validation error: {exc.errors()}")
         return JSONResponse(
             status_code=422,
@@ -37,13 +41,13 @@ def setup_exception_handlers(app: FastAPI):
                 "error": {
                     "code": "VALIDATION_ERROR",
                     "message": "Invalid input parameters",
-                    "details": exc.errors()
+                    "details": exc.errors(),
                 },
                 "timestamp": "validation_failed",
-                "request_id": getattr(request.state, "request_id", None)
-            }
+                "request_id": getattr(request.state, "request_id", None),
+            },
         )
-    
+
     @app.exception_handler(Exception)
     async def general_exception_handler(request: Request, exc: Exception):
         logger.error(f"Unexpected error: {str(exc)}", exc_info=True)
@@ -54,9 +58,9 @@ def setup_exception_handlers(app: FastAPI):
                 "error": {
                     "code": "INTERNAL_SERVER_ERROR",
                     "message": "An unexpected error occurred",
-                    "details": {"error": str(exc)} if request.app.debug else {}
+                    "details": {"error": str(exc)} if request.app.debug else {},
                 },
                 "timestamp": "server_error",
-                "request_id": getattr(request.state, "request_id", None)
-            }
-        )
\ No newline at end of file
+                "request_id": getattr(request.state, "request_id", None),
+            },
+        )
@@ -1,14 +1,24 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from contextlib import asynccontextmanager
-import logging
 
 from app.config import settings
-from app.database import engine, Base
-from app.routers import auth, documents, search, learning, admin
-from app.middleware import LoggingMiddleware, RateLimitMiddleware
+from app.core.password_hashing import get_password_hasher
+from app.database import Base, async_engine, engine
 from app.exceptions import setup_exception_handlers
+from app.middleware import (
+    DatabaseScopeMiddleware,
+    LoggingMiddleware,
+    RateLimitMiddleware,
+)
+from app.routers import admin, archive, auth, documents, learning, search
+from app.services.llm import get_llm_router
+from app.workers.runner import build_worker
+from app.workers.sessions import SessionMaintenance
 
 # Configure logging
 logging.basicConfig(
@@ -25,11 +35,29 @@ async def lifespan(app: FastAPI):
     # Create database tables
     Base.metadata.create_all(bind=engine)
     logger.info("Database tables created successfully")
-    
+
+    # Single-node installs process background jobs inside the API process
+    worker = worker_task = None
+    if settings.RUN_WORKERS_IN_PROCESS:
+        worker = build_worker()
+        worker_task = asyncio.create_task(worker.run())
+
+    # Writes buffered learning-session counts out and closes abandoned sessions
+    session_maintenance = SessionMaintenance(learning.learning_service)
+    session_maintenance_task = asyncio.create_task(session_maintenance.run())
+
     yield
-    
+
     # Shutdown
     logger.info("Shutting down AI Knowledge OS API...")
+    if worker:
+        await worker.stop()
+        await worker_task
+    await session_maintenance.stop()
+    await session_maintenance_task
+    await get_llm_router().aclose()
+    get_password_hasher().shutdown()
+    await async_engine.dispose()
 
 
 # Create FastAPI app
@@ -59,6 +87,7 @@ if not settings.DEBUG:
     )
 
 # Add custom middleware
+app.add_middleware(DatabaseScopeMiddleware)
 app.add_middleware(LoggingMiddleware)
 app.add_middleware(RateLimitMiddleware)
 
@@ -71,6 +100,7 @@ app.include_router(documents.router, prefix="/api/v1/documents", tags=["document
 app.include_router(search.router, prefix="/api/v1", tags=["search"])
 app.include_router(learning.router, prefix="/api/v1/learning", tags=["learning"])
 app.include_router(admin.router, prefix="/api/v1/admin", tags=["administration"])
+app.include_router(archive.router, prefix="/api/v1/archive", tags=["archive"])
 
 
 @app.get("/")
@@ -78,17 +108,15 @@ async def root():
     return {
         "message": "AI Personal Knowledge OS API",
         "version": "1.0.0",
-        "docs": "/docs" if settings.DEBUG else "Documentation not available in production"
+        "docs": (
+            "/docs" if settings.DEBUG else "Documentation not available in production"
+        ),
     }
 
 
 @app.get("/api/v1/health")
 async def health_check():
-    return {
-        "status": "healthy",
-        "service": "ai-knowledge-os",
-        "version": "1.0.0"
-    }
+    return {"status": "healthy", "service": "ai-knowledge-os", "version": "1.0.0"}
 
 
 @app.get("/api/v1/stats")
@@ -97,16 +125,17 @@ async def get_stats():
         "total_documents": 0,  # Will be implemented with actual database queries
         "total_users": 0,
         "total_searches": 0,
-        "system_status": "operational"
+        "system_status": "operational",
     }
 
 
 if __name__ == "__main__":
     import uvicorn
+
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=8000,
         reload=settings.DEBUG,
-        log_level=settings.LOG_LEVEL.lower()
-    )
\ No newline at end of file
+        log_level=settings.LOG_LEVEL.lower(),
+    )
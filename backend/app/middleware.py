@@ -1,83 +1,159 @@
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
-from time import time
-import uuid
 import logging
-from collections import defaultdict
-import asyncio
+import math
+import uuid
+from time import time
 
-from app.config import settings
+from fastapi import Request
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.core import query_metrics
+from app.core.metrics import metrics
+from app.core.rate_limit import RateLimitPolicy, get_rate_limiter
+from app.core.security import verify_token
+from app.database import begin_read_scope, end_read_scope
 
 logger = logging.getLogger(__name__)
 
 
 class LoggingMiddleware(BaseHTTPMiddleware):
     """Middleware for logging requests and responses."""
-    
+
     async def dispatch(self, request: Request, call_next):
         # Generate unique request ID
         request_id = str(uuid.uuid4())
         request.state.request_id = request_id
-        
+
         # Log request
         start_time = time()
         logger.info(f"Request {request_id}: {request.method} {request.url}")
-        
+
         # Process request
         response = await call_next(request)
-        
+
         # Log response
         process_time = time() - start_time
         logger.info(
             f"Response {request_id}: {response.status_code} - {process_time:.4f}s"
         )
-        
+
         # Add headers
         response.headers["X-Request-ID"] = request_id
         response.headers["X-Process-Time"] = str(process_time)
-        
+
         return response
 
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    """Simple rate limiting middleware."""
-    
+class RateLimitMiddleware:
+    """GCRA rate limiting per user (or per IP address when anonymous) and per route.
+
+    A plain ASGI middleware, so allowed requests only pay for the limiter
+    check. Limits come from the RATE_LIMIT_* settings and the state lives
+    in the backend from get_rate_limiter().
+    """
+
     def __init__(self, app):
-        super().__init__(app)
-        self.requests = defaultdict(list)
-        self.limit = settings.RATE_LIMIT_REQUESTS
-        self.window = settings.RATE_LIMIT_WINDOW
-    
-    async def dispatch(self, request: Request, call_next):
-        # Get client IP
-        client_ip = request.client.host
-        current_time = time()
-        
-        # Clean old requests
-        self.requests[client_ip] = [
-            req_time for req_time in self.requests[client_ip]
-            if current_time - req_time < self.window
+        self.app = app
+        self.policy = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Built on the first request so settings changed at startup apply
+        if self.policy is None:
+            self.policy = RateLimitPolicy.from_settings()
+        decision = await get_rate_limiter().hit(
+            self.policy.checks(self._identity(scope), scope["path"])
+        )
+        headers = [
+            (b"x-ratelimit-limit", str(decision.limit.requests).encode()),
+            (b"x-ratelimit-remaining", str(decision.remaining).encode()),
+            (b"x-ratelimit-reset", str(int(time() + decision.reset_after)).encode()),
         ]
-        
-        # Check rate limit
-        if len(self.requests[client_ip]) >= self.limit:
-            return Response(
-                content='{"error": "Rate limit exceeded"}',
-                status_code=429,
-                media_type="application/json"
+
+        if not decision.allowed:
+            metrics.incr("rate_limit.rejected")
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 429,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"retry-after", str(math.ceil(decision.retry_after)).encode()),
+                        *headers,
+                    ],
+                }
             )
-        
-        # Add current request
-        self.requests[client_ip].append(current_time)
-        
-        # Process request
-        response = await call_next(request)
-        
-        # Add rate limit headers
-        response.headers["X-RateLimit-Limit"] = str(self.limit)
-        response.headers["X-RateLimit-Remaining"] = str(
-            max(0, self.limit - len(self.requests[client_ip]))
-        )
-        response.headers["X-RateLimit-Reset"] = str(int(current_time + self.window))
-        
-        return response
\ No newline at end of file
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": b'{"error": "Rate limit exceeded"}',
+                }
+            )
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), *headers]
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    @staticmethod
+    def _identity(scope) -> str:
+        """ "user:<email>" for a valid bearer token, else "ip:<client address>"."""
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer" and token:
+                    try:
+                        return f"user:{verify_token(token)['sub']}"
+                    except Exception:
+                        pass
+                break
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+
+
+class DatabaseScopeMiddleware:
+    """Gives each HTTP request its own read-your-writes scope and statement counts.
+
+    A plain ASGI middleware, so the scopes are set in the context the route
+    runs in. Counts are reported per route template, e.g.
+    "GET /api/v1/learning/stats", once the response is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.route_paths = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        read_scope = begin_read_scope()
+        queries = query_metrics.begin_request()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            query_metrics.end_request(
+                queries, f"{scope['method']} {self._route_path(scope)}"
+            )
+            end_read_scope(read_scope)
+
+    def _route_path(self, scope) -> str:
+        """The path template of the route that handled the request, or "unmatched"."""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if endpoint not in self.route_paths:
+            router = getattr(scope.get("app"), "router", None)
+            for route in getattr(router, "routes", []):
+                if getattr(route, "endpoint", None) is endpoint:
+                    self.route_paths[endpoint] = route.path
+                    break
+            else:
+                self.route_paths[endpoint] = getattr(endpoint, "__name__", "unmatched")
+        return self.route_paths[endpoint]
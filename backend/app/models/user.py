@@ -0,0 +1,331 @@
+import uuid
+from datetime import datetime
+
+from sqlalchemy import (
+    JSON,
+    BigInteger,
+    Boolean,
+    Column,
+    Date,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    SmallInteger,
+    String,
+    Text,
+    text,
+)
+
+from app.database import Base
+
+
+def generate_uuid() -> str:
+    """Generate a string UUID primary key."""
+    return str(uuid.uuid4())
+
+
+class User(Base):
+    __tablename__ = "users"
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    email = Column(String(255), unique=True, index=True, nullable=False)
+    username = Column(String(100), nullable=False)
+    password_hash = Column(String(255), nullable=False)
+    is_active = Column(Boolean, default=True, nullable=False)
+    is_verified = Column(Boolean, default=False, nullable=False)
+    preferences = Column(JSON, default=dict)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, onupdate=datetime.utcnow)
+
+
+class Document(Base):
+    __tablename__ = "documents"
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    user_id = Column(
+        String(36),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        index=True,
+        nullable=False,
+    )
+    title = Column(String(500), nullable=False)
+    source_type = Column(String(50), nullable=False)
+    source_url = Column(String(2048))
+    file_path = Column(String(1024))
+    file_size = Column(Integer)
+    # uploaded, processing, completed, failed
+    status = Column(String(20), default="uploaded", index=True, nullable=False)
+    error_message = Column(Text)
+    chunk_count = Column(Integer, default=0, nullable=False)
+    # content version cards were last generated from
+    flashcards_version = Column(String(64))
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, onupdate=datetime.utcnow)
+
+
+class ContentChunk(Base):
+    __tablename__ = "content_chunks"
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    document_id = Column(
+        String(36),
+        ForeignKey("documents.id", ondelete="CASCADE"),
+        index=True,
+        nullable=False,
+    )
+    user_id = Column(
+        String(36),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        index=True,
+        nullable=False,
+    )
+    chunk_index = Column(Integer, nullable=False)
+    content = Column(Text, nullable=False)
+    content_hash = Column(String(64), index=True)
+    # text, code, image_caption
+    chunk_type = Column(String(20), default="text", nullable=False)
+    # page number, character offset, etc.
+    chunk_metadata = Column("metadata", JSON, default=dict)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class Summary(Base):
+    __tablename__ = "summaries"
+    __table_args__ = (
+        Index("ix_summaries_document_type", "document_id", "summary_type", unique=True),
+    )
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    document_id = Column(
+        String(36), ForeignKey("documents.id", ondelete="CASCADE"), nullable=False
+    )
+    user_id = Column(
+        String(36),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        index=True,
+        nullable=False,
+    )
+    # brief, detailed, bullet_points
+    summary_type = Column(String(20), default="brief", nullable=False)
+    content = Column(Text, nullable=False)
+    llm_provider = Column(String(50))
+    # document content version the summary was built from
+    source_version = Column(String(64))
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, onupdate=datetime.utcnow)
+
+
+class Concept(Base):
+    __tablename__ = "concepts"
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    document_id = Column(
+        String(36),
+        ForeignKey("documents.id", ondelete="CASCADE"),
+        index=True,
+        nullable=False,
+    )
+    user_id = Column(
+        String(36),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        index=True,
+        nullable=False,
+    )
+    name = Column(String(255), nullable=False)
+    definition = Column(Text)
+    category = Column(String(20))  # definition, example, process, relationship
+    confidence = Column(Float, default=0.0, nullable=False)
+    # chunks the concept was found in
+    mentions = Column(Integer, default=1, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ConceptRelationship(Base):
+    __tablename__ = "concept_relationships"
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    document_id = Column(
+        String(36),
+        ForeignKey("documents.id", ondelete="CASCADE"),
+        index=True,
+        nullable=False,
+    )
+    source_concept_id = Column(
+        String(36), ForeignKey("concepts.id", ondelete="CASCADE"), nullable=False
+    )
+    target_concept_id = Column(
+        String(36), ForeignKey("concepts.id", ondelete="CASCADE"), nullable=False
+    )
+    # prerequisite, related, example, contrast, component
+    relationship_type = Column(String(20), nullable=False)
+    confidence = Column(Float, default=0.0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class SummaryCache(Base):
+    # Content-addressed: a map result is keyed by its chunk's hash, a reduce result by
+    # its inputs' keys
+    __tablename__ = "summary_cache"
+
+    key = Column(String(64), primary_key=True)
+    content = Column(Text, nullable=False)
+    extracted = Column(JSON)  # concepts and relationships found by a map step
+    llm_provider = Column(String(50))
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class Flashcard(Base):
+    __tablename__ = "flashcards"
+    __table_args__ = (
+        # Serves due-card lookups and the schedule histogram as index range scans
+        Index("ix_flashcards_user_next_review", "user_id", "next_review"),
+        # Partial index over never-reviewed cards; counting them skips the rest
+        Index(
+            "ix_flashcards_user_new",
+            "user_id",
+            postgresql_where=text("review_count = 0"),
+            sqlite_where=text("review_count = 0"),
+        ),
+    )
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    user_id = Column(
+        String(36),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        index=True,
+        nullable=False,
+    )
+    document_id = Column(
+        String(36), ForeignKey("documents.id", ondelete="SET NULL"), index=True
+    )
+    front = Column(Text, nullable=False)
+    back = Column(Text, nullable=False)
+    difficulty = Column(Float, default=2.5, nullable=False)  # SM-2 ease factor
+    interval_days = Column(Integer, default=0, nullable=False)
+    next_review = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_review = Column(DateTime)
+    review_count = Column(Integer, default=0, nullable=False)
+    success_rate = Column(Float, default=0.0, nullable=False)
+    stability = Column(Float)  # FSRS memory state; null until FSRS schedules the card
+    memory_difficulty = Column(Float)
+    source_hash = Column(String(64))  # chunk group a generated card came from
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ReviewLog(Base):
+    # Append-only: one row per review, never updated
+    __tablename__ = "review_log"
+    __table_args__ = (
+        Index("ix_review_log_user_card", "user_id", "flashcard_id", "reviewed_at"),
+    )
+
+    id = Column(
+        BigInteger().with_variant(Integer, "sqlite"),
+        primary_key=True,
+        autoincrement=True,
+    )
+    user_id = Column(
+        String(36), ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+    flashcard_id = Column(
+        String(36), ForeignKey("flashcards.id", ondelete="CASCADE"), nullable=False
+    )
+    rating = Column(SmallInteger, nullable=False)  # 1-5 as submitted
+    response_time_ms = Column(Integer)
+    # since the card's previous review; 0 for the first
+    elapsed_days = Column(Float, nullable=False)
+    scheduled_days = Column(Integer, nullable=False)  # interval the scheduler chose
+    reviewed_at = Column(DateTime, nullable=False)
+
+
+class UserSchedulerParams(Base):
+    __tablename__ = "user_scheduler_params"
+
+    user_id = Column(
+        String(36), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    algorithm = Column(String(20), nullable=False)
+    weights = Column(JSON, nullable=False)
+    review_count = Column(Integer, nullable=False)  # log rows the fit used
+    log_loss = Column(Float)
+    fitted_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class Query(Base):
+    __tablename__ = "queries"
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    user_id = Column(
+        String(36),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        index=True,
+        nullable=False,
+    )
+    question = Column(Text, nullable=False)
+    answer = Column(Text)
+    context_sources = Column(JSON, default=list)  # Referenced document/chunk IDs
+    llm_provider = Column(String(50))
+    response_time_ms = Column(Integer)
+    user_rating = Column(Integer)  # 1-5 stars
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class LearningSession(Base):
+    __tablename__ = "learning_sessions"
+    __table_args__ = (
+        # Partial index over open sessions, for the idle-session sweeper
+        Index(
+            "ix_learning_sessions_open",
+            "start_time",
+            postgresql_where=text("end_time IS NULL"),
+            sqlite_where=text("end_time IS NULL"),
+        ),
+    )
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    user_id = Column(
+        String(36),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        index=True,
+        nullable=False,
+    )
+    session_type = Column(String(50), nullable=False)  # flashcards, reading, review
+    start_time = Column(DateTime, default=datetime.utcnow, nullable=False)
+    end_time = Column(DateTime)
+    cards_reviewed = Column(Integer, default=0, nullable=False)
+    correct_answers = Column(Integer, default=0, nullable=False)
+    # last review counted into the session, as of the latest flush
+    last_activity_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+# Materialized by LearningStatsTracker on every review and session end
+class UserLearningStats(Base):
+    __tablename__ = "user_learning_stats"
+
+    user_id = Column(
+        String(36), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    total_cards = Column(Integer, default=0, nullable=False)
+    # sum of Flashcard.success_rate, for the deck average
+    success_rate_sum = Column(Float, default=0.0, nullable=False)
+    total_reviews = Column(Integer, default=0, nullable=False)
+    correct_reviews = Column(Integer, default=0, nullable=False)
+    response_time_total_ms = Column(BigInteger, default=0, nullable=False)
+    response_time_count = Column(Integer, default=0, nullable=False)
+    review_day = Column(Date)  # UTC day that cards_reviewed_today refers to
+    cards_reviewed_today = Column(Integer, default=0, nullable=False)
+    # first reviews on review_day, for the daily new-card cap
+    new_cards_today = Column(Integer, default=0, nullable=False)
+    # ISO date -> cards whose next review falls on it
+    due_by_day = Column(JSON, default=dict)
+    activity_start = Column(Date)  # day of bit 0 in activity_bitmap
+    # little-endian, one bit per UTC day with any study activity
+    activity_bitmap = Column(LargeBinary)
+    longest_streak = Column(Integer, default=0, nullable=False)
+    sessions_completed = Column(Integer, default=0, nullable=False)
+    study_seconds = Column(BigInteger, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
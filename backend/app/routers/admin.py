@@ -1,45 +1,84 @@
+from datetime import datetime
+from typing import Optional
+
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import Dict, Any
 
-from app.database import get_db
-from app.models.user import User, Document, Flashcard, Query, LearningSession
+from app.config import settings
+from app.core.metrics import metrics
+from app.core.principal_cache import (
+    Principal,
+    get_principal_cache,
+    invalidate_principals,
+)
+from app.database import (
+    async_engine,
+    get_async_db,
+    get_async_read_db,
+    get_db,
+    replica_engines,
+)
+from app.models.user import Document, Flashcard, LearningSession, Query, ReviewLog, User
 from app.routers.auth import get_current_user
+from app.services.llm import get_llm_router
+from app.workers.learning_stats import enqueue_stats_rebuild
+from app.workers.scheduler_fitting import enqueue_scheduler_fit
 
 router = APIRouter()
 
 
 @router.get("/stats")
 async def get_system_stats(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
 ):
     """Get system-wide statistics."""
     # Check if user is admin (you might want to add an is_admin field)
     if not current_user.email.endswith("@admin.com"):  # Simple admin check
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Admin access required"
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required"
         )
-    
+
     try:
         stats = {
-            "users": db.query(func.count(User.id)).scalar(),
-            "documents": db.query(func.count(Document.id)).scalar(),
-            "flashcards": db.query(func.count(Flashcard.id)).scalar(),
-            "queries": db.query(func.count(Query.id)).scalar(),
-            "learning_sessions": db.query(func.count(LearningSession.id)).scalar()
+            "users": await db.scalar(select(func.count(User.id))),
+            "documents": await db.scalar(select(func.count(Document.id))),
+            "flashcards": await db.scalar(select(func.count(Flashcard.id))),
+            "queries": await db.scalar(select(func.count(Query.id))),
+            "learning_sessions": await db.scalar(
+                select(func.count(LearningSession.id))
+            ),
         }
-        
+
         return {"stats": stats}
-        
+
     except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get stats: {str(e)}")
+
+
+@router.get("/metrics")
+async def get_metrics(current_user: Principal = Depends(get_current_user)):
+    """Get in-process counters and timings (cache hit rates, latencies)."""
+    if not current_user.email.endswith("@admin.com"):
         raise HTTPException(
-            status_code=500,
-            detail=f"Failed to get stats: {str(e)}"
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required"
         )
 
+    principal_cache = get_principal_cache()
+    return {
+        **metrics.snapshot(),
+        "llm": get_llm_router().stats(),
+        "principal_cache": (
+            principal_cache.stats() if principal_cache is not None else None
+        ),
+        "database": {
+            "replicas": len(replica_engines),
+            "pool": async_engine.pool.status(),
+        },
+    }
+
 
 @router.get("/health")
 async def health_check():
@@ -48,21 +87,122 @@ async def health_check():
         "status": "healthy",
         "service": "ai-knowledge-os",
         "timestamp": str(func.now()),
-        "version": "1.0.0"
+        "version": "1.0.0",
     }
 
 
+@router.post("/users/{user_id}/deactivate")
+async def deactivate_user(
+    user_id: str,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Deactivate a user account (admin only); their tokens stop working at once."""
+    if not current_user.email.endswith("@admin.com"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required"
+        )
+
+    email = await db.scalar(
+        update(User)
+        .where(User.id == user_id)
+        .values(is_active=False, updated_at=datetime.utcnow())
+        .returning(User.email)
+    )
+    if email is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+        )
+    await db.commit()
+    # A bulk UPDATE bypasses the ORM hooks, so drop the cached principal explicitly
+    await invalidate_principals(email)
+
+    return {"message": "User deactivated", "user_id": user_id}
+
+
 @router.post("/llm/switch")
 async def switch_llm_provider(
     provider: str,
-    current_user: User = Depends(get_current_user)
+    fallback: Optional[str] = None,
+    current_user: Principal = Depends(get_current_user),
+):
+    """Switch LLM provider (admin only).
+
+    Takes effect immediately for new requests in this process; pass an empty
+    `fallback` to disable failover.
+    """
+    if not current_user.email.endswith("@admin.com"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required"
+        )
+
+    llm_router = get_llm_router()
+    try:
+        llm_router.switch(provider, fallback)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    return {
+        "message": f"LLM provider switched to {provider}",
+        "llm": llm_router.stats(),
+    }
+
+
+@router.post("/learning-stats/rebuild")
+async def rebuild_learning_stats(
+    user_id: Optional[str] = None,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
 ):
-    """Switch LLM provider (admin only)."""
+    """Queue a rebuild of materialized learning stats from history (admin only).
+
+    Rebuilds one user's stats, or every user's if `user_id` is omitted.
+    """
     if not current_user.email.endswith("@admin.com"):
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Admin access required"
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required"
         )
-    
-    # This would update system configuration
-    return {"message": f"LLM provider switched to {provider}"}
\ No newline at end of file
+
+    user_ids = [user_id] if user_id else [row.id for row in db.query(User.id)]
+    queued = 0
+    for target in user_ids:
+        _, created = await enqueue_stats_rebuild(target)
+        queued += 1 if created else 0
+
+    return {
+        "message": f"Queued {queued} learning stats rebuilds",
+        "users": len(user_ids),
+    }
+
+
+@router.post("/scheduler/fit")
+async def fit_scheduler_parameters(
+    user_id: Optional[str] = None,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Queue fitting per-user FSRS parameters to the review log (admin only).
+
+    Fits one user, or every user with enough logged reviews if `user_id` is
+    omitted. Fitted parameters are used when SPACED_REPETITION_ALGORITHM=fsrs.
+    """
+    if not current_user.email.endswith("@admin.com"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required"
+        )
+
+    if user_id:
+        user_ids = [user_id]
+    else:
+        user_ids = [
+            row.user_id
+            for row in db.query(ReviewLog.user_id)
+            .group_by(ReviewLog.user_id)
+            .having(func.count() >= settings.FSRS_MIN_REVIEWS_TO_FIT)
+        ]
+    queued = 0
+    for target in user_ids:
+        _, created = await enqueue_scheduler_fit(target)
+        queued += 1 if created else 0
+
+    return {"message": f"Queued {queued} scheduler fits", "users": len(user_ids)}
@@ -0,0 +1,64 @@
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.core.principal_cache import Principal
+from app.database import get_db
+from app.routers.auth import get_current_user
+from app.services.archive import ArchiveExporter, ArchiveImporter
+
+router = APIRouter()
+archive_exporter = ArchiveExporter()
+archive_importer = ArchiveImporter()
+
+
+@router.get("/export")
+async def export_archive(
+    include_embeddings: bool = False,
+    current_user: Principal = Depends(get_current_user),
+):
+    """Download all of the user's documents, flashcards, review history, sessions and
+    queries.
+
+    The archive is gzip-compressed NDJSON, streamed as it is read from the
+    database. With `include_embeddings`, chunk vectors are included so an
+    import on a server using the same embedding model skips re-embedding.
+    """
+    filename = f"knowledge-os-{datetime.utcnow():%Y%m%d}.ndjson.gz"
+    return StreamingResponse(
+        archive_exporter.export(current_user.id, include_embeddings),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.post("/import")
+async def import_archive(
+    file: UploadFile = File(...),
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Add the contents of an exported archive to the user's account.
+
+    Imported rows are copies with new ids, so importing never overwrites
+    existing data. Nothing is imported unless the whole archive loads.
+    """
+    if file.size and file.size > settings.MAX_IMPORT_SIZE_MB * 1024 * 1024:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Archive too large. Maximum size: {settings.MAX_IMPORT_SIZE_MB}MB",
+        )
+
+    try:
+        counts = await archive_importer.import_archive(current_user.id, file.file, db)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Failed to import archive: {str(e)}"
+        )
+
+    return {"message": "Archive imported successfully", "imported": counts}
@@ -1,76 +1,157 @@
+from datetime import datetime
+from typing import Optional
+
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer
-from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from datetime import datetime, timedelta
-from typing import Optional
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_db
-from app.core.security import create_access_token, verify_token, get_password_hash, verify_password
+from app.core.password_hashing import PasswordHasherBusy, get_password_hasher
+from app.core.principal_cache import (
+    Principal,
+    get_principal_cache,
+    invalidate_principals,
+)
+from app.core.security import create_access_token, verify_token
+from app.database import AsyncSessionLocal, get_async_db, set_request_subject
 from app.models.user import User
-from app.schemas.user import UserCreate, UserLogin, UserResponse, TokenResponse
+from app.schemas.user import (
+    TokenResponse,
+    UserCreate,
+    UserLogin,
+    UserResponse,
+    UserUpdate,
+)
 
 router = APIRouter()
 security = HTTPBearer()
 
 
+def hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many sign-in attempts in progress, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+
+async def authenticate_token(token: str) -> Optional[Principal]:
+    """Return the user a bearer token belongs to, or None if it is invalid.
+
+    Users come from the principal cache when possible; only a miss opens a
+    database session.
+    """
+    try:
+        payload = verify_token(token)
+        email: str = payload.get("sub")
+    except Exception:
+        return None
+    if email is None:
+        return None
+
+    cache = get_principal_cache()
+    if cache is not None:
+        principal = await cache.get(email)
+        if principal is not None:
+            return principal
+        generation = cache.generation
+
+    async with AsyncSessionLocal() as db:
+        user = await db.scalar(select(User).where(User.email == email))
+        principal = Principal.from_user(user) if user else None
+
+    if principal is not None and cache is not None:
+        await cache.put(principal, generation)
+    return principal
+
+
+async def get_current_user(token: str = Depends(security)) -> Principal:
+    """Dependency to get current authenticated user."""
+    principal = await authenticate_token(token.credentials)
+    if principal is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if not principal.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user"
+        )
+
+    set_request_subject(principal.id)
+    return principal
+
+
 @router.post("/register", response_model=UserResponse)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Register a new user."""
     # Check if user already exists
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
+    existing_user = await db.scalar(
+        select(User.id).where(User.email == user_data.email)
+    )
     if existing_user:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered"
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered"
         )
-    
-    # Create new user
-    hashed_password = get_password_hash(user_data.password)
+
+    # Create new user; hashing runs in the hasher's pool, off the event loop
+    try:
+        hashed_password = await get_password_hasher().hash(user_data.password)
+    except PasswordHasherBusy:
+        raise hasher_busy()
     db_user = User(
         email=user_data.email,
         username=user_data.username,
         password_hash=hashed_password,
-        created_at=datetime.utcnow()
+        created_at=datetime.utcnow(),
     )
-    
+
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    
+    await db.commit()
+    await db.refresh(db_user)
+
     return UserResponse.from_orm(db_user)
 
 
 @router.post("/login", response_model=TokenResponse)
-async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
+async def login(user_credentials: UserLogin, db: AsyncSession = Depends(get_async_db)):
     """Authenticate user and return access token."""
     # Find user by email
-    user = db.query(User).filter(User.email == user_credentials.email).first()
-    if not user or not verify_password(user_credentials.password, user.password_hash):
+    user = await db.scalar(select(User).where(User.email == user_credentials.email))
+    valid, new_hash = False, None
+    if user:
+        try:
+            valid, new_hash = await get_password_hasher().verify_and_update(
+                user_credentials.password, user.password_hash
+            )
+        except PasswordHasherBusy:
+            raise hasher_busy()
+    if not valid:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid email or password"
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email or password"
         )
-    
+
+    # The stored hash used an old cost factor; replace it while we have the password
+    if new_hash:
+        user.password_hash = new_hash
+        await db.commit()
+
     # Create access token
     access_token = create_access_token(data={"sub": user.email})
-    
+
     return TokenResponse(
-        access_token=access_token,
-        token_type="bearer",
-        expires_in=3600
+        access_token=access_token, token_type="bearer", expires_in=3600
     )
 
 
 @router.post("/refresh", response_model=TokenResponse)
-async def refresh_token(current_user: User = Depends(get_current_user)):
+async def refresh_token(current_user: Principal = Depends(get_current_user)):
     """Refresh access token."""
     access_token = create_access_token(data={"sub": current_user.email})
-    
+
     return TokenResponse(
-        access_token=access_token,
-        token_type="bearer",
-        expires_in=3600
+        access_token=access_token, token_type="bearer", expires_in=3600
     )
 
 
@@ -81,32 +162,28 @@ async def logout():
 
 
 @router.get("/me", response_model=UserResponse)
-async def get_current_user_info(current_user: User = Depends(get_current_user)):
+async def get_current_user_info(current_user: Principal = Depends(get_current_user)):
     """Get current user information."""
     return UserResponse.from_orm(current_user)
 
 
-async def get_current_user(
-    token: str = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    """Dependency to get current authenticated user."""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    try:
-        payload = verify_token(token.credentials)
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except Exception:
-        raise credentials_exception
-    
-    user = db.query(User).filter(User.email == email).first()
-    if user is None:
-        raise credentials_exception
-    
-    return user
\ No newline at end of file
+@router.put("/me", response_model=UserResponse)
+async def update_current_user_info(
+    user_update: UserUpdate,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Update current user's username or preferences."""
+    values = user_update.model_dump(exclude_none=True)
+    if values:
+        await db.execute(
+            update(User)
+            .where(User.id == current_user.id)
+            .values(**values, updated_at=datetime.utcnow())
+        )
+        await db.commit()
+        # A bulk UPDATE bypasses the ORM hooks, so drop the cached principal explicitly
+        await invalidate_principals(current_user.email)
+
+    user = await db.scalar(select(User).where(User.id == current_user.id))
+    return UserResponse.from_orm(user)
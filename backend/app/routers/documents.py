@@ -1,18 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from sqlalchemy.orm import Session
-from typing import List
 import uuid
 from datetime import datetime
+from typing import List
+
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_db
-from app.models.user import User, Document
-from app.schemas.document import DocumentCreate, DocumentResponse, DocumentListResponse
+from app.core.principal_cache import Principal
+from app.database import get_async_db
+from app.models.user import Concept, ConceptRelationship, Document, Summary
 from app.routers.auth import get_current_user
-from app.services.document_processing import DocumentProcessor
+from app.schemas.document import (
+    ConceptMapResponse,
+    ConceptRelationshipResponse,
+    ConceptResponse,
+    DocumentCreate,
+    DocumentListResponse,
+    DocumentResponse,
+    SummaryResponse,
+)
 from app.services.file_storage import FileStorageService
+from app.services.summarization import SUMMARY_TYPES
+from app.workers.document_processor import doc_processor, enqueue_document_processing
+from app.workers.flashcard_generation import enqueue_flashcard_generation
+from app.workers.summarization import enqueue_summarization
 
 router = APIRouter()
-doc_processor = DocumentProcessor()
 file_storage = FileStorageService()
 
 
@@ -21,16 +34,16 @@ async def list_documents(
     skip: int = 0,
     limit: int = 20,
     status: str = None,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """List user's documents."""
-    query = db.query(Document).filter(Document.user_id == current_user.id)
-    
+    query = select(Document).where(Document.user_id == current_user.id)
+
     if status:
-        query = query.filter(Document.status == status)
-    
-    documents = query.offset(skip).limit(limit).all()
+        query = query.where(Document.status == status)
+
+    documents = (await db.scalars(query.offset(skip).limit(limit))).all()
     return [DocumentListResponse.from_orm(doc) for doc in documents]
 
 
@@ -39,61 +52,60 @@ async def upload_document(
     file: UploadFile = File(...),
     title: str = None,
     source_url: str = None,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Upload a new document."""
     # Validate file
     if not file.filename:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="No file provided"
+            status_code=status.HTTP_400_BAD_REQUEST, detail="No file provided"
         )
-    
+
     # Save file
     file_path = await file_storage.save_file(file, current_user.id)
-    
+
     # Create document record
     document = Document(
         id=str(uuid.uuid4()),
         user_id=current_user.id,
         title=title or file.filename,
-        source_type=file.filename.split('.')[-1].lower(),
+        source_type=file.filename.split(".")[-1].lower(),
         source_url=source_url,
         file_path=file_path,
         file_size=file.size,
         status="uploaded",
-        created_at=datetime.utcnow()
+        created_at=datetime.utcnow(),
     )
-    
+
     db.add(document)
-    db.commit()
-    db.refresh(document)
-    
-    # Start processing (async)
-    await doc_processor.process_document(document.id)
-    
+    await db.commit()
+    await db.refresh(document)
+
+    # Queue processing; the response goes out while the document is still "uploaded"
+    await enqueue_document_processing(document.id, current_user.id)
+
     return DocumentResponse.from_orm(document)
 
 
 @router.get("/{document_id}", response_model=DocumentResponse)
 async def get_document(
     document_id: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Get document details."""
-    document = db.query(Document).filter(
-        Document.id == document_id,
-        Document.user_id == current_user.id
-    ).first()
-    
+    document = await db.scalar(
+        select(Document).where(
+            Document.id == document_id, Document.user_id == current_user.id
+        )
+    )
+
     if not document:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Document not found"
+            status_code=status.HTTP_404_NOT_FOUND, detail="Document not found"
         )
-    
+
     return DocumentResponse.from_orm(document)
 
 
@@ -101,78 +113,251 @@ async def get_document(
 async def update_document(
     document_id: str,
     document_update: DocumentCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Update document metadata."""
-    document = db.query(Document).filter(
-        Document.id == document_id,
-        Document.user_id == current_user.id
-    ).first()
-    
+    document = await db.scalar(
+        select(Document).where(
+            Document.id == document_id, Document.user_id == current_user.id
+        )
+    )
+
     if not document:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Document not found"
+            status_code=status.HTTP_404_NOT_FOUND, detail="Document not found"
         )
-    
+
     document.title = document_update.title
     document.source_url = document_update.source_url
     document.updated_at = datetime.utcnow()
-    
-    db.commit()
-    db.refresh(document)
-    
+
+    await db.commit()
+    await db.refresh(document)
+
     return DocumentResponse.from_orm(document)
 
 
 @router.delete("/{document_id}")
 async def delete_document(
     document_id: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Delete a document."""
-    document = db.query(Document).filter(
-        Document.id == document_id,
-        Document.user_id == current_user.id
-    ).first()
-    
+    document = await db.scalar(
+        select(Document).where(
+            Document.id == document_id, Document.user_id == current_user.id
+        )
+    )
+
     if not document:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Document not found"
+            status_code=status.HTTP_404_NOT_FOUND, detail="Document not found"
         )
-    
+
     # Delete file
     if document.file_path:
         await file_storage.delete_file(document.file_path)
-    
+
+    # Remove its chunks from the search indexes
+    await doc_processor.remove_document(document.id, current_user.id, db)
+
     # Delete from database
-    db.delete(document)
-    db.commit()
-    
+    await db.delete(document)
+    await db.commit()
+
     return {"message": "Document deleted successfully"}
 
 
 @router.post("/{document_id}/process")
 async def process_document(
     document_id: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Trigger document processing."""
-    document = db.query(Document).filter(
-        Document.id == document_id,
-        Document.user_id == current_user.id
-    ).first()
-    
+    document = await db.scalar(
+        select(Document).where(
+            Document.id == document_id, Document.user_id == current_user.id
+        )
+    )
+
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Document not found"
+        )
+
+    job, created = await enqueue_document_processing(document_id, current_user.id)
+
+    return {
+        "message": (
+            "Document processing started"
+            if created
+            else "Document processing already in progress"
+        ),
+        "job_id": job.id,
+        "job_status": job.status,
+    }
+
+
+@router.post("/{document_id}/flashcards")
+async def generate_flashcards(
+    document_id: str,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Generate flashcards from a processed document.
+
+    Cards already generated for the document's current content are kept,
+    so this only calls the LLM for content that has none yet.
+    """
+    document = await db.scalar(
+        select(Document).where(
+            Document.id == document_id, Document.user_id == current_user.id
+        )
+    )
+
     if not document:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Document not found"
+            status_code=status.HTTP_404_NOT_FOUND, detail="Document not found"
+        )
+
+    if document.status != "completed":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=(
+                f"Document is {document.status}; flashcards can be generated once "
+                "processing completes"
+            ),
         )
-    
-    await doc_processor.process_document(document_id)
-    
-    return {"message": "Document processing started"}
\ No newline at end of file
+
+    job, created = await enqueue_flashcard_generation(document_id, current_user.id)
+
+    return {
+        "message": (
+            "Flashcard generation started"
+            if created
+            else "Flashcard generation already in progress"
+        ),
+        "job_id": job.id,
+        "job_status": job.status,
+    }
+
+
+@router.get("/{document_id}/summary", response_model=SummaryResponse)
+async def get_summary(
+    document_id: str,
+    summary_type: str = "brief",
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Get a document's AI-generated summary."""
+    summary = await db.scalar(
+        select(Summary).where(
+            Summary.document_id == document_id,
+            Summary.user_id == current_user.id,
+            Summary.summary_type == summary_type,
+        )
+    )
+
+    if not summary:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Summary not found"
+        )
+
+    return SummaryResponse.from_orm(summary)
+
+
+@router.post("/{document_id}/summary")
+async def generate_summary(
+    document_id: str,
+    summary_type: str = "brief",
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Generate or refresh a document's summary and concept map.
+
+    Sections summarized before are reused, so after an edit only the
+    changed parts of the document are sent to the LLM again.
+    """
+    if summary_type not in SUMMARY_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"summary_type must be one of {list(SUMMARY_TYPES)}",
+        )
+
+    document = await db.scalar(
+        select(Document).where(
+            Document.id == document_id, Document.user_id == current_user.id
+        )
+    )
+
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Document not found"
+        )
+
+    if document.status != "completed":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=(
+                f"Document is {document.status}; it can be summarized once processing "
+                "completes"
+            ),
+        )
+
+    job, created = await enqueue_summarization(
+        document_id, current_user.id, summary_type
+    )
+
+    return {
+        "message": (
+            "Summarization started" if created else "Summarization already in progress"
+        ),
+        "job_id": job.id,
+        "job_status": job.status,
+    }
+
+
+@router.get("/{document_id}/concepts", response_model=ConceptMapResponse)
+async def get_concept_map(
+    document_id: str,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Get the concept map extracted from a document."""
+    document = await db.scalar(
+        select(Document).where(
+            Document.id == document_id, Document.user_id == current_user.id
+        )
+    )
+
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Document not found"
+        )
+
+    concepts = (
+        await db.scalars(
+            select(Concept)
+            .where(Concept.document_id == document_id)
+            .order_by(Concept.confidence.desc())
+        )
+    ).all()
+    relationships = (
+        await db.scalars(
+            select(ConceptRelationship).where(
+                ConceptRelationship.document_id == document_id
+            )
+        )
+    ).all()
+
+    return ConceptMapResponse(
+        document_id=document_id,
+        concepts=[ConceptResponse.from_orm(concept) for concept in concepts],
+        relationships=[
+            ConceptRelationshipResponse.from_orm(relationship)
+            for relationship in relationships
+        ],
+    )
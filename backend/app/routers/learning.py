@@ -1,36 +1,58 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
-from datetime import datetime, timedelta
-
-from app.database import get_db
-from app.models.user import User, Flashcard, LearningSession
-from app.schemas.learning import FlashcardReviewRequest, LearningStatsResponse, LearningScheduleResponse
-from app.routers.auth import get_current_user
+import logging
+from typing import List, Optional
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.principal_cache import Principal
+from app.database import AsyncSessionLocal, get_async_db, get_async_read_db
+from app.models.user import LearningSession
+from app.routers.auth import authenticate_token, get_current_user
+from app.schemas.learning import (
+    BatchReviewRequest,
+    BatchReviewResponse,
+    FlashcardReviewRequest,
+    LearningScheduleResponse,
+    LearningSessionState,
+    LearningStatsResponse,
+    SessionEndMessage,
+    SessionSocketMessage,
+)
 from app.services.learning import LearningService
+from app.workers.learning_stats import enqueue_stats_rebuild
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 learning_service = LearningService()
+session_message = TypeAdapter(SessionSocketMessage)
 
 
 @router.get("/flashcards", response_model=List[dict])
 async def get_due_flashcards(
     limit: int = 20,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Get flashcards due for review."""
     try:
         flashcards = await learning_service.get_due_flashcards(
-            user_id=current_user.id,
-            limit=limit,
-            db=db
+            user_id=current_user.id, limit=limit, db=db
         )
         return flashcards
     except Exception as e:
         raise HTTPException(
-            status_code=500,
-            detail=f"Failed to get flashcards: {str(e)}"
+            status_code=500, detail=f"Failed to get flashcards: {str(e)}"
         )
 
 
@@ -38,8 +60,8 @@ async def get_due_flashcards(
 async def review_flashcard(
     flashcard_id: str,
     review_data: FlashcardReviewRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Record flashcard review result."""
     try:
@@ -48,105 +70,245 @@ async def review_flashcard(
             user_id=current_user.id,
             rating=review_data.rating,
             response_time_ms=review_data.response_time_ms,
-            db=db
+            db=db,
+            session_id=review_data.session_id,
         )
-        
+
         return {"message": "Review recorded successfully"}
-        
+
     except Exception as e:
         raise HTTPException(
-            status_code=500,
-            detail=f"Failed to record review: {str(e)}"
+            status_code=500, detail=f"Failed to record review: {str(e)}"
+        )
+
+
+@router.post("/reviews:batch", response_model=BatchReviewResponse)
+async def review_flashcards_batch(
+    batch: BatchReviewRequest,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Record many review results at once, e.g. after an offline study session.
+
+    Reviews are applied in `reviewed_at` order in a single transaction; each
+    item gets its own status, so unknown or stale cards don't fail the batch.
+    """
+    try:
+        return await learning_service.process_review_batch(
+            user_id=current_user.id,
+            reviews=batch.reviews,
+            db=db,
+            session_id=batch.session_id,
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Failed to record reviews: {str(e)}"
         )
 
 
 @router.get("/stats", response_model=LearningStatsResponse)
 async def get_learning_stats(
-    days: int = 30,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
 ):
-    """Get learning statistics."""
+    """Get all-time learning statistics."""
     try:
         stats = await learning_service.get_learning_stats(
-            user_id=current_user.id,
-            days=days,
-            db=db
+            user_id=current_user.id, db=db
         )
+        if stats is None:
+            # No stats row yet: the worker builds it from history; zeros until then
+            try:
+                await enqueue_stats_rebuild(current_user.id)
+            except Exception as e:
+                logger.warning(
+                    f"Failed to queue stats rebuild for user {current_user.id}: "
+                    f"{str(e)}"
+                )
+            stats = LearningStatsResponse()
         return stats
     except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to get stats: {str(e)}"
-        )
+        raise HTTPException(status_code=500, detail=f"Failed to get stats: {str(e)}")
 
 
 @router.get("/schedule", response_model=LearningScheduleResponse)
 async def get_learning_schedule(
     days: int = 7,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
 ):
     """Get learning schedule for upcoming days."""
     try:
         schedule = await learning_service.get_learning_schedule(
-            user_id=current_user.id,
-            days=days,
-            db=db
+            user_id=current_user.id, days=days, db=db
         )
         return schedule
     except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to get schedule: {str(e)}"
-        )
+        raise HTTPException(status_code=500, detail=f"Failed to get schedule: {str(e)}")
 
 
 @router.post("/session/start")
 async def start_learning_session(
     session_type: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Start a new learning session."""
     try:
         session = await learning_service.start_session(
-            user_id=current_user.id,
-            session_type=session_type,
-            db=db
+            user_id=current_user.id, session_type=session_type, db=db
         )
-        
+
         return {"session_id": session.id, "start_time": session.start_time}
-        
+
     except Exception as e:
         raise HTTPException(
-            status_code=500,
-            detail=f"Failed to start session: {str(e)}"
+            status_code=500, detail=f"Failed to start session: {str(e)}"
         )
 
 
+@router.get("/session/{session_id}", response_model=LearningSessionState)
+async def get_learning_session(
+    session_id: str,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Get a session's counts so far and the next card to study."""
+    try:
+        return await learning_service.get_session_state(
+            session_id=session_id, user_id=current_user.id, db=db
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get session: {str(e)}")
+
+
 @router.post("/session/{session_id}/end")
 async def end_learning_session(
     session_id: str,
-    cards_reviewed: int = 0,
-    correct_answers: int = 0,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    cards_reviewed: Optional[int] = None,
+    correct_answers: Optional[int] = None,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """End a learning session."""
+    """End a learning session.
+
+    The session keeps the counts the server recorded from its reviews;
+    `cards_reviewed` and `correct_answers` only fill in sessions without any,
+    such as reading sessions.
+    """
     try:
-        await learning_service.end_session(
+        session = await learning_service.end_session(
             session_id=session_id,
             user_id=current_user.id,
             cards_reviewed=cards_reviewed,
             correct_answers=correct_answers,
-            db=db
+            db=db,
         )
-        
-        return {"message": "Session ended successfully"}
-        
+
+        return {
+            "message": "Session ended successfully",
+            "session_id": session.id,
+            "end_time": session.end_time,
+            "cards_reviewed": session.cards_reviewed,
+            "correct_answers": session.correct_answers,
+        }
+
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to end session: {str(e)}"
-        )
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to end session: {str(e)}")
+
+
+@router.websocket("/session/{session_id}/ws")
+async def learning_session_socket(websocket: WebSocket, session_id: str, token: str):
+    """Study a session over one connection.
+
+    Browsers cannot set headers on a WebSocket, so the access token is passed
+    as the `token` query parameter. The server sends the session state on
+    connect and after every review, including the next card, so the client
+    never polls. Client messages:
+
+    - {"type": "review", "flashcard_id", "rating", "response_time_ms"}
+    - {"type": "end"}: ends the session and closes the connection
+
+    Malformed messages are answered with {"type": "error", "detail"} and
+    the connection stays open. Each message uses its own database session;
+    none is held while idle.
+    """
+    user = await authenticate_token(token)
+    if user is None or not user.is_active:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    user_id = user.id
+
+    async with AsyncSessionLocal() as db:
+        session = await db.scalar(
+            select(LearningSession).where(
+                LearningSession.id == session_id, LearningSession.user_id == user_id
+            )
+        )
+        if session is None or session.end_time is not None:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+
+        await websocket.accept()
+        state = await learning_service.get_session_state(session_id, user_id, db)
+    await websocket.send_json(jsonable_encoder({"type": "state", **state.dict()}))
+
+    try:
+        while True:
+            try:
+                message = session_message.validate_json(await websocket.receive_text())
+            except ValidationError as e:
+                await websocket.send_json(
+                    {
+                        "type": "error",
+                        "detail": jsonable_encoder(e.errors(include_url=False)),
+                    }
+                )
+                continue
+
+            async with AsyncSessionLocal() as db:
+                if isinstance(message, SessionEndMessage):
+                    session = await learning_service.end_session(
+                        session_id, user_id, None, None, db
+                    )
+                    await websocket.send_json(
+                        {
+                            "type": "ended",
+                            "session_id": session_id,
+                            "cards_reviewed": session.cards_reviewed,
+                            "correct_answers": session.correct_answers,
+                        }
+                    )
+                    await websocket.close()
+                    return
+
+                try:
+                    result = await learning_service.process_review(
+                        flashcard_id=message.flashcard_id,
+                        user_id=user_id,
+                        rating=message.rating,
+                        response_time_ms=message.response_time_ms,
+                        db=db,
+                        session_id=session_id,
+                    )
+                except ValueError as e:
+                    await websocket.send_json({"type": "error", "detail": str(e)})
+                    continue
+                state = await learning_service.get_session_state(
+                    session_id, user_id, db
+                )
+                await websocket.send_json(
+                    jsonable_encoder(
+                        {"type": "reviewed", "result": result, **state.dict()}
+                    )
+                )
+
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Error in learning session socket {session_id}: {str(e)}")
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
@@ -1,13 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from typing import List, Optional
+import json
+import logging
 import uuid
+from contextlib import aclosing
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from starlette.background import BackgroundTask
 
-from app.database import get_db
-from app.models.user import User, Query
-from app.schemas.search import SearchRequest, SearchResponse, QnARequest, QnAResponse
+from app.config import settings
+from app.core.principal_cache import Principal
+from app.database import SessionLocal, get_db
+from app.models.user import Query as QueryRecord
 from app.routers.auth import get_current_user
-from app.services.search import SearchService
+from app.schemas.search import QnARequest, QnAResponse, SearchMode, SearchResponse
+from app.services.search import SearchCursor, SearchService
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 search_service = SearchService()
@@ -17,77 +27,160 @@ search_service = SearchService()
 async def search_documents(
     q: str = Query(..., description="Search query"),
     limit: int = Query(10, ge=1, le=50),
-    offset: int = Query(0, ge=0),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    offset: int = Query(
+        0,
+        ge=0,
+        le=settings.SEARCH_MAX_OFFSET,
+        description="Use `cursor` for deeper pages",
+    ),
+    cursor: Optional[str] = Query(
+        None, description="next_cursor from the previous page"
+    ),
+    mode: SearchMode = Query(
+        SearchMode.HYBRID, description="Retriever: lexical (BM25), vector, or hybrid"
+    ),
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
 ):
-    """Search documents using semantic search."""
+    """Search documents using lexical, semantic or hybrid retrieval."""
+    search_cursor = None
+    if cursor:
+        search_cursor = SearchCursor.decode(cursor)
+        if not search_cursor.matches(current_user.id, q, mode):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Cursor does not belong to this search",
+            )
+
     try:
         results = await search_service.semantic_search(
             query=q,
             user_id=current_user.id,
+            db=db,
             limit=limit,
-            offset=offset
+            offset=offset,
+            mode=mode,
+            cursor=search_cursor,
         )
         return results
     except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Search failed: {str(e)}"
-        )
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
 
 @router.post("/ask", response_model=QnAResponse)
 async def ask_question(
     request: QnARequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
 ):
     """Ask a question over your knowledge base."""
     try:
         result = await search_service.answer_question(
             question=request.question,
             user_id=current_user.id,
-            max_context=request.max_context_documents
+            db=db,
+            max_context=request.max_context_documents,
         )
-        
+
         # Log the query
-        query_record = Query(
+        query_record = QueryRecord(
             id=str(uuid.uuid4()),
             user_id=current_user.id,
             question=request.question,
             answer=result.answer,
             context_sources=result.source_documents,
             llm_provider=result.llm_provider,
-            response_time_ms=result.response_time_ms
+            response_time_ms=result.response_time_ms,
         )
-        
+
         db.add(query_record)
         db.commit()
-        
+
         return result
-        
+
     except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Q&A failed: {str(e)}"
+        raise HTTPException(status_code=500, detail=f"Q&A failed: {str(e)}")
+
+
+@router.post("/ask/stream")
+async def ask_question_stream(
+    request: QnARequest,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Ask a question and receive the answer as Server-Sent Events.
+
+    Events: `sources` (retrieved document and chunk IDs), `token` (a piece of
+    the answer), then `done` (full answer and timings) or `error`.
+    """
+    user_id = current_user.id
+    completed: Dict[str, Any] = {}
+
+    async def events():
+        try:
+            answer = search_service.stream_answer(
+                question=request.question,
+                user_id=user_id,
+                db=db,
+                max_context=request.max_context_documents,
+            )
+            # Closed even if the response stops early, releasing the answer's LLM slot
+            async with aclosing(answer):
+                async for event, data in answer:
+                    if event == "done":
+                        completed.update(data)
+                    yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            logger.error(f"Streaming Q&A error: {str(e)}")
+            detail = json.dumps({"detail": f"Q&A failed: {str(e)}"})
+            yield f"event: error\ndata: {detail}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Log the query once the stream has been sent, off the response path;
+        # a sync task runs in the threadpool, so the blocking write never holds the loop
+        background=BackgroundTask(_log_streamed_query, user_id, completed),
+    )
+
+
+def _log_streamed_query(user_id: str, result: Dict[str, Any]) -> None:
+    if not result:
+        return
+    db = SessionLocal()
+    try:
+        db.add(
+            QueryRecord(
+                id=str(uuid.uuid4()),
+                user_id=user_id,
+                question=result["question"],
+                answer=result["answer"],
+                context_sources=result["source_documents"],
+                llm_provider=result["llm_provider"],
+                response_time_ms=result["response_time_ms"],
+            )
         )
+        db.commit()
+    except Exception as e:
+        logger.error(f"Failed to log streamed query: {str(e)}")
+        db.rollback()
+    finally:
+        db.close()
 
 
 @router.get("/suggestions")
 async def get_suggestions(
     limit: int = Query(5, ge=1, le=20),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user),
 ):
     """Get related content suggestions."""
     try:
         suggestions = await search_service.get_suggestions(
-            user_id=current_user.id,
-            limit=limit
+            user_id=current_user.id, limit=limit
         )
         return {"suggestions": suggestions}
     except Exception as e:
         raise HTTPException(
-            status_code=500,
-            detail=f"Failed to get suggestions: {str(e)}"
-        )
\ No newline at end of file
+            status_code=500, detail=f"Failed to get suggestions: {str(e)}"
+        )
@@ -1 +1 @@
-# Schemas package
\ No newline at end of file
+# Schemas package
@@ -1,18 +1,19 @@
-from pydantic import BaseModel, validator
-from typing import Optional, List
 from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, validator
 
 
 class DocumentCreate(BaseModel):
     title: str
     source_type: str
     source_url: Optional[str] = None
-    
-    @validator('source_type')
+
+    @validator("source_type")
     def validate_source_type(cls, v):
-        allowed_types = ['pdf', 'youtube', 'markdown', 'text']
+        allowed_types = ["pdf", "youtube", "markdown", "text"]
         if v not in allowed_types:
-            raise ValueError(f'source_type must be one of {allowed_types}')
+            raise ValueError(f"source_type must be one of {allowed_types}")
         return v
 
 
@@ -26,7 +27,7 @@ class DocumentResponse(BaseModel):
     file_size: Optional[int]
     created_at: datetime
     updated_at: Optional[datetime]
-    
+
     class Config:
         from_attributes = True
 
@@ -37,6 +38,46 @@ class DocumentListResponse(BaseModel):
     source_type: str
     status: str
     created_at: datetime
-    
+
+    class Config:
+        from_attributes = True
+
+
+class SummaryResponse(BaseModel):
+    document_id: str
+    summary_type: str
+    content: str
+    llm_provider: Optional[str]
+    created_at: datetime
+    updated_at: Optional[datetime]
+
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class ConceptResponse(BaseModel):
+    id: str
+    name: str
+    definition: Optional[str]
+    category: Optional[str]
+    confidence: float
+    mentions: int
+
+    class Config:
+        from_attributes = True
+
+
+class ConceptRelationshipResponse(BaseModel):
+    source_concept_id: str
+    target_concept_id: str
+    relationship_type: str
+    confidence: float
+
+    class Config:
+        from_attributes = True
+
+
+class ConceptMapResponse(BaseModel):
+    document_id: str
+    concepts: List[ConceptResponse]
+    relationships: List[ConceptRelationshipResponse]
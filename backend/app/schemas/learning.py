@@ -1,29 +1,103 @@
-from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Annotated, List, Literal, Optional, Union
+
+from pydantic import BaseModel, Field, validator
+
+from app.config import settings
 
 
 class FlashcardReviewRequest(BaseModel):
-    rating: int  # 1-5 scale
+    rating: int = Field(..., ge=1, le=5)
     response_time_ms: Optional[int] = None
-    
+    # session to count the review in; defaults to the user's latest open one
+    session_id: Optional[str] = None
+
     class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
+        json_encoders = {datetime: lambda v: v.isoformat()}
+
+
+class BatchReviewItem(BaseModel):
+    flashcard_id: str
+    rating: int  # 1-5 scale; out-of-range ratings are reported per item
+    response_time_ms: Optional[int] = None
+    # when the client recorded it; defaults to now
+    reviewed_at: Optional[datetime] = None
+
+    @validator("reviewed_at")
+    def to_naive_utc(cls, v):
+        # Stored timestamps are naive UTC
+        if v is not None and v.tzinfo is not None:
+            return v.astimezone(timezone.utc).replace(tzinfo=None)
+        return v
+
+
+class BatchReviewRequest(BaseModel):
+    reviews: List[BatchReviewItem] = Field(
+        ..., min_length=1, max_length=settings.REVIEW_BATCH_MAX_ITEMS
+    )
+    session_id: Optional[str] = None
+
+
+class ReviewStatus(str, Enum):
+    APPLIED = "applied"
+    NOT_FOUND = "not_found"
+    STALE = "stale"  # older than the card's last recorded review
+    INVALID = "invalid"
+
+
+class BatchReviewResult(BaseModel):
+    flashcard_id: str
+    status: ReviewStatus
+    interval_days: Optional[int] = None
+    next_review: Optional[datetime] = None
+    error: Optional[str] = None
+
+
+class BatchReviewResponse(BaseModel):
+    results: List[BatchReviewResult]  # in request order
+    applied: int
+    rejected: int
+
+
+class SessionReviewMessage(BaseModel):
+    type: Literal["review"]
+    flashcard_id: str
+    rating: int = Field(..., ge=1, le=5)
+    response_time_ms: Optional[int] = Field(None, ge=0)
+
+
+class SessionEndMessage(BaseModel):
+    type: Literal["end"]
+
+
+# A client message on the learning session WebSocket, told apart by `type`
+SessionSocketMessage = Annotated[
+    Union[SessionReviewMessage, SessionEndMessage], Field(discriminator="type")
+]
+
+
+class LearningSessionState(BaseModel):
+    session_id: str
+    cards_reviewed: int
+    correct_answers: int
+    # from the due queue; None when nothing is left to study
+    next_card: Optional[dict] = None
 
 
 class LearningStatsResponse(BaseModel):
-    total_cards: int
-    cards_reviewed_today: int
-    accuracy_rate: float
-    current_streak: int
-    longest_streak: int
-    average_response_time: float
-    cards_due_tomorrow: int
+    total_cards: int = 0
+    cards_reviewed_today: int = 0
+    accuracy_rate: float = 0.0
+    current_streak: int = 0
+    longest_streak: int = 0
+    average_response_time: float = 0.0
+    cards_due_tomorrow: int = 0
+    total_reviews: int = 0
+    sessions_completed: int = 0
 
 
 class LearningScheduleResponse(BaseModel):
     schedule: List[dict]
     total_due: int
-    new_cards_available: int
\ No newline at end of file
+    new_cards_available: int
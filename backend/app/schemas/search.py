@@ -1,11 +1,20 @@
-from pydantic import BaseModel
+from enum import Enum
 from typing import List, Optional
 
+from pydantic import BaseModel
+
+
+class SearchMode(str, Enum):
+    LEXICAL = "lexical"
+    VECTOR = "vector"
+    HYBRID = "hybrid"
+
 
 class SearchRequest(BaseModel):
     query: str
     limit: int = 10
     offset: int = 0
+    mode: SearchMode = SearchMode.HYBRID
 
 
 class SearchResult(BaseModel):
@@ -22,6 +31,7 @@ class SearchResponse(BaseModel):
     total: int
     query: str
     response_time_ms: int
+    next_cursor: Optional[str] = None  # pass back as `cursor` to fetch the next page
 
 
 class QnARequest(BaseModel):
@@ -34,4 +44,5 @@ class QnAResponse(BaseModel):
     answer: str
     source_documents: List[str]
     llm_provider: str
-    response_time_ms: int
\ No newline at end of file
+    response_time_ms: int
+    cached: bool = False  # served from the semantic answer cache
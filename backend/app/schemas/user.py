@@ -1,17 +1,18 @@
-from pydantic import BaseModel, EmailStr, validator
-from typing import Optional
 from datetime import datetime
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel, EmailStr, validator
 
 
 class UserCreate(BaseModel):
     email: EmailStr
     username: str
     password: str
-    
-    @validator('password')
+
+    @validator("password")
     def validate_password(cls, v):
         if len(v) < 8:
-            raise ValueError('Password must be at least 8 characters long')
+            raise ValueError("Password must be at least 8 characters long")
         return v
 
 
@@ -20,6 +21,11 @@ class UserLogin(BaseModel):
     password: str
 
 
+class UserUpdate(BaseModel):
+    username: Optional[str] = None
+    preferences: Optional[Dict[str, Any]] = None
+
+
 class UserResponse(BaseModel):
     id: str
     email: str
@@ -28,7 +34,7 @@ class UserResponse(BaseModel):
     is_verified: bool
     created_at: datetime
     updated_at: Optional[datetime] = None
-    
+
     class Config:
         from_attributes = True
 
@@ -36,4 +42,4 @@ class UserResponse(BaseModel):
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str
-    expires_in: int
\ No newline at end of file
+    expires_in: int
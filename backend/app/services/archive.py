@@ -0,0 +1,425 @@
+import asyncio
+import base64
+import gzip
+import io
+import json
+import logging
+import uuid
+import zlib
+from datetime import date, datetime
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import JSON, Boolean, Date, DateTime, Table, insert, select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.core.lexical_index import get_lexical_index
+from app.core.metrics import metrics
+from app.core.vector_store import get_vector_store
+from app.database import SessionLocal
+from app.models.user import (
+    ContentChunk,
+    Document,
+    Flashcard,
+    LearningSession,
+    Query,
+    ReviewLog,
+)
+from app.services.due_queue import get_due_queue
+from app.services.embeddings import get_embedding_service
+from app.services.learning_stats import stats_tracker
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMAT = "knowledge-os-archive"
+ARCHIVE_VERSION = 1
+
+# Parents come before children, so an import can remap foreign keys as rows arrive
+ARCHIVE_TABLES: Dict[str, Table] = {
+    "documents": Document.__table__,
+    "content_chunks": ContentChunk.__table__,
+    "flashcards": Flashcard.__table__,
+    "review_log": ReviewLog.__table__,
+    "learning_sessions": LearningSession.__table__,
+    "queries": Query.__table__,
+}
+# The owner is whoever imports; a stored file path only means something on the
+# exporting server; review log ids are reassigned by the database
+_EXCLUDED_COLUMNS = {
+    "documents": {"user_id", "file_path"},
+    "review_log": {"user_id", "id"},
+}
+# Foreign keys to rewrite on import: column -> (referenced table, whether rows without a
+# match are dropped)
+_REFERENCES = {
+    "content_chunks": {"document_id": ("documents", True)},
+    "flashcards": {"document_id": ("documents", False)},
+    "review_log": {"flashcard_id": ("flashcards", True)},
+}
+
+
+def _exported_columns(name: str) -> List[Any]:
+    excluded = _EXCLUDED_COLUMNS.get(name, {"user_id"})
+    return [
+        column for column in ARCHIVE_TABLES[name].columns if column.name not in excluded
+    ]
+
+
+def _encode_value(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def _decode_value(value: Any, column_type: Any) -> Any:
+    if value is None or not isinstance(value, str):
+        return value
+    if isinstance(column_type, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column_type, Date):
+        return date.fromisoformat(value)
+    return value
+
+
+def encode_vector(vector: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode(
+        "ascii"
+    )
+
+
+def decode_vector(text: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(text), dtype=np.float32)
+
+
+def _copy_field(value: Any, column_type: Any) -> str:
+    """Render a value in PostgreSQL COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(column_type, JSON):
+        value = json.dumps(value)
+    elif isinstance(column_type, Boolean):
+        return "t" if value else "f"
+    elif isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class ArchiveExporter:
+    """Streams a user's data out as a gzip-compressed NDJSON archive.
+
+    The first line is a header. Each following line is one batch of up to
+    ARCHIVE_BATCH_SIZE rows of a table, stored column by column
+    ({"table": ..., "rows": n, "columns": {name: [values]}}), which keeps the
+    archive small after compression. The last line holds the row counts, so
+    a truncated archive is detected on import. Rows are read through
+    server-side cursors one batch at a time, so memory use does not grow
+    with the size of the deck.
+    """
+
+    def __init__(self):
+        self.vector_store = get_vector_store()
+        self.embedding_service = get_embedding_service()
+        self.batch_size = settings.ARCHIVE_BATCH_SIZE
+
+    def export(self, user_id: str, include_embeddings: bool = False) -> Iterator[bytes]:
+        """Yield the compressed archive in pieces, for a streaming response."""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+        for record in self.records(user_id, include_embeddings):
+            data = compressor.compress(
+                json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+            )
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def records(
+        self, user_id: str, include_embeddings: bool = False
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield the archive's records (header, row batches, trailer) uncompressed."""
+        db = SessionLocal()
+        try:
+            backend = self.embedding_service.backend
+            yield {
+                "format": ARCHIVE_FORMAT,
+                "version": ARCHIVE_VERSION,
+                "exported_at": datetime.utcnow().isoformat(),
+                "tables": list(ARCHIVE_TABLES),
+                "embedding_model": backend.name if include_embeddings else None,
+                "embedding_dimension": (
+                    backend.dimension if include_embeddings else None
+                ),
+            }
+
+            counts = {}
+            for name in ARCHIVE_TABLES:
+                counts[name] = 0
+                for batch in self._batches(db, name, user_id, include_embeddings):
+                    counts[name] += batch["rows"]
+                    yield batch
+
+            metrics.incr("archive.exports")
+            logger.info(f"Exported archive for user {user_id}: {counts}")
+            yield {"end": True, "counts": counts}
+
+        finally:
+            db.close()
+
+    def _batches(
+        self, db: Session, name: str, user_id: str, include_embeddings: bool
+    ) -> Iterator[Dict[str, Any]]:
+        table = ARCHIVE_TABLES[name]
+        columns = _exported_columns(name)
+        result = db.execute(
+            select(*columns)
+            .where(table.c.user_id == user_id)
+            .execution_options(yield_per=self.batch_size)
+        )
+        for rows in result.partitions():
+            values = list(zip(*rows))
+            batch = {
+                column.name: [_encode_value(value) for value in column_values]
+                for column, column_values in zip(columns, values)
+            }
+            if include_embeddings and name == "content_chunks":
+                vectors = self.vector_store.get(user_id, batch["id"])
+                batch["embedding"] = [
+                    encode_vector(vectors[chunk_id]) if chunk_id in vectors else None
+                    for chunk_id in batch["id"]
+                ]
+            yield {"table": name, "rows": len(rows), "columns": batch}
+
+
+class ArchiveImporter:
+    """Loads an archive written by ArchiveExporter into a user's account.
+
+    An import adds copies: every row gets a fresh id and foreign keys are
+    rewritten to match, so an archive can be loaded into the account it
+    came from, or into several, without conflicts. Batches are bulk-loaded
+    with COPY on PostgreSQL and multi-row INSERTs elsewhere, all in one
+    transaction that commits only once the archive's trailer is read.
+    Chunks are indexed for search as they arrive, from the archive's
+    embeddings when they came from the embedding model in use here and
+    through the embedding service otherwise.
+    """
+
+    def __init__(self):
+        self.vector_store = get_vector_store()
+        self.lexical_index = get_lexical_index()
+        self.embedding_service = get_embedding_service()
+        self.due_queue = get_due_queue()
+
+    async def import_archive(
+        self, user_id: str, stream: BinaryIO, db: Session
+    ) -> Dict[str, int]:
+        """Import a gzip-compressed archive and return the rows added per table."""
+        reader = self._read_records(stream)
+        indexed_chunks: List[str] = []
+        try:
+            header = await asyncio.to_thread(next, reader, None)
+            if not header or header.get("format") != ARCHIVE_FORMAT:
+                raise ValueError("Not a knowledge-os archive")
+            if header.get("version") != ARCHIVE_VERSION:
+                raise ValueError(
+                    f"Unsupported archive version: {header.get('version')}"
+                )
+            backend = self.embedding_service.backend
+            reuse_embeddings = (
+                header.get("embedding_model") == backend.name
+                and header.get("embedding_dimension") == backend.dimension
+            )
+
+            id_maps: Dict[str, Dict[str, str]] = {name: {} for name in ARCHIVE_TABLES}
+            counts = {name: 0 for name in ARCHIVE_TABLES}
+            while True:
+                record = await asyncio.to_thread(next, reader, None)
+                if record is None:
+                    raise ValueError("Archive is truncated")
+                if record.get("end"):
+                    break
+
+                name = record.get("table")
+                if name not in ARCHIVE_TABLES or not isinstance(
+                    record.get("columns"), dict
+                ):
+                    raise ValueError(f"Unknown archive record for table {name!r}")
+                rows, embeddings = self._decode_batch(
+                    name, record["columns"], user_id, id_maps
+                )
+                if not rows:
+                    continue
+                await asyncio.to_thread(self._load_rows, db, name, rows)
+                counts[name] += len(rows)
+
+                if name == "content_chunks":
+                    indexed_chunks.extend(row["id"] for row in rows)
+                    await self._index_chunks(
+                        user_id, rows, embeddings if reuse_embeddings else None
+                    )
+
+            await asyncio.to_thread(self._finish, db, user_id)
+
+        except Exception as e:
+            db.rollback()
+            if indexed_chunks:
+                await asyncio.to_thread(
+                    self.vector_store.delete, user_id, indexed_chunks
+                )
+                await asyncio.to_thread(
+                    self.lexical_index.delete, user_id, indexed_chunks
+                )
+            logger.error(f"Error importing archive for user {user_id}: {str(e)}")
+            raise e
+
+        await self.due_queue.invalidate(user_id)
+        metrics.incr("archive.imports")
+        logger.info(f"Imported archive for user {user_id}: {counts}")
+        return counts
+
+    @staticmethod
+    def _read_records(stream: BinaryIO) -> Iterator[Dict[str, Any]]:
+        """Decompress and parse records, refusing archives that inflate past
+        MAX_IMPORT_UNCOMPRESSED_MB or hold a record over MAX_IMPORT_RECORD_MB."""
+        max_bytes = settings.MAX_IMPORT_UNCOMPRESSED_MB * 1024 * 1024
+        max_record = settings.MAX_IMPORT_RECORD_MB * 1024 * 1024
+        total = 0
+        try:
+            with gzip.open(stream, "rb") as lines:
+                while True:
+                    # Reading one byte past the cap is enough to tell a line is too long
+                    line = lines.readline(max_record + 1)
+                    if not line:
+                        break
+                    total += len(line)
+                    if total > max_bytes:
+                        raise ValueError(
+                            "Archive is larger than "
+                            f"{settings.MAX_IMPORT_UNCOMPRESSED_MB}MB uncompressed"
+                        )
+                    if len(line) > max_record and not line.endswith(b"\n"):
+                        raise ValueError(
+                            "Archive record is larger than "
+                            f"{settings.MAX_IMPORT_RECORD_MB}MB"
+                        )
+                    if line.strip():
+                        yield json.loads(line)
+        except (OSError, EOFError, zlib.error, UnicodeDecodeError) as e:
+            raise ValueError(f"Archive could not be read: {str(e)}")
+
+    def _decode_batch(
+        self,
+        name: str,
+        columns: Dict[str, List[Any]],
+        user_id: str,
+        id_maps: Dict[str, Dict[str, str]],
+    ) -> Tuple[List[Dict[str, Any]], List[Optional[str]]]:
+        """Turn a columnar batch into insertable rows with new ids; returns the rows and
+        their embeddings.
+        """
+        known = [column for column in _exported_columns(name) if column.name in columns]
+        size = len(columns[known[0].name]) if known else 0
+        if any(len(values) != size for values in columns.values()):
+            raise ValueError(
+                f"Archive batch for {name} has columns of different lengths"
+            )
+
+        embeddings = columns.get("embedding") or [None] * size
+        rows, kept_embeddings = [], []
+        for values, embedding in zip(
+            zip(*(columns[column.name] for column in known)), embeddings
+        ):
+            row = {
+                column.name: _decode_value(value, column.type)
+                for column, value in zip(known, values)
+            }
+            row["user_id"] = user_id
+
+            dropped = False
+            for column, (target, required) in _REFERENCES.get(name, {}).items():
+                row[column] = id_maps[target].get(row.get(column))
+                dropped = dropped or (required and row[column] is None)
+            if dropped:
+                continue
+
+            if "id" in row:
+                new_id = str(uuid.uuid4())
+                id_maps[name][row["id"]] = new_id
+                row["id"] = new_id
+            if name == "documents" and row.get("status") != "completed":
+                # Without its source file the document can't be processed again
+                row["status"], row["error_message"] = (
+                    "failed",
+                    "Imported without its source file",
+                )
+            if name == "queries" and isinstance(row.get("context_sources"), list):
+                row["context_sources"] = [
+                    id_maps["documents"][source]
+                    for source in row["context_sources"]
+                    if source in id_maps["documents"]
+                ]
+
+            rows.append(row)
+            kept_embeddings.append(embedding)
+        return rows, kept_embeddings
+
+    def _load_rows(self, db: Session, name: str, rows: List[Dict[str, Any]]) -> None:
+        table = ARCHIVE_TABLES[name]
+        if db.get_bind().dialect.name != "postgresql":
+            db.execute(insert(table), rows)
+            return
+
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(
+                "\t".join(
+                    _copy_field(row.get(column), table.c[column].type)
+                    for column in columns
+                )
+            )
+            buffer.write("\n")
+        buffer.seek(0)
+        # COPY runs on the session's own connection, inside its transaction
+        cursor = db.connection().connection.cursor()
+        try:
+            column_list = ", ".join(f'"{column}"' for column in columns)
+            cursor.copy_expert(f"COPY {table.name} ({column_list}) FROM STDIN", buffer)
+        finally:
+            cursor.close()
+
+    async def _index_chunks(
+        self,
+        user_id: str,
+        rows: List[Dict[str, Any]],
+        embeddings: Optional[List[Optional[str]]],
+    ) -> None:
+        """Add imported chunks to the vector and lexical indexes, embedding those that
+        came without a vector.
+        """
+        vectors: List[Optional[np.ndarray]] = [
+            decode_vector(embedding) if embedding else None
+            for embedding in (embeddings or [None] * len(rows))
+        ]
+        missing = [index for index, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = await self.embedding_service.embed_texts(
+                [rows[index]["content"] for index in missing]
+            )
+            for index, vector in zip(missing, computed):
+                vectors[index] = vector
+        metrics.incr("archive.embeddings_reused", len(rows) - len(missing))
+
+        ids = [row["id"] for row in rows]
+        await asyncio.to_thread(self.vector_store.add, user_id, ids, np.stack(vectors))
+        await asyncio.to_thread(
+            self.lexical_index.add, user_id, ids, [row["content"] for row in rows]
+        )
+
+    @staticmethod
+    def _finish(db: Session, user_id: str) -> None:
+        stats_tracker.rebuild(user_id, db)
+        db.commit()
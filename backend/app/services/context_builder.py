@@ -0,0 +1,166 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from app.config import settings
+from app.schemas.search import SearchResult
+from app.utils.text_processing import estimate_tokens
+
+_SHINGLE_WORDS = 5
+_WORD = re.compile(r"\w+")
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]?\s")
+
+
+@dataclass
+class ContextPassage:
+    """A contiguous span of one document, built from one or more retrieved chunks."""
+
+    document_id: str
+    title: str
+    content: str
+    score: float
+    chunk_ids: List[str] = field(default_factory=list)
+    start_char: Optional[int] = None
+    end_char: Optional[int] = None
+    chunk_index: int = 0
+    tokens: int = 0
+
+
+def _shingles(text: str) -> Set[int]:
+    words = _WORD.findall(text.lower())
+    if len(words) < _SHINGLE_WORDS:
+        return {hash(" ".join(words))}
+    return {
+        hash(" ".join(words[i : i + _SHINGLE_WORDS]))
+        for i in range(len(words) - _SHINGLE_WORDS + 1)
+    }
+
+
+def _join_overlapping(left: str, right: str) -> str:
+    """Concatenate two chunks, writing the text they share only once."""
+    probe = right[: min(len(right), 64)]
+    position = left.rfind(probe)
+    while position >= 0:
+        if right.startswith(left[position:]):
+            return left[:position] + right
+        position = left.rfind(probe, 0, position)
+    return f"{left}\n{right}"
+
+
+class ContextBuilder:
+    """Turns retrieved chunks into a compact, token-budgeted RAG context.
+
+    Neighbouring and overlapping chunks of the same document (CHUNK_OVERLAP
+    guarantees consecutive chunks share text) are merged into one passage,
+    passages that repeat one another are dropped, and the rest are packed
+    best-first until the token budget or the passage limit is reached.
+    """
+
+    def __init__(self, duplicate_threshold: float = None):
+        self.duplicate_threshold = (
+            duplicate_threshold or settings.CONTEXT_DUPLICATE_THRESHOLD
+        )
+
+    def build(
+        self, results: List[SearchResult], max_passages: int, budget: int
+    ) -> List[ContextPassage]:
+        """Return at most `max_passages` passages totalling at most `budget` tokens,
+        most relevant first.
+        """
+        passages = self._deduplicate(self._merge(results))
+
+        packed = []
+        for passage in sorted(
+            passages, key=lambda passage: passage.score, reverse=True
+        ):
+            if len(packed) >= max_passages or budget <= 0:
+                break
+            # The "[n] title" header each passage gets in the prompt counts too
+            header = estimate_tokens(passage.title) + 4
+            passage.tokens = header + estimate_tokens(passage.content)
+            if passage.tokens > budget:
+                if packed:
+                    # Something smaller and less relevant may still fit
+                    continue
+                passage.content = self._truncate(passage.content, budget - header)
+                passage.tokens = header + estimate_tokens(passage.content)
+            packed.append(passage)
+            budget -= passage.tokens
+        return packed
+
+    def _merge(self, results: List[SearchResult]) -> List[ContextPassage]:
+        by_document: Dict[str, List[SearchResult]] = {}
+        for result in results:
+            by_document.setdefault(
+                result.metadata.get("document_id", result.id), []
+            ).append(result)
+
+        passages = []
+        for document_id, chunks in by_document.items():
+            chunks.sort(key=lambda result: result.metadata.get("chunk_index", 0))
+            current = None
+            for chunk in chunks:
+                metadata = chunk.metadata
+                if current is not None and self._touches(current, metadata):
+                    current.content = _join_overlapping(current.content, chunk.content)
+                    current.score = max(current.score, chunk.score)
+                    current.chunk_ids.append(chunk.id)
+                    current.end_char = metadata.get("end_char", current.end_char)
+                    current.chunk_index = metadata.get(
+                        "chunk_index", current.chunk_index
+                    )
+                    continue
+                current = ContextPassage(
+                    document_id=document_id,
+                    title=chunk.title,
+                    content=chunk.content,
+                    score=chunk.score,
+                    chunk_ids=[chunk.id],
+                    start_char=metadata.get("start_char"),
+                    end_char=metadata.get("end_char"),
+                    chunk_index=metadata.get("chunk_index", 0),
+                )
+                passages.append(current)
+        return passages
+
+    @staticmethod
+    def _touches(passage: ContextPassage, metadata: dict) -> bool:
+        if metadata.get("chunk_index") == passage.chunk_index + 1:
+            return True
+        start = metadata.get("start_char")
+        return (
+            start is not None
+            and passage.end_char is not None
+            and start <= passage.end_char
+        )
+
+    def _deduplicate(self, passages: List[ContextPassage]) -> List[ContextPassage]:
+        """Drop passages that mostly repeat a more relevant one (e.g. the same notes
+        uploaded twice).
+        """
+        kept, kept_shingles = [], []
+        for passage in sorted(
+            passages, key=lambda passage: passage.score, reverse=True
+        ):
+            shingles = _shingles(passage.content)
+            duplicate = any(
+                len(shingles & other) / min(len(shingles), len(other))
+                >= self.duplicate_threshold
+                for other in kept_shingles
+            )
+            if not duplicate:
+                kept.append(passage)
+                kept_shingles.append(shingles)
+        return kept
+
+    @staticmethod
+    def _truncate(text: str, budget: int) -> str:
+        """Cut text to roughly `budget` tokens, ending on a sentence where possible."""
+        end = len(text)
+        while end > 0 and estimate_tokens(text[:end]) > budget:
+            end = int(end * 0.9)
+        cut = text[:end]
+        sentence_ends = list(_SENTENCE_END.finditer(cut))
+        if sentence_ends and sentence_ends[-1].end() > end // 2:
+            cut = cut[: sentence_ends[-1].end()]
+        return cut.strip()
@@ -1,37 +1,323 @@
 import asyncio
-from typing import Dict, Any
+import itertools
 import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.core.cache import get_answer_cache
+from app.core.lexical_index import get_lexical_index
+from app.core.vector_store import get_vector_store
+from app.database import SessionLocal
+from app.models.user import ContentChunk, Document, generate_uuid
+from app.services.embeddings import get_embedding_service
+from app.utils.text_processing import (
+    TextChunk,
+    TextChunker,
+    content_hash,
+    iter_text_blocks,
+)
 
 logger = logging.getLogger(__name__)
 
+# Marks the end of a stage's output stream
+_STAGE_DONE = object()
+
+EmbeddedChunk = Tuple[TextChunk, np.ndarray]
+
+
+@dataclass
+class PipelineRun:
+    """State for one pass of a document through the ingestion pipeline."""
+
+    document_id: str
+    user_id: str
+    file_path: str
+    source_type: str
+    chunk_count: int = 0
+    stale_chunk_ids: List[str] = field(default_factory=list)
+
 
 class DocumentProcessor:
-    """Service for processing uploaded documents."""
-    
+    """Service for processing uploaded documents.
+
+    Processing is a staged pipeline: extract -> chunk -> embed -> index.
+    Stages are connected by bounded queues so a large PDF is streamed through
+    a page at a time instead of being loaded into memory, and a slow stage
+    applies backpressure to the ones in front of it.
+    """
+
     def __init__(self):
-        self.chunk_size = 1000
-        self.chunk_overlap = 200
-    
+        self.chunk_size = settings.CHUNK_SIZE
+        self.chunk_overlap = settings.CHUNK_OVERLAP
+        self.max_workers = settings.MAX_WORKERS
+        self.queue_size = settings.PIPELINE_QUEUE_SIZE
+        self.batch_size = settings.PIPELINE_BATCH_SIZE
+        self.chunker = TextChunker(self.chunk_size, self.chunk_overlap)
+        self.embedding_service = get_embedding_service()
+        self.vector_store = get_vector_store()
+        self.lexical_index = get_lexical_index()
+        self.answer_cache = get_answer_cache()
+
     async def process_document(self, document_id: str) -> Dict[str, Any]:
-        """Process a document asynchronously."""
+        """Run a document through the ingestion pipeline and record its status."""
         try:
-            # In a real implementation, this would:
-            # 1. Extract text from document
-            # 2. Split into chunks
-            # 3. Generate embeddings
-            # 4. Store in vector database
-            # 5. Generate summaries and flashcards
-            
+            # Blocking session work runs on a worker thread so requests are not held up
+            run = await asyncio.to_thread(self._start_processing, document_id)
+            if run is None:
+                logger.warning(f"Document {document_id} not found, skipping processing")
+                return {
+                    "status": "failed",
+                    "error": "Document not found",
+                    "retryable": False,
+                }
+
             logger.info(f"Starting processing for document: {document_id}")
-            
-            # Simulate processing time
-            await asyncio.sleep(2)
-            
-            # Update document status (would be done via DB operations)
-            logger.info(f"Completed processing for document: {document_id}")
-            
-            return {"status": "completed", "document_id": document_id}
-            
+            await self._unindex_chunks(run.user_id, document_id, run.stale_chunk_ids)
+            await self._run_pipeline(run)
+
+            await asyncio.to_thread(
+                self._finish_processing, document_id, "completed", run.chunk_count, None
+            )
+            logger.info(
+                f"Completed processing for document: {document_id} ({run.chunk_count} "
+                "chunks)"
+            )
+
+            return {
+                "status": "completed",
+                "document_id": document_id,
+                "user_id": run.user_id,
+                "chunks": run.chunk_count,
+            }
+
+        except ValueError as e:
+            # Bad input (unsupported type, missing file): retrying will not help
+            logger.error(f"Error processing document {document_id}: {str(e)}")
+            await asyncio.to_thread(
+                self._finish_processing, document_id, "failed", 0, str(e)
+            )
+            return {"status": "failed", "error": str(e), "retryable": False}
+
         except Exception as e:
             logger.error(f"Error processing document {document_id}: {str(e)}")
-            return {"status": "failed", "error": str(e)}
\ No newline at end of file
+            await asyncio.to_thread(
+                self._finish_processing, document_id, "failed", 0, str(e)
+            )
+            return {"status": "failed", "error": str(e), "retryable": True}
+
+    async def _run_pipeline(self, run: PipelineRun) -> None:
+        """Wire the stages together and wait for the stream to drain."""
+        chunk_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        index_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+
+        tasks = [
+            asyncio.create_task(self._extract_stage(run, chunk_queue)),
+            asyncio.create_task(
+                self._run_stage(chunk_queue, index_queue, self._embed_batch)
+            ),
+            asyncio.create_task(
+                self._run_stage(
+                    index_queue, None, lambda batch: self._index_batch(run, batch)
+                )
+            ),
+        ]
+
+        try:
+            await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def _extract_stage(self, run: PipelineRun, outbox: asyncio.Queue) -> None:
+        """Producer: stream text out of the file and emit batches of chunks."""
+        chunks = self.chunker.iter_chunks(
+            iter_text_blocks(run.file_path, run.source_type)
+        )
+
+        while True:
+            # Extraction and chunking are blocking, so pull each batch on a worker
+            # thread
+            batch = await asyncio.to_thread(self._next_batch, chunks)
+            if not batch:
+                break
+            await outbox.put(batch)
+
+        await outbox.put(_STAGE_DONE)
+
+    def _next_batch(self, chunks: Iterator[TextChunk]) -> List[TextChunk]:
+        return list(itertools.islice(chunks, self.batch_size))
+
+    async def _run_stage(
+        self,
+        inbox: asyncio.Queue,
+        outbox: Optional[asyncio.Queue],
+        handler: Callable[[Any], Awaitable[Any]],
+    ) -> None:
+        """Consume batches from inbox with MAX_WORKERS workers, feeding outbox."""
+
+        async def worker():
+            while True:
+                batch = await inbox.get()
+                if batch is _STAGE_DONE:
+                    # Hand the marker on to sibling workers
+                    inbox.put_nowait(_STAGE_DONE)
+                    return
+                result = await handler(batch)
+                if outbox is not None:
+                    await outbox.put(result)
+
+        await asyncio.gather(*(worker() for _ in range(self.max_workers)))
+
+        if outbox is not None:
+            await outbox.put(_STAGE_DONE)
+
+    async def _embed_batch(self, batch: List[TextChunk]) -> List[EmbeddedChunk]:
+        """Embed stage: attach a vector to each chunk in the batch."""
+        vectors = await self.embedding_service.embed_texts(
+            [chunk.content for chunk in batch]
+        )
+        return list(zip(batch, vectors))
+
+    async def _index_batch(self, run: PipelineRun, batch: List[EmbeddedChunk]) -> None:
+        """Index stage: persist the chunks of a batch and add them to the search
+        indexes.
+        """
+        chunk_ids = await asyncio.to_thread(self._store_chunks, run, batch)
+        await asyncio.gather(
+            asyncio.to_thread(
+                self.vector_store.add,
+                run.user_id,
+                chunk_ids,
+                np.stack([vector for _, vector in batch]),
+            ),
+            asyncio.to_thread(
+                self.lexical_index.add,
+                run.user_id,
+                chunk_ids,
+                [chunk.content for chunk, _ in batch],
+            ),
+        )
+        run.chunk_count += len(batch)
+
+    def _store_chunks(self, run: PipelineRun, batch: List[EmbeddedChunk]) -> List[str]:
+        chunk_ids = [generate_uuid() for _ in batch]
+        db = SessionLocal()
+        try:
+            db.bulk_insert_mappings(
+                ContentChunk,
+                [
+                    {
+                        "id": chunk_id,
+                        "document_id": run.document_id,
+                        "user_id": run.user_id,
+                        "chunk_index": chunk.index,
+                        "content": chunk.content,
+                        "content_hash": content_hash(chunk.content),
+                        "chunk_metadata": chunk.metadata,
+                    }
+                    for chunk_id, (chunk, _) in zip(chunk_ids, batch)
+                ],
+            )
+            db.commit()
+            return chunk_ids
+        finally:
+            db.close()
+
+    def _delete_chunks(self, document_id: str, db: Session) -> List[str]:
+        """Delete a document's chunk rows and return their IDs."""
+        chunk_ids = [
+            chunk_id
+            for (chunk_id,) in db.query(ContentChunk.id).filter(
+                ContentChunk.document_id == document_id
+            )
+        ]
+        db.query(ContentChunk).filter(ContentChunk.document_id == document_id).delete(
+            synchronize_session=False
+        )
+        return chunk_ids
+
+    async def remove_document(
+        self, document_id: str, user_id: str, db: AsyncSession
+    ) -> None:
+        """Drop a document's chunks from the database and the search indexes; the caller
+        commits.
+        """
+        chunk_ids = await db.run_sync(
+            lambda sync_db: self._delete_chunks(document_id, sync_db)
+        )
+        await self._unindex_chunks(user_id, document_id, chunk_ids)
+
+    async def _unindex_chunks(
+        self, user_id: str, document_id: str, chunk_ids: List[str]
+    ) -> None:
+        """Remove a document's old chunks from the indexes and drop answers built from
+        them.
+        """
+        tasks = [
+            asyncio.to_thread(self.vector_store.delete, user_id, chunk_ids),
+            asyncio.to_thread(self.lexical_index.delete, user_id, chunk_ids),
+        ]
+        if self.answer_cache is not None:
+            tasks.append(
+                asyncio.to_thread(
+                    self.answer_cache.invalidate_documents, user_id, [document_id]
+                )
+            )
+        await asyncio.gather(*tasks)
+
+    def _start_processing(self, document_id: str) -> Optional[PipelineRun]:
+        """Mark the document as processing and clear chunks from earlier runs."""
+        db = SessionLocal()
+        try:
+            document = db.query(Document).filter(Document.id == document_id).first()
+            if not document:
+                return None
+
+            if not document.file_path:
+                raise ValueError("Document has no stored file to process")
+
+            stale_chunk_ids = self._delete_chunks(document_id, db)
+
+            document.status = "processing"
+            document.error_message = None
+            document.updated_at = datetime.utcnow()
+            db.commit()
+
+            return PipelineRun(
+                document_id=document.id,
+                user_id=document.user_id,
+                file_path=document.file_path,
+                source_type=document.source_type,
+                stale_chunk_ids=stale_chunk_ids,
+            )
+        finally:
+            db.close()
+
+    def _finish_processing(
+        self,
+        document_id: str,
+        status: str,
+        chunk_count: int,
+        error_message: Optional[str],
+    ) -> None:
+        db = SessionLocal()
+        try:
+            document = db.query(Document).filter(Document.id == document_id).first()
+            if not document:
+                return
+
+            document.status = status
+            document.chunk_count = chunk_count
+            document.error_message = error_message
+            document.updated_at = datetime.utcnow()
+            db.commit()
+        finally:
+            db.close()
@@ -0,0 +1,337 @@
+import json
+import logging
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.core.cache import TTLCache
+from app.core.metrics import metrics
+from app.models.user import Flashcard, UserLearningStats
+from app.services.scheduling import fsrs_retrievability
+
+logger = logging.getLogger(__name__)
+
+# A queue and the facts it was built under: the UTC day (the new-card cap is
+# per day) and whether it held every card due at build time
+QueueMeta = Dict[str, Any]
+
+
+def interleave(reviews: List[Dict], new_cards: List[Dict], every: int) -> List[Dict]:
+    """Place one new card after every `every` reviews; leftovers of either kind
+    go last."""
+    if every <= 0:
+        return new_cards + reviews
+    queue, pending = [], list(reversed(new_cards))
+    for position, card in enumerate(reviews, start=1):
+        queue.append(card)
+        if position % every == 0 and pending:
+            queue.append(pending.pop())
+    queue.extend(reversed(pending))
+    return queue
+
+
+def recall_risk(
+    now: datetime,
+    last_review: Sequence[Optional[datetime]],
+    next_review: Sequence[datetime],
+    interval_days: np.ndarray,
+    stability: np.ndarray,
+) -> np.ndarray:
+    """Probability that each card has been forgotten by `now`.
+
+    FSRS cards use their stability. SM-2 cards have none, so their interval
+    stands in for it: FSRS defines stability as the delay at which recall
+    drops to 90%, which is what an SM-2 interval aims for. Either way a card
+    just coming due scores about 0.1 and the score grows with how far it is
+    overdue relative to its interval.
+    """
+    interval = np.maximum(interval_days.astype(np.float64), 1.0)
+    elapsed = np.array(
+        [
+            (
+                (now - last).total_seconds()
+                if last is not None
+                else (now - due).total_seconds() + days * 86400
+            )
+            / 86400
+            for last, due, days in zip(last_review, next_review, interval)
+        ],
+        dtype=np.float64,
+    )
+    stability = np.where(np.isnan(stability), interval, stability)
+    return 1 - fsrs_retrievability(np.maximum(elapsed, 0.0), stability)
+
+
+class DueQueueStore(ABC):
+    """Holds each user's prefetched review queue, in order."""
+
+    @abstractmethod
+    async def load(
+        self, user_id: str, limit: int
+    ) -> Optional[Tuple[List[Dict], QueueMeta]]:
+        """Return the first `limit` cards and the queue's meta, or None if there is no
+        queue.
+        """
+
+    @abstractmethod
+    async def save(self, user_id: str, cards: List[Dict], meta: QueueMeta) -> None:
+        """Replace the user's queue."""
+
+    @abstractmethod
+    async def remove(self, user_id: str, card_ids: Sequence[str]) -> None:
+        """Drop cards from the queue, keeping the order of the rest."""
+
+    @abstractmethod
+    async def invalidate(self, user_id: str) -> None:
+        """Drop the user's queue."""
+
+
+class InMemoryDueQueueStore(DueQueueStore):
+    """Queues held in this process; for single-process deployments."""
+
+    def __init__(self, max_users: int = 10000, ttl_seconds: int = None):
+        self._queues = TTLCache(
+            max_users, ttl_seconds or settings.DUE_QUEUE_TTL_SECONDS
+        )
+        self._lock = threading.Lock()
+
+    async def load(self, user_id, limit):
+        with self._lock:
+            entry = self._queues.get(user_id)
+            if entry is None:
+                return None
+            cards, meta = entry
+            return [cards[card_id] for card_id in list(cards)[:limit]], dict(meta)
+
+    async def save(self, user_id, cards, meta):
+        with self._lock:
+            self._queues.put(
+                user_id, ({card["id"]: card for card in cards}, dict(meta))
+            )
+
+    async def remove(self, user_id, card_ids):
+        with self._lock:
+            entry = self._queues.get(user_id)
+            if entry is not None:
+                for card_id in card_ids:
+                    entry[0].pop(card_id, None)
+
+    async def invalidate(self, user_id):
+        with self._lock:
+            self._queues.pop(user_id)
+
+
+class RedisDueQueueStore(DueQueueStore):
+    """Queues shared by every API process through Redis.
+
+    Per user: a sorted set of card ids scored by queue position, a hash of
+    JSON card payloads and a hash of meta fields. All three expire
+    DUE_QUEUE_TTL_SECONDS after the queue was built.
+    """
+
+    def __init__(self, url: str = None, prefix: str = "due:", ttl_seconds: int = None):
+        import redis.asyncio as redis
+
+        self.redis = redis.Redis.from_url(
+            url or settings.REDIS_URL, decode_responses=True
+        )
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds or settings.DUE_QUEUE_TTL_SECONDS
+
+    def _keys(self, user_id: str) -> Tuple[str, str, str]:
+        return (
+            f"{self.prefix}{user_id}:order",
+            f"{self.prefix}{user_id}:cards",
+            f"{self.prefix}{user_id}:meta",
+        )
+
+    async def load(self, user_id, limit):
+        order, cards, meta = self._keys(user_id)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(meta)
+        pipe.zrange(order, 0, limit - 1)
+        stored_meta, card_ids = await pipe.execute()
+        if not stored_meta:
+            return None
+        payloads = await self.redis.hmget(cards, card_ids) if card_ids else []
+        return (
+            [json.loads(payload) for payload in payloads if payload is not None],
+            {
+                "day": stored_meta.get("day"),
+                "complete": stored_meta.get("complete") == "1",
+            },
+        )
+
+    async def save(self, user_id, cards, meta):
+        order, payloads, meta_key = self._keys(user_id)
+        pipe = self.redis.pipeline()
+        pipe.delete(order, payloads, meta_key)
+        if cards:
+            pipe.zadd(
+                order, {card["id"]: position for position, card in enumerate(cards)}
+            )
+            pipe.hset(
+                payloads, mapping={card["id"]: json.dumps(card) for card in cards}
+            )
+        pipe.hset(
+            meta_key,
+            mapping={"day": meta["day"], "complete": "1" if meta["complete"] else "0"},
+        )
+        for key in (order, payloads, meta_key):
+            pipe.expire(key, self.ttl_seconds)
+        await pipe.execute()
+
+    async def remove(self, user_id, card_ids):
+        if not card_ids:
+            return
+        order, payloads, _ = self._keys(user_id)
+        pipe = self.redis.pipeline()
+        pipe.zrem(order, *card_ids)
+        pipe.hdel(payloads, *card_ids)
+        await pipe.execute()
+
+    async def invalidate(self, user_id):
+        await self.redis.delete(*self._keys(user_id))
+
+
+class DueQueue:
+    """Per-user queue of cards to study next, most at risk of being forgotten first.
+
+    Due cards are ranked by recall_risk() and never-reviewed cards are
+    interleaved up to NEW_CARDS_PER_DAY. A refill costs three queries (the
+    stats row for today's new-card count, due cards, new cards) and
+    prefetches DUE_QUEUE_SIZE cards; reviews then remove cards from the
+    stored queue, so a session reads the database again only when the
+    queue runs short, the day changes, or the queue expires.
+    """
+
+    def __init__(self, store: DueQueueStore):
+        self.store = store
+
+    async def peek(self, user_id: str, limit: int, db: AsyncSession) -> List[Dict]:
+        """Return the next `limit` cards, refilling the queue from the database if
+        needed.
+
+        Only the refill queries run inside run_sync; the store is awaited
+        directly, so a Redis round trip never holds the event loop.
+        """
+        today = datetime.utcnow().date().isoformat()
+        cached = await self.store.load(user_id, limit)
+        if cached is not None:
+            cards, meta = cached
+            if meta["day"] == today and (len(cards) >= limit or meta["complete"]):
+                metrics.incr("due_queue.hits")
+                return cards
+
+        metrics.incr("due_queue.refills")
+        size = max(settings.DUE_QUEUE_SIZE, limit)
+        cards, complete = await db.run_sync(
+            lambda sync_db: self.build(user_id, size, sync_db)
+        )
+        await self.store.save(user_id, cards, {"day": today, "complete": complete})
+        return cards[:limit]
+
+    def build(self, user_id: str, size: int, db: Session) -> Tuple[List[Dict], bool]:
+        """Rank the user's due and new cards; returns up to `size` cards and whether
+        that is all of them.
+        """
+        now = datetime.utcnow()
+        stats = db.get(UserLearningStats, user_id)
+        new_today = (
+            stats.new_cards_today
+            if stats is not None and stats.review_day == now.date()
+            else 0
+        )
+        new_quota = max(0, settings.NEW_CARDS_PER_DAY - new_today)
+
+        columns = (
+            Flashcard.id,
+            Flashcard.front,
+            Flashcard.back,
+            Flashcard.difficulty,
+            Flashcard.review_count,
+            Flashcard.interval_days,
+            Flashcard.stability,
+            Flashcard.last_review,
+            Flashcard.next_review,
+        )
+        # The (user_id, next_review) index yields the most overdue cards first
+        due = (
+            db.query(*columns)
+            .filter(
+                Flashcard.user_id == user_id,
+                Flashcard.next_review <= now,
+                Flashcard.review_count > 0,
+            )
+            .order_by(Flashcard.next_review)
+            .limit(settings.DUE_QUEUE_SCAN_LIMIT)
+            .all()
+        )
+        new_cards = (
+            db.query(*columns)
+            .filter(Flashcard.user_id == user_id, Flashcard.review_count == 0)
+            .order_by(Flashcard.created_at)
+            .limit(min(new_quota, size))
+            .all()
+            if new_quota
+            else []
+        )
+
+        reviews = []
+        if due:
+            risk = recall_risk(
+                now,
+                [row.last_review for row in due],
+                [row.next_review for row in due],
+                np.array([row.interval_days or 0 for row in due]),
+                np.array(
+                    [np.nan if row.stability is None else row.stability for row in due],
+                    dtype=np.float64,
+                ),
+            )
+            # Stable sort keeps the most overdue first among equal risks
+            reviews = [due[index] for index in np.argsort(-risk, kind="stable")]
+
+        queue = interleave(
+            [self._payload(row) for row in reviews],
+            [self._payload(row) for row in new_cards],
+            settings.NEW_CARD_INTERLEAVE,
+        )
+        complete = len(queue) <= size and len(due) < settings.DUE_QUEUE_SCAN_LIMIT
+        return queue[:size], complete
+
+    async def remove(self, user_id: str, card_ids: Sequence[str]) -> None:
+        await self.store.remove(user_id, list(card_ids))
+
+    async def invalidate(self, user_id: str) -> None:
+        """Drop the user's queue, e.g. after cards were added or deleted."""
+        await self.store.invalidate(user_id)
+
+    @staticmethod
+    def _payload(row: Any) -> Dict:
+        return {
+            "id": row.id,
+            "front": row.front,
+            "back": row.back,
+            "difficulty": row.difficulty,
+            "review_count": row.review_count,
+            "is_new": row.review_count == 0,
+        }
+
+
+@lru_cache()
+def get_due_queue() -> DueQueue:
+    """Return the process-wide due queue with the store selected by
+    DUE_QUEUE_BACKEND."""
+    if settings.DUE_QUEUE_BACKEND == "memory":
+        return DueQueue(InMemoryDueQueueStore())
+    if settings.DUE_QUEUE_BACKEND == "redis":
+        return DueQueue(RedisDueQueueStore())
+    raise ValueError(f"Unknown due queue backend: {settings.DUE_QUEUE_BACKEND}")
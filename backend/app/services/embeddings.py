@@ -0,0 +1,353 @@
+import asyncio
+import hashlib
+import logging
+import math
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import httpx
+import numpy as np
+
+from app.config import settings
+from app.utils.text_processing import content_hash
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class EmbeddingBackend(ABC):
+    """Turns batches of texts into vectors."""
+
+    name: str = "base"
+    dimension: int = 0
+    max_batch_size: int = 256
+
+    @abstractmethod
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Return a float32 matrix with one row per text."""
+
+
+@lru_cache(maxsize=200_000)
+def _hashed_feature(feature: str, dimension: int) -> Tuple[int, float]:
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+    value = int.from_bytes(digest, "little")
+    return value % dimension, 1.0 if value >> 63 else -1.0
+
+
+class LocalEmbeddingBackend(EmbeddingBackend):
+    """Deterministic feature-hashing embeddings for offline use and benchmarks.
+
+    Word unigrams and bigrams are hashed into a fixed number of signed
+    buckets with sublinear term weighting, then L2-normalised. Texts that
+    share vocabulary land close together, which is enough for exercising the
+    retrieval stack without a network connection.
+    """
+
+    name = "local-hash"
+
+    def __init__(self, dimension: int = None):
+        self.dimension = dimension or settings.EMBEDDING_DIMENSION
+        self.max_batch_size = 4096
+        self.name = f"local-hash-{self.dimension}"
+
+    def _embed_one(self, text: str, out: np.ndarray) -> None:
+        tokens = _TOKEN_PATTERN.findall(text.lower())
+        features = Counter(tokens)
+        features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+
+        for feature, count in features.items():
+            bucket, sign = _hashed_feature(feature, self.dimension)
+            out[bucket] += sign * (1.0 + math.log(count))
+
+        norm = np.linalg.norm(out)
+        if norm > 0:
+            out /= norm
+
+    def _embed_sync(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in zip(matrix, texts):
+            self._embed_one(text, row)
+        return matrix
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        return await asyncio.to_thread(self._embed_sync, texts)
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """Embeddings from the OpenAI API using EMBEDDING_MODEL."""
+
+    _DIMENSIONS = {
+        "text-embedding-ada-002": 1536,
+        "text-embedding-3-small": 1536,
+        "text-embedding-3-large": 3072,
+    }
+
+    def __init__(self, model: str = None, api_key: str = None):
+        self.model = model or settings.EMBEDDING_MODEL
+        self.name = f"openai-{self.model}"
+        self.dimension = self._DIMENSIONS.get(self.model, 1536)
+        self.max_batch_size = 2048
+        self.client = httpx.AsyncClient(
+            base_url="https://api.openai.com/v1",
+            headers={"Authorization": f"Bearer {api_key or settings.OPENAI_API_KEY}"},
+            timeout=60.0,
+        )
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        response = await self.client.post(
+            "/embeddings", json={"model": self.model, "input": texts}
+        )
+        response.raise_for_status()
+        data = sorted(response.json()["data"], key=lambda item: item["index"])
+        return np.asarray([item["embedding"] for item in data], dtype=np.float32)
+
+
+class EmbeddingStore:
+    """Persistent on-disk map from embedding key to vector."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB "
+            "NOT NULL)"
+        )
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, np.ndarray]]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [
+                    (key, np.asarray(vector, dtype=np.float32).tobytes())
+                    for key, vector in items
+                ],
+            )
+            self._conn.commit()
+
+
+class LRUCache:
+    """Size-bounded least-recently-used map."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: np.ndarray) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class EmbeddingService:
+    """Batched, content-addressed embedding engine.
+
+    Texts are keyed by backend name plus content hash, so an identical chunk
+    is embedded once no matter which document or user it belongs to, and a
+    re-ingested document only pays for the chunks that changed. Lookups go
+    through an in-memory LRU, then the on-disk store; misses from concurrent
+    callers are coalesced into large provider batches.
+    """
+
+    def __init__(
+        self,
+        backend: EmbeddingBackend,
+        store: Optional[EmbeddingStore] = None,
+        cache_size: int = None,
+        batch_size: int = None,
+        batch_wait_ms: int = None,
+    ):
+        self.backend = backend
+        self.store = store
+        self.cache = LRUCache(cache_size or settings.EMBEDDING_CACHE_SIZE)
+        self.batch_size = min(
+            batch_size or settings.EMBEDDING_BATCH_SIZE, backend.max_batch_size
+        )
+        self.batch_wait = (
+            batch_wait_ms
+            if batch_wait_ms is not None
+            else settings.EMBEDDING_BATCH_WAIT_MS
+        ) / 1000
+
+        self._pending: List[Tuple[str, str]] = []
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._batch_tasks = set()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.provider_calls = 0
+        self.texts_embedded = 0
+
+    @property
+    def dimension(self) -> int:
+        return self.backend.dimension
+
+    def key_for(self, text: str) -> str:
+        return f"{self.backend.name}:{content_hash(text)}"
+
+    async def embed_query(self, text: str) -> np.ndarray:
+        """Embed a single search query."""
+        return (await self.embed_texts([text]))[0]
+
+    async def embed_texts(self, texts: Sequence[str]) -> np.ndarray:
+        """Return one vector per text, only calling the provider for unseen content."""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        keys = [self.key_for(text) for text in texts]
+        text_by_key = dict(zip(keys, texts))
+        vectors: Dict[str, np.ndarray] = {}
+        missing = []
+
+        for key in text_by_key:
+            vector = self.cache.get(key)
+            if vector is not None:
+                vectors[key] = vector
+                self.memory_hits += 1
+            else:
+                missing.append(key)
+
+        if missing and self.store is not None:
+            stored = await asyncio.to_thread(self.store.get_many, missing)
+            for key, vector in stored.items():
+                self.cache.put(key, vector)
+                vectors[key] = vector
+            self.disk_hits += len(stored)
+            missing = [key for key in missing if key not in stored]
+
+        if missing:
+            computed = await self._embed_missing(
+                [(key, text_by_key[key]) for key in missing]
+            )
+            vectors.update(computed)
+
+        return np.stack([vectors[key] for key in keys])
+
+    async def _embed_missing(
+        self, items: List[Tuple[str, str]]
+    ) -> Dict[str, np.ndarray]:
+        """Queue texts for the next provider batch and wait for their vectors."""
+        loop = asyncio.get_running_loop()
+        futures = {}
+
+        for key, text in items:
+            future = self._inflight.get(key)
+            if future is None:
+                # Identical text already in flight for another caller is shared
+                future = loop.create_future()
+                self._inflight[key] = future
+                self._pending.append((key, text))
+            futures[key] = future
+
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._pending and self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_wait, self._flush)
+
+        # Shielded: a cancelled caller must not cancel vectors other callers share
+        results = await asyncio.gather(*map(asyncio.shield, futures.values()))
+        return dict(zip(futures.keys(), results))
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        pending, self._pending = self._pending, []
+        for start in range(0, len(pending), self.batch_size):
+            task = asyncio.ensure_future(
+                self._run_batch(pending[start : start + self.batch_size])
+            )
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[str, str]]) -> None:
+        try:
+            self.provider_calls += 1
+            matrix = await self.backend.embed([text for _, text in batch])
+            self.texts_embedded += len(batch)
+
+            if self.store is not None:
+                await asyncio.to_thread(
+                    self.store.put_many,
+                    [(key, matrix[i]) for i, (key, _) in enumerate(batch)],
+                )
+
+            for i, (key, _) in enumerate(batch):
+                self.cache.put(key, matrix[i])
+                future = self._inflight.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_result(matrix[i])
+
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(batch)} texts failed: {str(e)}")
+            for key, _ in batch:
+                future = self._inflight.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "provider_calls": self.provider_calls,
+            "texts_embedded": self.texts_embedded,
+            "cached_vectors": len(self.cache),
+        }
+
+
+def create_embedding_backend() -> EmbeddingBackend:
+    """Build the backend selected by EMBEDDING_BACKEND."""
+    backend = settings.EMBEDDING_BACKEND
+    if backend == "auto":
+        backend = "openai" if settings.OPENAI_API_KEY else "local"
+
+    if backend == "openai":
+        return OpenAIEmbeddingBackend()
+    if backend == "local":
+        return LocalEmbeddingBackend()
+    raise ValueError(f"Unknown embedding backend: {settings.EMBEDDING_BACKEND}")
+
+
+@lru_cache()
+def get_embedding_service() -> EmbeddingService:
+    """Return the process-wide embedding service."""
+    return EmbeddingService(
+        backend=create_embedding_backend(),
+        store=EmbeddingStore(settings.EMBEDDING_CACHE_PATH),
+    )
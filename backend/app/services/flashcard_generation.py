@@ -0,0 +1,400 @@
+import asyncio
+import json
+import logging
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import insert
+
+from app.config import settings
+from app.core.metrics import metrics
+from app.database import SessionLocal
+from app.models.user import ContentChunk, Document, Flashcard
+from app.services.due_queue import get_due_queue
+from app.services.learning_stats import stats_tracker
+from app.services.llm import get_llm_router
+from app.utils.text_processing import combined_hash, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+_JSON_ARRAY = re.compile(r"\[.*\]", re.DOTALL)
+_QA_LINE = re.compile(
+    r"^\s*(?:[-*\d.)]+\s*)?(Q|A|Front|Back)\s*:\s*(.+)$", re.IGNORECASE
+)
+# Words too common to tell two questions apart
+_STOPWORDS = frozenset(
+    "a an and are as at be by did do does for from how in is it of on or that the "
+    "this to was were what when where which who why with".split()
+)
+# Generous per-card allowance for the model's output
+_TOKENS_PER_CARD = 80
+
+
+@dataclass
+class ChunkGroup:
+    """Chunks sent to the LLM together, identified by the hash of their contents."""
+
+    chunks: List[Any]
+    source_hash: str
+
+
+@dataclass
+class CardDraft:
+    front: str
+    back: str
+
+
+def normalize_card_text(text: str) -> str:
+    """Lowercased words only, so punctuation and spacing don't make cards differ."""
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def _terms(normalized: str) -> FrozenSet[str]:
+    words = normalized.split()
+    return frozenset(word for word in words if word not in _STOPWORDS) or frozenset(
+        words
+    )
+
+
+class DeckIndex:
+    """Near-duplicate lookup over card fronts.
+
+    A front is a duplicate when its normalized text matches a card's exactly,
+    or when the Jaccard overlap of their content words reaches `threshold`.
+    An inverted index limits the comparison to cards sharing a word.
+    """
+
+    def __init__(self, threshold: float = None):
+        self.threshold = threshold or settings.FLASHCARD_DUPLICATE_THRESHOLD
+        self._exact: Set[str] = set()
+        self._terms: List[FrozenSet[str]] = []
+        self._postings: Dict[str, List[int]] = {}
+
+    def add(self, front: str) -> None:
+        normalized = normalize_card_text(front)
+        self._exact.add(normalized)
+        terms = _terms(normalized)
+        for term in terms:
+            self._postings.setdefault(term, []).append(len(self._terms))
+        self._terms.append(terms)
+
+    def is_duplicate(self, front: str) -> bool:
+        normalized = normalize_card_text(front)
+        if normalized in self._exact:
+            return True
+        terms = _terms(normalized)
+        shared = Counter()
+        for term in terms:
+            shared.update(self._postings.get(term, ()))
+        for card, overlap in shared.items():
+            if (
+                overlap / (len(terms) + len(self._terms[card]) - overlap)
+                >= self.threshold
+            ):
+                return True
+        return False
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+
+def group_chunks(
+    chunks: List[Any], max_chunks: int, max_tokens: int
+) -> List[ChunkGroup]:
+    """Pack consecutive chunks into prompts of at most `max_chunks` chunks and
+    `max_tokens` tokens.
+    """
+    groups, current, tokens = [], [], 0
+    for chunk in chunks:
+        cost = estimate_tokens(chunk.content)
+        if current and (len(current) >= max_chunks or tokens + cost > max_tokens):
+            groups.append(current)
+            current, tokens = [], 0
+        current.append(chunk)
+        tokens += cost
+    if current:
+        groups.append(current)
+    return [
+        ChunkGroup(
+            chunks=group,
+            source_hash=combined_hash(chunk.content_hash for chunk in group),
+        )
+        for group in groups
+    ]
+
+
+@dataclass
+class GenerationRun:
+    """What one generation pass over a document needs from the database."""
+
+    document_id: str
+    user_id: str
+    title: str
+    skip_reason: Optional[str] = None
+    version: str = ""
+    groups: List[ChunkGroup] = field(default_factory=list)
+    pending: List[ChunkGroup] = field(default_factory=list)
+    deck: DeckIndex = field(default_factory=DeckIndex)
+
+
+def build_flashcard_prompt(title: str, chunks: List[Any], cards_per_chunk: int) -> str:
+    passages = "\n\n".join(
+        f"[{index}] {chunk.content}" for index, chunk in enumerate(chunks, start=1)
+    )
+    return (
+        "You are an educational expert specializing in spaced repetition learning. "
+        "Create flashcards (front/back) from the numbered passages below. Each "
+        "flashcard should test a single concept or fact, be clear and unambiguous, "
+        "fit within 100 characters on the front and give a complete answer on the "
+        "back.\n\n"
+        f"Document Title: {title}\n\n"
+        f"Passages:\n{passages}\n\n"
+        f"Write up to {cards_per_chunk} flashcards per passage, skipping passages "
+        "with nothing worth learning. Respond with only a JSON array of objects with "
+        'the keys "passage", "front" and "back".'
+    )
+
+
+def parse_flashcards(text: str) -> List[CardDraft]:
+    """Read cards from the model's reply: a JSON array, or failing that "Q: /
+    A:" lines."""
+    drafts = []
+    match = _JSON_ARRAY.search(text)
+    if match:
+        try:
+            items = json.loads(match.group(0))
+        except ValueError:
+            items = []
+        for item in items if isinstance(items, list) else []:
+            if (
+                isinstance(item, dict)
+                and isinstance(item.get("front"), str)
+                and isinstance(item.get("back"), str)
+            ):
+                drafts.append(
+                    CardDraft(front=item["front"].strip(), back=item["back"].strip())
+                )
+
+    if not drafts:
+        front = None
+        for line in text.splitlines():
+            line_match = _QA_LINE.match(line)
+            if not line_match:
+                continue
+            kind, value = line_match.group(1).lower(), line_match.group(2).strip()
+            if kind in ("q", "front"):
+                front = value
+            elif front:
+                drafts.append(CardDraft(front=front, back=value))
+                front = None
+
+    return [draft for draft in drafts if draft.front and draft.back]
+
+
+class FlashcardGenerator:
+    """Generates flashcards from a processed document's chunks.
+
+    Chunks are packed several to a prompt, generated concurrently (the LLM
+    router bounds concurrency), and each group's cards are deduplicated
+    against the user's deck and bulk-inserted as soon as it returns. Cards
+    record the hash of the group they came from, so a retried job skips
+    groups it already stored; once every group is done the document's
+    content version is recorded, and reprocessing a document whose chunks
+    did not change skips generation without any LLM call.
+    """
+
+    def __init__(self):
+        self.llm = get_llm_router()
+        self.due_queue = get_due_queue()
+        self.chunks_per_call = settings.FLASHCARD_CHUNKS_PER_CALL
+        self.prompt_tokens = settings.FLASHCARD_PROMPT_TOKENS
+        self.cards_per_chunk = settings.FLASHCARDS_PER_CHUNK
+
+    async def generate_for_document(self, document_id: str) -> Dict[str, Any]:
+        """Generate any missing cards for a document and return counts of what
+        was done."""
+        try:
+            # Sessions are only used on worker threads; the loop keeps the LLM calls
+            run = await asyncio.to_thread(self._start_generation, document_id)
+            if run is None:
+                return {
+                    "status": "failed",
+                    "error": "Document not found",
+                    "retryable": False,
+                }
+            if run.skip_reason:
+                return {"status": "skipped", "reason": run.skip_reason}
+
+            created, duplicates = 0, 0
+            tasks = [
+                asyncio.create_task(self._generate(run.title, group))
+                for group in run.pending
+            ]
+            try:
+                for next_group in asyncio.as_completed(tasks):
+                    group, drafts = await next_group
+                    stored, dropped = await asyncio.to_thread(
+                        self._store_cards, run, group, drafts
+                    )
+                    created += stored
+                    duplicates += dropped
+            except Exception:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            finally:
+                if created:
+                    await self.due_queue.invalidate(run.user_id)
+
+            await asyncio.to_thread(self._finish_generation, document_id, run.version)
+
+            metrics.incr("flashcards.generated", created)
+            metrics.incr("flashcards.duplicates", duplicates)
+            logger.info(
+                f"Generated {created} flashcards for document {document_id} "
+                f"({len(run.pending)} LLM calls, "
+                f"{len(run.groups) - len(run.pending)} groups reused, "
+                f"{duplicates} duplicates)"
+            )
+            return {
+                "status": "completed",
+                "document_id": document_id,
+                "created": created,
+                "duplicates": duplicates,
+                "llm_calls": len(run.pending),
+            }
+
+        except Exception as e:
+            logger.error(
+                f"Error generating flashcards for document {document_id}: {str(e)}"
+            )
+            return {"status": "failed", "error": str(e), "retryable": True}
+
+    def _start_generation(self, document_id: str) -> Optional[GenerationRun]:
+        """Load the document's chunk groups, the ones still without cards and the
+        user's deck."""
+        db = SessionLocal()
+        try:
+            document = db.query(Document).filter(Document.id == document_id).first()
+            if not document:
+                return None
+
+            run = GenerationRun(
+                document_id=document_id,
+                user_id=document.user_id,
+                title=document.title,
+            )
+            if document.status != "completed":
+                run.skip_reason = f"document is {document.status}"
+                return run
+
+            chunks = (
+                db.query(
+                    ContentChunk.id, ContentChunk.content, ContentChunk.content_hash
+                )
+                .filter(ContentChunk.document_id == document_id)
+                .order_by(ContentChunk.chunk_index)
+                .all()
+            )
+            run.version = combined_hash(chunk.content_hash for chunk in chunks)
+            if document.flashcards_version == run.version:
+                metrics.incr("flashcards.versions_skipped")
+                run.skip_reason = "cards already generated for this version"
+                return run
+
+            run.groups = group_chunks(chunks, self.chunks_per_call, self.prompt_tokens)
+            done = {
+                source_hash
+                for source_hash, in db.query(Flashcard.source_hash)
+                .filter(
+                    Flashcard.document_id == document_id,
+                    Flashcard.source_hash.in_(
+                        [group.source_hash for group in run.groups]
+                    ),
+                )
+                .distinct()
+            }
+            run.pending = [
+                group for group in run.groups if group.source_hash not in done
+            ]
+
+            for (front,) in db.query(Flashcard.front).filter(
+                Flashcard.user_id == run.user_id
+            ):
+                run.deck.add(front)
+            return run
+        finally:
+            db.close()
+
+    def _finish_generation(self, document_id: str, version: str) -> None:
+        """Record the content version the document's cards now cover."""
+        db = SessionLocal()
+        try:
+            document = db.query(Document).filter(Document.id == document_id).first()
+            if not document:
+                return
+
+            document.flashcards_version = version
+            db.commit()
+        finally:
+            db.close()
+
+    async def _generate(
+        self, title: str, group: ChunkGroup
+    ) -> Tuple[ChunkGroup, List[CardDraft]]:
+        prompt = build_flashcard_prompt(title, group.chunks, self.cards_per_chunk)
+        result = await self.llm.generate(
+            prompt,
+            max_tokens=len(group.chunks) * self.cards_per_chunk * _TOKENS_PER_CARD,
+        )
+        drafts = parse_flashcards(result.text)
+        if not drafts:
+            logger.warning(
+                f"No flashcards could be parsed from a {result.provider} reply"
+            )
+        return group, drafts
+
+    def _store_cards(
+        self, run: GenerationRun, group: ChunkGroup, drafts: Iterable[CardDraft]
+    ) -> Tuple[int, int]:
+        """Insert a group's new cards in one statement and count them in the stats;
+        returns (stored, duplicates).
+        """
+        rows, duplicates = [], 0
+        for draft in drafts:
+            if run.deck.is_duplicate(draft.front):
+                duplicates += 1
+                continue
+            run.deck.add(draft.front)
+            rows.append(
+                {
+                    "user_id": run.user_id,
+                    "document_id": run.document_id,
+                    "front": draft.front,
+                    "back": draft.back,
+                    "source_hash": group.source_hash,
+                }
+            )
+        if not rows:
+            return 0, duplicates
+
+        db = SessionLocal()
+        try:
+            # Lock the stats row (rebuilding it if missing) before the cards exist, so
+            # they are counted once
+            stats = stats_tracker.get(run.user_id, db, for_update=True)
+            inserted = db.execute(
+                insert(Flashcard).returning(
+                    Flashcard.id, Flashcard.next_review, Flashcard.success_rate
+                ),
+                rows,
+            ).all()
+            stats_tracker.add_cards(stats, inserted)
+            db.commit()
+            return len(inserted), duplicates
+        finally:
+            db.close()
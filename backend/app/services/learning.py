@@ -1,231 +1,648 @@
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
 import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 
-from app.models.user import Flashcard, LearningSession
-from app.schemas.learning import FlashcardReviewRequest, LearningStatsResponse, LearningScheduleResponse
+from app.config import settings
+from app.models.user import Flashcard, LearningSession, ReviewLog, UserLearningStats
+from app.schemas.learning import (
+    BatchReviewItem,
+    BatchReviewResponse,
+    BatchReviewResult,
+    LearningScheduleResponse,
+    LearningSessionState,
+    LearningStatsResponse,
+    ReviewStatus,
+)
+from app.services.due_queue import get_due_queue
+from app.services.learning_stats import as_date, day_bucket, stats_tracker
+from app.services.scheduling import CardStates, get_scheduler, load_weights
+from app.services.session_buffer import SessionCounts, get_session_buffer
 
 logger = logging.getLogger(__name__)
 
 
+def update_success_rate(
+    review_count: np.ndarray, success_rate: np.ndarray, correct: np.ndarray
+) -> np.ndarray:
+    """Fold one more review into each card's success rate (a percentage of its
+    reviews)."""
+    return (review_count * success_rate / 100 + correct) / (review_count + 1) * 100
+
+
 class LearningService:
-    """Service for spaced repetition learning system."""
-    
+    """Service for spaced repetition learning system.
+
+    Request handlers pass an AsyncSession. Work shared with the synchronous
+    helpers (due queue refills, the stats tracker, the scheduler) runs through
+    AsyncSession.run_sync, which still waits on the async driver for every
+    statement.
+    """
+
     def __init__(self):
-        self.initial_ease_factor = 2.5
-        self.min_ease_factor = 1.3
-    
-    async def get_due_flashcards(self, user_id: str, limit: int, db: Session) -> List[Dict]:
-        """Get flashcards due for review."""
+        self.initial_ease_factor = settings.INITIAL_EASE_FACTOR
+        self.min_ease_factor = settings.MIN_EASE_FACTOR
+        self.due_queue = get_due_queue()
+        self.sessions = get_session_buffer()
+
+    async def get_due_flashcards(
+        self, user_id: str, limit: int, db: AsyncSession
+    ) -> List[Dict]:
+        """Get the next flashcards to study: due cards by recall risk, with today's new
+        cards interleaved.
+        """
         try:
-            flashcards = db.query(Flashcard).filter(
-                Flashcard.user_id == user_id,
-                Flashcard.next_review <= datetime.utcnow()
-            ).limit(limit).all()
-            
-            return [
-                {
-                    "id": card.id,
-                    "front": card.front,
-                    "back": card.back,
-                    "difficulty": card.difficulty,
-                    "review_count": card.review_count
-                }
-                for card in flashcards
-            ]
+            return await self.due_queue.peek(user_id, limit, db)
         except Exception as e:
             logger.error(f"Error getting due flashcards: {str(e)}")
             raise e
-    
+
     async def process_review(
-        self, 
-        flashcard_id: str, 
-        user_id: str, 
-        rating: int, 
+        self,
+        flashcard_id: str,
+        user_id: str,
+        rating: int,
         response_time_ms: int,
-        db: Session
-    ) -> None:
-        """Process flashcard review using SM-2 algorithm."""
+        db: AsyncSession,
+        session_id: str = None,
+    ) -> BatchReviewResult:
+        """Process a flashcard review with the configured spaced repetition
+        algorithm."""
         try:
-            flashcard = db.query(Flashcard).filter(
-                Flashcard.id == flashcard_id,
-                Flashcard.user_id == user_id
-            ).first()
-            
-            if not flashcard:
+            result = (
+                await self._apply_reviews(
+                    user_id,
+                    [
+                        BatchReviewItem(
+                            flashcard_id=flashcard_id,
+                            rating=rating,
+                            response_time_ms=response_time_ms,
+                        )
+                    ],
+                    db,
+                    session_id,
+                )
+            )[0]
+            if result.status == ReviewStatus.NOT_FOUND:
                 raise ValueError("Flashcard not found")
-            
-            # SM-2 algorithm implementation
-            if rating >= 3:  # Correct response
-                if flashcard.review_count == 0:
-                    flashcard.interval_days = 1
-                elif flashcard.review_count == 1:
-                    flashcard.interval_days = 6
-                else:
-                    flashcard.interval_days = int(flashcard.interval_days * flashcard.difficulty)
-                
-                flashcard.difficulty = max(
-                    self.min_ease_factor,
-                    flashcard.difficulty + (0.1 - (5 - rating) * (0.08 + (5 - rating) * 0.02))
-                )
-            else:  # Incorrect response
-                flashcard.interval_days = 1
-                flashcard.difficulty = max(
-                    self.min_ease_factor,
-                    flashcard.difficulty - 0.2
-                )
-            
-            # Update flashcard
-            flashcard.next_review = datetime.utcnow() + timedelta(days=flashcard.interval_days)
-            flashcard.last_review = datetime.utcnow()
-            flashcard.review_count += 1
-            
-            # Update success rate
-            total_reviews = flashcard.review_count
-            successful_reviews = total_reviews * (flashcard.success_rate * 0.01) + (1 if rating >= 3 else 0)
-            flashcard.success_rate = (successful_reviews / total_reviews) * 100
-            
-            db.commit()
-            
+            if result.status != ReviewStatus.APPLIED:
+                raise ValueError(
+                    result.error or f"Review not applied: {result.status.value}"
+                )
+            return result
+
         except Exception as e:
             logger.error(f"Error processing review: {str(e)}")
             raise e
-    
-    async def get_learning_stats(
-        self, 
-        user_id: str, 
-        days: int, 
-        db: Session
-    ) -> LearningStatsResponse:
-        """Get learning statistics for user."""
+
+    async def process_review_batch(
+        self,
+        user_id: str,
+        reviews: List[BatchReviewItem],
+        db: AsyncSession,
+        session_id: str = None,
+    ) -> BatchReviewResponse:
+        """Apply many reviews, e.g. synced from an offline client, in one
+        transaction."""
         try:
-            since_date = datetime.utcnow() - timedelta(days=days)
-            
-            # Get total cards
-            total_cards = db.query(func.count(Flashcard.id)).filter(
-                Flashcard.user_id == user_id
-            ).scalar() or 0
-            
-            # Get cards reviewed today
-            today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-            cards_reviewed_today = db.query(func.count(Flashcard.id)).filter(
-                Flashcard.user_id == user_id,
-                Flashcard.last_review >= today_start
-            ).scalar() or 0
-            
-            # Get average accuracy
-            avg_accuracy = db.query(func.avg(Flashcard.success_rate)).filter(
-                Flashcard.user_id == user_id
-            ).scalar() or 0.0
-            
-            # Get cards due tomorrow
-            tomorrow_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
-            tomorrow_end = tomorrow_start + timedelta(days=1)
-            cards_due_tomorrow = db.query(func.count(Flashcard.id)).filter(
+            results = await self._apply_reviews(user_id, reviews, db, session_id)
+            applied = sum(
+                1 for result in results if result.status == ReviewStatus.APPLIED
+            )
+            return BatchReviewResponse(
+                results=results, applied=applied, rejected=len(results) - applied
+            )
+
+        except Exception as e:
+            logger.error(f"Error processing review batch: {str(e)}")
+            raise e
+
+    async def _apply_reviews(
+        self,
+        user_id: str,
+        reviews: List[BatchReviewItem],
+        db: AsyncSession,
+        session_id: str = None,
+    ) -> List[BatchReviewResult]:
+        """Schedule, log and store reviews in a single transaction; one result per
+        review, in order.
+
+        Applied reviews count towards `session_id`, or the user's latest open
+        session, once the transaction commits.
+        """
+        try:
+            results, card_ids, next_reviews = await db.run_sync(
+                lambda sync_db: self._write_reviews(user_id, reviews, sync_db)
+            )
+            await db.commit()
+            if card_ids:
+                await self._update_due_queue(user_id, card_ids, next_reviews)
+            await self._count_session_reviews(
+                user_id,
+                [
+                    reviews[index]
+                    for index, result in enumerate(results)
+                    if result.status == ReviewStatus.APPLIED
+                ],
+                session_id,
+            )
+            return results
+
+        except Exception as e:
+            await db.rollback()
+            raise e
+
+    def _write_reviews(
+        self, user_id: str, reviews: List[BatchReviewItem], db: Session
+    ) -> Tuple[List[BatchReviewResult], List[str], List[datetime]]:
+        """Schedule reviews and stage their card updates and log rows; the caller
+        commits.
+
+        Reviews are replayed in timestamp order. The k-th review of every card
+        is applied in round k, so each round is one vectorised scheduler step
+        and a card reviewed several times advances once per review. A review
+        older than the card's last recorded one is reported as stale. Returns
+        the results with the updated cards and their next reviews.
+        """
+        now = datetime.utcnow()
+        results: List[BatchReviewResult] = [None] * len(reviews)
+        reviewed_at = [min(item.reviewed_at or now, now) for item in reviews]
+
+        rows = (
+            db.query(
+                Flashcard.id,
+                Flashcard.review_count,
+                Flashcard.interval_days,
+                Flashcard.difficulty,
+                Flashcard.stability,
+                Flashcard.memory_difficulty,
+                Flashcard.success_rate,
+                Flashcard.last_review,
+                Flashcard.next_review,
+            )
+            .filter(
                 Flashcard.user_id == user_id,
-                Flashcard.next_review >= tomorrow_start,
-                Flashcard.next_review < tomorrow_end
-            ).scalar() or 0
-            
-            return LearningStatsResponse(
-                total_cards=total_cards,
-                cards_reviewed_today=cards_reviewed_today,
-                accuracy_rate=float(avg_accuracy),
-                current_streak=0,  # Would need streak calculation
-                longest_streak=0,  # Would need streak calculation
-                average_response_time=2500.0,  # Mock value
-                cards_due_tomorrow=cards_due_tomorrow
-            )
-            
+                Flashcard.id.in_({item.flashcard_id for item in reviews}),
+            )
+            .all()
+        )
+        position = {row.id: index for index, row in enumerate(rows)}
+        states = CardStates.from_rows(rows)
+        success_rate = np.array([row.success_rate for row in rows], dtype=np.float64)
+        last_review = [row.last_review for row in rows]
+        next_review = [row.next_review for row in rows]
+
+        # Split the accepted reviews into rounds: round k holds each card's k-th review
+        rounds: List[List[int]] = []
+        seen: Dict[str, int] = {}
+        for index in sorted(range(len(reviews)), key=lambda index: reviewed_at[index]):
+            item = reviews[index]
+            if not 1 <= item.rating <= 5:
+                results[index] = BatchReviewResult(
+                    flashcard_id=item.flashcard_id,
+                    status=ReviewStatus.INVALID,
+                    error="rating must be between 1 and 5",
+                )
+            elif item.flashcard_id not in position:
+                results[index] = BatchReviewResult(
+                    flashcard_id=item.flashcard_id, status=ReviewStatus.NOT_FOUND
+                )
+            else:
+                occurrence = seen.get(item.flashcard_id, 0)
+                seen[item.flashcard_id] = occurrence + 1
+                if occurrence == len(rounds):
+                    rounds.append([])
+                rounds[occurrence].append(index)
+
+        if not rounds:
+            return results, [], []
+
+        scheduler = get_scheduler()
+        weights = load_weights(user_id, scheduler, db)
+        stats = stats_tracker.get(user_id, db, for_update=True)
+        touched, log_rows = set(), []
+        for round_items in rounds:
+            # Drop reviews the server has already seen a newer review for
+            applied = []
+            for index in round_items:
+                card = position[reviews[index].flashcard_id]
+                if (
+                    last_review[card] is not None
+                    and reviewed_at[index] < last_review[card]
+                ):
+                    results[index] = BatchReviewResult(
+                        flashcard_id=reviews[index].flashcard_id,
+                        status=ReviewStatus.STALE,
+                    )
+                else:
+                    applied.append(index)
+            if not applied:
+                continue
+
+            cards = np.array(
+                [position[reviews[index].flashcard_id] for index in applied]
+            )
+            ratings = np.array([reviews[index].rating for index in applied])
+            elapsed_days = np.array(
+                [
+                    (
+                        0.0
+                        if last_review[card] is None
+                        else (reviewed_at[index] - last_review[card]).total_seconds()
+                        / 86400
+                    )
+                    for card, index in zip(cards, applied)
+                ]
+            )
+            previous_success = success_rate[cards].copy()
+            success_rate[cards] = update_success_rate(
+                states.review_count[cards], previous_success, ratings >= 3
+            )
+            states.put(
+                cards,
+                scheduler.step(states.take(cards), ratings, elapsed_days, weights),
+            )
+
+            for offset, (card, index) in enumerate(zip(cards, applied)):
+                item = reviews[index]
+                interval = int(states.interval_days[card])
+                previous_review, previous_due = last_review[card], next_review[card]
+                last_review[card] = reviewed_at[index]
+                next_review[card] = reviewed_at[index] + timedelta(days=interval)
+                touched.add(int(card))
+                log_rows.append(
+                    {
+                        "user_id": user_id,
+                        "flashcard_id": item.flashcard_id,
+                        "rating": item.rating,
+                        "response_time_ms": item.response_time_ms,
+                        "elapsed_days": float(elapsed_days[offset]),
+                        "scheduled_days": interval,
+                        "reviewed_at": reviewed_at[index],
+                    }
+                )
+                stats_tracker.record_review(
+                    stats,
+                    previous_review,
+                    previous_due,
+                    float(previous_success[offset]),
+                    next_review[card],
+                    float(success_rate[card]),
+                    correct=item.rating >= 3,
+                    response_time_ms=item.response_time_ms,
+                    reviewed_at=reviewed_at[index],
+                )
+                results[index] = BatchReviewResult(
+                    flashcard_id=item.flashcard_id,
+                    status=ReviewStatus.APPLIED,
+                    interval_days=interval,
+                    next_review=next_review[card],
+                )
+
+        if touched:
+            db.execute(
+                update(Flashcard),
+                [
+                    {
+                        "id": rows[card].id,
+                        **states.card(card),
+                        "success_rate": float(success_rate[card]),
+                        "last_review": last_review[card],
+                        "next_review": next_review[card],
+                    }
+                    for card in sorted(touched)
+                ],
+            )
+            # Core insert: one executemany, where the ORM would split rows by which
+            # columns are NULL
+            db.execute(ReviewLog.__table__.insert(), log_rows)
+        return (
+            results,
+            [rows[card].id for card in touched],
+            [next_review[card] for card in touched],
+        )
+
+    async def _update_due_queue(
+        self, user_id: str, card_ids: List[str], next_reviews: List[datetime]
+    ) -> None:
+        """Take reviewed cards out of the user's queue once their reviews are committed.
+
+        A review synced late can leave a card due again already; the queue is
+        then rebuilt on the next fetch so the card is ranked afresh.
+        """
+        try:
+            now = datetime.utcnow()
+            if any(next_review <= now for next_review in next_reviews):
+                await self.due_queue.invalidate(user_id)
+            else:
+                await self.due_queue.remove(user_id, card_ids)
+        except Exception as e:
+            # The reviews are stored; a stale queue only costs a refill once it expires
+            logger.error(f"Error updating due queue for user {user_id}: {str(e)}")
+
+    async def _count_session_reviews(
+        self, user_id: str, applied: List[BatchReviewItem], session_id: str = None
+    ) -> None:
+        """Add committed reviews to the session buffer; the flusher writes the totals
+        out.
+        """
+        if not applied:
+            return
+        try:
+            await self.sessions.record(
+                user_id,
+                len(applied),
+                sum(1 for item in applied if item.rating >= 3),
+                datetime.utcnow(),
+                session_id,
+            )
+        except Exception as e:
+            logger.error(
+                f"Error counting reviews into session for user {user_id}: {str(e)}"
+            )
+
+    async def get_learning_stats(
+        self, user_id: str, db: AsyncSession
+    ) -> Optional[LearningStatsResponse]:
+        """Get learning statistics for user from their materialized stats row.
+
+        Read-only, so it can run on a replica: returns None if the user has
+        no stats row yet. Reviews and sessions create the row; for older
+        data the caller queues a rebuild.
+        """
+        try:
+            stats = await db.get(UserLearningStats, user_id)
+            return stats_tracker.to_response(stats) if stats is not None else None
+
         except Exception as e:
             logger.error(f"Error getting learning stats: {str(e)}")
             raise e
-    
+
     async def get_learning_schedule(
-        self, 
-        user_id: str, 
-        days: int, 
-        db: Session
+        self, user_id: str, days: int, db: AsyncSession
     ) -> LearningScheduleResponse:
         """Get learning schedule for upcoming days."""
         try:
+            today = datetime.utcnow().date()
+            start_datetime = datetime.combine(today, datetime.min.time())
+            end_datetime = start_datetime + timedelta(days=days)
+
+            due_bucket = day_bucket(db, Flashcard.next_review)
+            # count(*) rather than count(id) keeps this an index-only scan
+            rows = (
+                await db.execute(
+                    select(due_bucket, func.count())
+                    .where(
+                        Flashcard.user_id == user_id,
+                        Flashcard.next_review >= start_datetime,
+                        Flashcard.next_review < end_datetime,
+                    )
+                    .group_by(due_bucket)
+                )
+            ).all()
+            due_by_day = {as_date(bucket): count for bucket, count in rows}
+
             schedule = []
-            total_due = 0
-            
             for i in range(days):
-                date = datetime.utcnow().date() + timedelta(days=i)
-                start_datetime = datetime.combine(date, datetime.min.time())
-                end_datetime = start_datetime + timedelta(days=1)
-                
-                due_count = db.query(func.count(Flashcard.id)).filter(
-                    Flashcard.user_id == user_id,
-                    Flashcard.next_review >= start_datetime,
-                    Flashcard.next_review < end_datetime
-                ).scalar() or 0
-                
-                total_due += due_count
-                schedule.append({
-                    "date": date.isoformat(),
-                    "due_cards": due_count
-                })
-            
-            new_cards_available = 5  # Mock value
-            
+                day = today + timedelta(days=i)
+                schedule.append(
+                    {"date": day.isoformat(), "due_cards": due_by_day.get(day, 0)}
+                )
+
+            # Cards that have never been reviewed
+            new_cards_available = (
+                await db.scalar(
+                    select(func.count())
+                    .select_from(Flashcard)
+                    .where(Flashcard.user_id == user_id, Flashcard.review_count == 0)
+                )
+                or 0
+            )
+
             return LearningScheduleResponse(
                 schedule=schedule,
-                total_due=total_due,
-                new_cards_available=new_cards_available
+                total_due=sum(due_by_day.values()),
+                new_cards_available=new_cards_available,
             )
-            
+
         except Exception as e:
             logger.error(f"Error getting learning schedule: {str(e)}")
             raise e
-    
-    async def start_session(self, user_id: str, session_type: str, db: Session) -> LearningSession:
+
+    async def start_session(
+        self, user_id: str, session_type: str, db: AsyncSession
+    ) -> LearningSession:
         """Start a new learning session."""
         try:
             session = LearningSession(
-                user_id=user_id,
-                session_type=session_type,
-                start_time=datetime.utcnow()
+                user_id=user_id, session_type=session_type, start_time=datetime.utcnow()
             )
-            
+
             db.add(session)
-            db.commit()
-            db.refresh(session)
-            
+            await db.commit()
+            await self.sessions.open(session.id, user_id)
+
             return session
-            
+
         except Exception as e:
             logger.error(f"Error starting session: {str(e)}")
             raise e
-    
+
     async def end_session(
-        self, 
-        session_id: str, 
-        user_id: str, 
-        cards_reviewed: int, 
-        correct_answers: int,
-        db: Session
-    ) -> None:
-        """End a learning session."""
+        self,
+        session_id: str,
+        user_id: str,
+        cards_reviewed: Optional[int],
+        correct_answers: Optional[int],
+        db: AsyncSession,
+    ) -> LearningSession:
+        """End a learning session with the counts the server recorded.
+
+        Client-reported counts are only used for sessions the server counted
+        no reviews in, such as reading sessions. Ending a session twice
+        changes nothing.
+        """
         try:
-            session = db.query(LearningSession).filter(
-                LearningSession.id == session_id,
-                LearningSession.user_id == user_id
-            ).first()
-            
+            session = await db.scalar(
+                select(LearningSession).where(
+                    LearningSession.id == session_id, LearningSession.user_id == user_id
+                )
+            )
+
             if not session:
                 raise ValueError("Session not found")
-            
-            session.end_time = datetime.utcnow()
-            session.cards_reviewed = cards_reviewed
-            session.correct_answers = correct_answers
-            
-            db.commit()
-            
+            if session.end_time is not None:
+                return session
+
+            counts = await self.sessions.get(session_id) or SessionCounts(
+                session_id,
+                user_id,
+                session.cards_reviewed,
+                session.correct_answers,
+                session.last_activity_at,
+            )
+            if counts.cards_reviewed == 0 and cards_reviewed:
+                counts = SessionCounts(
+                    session_id,
+                    user_id,
+                    cards_reviewed,
+                    min(correct_answers or 0, cards_reviewed),
+                    counts.last_activity,
+                )
+            # The UPDATE in _close_session also refreshes `session` in place
+            await db.run_sync(
+                lambda sync_db: self._close_session(
+                    session, datetime.utcnow(), counts, sync_db
+                )
+            )
+            await db.commit()
+            await self.sessions.close(session_id)
+
+            return session
+
         except Exception as e:
+            await db.rollback()
             logger.error(f"Error ending session: {str(e)}")
-            raise e
\ No newline at end of file
+            raise e
+
+    def _close_session(
+        self,
+        session: LearningSession,
+        end_time: datetime,
+        counts: SessionCounts,
+        db: Session,
+    ) -> bool:
+        """Close a session unless someone else already has; folds it into the stats if
+        this call closed it.
+
+        The conditional UPDATE makes the sweeper and end_session safe to race
+        across processes: only one of them sees a row updated.
+        """
+        closed = db.execute(
+            update(LearningSession)
+            .where(LearningSession.id == session.id, LearningSession.end_time.is_(None))
+            .values(
+                end_time=end_time,
+                cards_reviewed=counts.cards_reviewed,
+                correct_answers=counts.correct_answers,
+                last_activity_at=counts.last_activity,
+            )
+        ).rowcount
+        if closed:
+            stats_tracker.record_session(
+                stats_tracker.get(session.user_id, db, for_update=True), session
+            )
+        return bool(closed)
+
+    async def get_session_state(
+        self, session_id: str, user_id: str, db: AsyncSession
+    ) -> LearningSessionState:
+        """Current counts of an open session and the next card to study."""
+        try:
+            counts = await self.sessions.get(session_id)
+            if counts is None:
+                session = await db.scalar(
+                    select(LearningSession).where(
+                        LearningSession.id == session_id,
+                        LearningSession.user_id == user_id,
+                    )
+                )
+                if not session:
+                    raise ValueError("Session not found")
+                counts = SessionCounts(
+                    session_id, user_id, session.cards_reviewed, session.correct_answers
+                )
+
+            next_cards = await self.due_queue.peek(user_id, 1, db)
+            return LearningSessionState(
+                session_id=session_id,
+                cards_reviewed=counts.cards_reviewed,
+                correct_answers=counts.correct_answers,
+                next_card=next_cards[0] if next_cards else None,
+            )
+
+        except Exception as e:
+            logger.error(f"Error getting session state: {str(e)}")
+            raise e
+
+    async def flush_session_counts(self, db: AsyncSession) -> int:
+        """Write buffered session counts to their rows in one statement; returns the
+        sessions written.
+        """
+        pending = await self.sessions.take_dirty()
+        if not pending:
+            return 0
+        try:
+            await db.execute(
+                update(LearningSession),
+                [
+                    {
+                        "id": counts.session_id,
+                        "cards_reviewed": counts.cards_reviewed,
+                        "correct_answers": counts.correct_answers,
+                        "last_activity_at": counts.last_activity,
+                    }
+                    for counts in pending
+                ],
+            )
+            await db.commit()
+            return len(pending)
+        except Exception as e:
+            await db.rollback()
+            await self.sessions.mark_dirty([counts.session_id for counts in pending])
+            logger.error(f"Error flushing session counts: {str(e)}")
+            raise e
+
+    async def close_idle_sessions(self, db: AsyncSession, limit: int = 500) -> int:
+        """Close sessions with no activity for SESSION_IDLE_TIMEOUT_MINUTES, ending them
+        at their last activity.
+        """
+        try:
+            cutoff = datetime.utcnow() - timedelta(
+                minutes=settings.SESSION_IDLE_TIMEOUT_MINUTES
+            )
+            # Filtered on the last flushed activity, so long-running active sessions
+            # can't fill the batch; the buffer below covers activity since the flush
+            last_flushed = func.coalesce(
+                LearningSession.last_activity_at, LearningSession.start_time
+            )
+            candidates = (
+                await db.scalars(
+                    select(LearningSession)
+                    .where(LearningSession.end_time.is_(None), last_flushed < cutoff)
+                    .order_by(last_flushed)
+                    .limit(limit)
+                )
+            ).all()
+
+            closed = []
+            for session in candidates:
+                counts = await self.sessions.get(session.id) or SessionCounts(
+                    session.id,
+                    session.user_id,
+                    session.cards_reviewed,
+                    session.correct_answers,
+                    session.last_activity_at,
+                )
+                last_activity = counts.last_activity or session.start_time
+                if last_activity >= cutoff:
+                    continue
+                await db.run_sync(
+                    lambda sync_db: self._close_session(
+                        session, last_activity, counts, sync_db
+                    )
+                )
+                closed.append(session.id)
+            await db.commit()
+            for session_id in closed:
+                await self.sessions.close(session_id)
+            return len(closed)
+
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Error closing idle sessions: {str(e)}")
+            raise e
@@ -0,0 +1,403 @@
+import logging
+from datetime import date, datetime, timedelta
+from typing import Any, Iterable, Optional
+
+from sqlalchemy import and_, case, func
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.models.user import Flashcard, LearningSession, ReviewLog, UserLearningStats
+from app.schemas.learning import LearningStatsResponse
+
+logger = logging.getLogger(__name__)
+
+
+def day_bucket(db: Session, column: Any):
+    """SQL expression truncating a timestamp column to its day, for GROUP BY."""
+    if db.get_bind().dialect.name == "postgresql":
+        return func.date_trunc("day", column)
+    # SQLite (and others) have no date_trunc; date() yields 'YYYY-MM-DD'
+    return func.date(column)
+
+
+def as_date(bucket: Any) -> date:
+    """Normalise a day_bucket() value (datetime, date or ISO string) to a date."""
+    if isinstance(bucket, datetime):
+        return bucket.date()
+    if isinstance(bucket, date):
+        return bucket
+    return date.fromisoformat(str(bucket)[:10])
+
+
+def _bits(stats: UserLearningStats) -> int:
+    return int.from_bytes(stats.activity_bitmap or b"", "little")
+
+
+def _run_length(bits: int, index: int, step: int) -> int:
+    """Number of consecutive set bits starting at `index` and moving by `step`."""
+    length = 0
+    while index >= 0 and (bits >> index) & 1:
+        length += 1
+        index += step
+    return length
+
+
+def mark_active(stats: UserLearningStats, day: date) -> None:
+    """Set the activity bit for `day` and extend longest_streak if the run it joins is
+    now longer.
+    """
+    bits = _bits(stats)
+    if stats.activity_start is None:
+        stats.activity_start = day
+    elif day < stats.activity_start:
+        bits <<= (stats.activity_start - day).days
+        stats.activity_start = day
+
+    index = (day - stats.activity_start).days
+    if (bits >> index) & 1:
+        return
+    bits |= 1 << index
+    stats.activity_bitmap = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+    run = _run_length(bits, index, -1) + _run_length(bits, index + 1, 1)
+    stats.longest_streak = max(stats.longest_streak or 0, run)
+
+
+def current_streak(stats: UserLearningStats, today: date) -> int:
+    """Consecutive active days ending today, or yesterday if today has no
+    activity yet."""
+    if stats.activity_start is None or today < stats.activity_start:
+        return 0
+    bits = _bits(stats)
+    index = (today - stats.activity_start).days
+    if not (bits >> index) & 1:
+        index -= 1
+    return _run_length(bits, index, -1)
+
+
+def _shift_due(
+    stats: UserLearningStats,
+    old: Optional[datetime],
+    new: Optional[datetime],
+    today: date,
+) -> None:
+    """Move one card between due_by_day buckets, dropping buckets already in the
+    past."""
+    due_by_day = {
+        day: count
+        for day, count in (stats.due_by_day or {}).items()
+        if day >= today.isoformat()
+    }
+    if old is not None:
+        key = old.date().isoformat()
+        if key in due_by_day:
+            due_by_day[key] -= 1
+            if due_by_day[key] <= 0:
+                del due_by_day[key]
+    if new is not None:
+        key = new.date().isoformat()
+        due_by_day[key] = due_by_day.get(key, 0) + 1
+    # Reassign so SQLAlchemy sees the JSON column change
+    stats.due_by_day = due_by_day
+
+
+class LearningStatsTracker:
+    """Keeps each user's UserLearningStats row in step with their reviews and sessions.
+
+    Updates happen in the caller's transaction, so the row commits or rolls
+    back with the change it describes. A user without a row (existing data,
+    or cards added behind the tracker's back) gets one rebuilt from history.
+    """
+
+    def get(
+        self, user_id: str, db: Session, for_update: bool = False
+    ) -> UserLearningStats:
+        """Return the user's stats row, building it from history on first use."""
+        query = db.query(UserLearningStats).filter(UserLearningStats.user_id == user_id)
+        if for_update:
+            query = query.with_for_update()
+        stats = query.first()
+        if stats is None:
+            stats = self.rebuild(user_id, db)
+        return stats
+
+    def record_review(
+        self,
+        stats: UserLearningStats,
+        previous_review: Optional[datetime],
+        previous_due: Optional[datetime],
+        previous_success_rate: float,
+        next_review: datetime,
+        success_rate: float,
+        correct: bool,
+        response_time_ms: Optional[int],
+        reviewed_at: datetime,
+    ) -> None:
+        """Fold one review, taking a card from its previous to its new schedule, into
+        the stats.
+        """
+        today = datetime.utcnow().date()
+        stats.total_reviews += 1
+        stats.correct_reviews += 1 if correct else 0
+        stats.success_rate_sum += success_rate - (previous_success_rate or 0.0)
+        if response_time_ms is not None and response_time_ms >= 0:
+            stats.response_time_total_ms += response_time_ms
+            stats.response_time_count += 1
+
+        # Reviews synced from an offline client may belong to an earlier day
+        if reviewed_at.date() == today:
+            if stats.review_day != today:
+                stats.review_day = today
+                stats.cards_reviewed_today = 0
+                stats.new_cards_today = 0
+            if previous_review is None or previous_review.date() < today:
+                stats.cards_reviewed_today += 1
+            if previous_review is None:
+                stats.new_cards_today += 1
+
+        _shift_due(stats, previous_due, next_review, today)
+        mark_active(stats, reviewed_at.date())
+
+    def record_session(
+        self, stats: UserLearningStats, session: LearningSession
+    ) -> None:
+        """Fold a finished session into the stats."""
+        stats.sessions_completed += 1
+        stats.study_seconds += max(
+            0, int((session.end_time - session.start_time).total_seconds())
+        )
+        mark_active(stats, session.start_time.date())
+        mark_active(stats, session.end_time.date())
+
+    def add_cards(
+        self, stats: UserLearningStats, flashcards: Iterable[Flashcard]
+    ) -> None:
+        """Count newly created cards."""
+        today = datetime.utcnow().date()
+        for flashcard in flashcards:
+            stats.total_cards += 1
+            stats.success_rate_sum += flashcard.success_rate or 0.0
+            _shift_due(stats, None, flashcard.next_review, today)
+
+    def rebuild(self, user_id: str, db: Session) -> UserLearningStats:
+        """Recompute the user's stats row from flashcards and sessions. The caller
+        commits.
+
+        Review totals, response times and activity days come from the review
+        log. Reviews from before the log existed are still counted in each
+        card's review_count and success_rate, so while the log is shorter
+        than that history, totals are derived from the cards instead and
+        response times are carried over as-is.
+        """
+        try:
+            # Lock the row before reading history, so a racing rebuild sees its reviews
+            stats = self._lock_row(user_id, db)
+
+            now = datetime.utcnow()
+            today = now.date()
+            today_start = datetime.combine(today, datetime.min.time())
+
+            (
+                total_cards,
+                success_rate_sum,
+                total_reviews,
+                correct_reviews,
+                reviewed_today,
+            ) = (
+                db.query(
+                    func.count(),
+                    func.coalesce(func.sum(Flashcard.success_rate), 0.0),
+                    func.coalesce(func.sum(Flashcard.review_count), 0),
+                    func.coalesce(
+                        func.sum(
+                            Flashcard.review_count * Flashcard.success_rate / 100.0
+                        ),
+                        0.0,
+                    ),
+                    func.coalesce(
+                        func.sum(
+                            case((Flashcard.last_review >= today_start, 1), else_=0)
+                        ),
+                        0,
+                    ),
+                )
+                .filter(Flashcard.user_id == user_id)
+                .one()
+            )
+
+            due_bucket = day_bucket(db, Flashcard.next_review)
+            due_rows = (
+                db.query(due_bucket, func.count())
+                .filter(
+                    Flashcard.user_id == user_id, Flashcard.next_review >= today_start
+                )
+                .group_by(due_bucket)
+                .all()
+            )
+
+            review_bucket = day_bucket(db, Flashcard.last_review)
+            active_days = {
+                as_date(day)
+                for day, in db.query(review_bucket)
+                .filter(Flashcard.user_id == user_id, Flashcard.last_review.isnot(None))
+                .distinct()
+            }
+
+            log_bucket = day_bucket(db, ReviewLog.reviewed_at)
+            active_days |= {
+                as_date(day)
+                for day, in db.query(log_bucket)
+                .filter(ReviewLog.user_id == user_id)
+                .distinct()
+            }
+
+            (
+                logged_reviews,
+                logged_correct,
+                response_time_total,
+                response_time_count,
+                new_today,
+            ) = (
+                db.query(
+                    func.count(),
+                    func.coalesce(
+                        func.sum(case((ReviewLog.rating >= 3, 1), else_=0)), 0
+                    ),
+                    func.coalesce(func.sum(ReviewLog.response_time_ms), 0),
+                    func.count(ReviewLog.response_time_ms),
+                    # A card's first review is the only one logged with no elapsed time
+                    func.coalesce(
+                        func.sum(
+                            case(
+                                (
+                                    and_(
+                                        ReviewLog.reviewed_at >= today_start,
+                                        ReviewLog.elapsed_days == 0,
+                                    ),
+                                    1,
+                                ),
+                                else_=0,
+                            )
+                        ),
+                        0,
+                    ),
+                )
+                .filter(ReviewLog.user_id == user_id)
+                .one()
+            )
+
+            sessions = (
+                db.query(LearningSession.start_time, LearningSession.end_time)
+                .filter(
+                    LearningSession.user_id == user_id,
+                    LearningSession.end_time.isnot(None),
+                )
+                .all()
+            )
+
+            stats.total_cards = total_cards
+            stats.success_rate_sum = float(success_rate_sum)
+            if logged_reviews >= total_reviews:
+                stats.total_reviews, stats.correct_reviews = logged_reviews, int(
+                    logged_correct
+                )
+                stats.response_time_total_ms, stats.response_time_count = (
+                    int(response_time_total),
+                    response_time_count,
+                )
+            else:
+                stats.total_reviews = int(total_reviews)
+                stats.correct_reviews = int(round(correct_reviews))
+            stats.review_day = today
+            stats.cards_reviewed_today = int(reviewed_today)
+            stats.new_cards_today = int(new_today)
+            stats.due_by_day = {
+                as_date(day).isoformat(): count for day, count in due_rows
+            }
+            stats.sessions_completed = len(sessions)
+            stats.study_seconds = sum(
+                max(0, int((end - start).total_seconds())) for start, end in sessions
+            )
+
+            stats.activity_start, stats.activity_bitmap, stats.longest_streak = (
+                None,
+                None,
+                0,
+            )
+            for start, end in sessions:
+                active_days.update((start.date(), end.date()))
+            for day in sorted(active_days):
+                mark_active(stats, day)
+
+            db.flush()
+            return stats
+
+        except Exception as e:
+            logger.error(
+                f"Error rebuilding learning stats for user {user_id}: {str(e)}"
+            )
+            raise e
+
+    @staticmethod
+    def _lock_row(user_id: str, db: Session) -> UserLearningStats:
+        """Return the user's stats row locked for update, inserting an empty one if
+        there is none.
+
+        Requests handled concurrently can both find the row missing; the
+        insert skips a row another transaction created, rather than failing
+        on its primary key.
+        """
+        dialect = db.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+            db.execute(
+                insert(UserLearningStats)
+                .values(
+                    user_id=user_id, response_time_total_ms=0, response_time_count=0
+                )
+                .on_conflict_do_nothing(index_elements=[UserLearningStats.user_id])
+            )
+        elif db.get(UserLearningStats, user_id) is None:
+            db.add(
+                UserLearningStats(
+                    user_id=user_id, response_time_total_ms=0, response_time_count=0
+                )
+            )
+            db.flush()
+        return (
+            db.query(UserLearningStats)
+            .filter(UserLearningStats.user_id == user_id)
+            .with_for_update()
+            .populate_existing()
+            .one()
+        )
+
+    def to_response(
+        self, stats: UserLearningStats, today: date = None
+    ) -> LearningStatsResponse:
+        today = today or datetime.utcnow().date()
+        return LearningStatsResponse(
+            total_cards=stats.total_cards,
+            cards_reviewed_today=(
+                stats.cards_reviewed_today if stats.review_day == today else 0
+            ),
+            accuracy_rate=(
+                stats.success_rate_sum / stats.total_cards if stats.total_cards else 0.0
+            ),
+            current_streak=current_streak(stats, today),
+            longest_streak=stats.longest_streak,
+            average_response_time=(
+                stats.response_time_total_ms / stats.response_time_count
+                if stats.response_time_count
+                else 0.0
+            ),
+            cards_due_tomorrow=(stats.due_by_day or {}).get(
+                (today + timedelta(days=1)).isoformat(), 0
+            ),
+            total_reviews=stats.total_reviews,
+            sessions_completed=stats.sessions_completed,
+        )
+
+
+stats_tracker = LearningStatsTracker()
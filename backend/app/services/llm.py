@@ -0,0 +1,592 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.config import settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_TOKEN = re.compile(r"\S+\s*")
+_PASSAGE_HEADER = re.compile(r"^\[\d+\].*$", re.MULTILINE)
+_NUMBERED = re.compile(r"^\[(\d+)\] ", re.MULTILINE)
+# The heading that opens the material of each prompt the app builds
+_PROMPT_SECTION = re.compile(r"^(Context|Passages|Passage|Summaries):$", re.MULTILINE)
+_CARDS_PER_PASSAGE = re.compile(r"up to (\d+) flashcards per passage")
+_WORD = re.compile(r"\w+")
+
+
+def _sentences(text: str) -> List[str]:
+    return [
+        sentence.strip() for sentence in _SENTENCE_END.split(text) if sentence.strip()
+    ]
+
+
+def _numbered(text: str) -> List[Tuple[int, str]]:
+    """Split "[1] ...\n\n[2] ..." into (number, text) pairs."""
+    parts = _NUMBERED.split(text)
+    return [
+        (int(number), body.strip()) for number, body in zip(parts[1::2], parts[2::2])
+    ]
+
+
+def _token_count(text: str) -> int:
+    return len(_TOKEN.findall(text))
+
+
+class LLMProvider(ABC):
+    """Generates an answer for a prompt, optionally token by token."""
+
+    name: str = "base"
+
+    @abstractmethod
+    async def stream(
+        self, prompt: str, max_tokens: int = None, temperature: float = None
+    ) -> AsyncIterator[str]:
+        """Yield the answer in pieces as they are generated."""
+
+    async def generate(
+        self, prompt: str, max_tokens: int = None, temperature: float = None
+    ) -> str:
+        """Return the whole answer."""
+        return "".join(
+            [piece async for piece in self.stream(prompt, max_tokens, temperature)]
+        )
+
+    async def aclose(self) -> None:
+        """Release pooled connections."""
+
+
+class LocalLLMProvider(LLMProvider):
+    """Offline stand-in for a real model, for tests and load testing.
+
+    Recognises the app's prompts by the heading of their material and
+    replies in the shape each one asks for, built from that material:
+    questions are "answered" by quoting the context sentences that share
+    the most words with them, flashcard prompts get a JSON array of
+    fill-in-the-blank cards, passage summaries get the passage's opening
+    sentences and its most frequent long words as concepts, and merges
+    join the opening sentence of each summary. Output is emitted word by
+    word; first-token and per-token delays can be set to mimic a remote
+    model's latency profile.
+    """
+
+    name = "local"
+
+    def __init__(self, first_token_ms: float = None, token_ms: float = None):
+        self.first_token_delay = (
+            first_token_ms
+            if first_token_ms is not None
+            else settings.LOCAL_LLM_FIRST_TOKEN_MS
+        ) / 1000
+        self.token_delay = (
+            token_ms if token_ms is not None else settings.LOCAL_LLM_TOKEN_MS
+        ) / 1000
+
+    def compose(self, prompt: str, max_tokens: int) -> List[str]:
+        section = _PROMPT_SECTION.search(prompt)
+        kind = section.group(1) if section else "Context"
+        material = prompt[section.end() :] if section else prompt
+        if kind == "Passages":
+            cards = _CARDS_PER_PASSAGE.search(prompt)
+            text = self._flashcards(
+                material.rpartition("\n\n")[0],
+                int(cards.group(1)) if cards else 1,
+                max_tokens,
+            )
+        elif kind == "Passage":
+            text = self._passage_summary(material.rpartition("\n\n")[0], max_tokens)
+        elif kind == "Summaries":
+            text = self._merged_summary(material, bullets="bullet points" in prompt)
+        else:
+            text = self._answer(prompt)
+        return _TOKEN.findall(text)[:max_tokens]
+
+    @staticmethod
+    def _answer(prompt: str) -> str:
+        context, _, question = prompt.partition("Context:")[2].rpartition("Question:")
+        context = _PASSAGE_HEADER.sub("", context)
+        question_words = set(_WORD.findall(question.lower()))
+        ranked = sorted(
+            _sentences(context),
+            key=lambda sentence: len(
+                question_words & set(_WORD.findall(sentence.lower()))
+            ),
+            reverse=True,
+        )
+        return (
+            " ".join(ranked[:3])
+            or "I could not find anything about that in your documents."
+        )
+
+    @staticmethod
+    def _flashcards(passages: str, per_passage: int, max_tokens: int) -> str:
+        """One card per sentence, up to `per_passage` a passage, blanking the sentence's
+        longest word.
+        """
+        cards, budget = [], max_tokens - 1
+        for number, passage in _numbered(passages):
+            for sentence in _sentences(passage)[:per_passage]:
+                answer = max(_WORD.findall(sentence), key=len, default="")
+                if len(answer) < 4:
+                    continue
+                front = re.sub(rf"\b{re.escape(answer)}\b", "_____", sentence, count=1)[
+                    :100
+                ]
+                card = json.dumps({"passage": number, "front": front, "back": answer})
+                # Stop before the reply would be cut off mid-array
+                if _token_count(card) + 1 > budget:
+                    return "[" + ", ".join(cards) + "]"
+                cards.append(card)
+                budget -= _token_count(card) + 1
+        return "[" + ", ".join(cards) + "]"
+
+    @staticmethod
+    def _passage_summary(passage: str, max_tokens: int) -> str:
+        """The opening sentences as the summary; the most frequent long words as
+        concepts.
+        """
+        sentences = _sentences(passage)
+        counts: Dict[str, int] = {}
+        for word in _WORD.findall(passage.lower()):
+            if len(word) >= 6 and not word.isdigit():
+                counts[word] = counts.get(word, 0) + 1
+        names = sorted(counts, key=lambda word: (-counts[word], word))[:3]
+        concepts = [
+            {
+                "name": name,
+                "definition": " ".join(
+                    next((s for s in sentences if name in s.lower()), "").split()[:25]
+                ),
+                "importance": round(min(1.0, 0.4 + 0.1 * counts[name]), 2),
+                "category": "definition",
+            }
+            for name in names
+        ]
+        relationships = [
+            {"source": source, "target": target, "type": "related"}
+            for source, target in zip(names, names[1:])
+        ]
+        summary = " ".join(" ".join(sentences[:2]).split()[: max(max_tokens // 2, 1)])
+        reply = json.dumps(
+            {"summary": summary, "concepts": concepts, "relationships": relationships}
+        )
+        if _token_count(reply) > max_tokens:
+            reply = json.dumps(
+                {"summary": summary, "concepts": [], "relationships": []}
+            )
+        return reply
+
+    @staticmethod
+    def _merged_summary(summaries: str, bullets: bool) -> str:
+        openings = [
+            (_sentences(summary) or [summary])[0] for _, summary in _numbered(summaries)
+        ]
+        if bullets:
+            return "\n".join(f"- {opening}" for opening in openings)
+        return " ".join(openings)
+
+    async def stream(self, prompt, max_tokens=None, temperature=None):
+        tokens = self.compose(prompt, max_tokens or settings.LLM_MAX_ANSWER_TOKENS)
+        await asyncio.sleep(self.first_token_delay)
+        for index, token in enumerate(tokens):
+            if index and self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield token
+
+
+class OpenAIProvider(LLMProvider):
+    """Chat completions from the OpenAI API using OPENAI_CHAT_MODEL."""
+
+    name = "openai"
+
+    def __init__(self, model: str = None, api_key: str = None):
+        self.model = model or settings.OPENAI_CHAT_MODEL
+        # One pooled client per provider: connections are reused across requests
+        self.client = httpx.AsyncClient(
+            base_url="https://api.openai.com/v1",
+            headers={"Authorization": f"Bearer {api_key or settings.OPENAI_API_KEY}"},
+            timeout=httpx.Timeout(settings.LLM_TIMEOUT_SECONDS, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=settings.LLM_MAX_CONCURRENCY,
+                max_keepalive_connections=settings.LLM_MAX_CONCURRENCY,
+            ),
+        )
+
+    def _request(
+        self,
+        prompt: str,
+        max_tokens: Optional[int],
+        temperature: Optional[float],
+        stream: bool,
+    ) -> dict:
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens or settings.LLM_MAX_ANSWER_TOKENS,
+            "temperature": settings.TEMPERATURE if temperature is None else temperature,
+            "stream": stream,
+        }
+
+    async def generate(self, prompt, max_tokens=None, temperature=None):
+        response = await self.client.post(
+            "/chat/completions",
+            json=self._request(prompt, max_tokens, temperature, False),
+        )
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+    async def stream(self, prompt, max_tokens=None, temperature=None):
+        request = self._request(prompt, max_tokens, temperature, True)
+        async with self.client.stream(
+            "POST", "/chat/completions", json=request
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[len("data: ") :]
+                if data == "[DONE]":
+                    break
+                content = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if content:
+                    yield content
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+LLM_PROVIDERS = {
+    "openai": OpenAIProvider,
+    "local": LocalLLMProvider,
+}
+
+
+def create_llm_provider(name: str) -> LLMProvider:
+    """Build a provider by registry name."""
+    if name not in LLM_PROVIDERS:
+        raise ValueError(f"Unknown LLM provider: {name}")
+    if name == "openai" and not settings.OPENAI_API_KEY:
+        logger.warning(
+            "OPENAI_API_KEY is not set, answering with the local LLM provider"
+        )
+        return LocalLLMProvider()
+    return LLM_PROVIDERS[name]()
+
+
+class ProviderUnavailable(Exception):
+    """Raised when no configured provider could serve a request."""
+
+
+class CircuitBreaker:
+    """Stops sending requests to a provider after repeated failures.
+
+    After LLM_BREAKER_FAILURES consecutive failures the circuit opens and
+    calls are refused for LLM_BREAKER_RESET_SECONDS; then a single trial
+    call is let through, and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = None, reset_seconds: float = None):
+        self.failure_threshold = failure_threshold or settings.LLM_BREAKER_FAILURES
+        self.reset_seconds = (
+            reset_seconds
+            if reset_seconds is not None
+            else settings.LLM_BREAKER_RESET_SECONDS
+        )
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class ProviderSlot:
+    """A provider with its own concurrency limit and circuit breaker."""
+
+    def __init__(self, name: str, provider: LLMProvider):
+        self.name = name
+        self.provider = provider
+        self.semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+        self.breaker = CircuitBreaker()
+        self.in_flight = 0
+
+    async def acquire(self) -> None:
+        """Wait for a free concurrency slot."""
+        await self.semaphore.acquire()
+        self.in_flight += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self.semaphore.release()
+
+    def record_failure(self, error: Exception) -> str:
+        """Count a failed call against the circuit breaker; returns a
+        description of it."""
+        self.breaker.record_failure()
+        metrics.incr(f"llm.{self.name}.failures")
+        reason = str(error) or type(error).__name__
+        logger.error(f"LLM provider {self.name} failed: {reason}")
+        return f"{self.name}: {reason}"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider.name,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.in_flight,
+        }
+
+
+@dataclass
+class LLMResult:
+    text: str
+    provider: str
+
+
+@dataclass
+class SharedCall:
+    """An upstream call shared by every caller of an identical prompt."""
+
+    task: asyncio.Task
+    callers: int = 0
+
+
+class LLMStream:
+    """An answer being streamed by whichever provider accepted the request.
+
+    Holds one of the provider's concurrency slots until the answer has been
+    read to the end or `aclose()` is called. Consumers that may stop early,
+    such as a client disconnecting, must call `aclose()`.
+    """
+
+    def __init__(
+        self, slot: ProviderSlot, first_piece: str, pieces: AsyncIterator[str]
+    ):
+        self.provider = slot.provider.name
+        self._slot = slot
+        self._first_piece = first_piece
+        self._pieces = pieces
+        self._closed = False
+
+    async def __aiter__(self):
+        try:
+            if self._first_piece:
+                yield self._first_piece
+            while True:
+                async with asyncio.timeout(settings.LLM_TIMEOUT_SECONDS):
+                    piece = await anext(self._pieces, None)
+                if piece is None:
+                    break
+                yield piece
+        except Exception as e:
+            self._slot.record_failure(e)
+            raise
+        else:
+            self._slot.breaker.record_success()
+            metrics.incr(f"llm.{self._slot.name}.calls")
+        finally:
+            await self.aclose()
+
+    async def aclose(self) -> None:
+        """Give the provider's slot back; safe to call more than once."""
+        if self._closed:
+            return
+        self._closed = True
+        self._slot.release()
+        await self._pieces.aclose()
+
+
+class LLMRouter:
+    """Routes prompts to the active provider, failing over to a fallback.
+
+    Each provider has a pooled client, a concurrency semaphore
+    (LLM_MAX_CONCURRENCY), a per-call timeout and a circuit breaker.
+    Identical prompts already in flight share one upstream call. The active
+    provider can be switched at runtime without a restart.
+    """
+
+    def __init__(self, primary: str = None, fallback: str = None):
+        self._slots: Dict[str, ProviderSlot] = {}
+        self._inflight: Dict[str, SharedCall] = {}
+        self.primary = primary or settings.DEFAULT_LLM_PROVIDER
+        self.fallback = (
+            fallback if fallback is not None else settings.LLM_FALLBACK_PROVIDER
+        )
+        self._slot(self.primary)
+
+    @property
+    def name(self) -> str:
+        return self._slot(self.primary).provider.name
+
+    def _slot(self, name: str) -> ProviderSlot:
+        slot = self._slots.get(name)
+        if slot is None:
+            slot = self._slots[name] = ProviderSlot(name, create_llm_provider(name))
+        return slot
+
+    def _candidates(self) -> List[ProviderSlot]:
+        names = [self.primary]
+        if self.fallback and self.fallback != self.primary:
+            names.append(self.fallback)
+        return [self._slot(name) for name in names]
+
+    def switch(self, name: str, fallback: Optional[str] = None) -> None:
+        """Make `name` the active provider. In-flight requests finish where they
+        started.
+        """
+        self._slot(name)
+        if fallback is not None:
+            if fallback:
+                self._slot(fallback)
+            self.fallback = fallback or None
+        self.primary = name
+        logger.info(f"LLM provider switched to {name} (fallback: {self.fallback})")
+
+    async def generate(
+        self, prompt: str, max_tokens: int = None, temperature: float = None
+    ) -> LLMResult:
+        """Return the whole answer; identical concurrent prompts share one call."""
+        key = hashlib.sha256(
+            json.dumps(
+                [self.primary, self.fallback, prompt, max_tokens, temperature]
+            ).encode("utf-8")
+        ).hexdigest()
+        call = self._inflight.get(key)
+        if call is None:
+            # The call runs as its own task, so no single caller's cancellation ends it
+            call = SharedCall(
+                asyncio.create_task(self._generate(prompt, max_tokens, temperature))
+            )
+            self._inflight[key] = call
+            call.task.add_done_callback(lambda task: self._finish_call(key, call))
+        else:
+            metrics.incr("llm.coalesced")
+
+        call.callers += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.callers -= 1
+            if not call.callers and not call.task.done():
+                call.task.cancel()
+
+    def _finish_call(self, key: str, call: SharedCall) -> None:
+        if self._inflight.get(key) is call:
+            del self._inflight[key]
+        if not call.task.cancelled():
+            # Mark retrieved so a failure nobody waited for does not log a warning
+            call.task.exception()
+
+    async def _generate(self, prompt, max_tokens, temperature) -> LLMResult:
+        errors = []
+        for slot in self._candidates():
+            if not slot.breaker.allow():
+                errors.append(f"{slot.name}: circuit open")
+                continue
+            # Queueing for a slot is local load, not a provider failure: time the call
+            await slot.acquire()
+            start = time.monotonic()
+            try:
+                async with asyncio.timeout(settings.LLM_TIMEOUT_SECONDS):
+                    text = await slot.provider.generate(prompt, max_tokens, temperature)
+            except Exception as e:
+                errors.append(slot.record_failure(e))
+                continue
+            finally:
+                slot.release()
+
+            slot.breaker.record_success()
+            metrics.incr(f"llm.{slot.name}.calls")
+            metrics.observe(
+                f"llm.{slot.name}.latency_ms", (time.monotonic() - start) * 1000
+            )
+            return LLMResult(text=text, provider=slot.provider.name)
+
+        raise ProviderUnavailable("; ".join(errors))
+
+    async def open_stream(
+        self, prompt: str, max_tokens: int = None, temperature: float = None
+    ) -> LLMStream:
+        """Start streaming an answer.
+
+        Failover happens only until the first piece arrives; after that the
+        stream is committed to its provider.
+        """
+        errors = []
+        for slot in self._candidates():
+            if not slot.breaker.allow():
+                errors.append(f"{slot.name}: circuit open")
+                continue
+            await slot.acquire()
+            pieces = slot.provider.stream(prompt, max_tokens, temperature)
+            start = time.monotonic()
+            try:
+                async with asyncio.timeout(settings.LLM_TIMEOUT_SECONDS):
+                    first_piece = await anext(pieces, "")
+            except BaseException as e:
+                slot.release()
+                await pieces.aclose()
+                if not isinstance(e, Exception):
+                    raise
+                errors.append(slot.record_failure(e))
+                continue
+
+            metrics.observe(
+                f"llm.{slot.name}.first_token_ms", (time.monotonic() - start) * 1000
+            )
+            return LLMStream(slot, first_piece, pieces)
+
+        raise ProviderUnavailable("; ".join(errors))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "primary": self.primary,
+            "fallback": self.fallback,
+            "providers": {name: slot.stats() for name, slot in self._slots.items()},
+        }
+
+    async def aclose(self) -> None:
+        for slot in self._slots.values():
+            await slot.provider.aclose()
+
+
+@lru_cache()
+def get_llm_router() -> LLMRouter:
+    """Return the process-wide LLM router."""
+    return LLMRouter()
@@ -0,0 +1,415 @@
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.user import ReviewLog, UserSchedulerParams
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CardStates:
+    """Scheduling state of many cards, one array element per card.
+
+    `stability` and `memory_difficulty` are the FSRS memory state and are NaN
+    for cards FSRS has not scheduled yet.
+    """
+
+    review_count: np.ndarray
+    interval_days: np.ndarray
+    ease: np.ndarray
+    stability: np.ndarray
+    memory_difficulty: np.ndarray
+
+    @classmethod
+    def from_rows(cls, rows: Sequence) -> "CardStates":
+        """Build from Flashcard rows or objects."""
+        return cls(
+            review_count=np.array([row.review_count for row in rows], dtype=np.int64),
+            interval_days=np.array([row.interval_days for row in rows], dtype=np.int64),
+            ease=np.array([row.difficulty for row in rows], dtype=np.float64),
+            stability=np.array(
+                [np.nan if row.stability is None else row.stability for row in rows],
+                dtype=np.float64,
+            ),
+            memory_difficulty=np.array(
+                [
+                    np.nan if row.memory_difficulty is None else row.memory_difficulty
+                    for row in rows
+                ],
+                dtype=np.float64,
+            ),
+        )
+
+    def take(self, index: np.ndarray) -> "CardStates":
+        return CardStates(
+            **{name: values[index] for name, values in vars(self).items()}
+        )
+
+    def put(self, index: np.ndarray, other: "CardStates") -> None:
+        for name, values in vars(self).items():
+            values[index] = getattr(other, name)
+
+    def card(self, index: int) -> Dict[str, Optional[float]]:
+        """Column values for one card, ready for a Flashcard update."""
+        return {
+            "review_count": int(self.review_count[index]),
+            "interval_days": int(self.interval_days[index]),
+            "difficulty": float(self.ease[index]),
+            "stability": (
+                None
+                if np.isnan(self.stability[index])
+                else float(self.stability[index])
+            ),
+            "memory_difficulty": (
+                None
+                if np.isnan(self.memory_difficulty[index])
+                else float(self.memory_difficulty[index])
+            ),
+        }
+
+
+def fsrs_grade(rating: np.ndarray) -> np.ndarray:
+    """Map the app's 1-5 rating onto FSRS grades: 1-2 again, 3 hard, 4 good, 5 easy."""
+    return np.clip(np.asarray(rating) - 1, 1, 4)
+
+
+class Scheduler(ABC):
+    """A spaced-repetition algorithm, applied to many cards at once."""
+
+    name = ""
+
+    @abstractmethod
+    def step(
+        self,
+        states: CardStates,
+        rating: np.ndarray,
+        elapsed_days: np.ndarray,
+        weights: Optional[np.ndarray] = None,
+    ) -> CardStates:
+        """Return the cards' states after one review each, including the new
+        interval."""
+
+
+class SM2Scheduler(Scheduler):
+    """SuperMemo-2 with the ease factor floored at MIN_EASE_FACTOR."""
+
+    name = "sm2"
+
+    def step(self, states, rating, elapsed_days, weights=None):
+        correct = rating >= 3
+        grown = np.floor(states.interval_days * states.ease)
+        interval = np.where(
+            states.review_count == 0, 1, np.where(states.review_count == 1, 6, grown)
+        )
+        interval = np.clip(
+            np.where(correct, interval, 1), 1, settings.MAX_INTERVAL_DAYS
+        ).astype(np.int64)
+
+        lapse = 5 - rating
+        ease = np.where(
+            correct,
+            states.ease + (0.1 - lapse * (0.08 + lapse * 0.02)),
+            states.ease - 0.2,
+        )
+        return replace(
+            states,
+            review_count=states.review_count + 1,
+            interval_days=interval,
+            ease=np.maximum(settings.MIN_EASE_FACTOR, ease),
+        )
+
+
+# FSRS-4.5 default weights and the bounds the optimiser keeps them in
+# fmt: off
+FSRS_DEFAULT_WEIGHTS = np.array([
+    0.4872, 1.4003, 3.7145, 13.8206, 5.1618, 1.2298, 0.8975, 0.031, 1.6474,
+    0.1367, 1.0461, 2.1072, 0.0793, 0.3246, 1.587, 0.2272, 2.8755,
+])
+FSRS_WEIGHT_BOUNDS = np.array([
+    (0.1, 100), (0.1, 100), (0.1, 100), (0.1, 100), (1, 10), (0.1, 5), (0.1, 5),
+    (0, 0.5), (0, 3), (0.1, 0.8), (0.01, 2.5), (0.5, 5), (0.01, 0.2), (0.01, 0.9),
+    (0.01, 2), (0, 1), (1, 4),
+]).T
+# fmt: on
+FSRS_DECAY = -0.5
+# makes retrievability 90% after `stability` days
+FSRS_FACTOR = 0.9 ** (1 / FSRS_DECAY) - 1
+
+
+def fsrs_retrievability(elapsed_days: np.ndarray, stability: np.ndarray) -> np.ndarray:
+    """Probability of recall after `elapsed_days` for memories of the given
+    stability."""
+    return (1 + FSRS_FACTOR * elapsed_days / stability) ** FSRS_DECAY
+
+
+def fsrs_memory_step(
+    stability: np.ndarray,
+    difficulty: np.ndarray,
+    grade: np.ndarray,
+    elapsed_days: np.ndarray,
+    w: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """FSRS-4.5 memory update. NaN stability marks a first review.
+
+    `w` is one weight vector, or a (sets x 17) matrix to update a copy of the
+    state under each weight set at once (states then have a leading axis).
+    """
+    w = np.asarray(w)
+    w = w.T[:, :, None] if w.ndim == 2 else w
+    first = np.isnan(stability)
+    initial_stability = np.choose(np.clip(grade, 1, 4) - 1, [w[0], w[1], w[2], w[3]])
+    initial_difficulty = np.clip(w[4] - (grade - 3) * w[5], 1, 10)
+
+    stability = np.where(first, 1.0, stability)
+    difficulty = np.where(first, 5.0, difficulty)
+    retrievability = fsrs_retrievability(np.maximum(elapsed_days, 0), stability)
+
+    recall = stability * (
+        1
+        + np.exp(w[8])
+        * (11 - difficulty)
+        * stability ** -w[9]
+        * (np.exp(w[10] * (1 - retrievability)) - 1)
+        * np.where(grade == 2, w[15], 1)
+        * np.where(grade == 4, w[16], 1)
+    )
+    forget = np.minimum(
+        w[11]
+        * difficulty ** -w[12]
+        * ((stability + 1) ** w[13] - 1)
+        * np.exp(w[14] * (1 - retrievability)),
+        stability,
+    )
+    next_difficulty = np.clip(
+        w[7] * w[4] + (1 - w[7]) * (difficulty - w[6] * (grade - 3)), 1, 10
+    )
+
+    next_stability = np.where(
+        first, initial_stability, np.where(grade == 1, forget, recall)
+    )
+    return np.maximum(next_stability, 0.01), np.where(
+        first, initial_difficulty, next_difficulty
+    )
+
+
+class FSRSScheduler(Scheduler):
+    """Free Spaced Repetition Scheduler (FSRS-4.5).
+
+    Tracks each card's memory stability and difficulty, and schedules the
+    next review for when recall probability falls to FSRS_DESIRED_RETENTION.
+    Cards last scheduled by SM-2 are seeded from their interval and ease.
+    """
+
+    name = "fsrs"
+
+    def step(self, states, rating, elapsed_days, weights=None):
+        w = FSRS_DEFAULT_WEIGHTS if weights is None else weights
+        stability, difficulty = states.stability, states.memory_difficulty
+        seeded = np.isnan(stability) & (states.review_count > 0)
+        stability = np.where(
+            seeded, np.maximum(states.interval_days, 1).astype(np.float64), stability
+        )
+        difficulty = np.where(
+            seeded,
+            np.clip(w[4] + (settings.INITIAL_EASE_FACTOR - states.ease) * 4, 1, 10),
+            difficulty,
+        )
+
+        stability, difficulty = fsrs_memory_step(
+            stability, difficulty, fsrs_grade(rating), elapsed_days, w
+        )
+        retention = settings.FSRS_DESIRED_RETENTION
+        interval = np.rint(
+            stability / FSRS_FACTOR * (retention ** (1 / FSRS_DECAY) - 1)
+        )
+        return replace(
+            states,
+            review_count=states.review_count + 1,
+            interval_days=np.clip(interval, 1, settings.MAX_INTERVAL_DAYS).astype(
+                np.int64
+            ),
+            stability=stability,
+            memory_difficulty=difficulty,
+        )
+
+
+SCHEDULERS = {
+    SM2Scheduler.name: SM2Scheduler,
+    FSRSScheduler.name: FSRSScheduler,
+}
+
+
+def get_scheduler(name: str = None) -> Scheduler:
+    """Return the scheduler for `name`, defaulting to SPACED_REPETITION_ALGORITHM."""
+    name = name or settings.SPACED_REPETITION_ALGORITHM
+    if name not in SCHEDULERS:
+        raise ValueError(f"Unknown spaced repetition algorithm: {name}")
+    return SCHEDULERS[name]()
+
+
+def load_weights(
+    user_id: str, scheduler: Scheduler, db: Session
+) -> Optional[np.ndarray]:
+    """The user's fitted parameters for `scheduler`, or None to use its defaults."""
+    if scheduler.name != FSRSScheduler.name:
+        return None
+    params = db.get(UserSchedulerParams, user_id)
+    if params is None or params.algorithm != scheduler.name:
+        return None
+    return np.array(params.weights, dtype=np.float64)
+
+
+def _review_sequences(
+    grades: List[List[int]], elapsed: List[List[float]]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Pad per-card review histories into (cards x reviews) arrays plus a
+    validity mask."""
+    length = max(len(sequence) for sequence in grades)
+    grade = np.ones((len(grades), length), dtype=np.int64)
+    elapsed_days = np.zeros((len(grades), length))
+    mask = np.zeros((len(grades), length), dtype=bool)
+    for row, (card_grades, card_elapsed) in enumerate(zip(grades, elapsed)):
+        grade[row, : len(card_grades)] = card_grades
+        elapsed_days[row, : len(card_elapsed)] = card_elapsed
+        mask[row, : len(card_grades)] = True
+    return grade, elapsed_days, mask
+
+
+def fsrs_log_loss(
+    w: np.ndarray, grade: np.ndarray, elapsed_days: np.ndarray, mask: np.ndarray
+) -> np.ndarray:
+    """Mean log loss of FSRS recall predictions over every non-first review.
+
+    Replays all cards in lockstep: column k is each card's k-th review. With
+    a (sets x 17) weight matrix, returns one loss per weight set.
+    """
+    sets = np.asarray(w).shape[:-1]
+    stability = np.full(sets + grade.shape[:1], np.nan)
+    difficulty = np.full(sets + grade.shape[:1], np.nan)
+    total, count = np.zeros(sets), 0
+    for k in range(grade.shape[1]):
+        active = mask[:, k]
+        if k > 0:
+            predicted = np.clip(
+                fsrs_retrievability(elapsed_days[active, k], stability[..., active]),
+                1e-4,
+                1 - 1e-4,
+            )
+            recalled = grade[active, k] > 1
+            total -= np.sum(
+                np.where(recalled, np.log(predicted), np.log(1 - predicted)), axis=-1
+            )
+            count += int(active.sum())
+        stability[..., active], difficulty[..., active] = fsrs_memory_step(
+            stability[..., active],
+            difficulty[..., active],
+            grade[active, k],
+            elapsed_days[active, k],
+            w,
+        )
+    return total / max(count, 1)
+
+
+def fit_fsrs_weights(
+    grades: List[List[int]],
+    elapsed: List[List[float]],
+    iterations: int = None,
+    learning_rate: float = 0.05,
+    regularization: float = 0.01,
+) -> Tuple[np.ndarray, float, float]:
+    """Fit FSRS weights to review histories by gradient descent.
+
+    `grades` and `elapsed` hold one list per card: its FSRS grades and days
+    since the previous review, in review order. Weights are optimised in
+    units of the defaults (so every weight moves at a comparable rate) with
+    Adam on finite-difference gradients, an L2 pull toward the defaults and
+    the FSRS bounds. Each iteration replays the log once for the current
+    weights and every probe together. Returns (weights, loss with defaults,
+    fitted loss).
+    """
+    iterations = iterations or settings.FSRS_FIT_ITERATIONS
+    grade, elapsed_days, mask = _review_sequences(grades, elapsed)
+    scale = FSRS_DEFAULT_WEIGHTS
+    low, high = FSRS_WEIGHT_BOUNDS[0] / scale, FSRS_WEIGHT_BOUNDS[1] / scale
+    step = 1e-4
+    probes = np.vstack([np.zeros(scale.size), np.eye(scale.size) * step])
+
+    theta = np.ones_like(scale)
+    moment, velocity = np.zeros_like(theta), np.zeros_like(theta)
+    for iteration in range(1, iterations + 1):
+        thetas = theta + probes
+        losses = fsrs_log_loss(thetas * scale, grade, elapsed_days, mask)
+        losses += regularization * np.mean((thetas - 1) ** 2, axis=1)
+        gradient = (losses[1:] - losses[0]) / step
+
+        moment = 0.9 * moment + 0.1 * gradient
+        velocity = 0.999 * velocity + 0.001 * gradient**2
+        update = (
+            learning_rate
+            * (moment / (1 - 0.9**iteration))
+            / (np.sqrt(velocity / (1 - 0.999**iteration)) + 1e-8)
+        )
+        theta = np.clip(theta - update, low, high)
+
+    default_loss, fitted_loss = fsrs_log_loss(
+        np.vstack([scale, theta * scale]), grade, elapsed_days, mask
+    )
+    return theta * scale, float(default_loss), float(fitted_loss)
+
+
+def fit_user_parameters(user_id: str, db: Session) -> Optional[UserSchedulerParams]:
+    """Fit the user's FSRS weights from their review log. The caller commits.
+
+    Returns None, leaving any previous fit in place, when the log is too
+    short or the fit does not beat the default weights.
+    """
+    try:
+        rows = (
+            db.query(ReviewLog.flashcard_id, ReviewLog.rating, ReviewLog.elapsed_days)
+            .filter(ReviewLog.user_id == user_id)
+            .order_by(ReviewLog.flashcard_id, ReviewLog.reviewed_at, ReviewLog.id)
+            .all()
+        )
+        if len(rows) < settings.FSRS_MIN_REVIEWS_TO_FIT:
+            logger.info(
+                f"Skipping scheduler fit for user {user_id}: {len(rows)} reviews logged"
+            )
+            return None
+
+        grades: Dict[str, List[int]] = {}
+        elapsed: Dict[str, List[float]] = {}
+        for flashcard_id, rating, elapsed_days in rows:
+            grades.setdefault(flashcard_id, []).append(int(fsrs_grade(rating)))
+            elapsed.setdefault(flashcard_id, []).append(elapsed_days or 0.0)
+
+        weights, default_loss, fitted_loss = fit_fsrs_weights(
+            list(grades.values()), list(elapsed.values())
+        )
+        logger.info(
+            f"Scheduler fit for user {user_id}: log loss {default_loss:.4f} -> "
+            f"{fitted_loss:.4f} over {len(rows)} reviews"
+        )
+        if fitted_loss >= default_loss:
+            return None
+
+        params = db.get(UserSchedulerParams, user_id)
+        if params is None:
+            params = UserSchedulerParams(user_id=user_id)
+            db.add(params)
+        params.algorithm = FSRSScheduler.name
+        params.weights = [round(float(weight), 6) for weight in weights]
+        params.review_count = len(rows)
+        params.log_loss = fitted_loss
+        params.fitted_at = datetime.utcnow()
+        return params
+
+    except Exception as e:
+        logger.error(f"Error fitting scheduler parameters for user {user_id}: {str(e)}")
+        raise e
@@ -1,100 +1,472 @@
 import asyncio
-import time
-from typing import List, Dict, Any
+import base64
+import hashlib
 import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
 
-from app.schemas.search import SearchResponse, SearchResult, QnAResponse
+from app.config import settings
+from app.core.cache import TTLCache, get_answer_cache
+from app.core.lexical_index import get_lexical_index
+from app.core.metrics import metrics
+from app.core.security import create_cursor_token, verify_cursor_token
+from app.core.vector_store import get_vector_store
+from app.models.user import ContentChunk, Document
+from app.schemas.search import QnAResponse, SearchMode, SearchResponse, SearchResult
+from app.services.context_builder import ContextBuilder, ContextPassage
+from app.services.embeddings import get_embedding_service
+from app.services.llm import get_llm_router
+from app.utils.text_processing import estimate_tokens
 
 logger = logging.getLogger(__name__)
 
 
+def reciprocal_rank_fusion(
+    rankings: List[List[Tuple[str, float]]], k: int = None
+) -> List[Tuple[str, float]]:
+    """Merge ranked (id, score) lists by reciprocal rank, best first.
+
+    Only ranks are used, so BM25 and cosine scores never need to be put on a
+    common scale; each list contributes 1 / (k + rank) for every ID it holds.
+    """
+    k = k or settings.SEARCH_RRF_K
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, (item_id, _) in enumerate(ranking, start=1):
+            fused[item_id] = fused.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def query_digest(query: str) -> str:
+    return hashlib.sha256(query.strip().lower().encode("utf-8")).hexdigest()[:32]
+
+
+@dataclass
+class RankedCandidates:
+    """A cached ranking for one (user, mode, query)."""
+
+    hits: List[Tuple[str, float]]
+    exhausted: bool  # True if hits holds every match, not just the top of them
+    query_vector: Optional[np.ndarray] = None
+
+
+@dataclass
+class SearchCursor:
+    """Continuation state for the next page of a search."""
+
+    user_id: str
+    mode: str
+    digest: str
+    position: int
+    last_id: str
+    last_score: float
+    vector: Optional[np.ndarray] = None
+
+    def encode(self) -> str:
+        data = {
+            "uid": self.user_id,
+            "mode": self.mode,
+            "q": self.digest,
+            "pos": self.position,
+            "id": self.last_id,
+            "score": self.last_score,
+        }
+        if self.vector is not None:
+            # float16 halves the cursor size; plenty of precision for ranking
+            data["vec"] = base64.urlsafe_b64encode(
+                self.vector.astype(np.float16).tobytes()
+            ).decode("ascii")
+        return create_cursor_token(data)
+
+    @classmethod
+    def decode(cls, token: str) -> "SearchCursor":
+        payload = verify_cursor_token(token)
+        vector = None
+        if payload.get("vec"):
+            vector = np.frombuffer(
+                base64.urlsafe_b64decode(payload["vec"]), dtype=np.float16
+            ).astype(np.float32)
+        return cls(
+            user_id=payload["uid"],
+            mode=payload["mode"],
+            digest=payload["q"],
+            position=payload["pos"],
+            last_id=payload["id"],
+            last_score=payload["score"],
+            vector=vector,
+        )
+
+    def matches(self, user_id: str, query: str, mode: SearchMode) -> bool:
+        return (
+            self.user_id == user_id
+            and self.mode == mode.value
+            and self.digest == query_digest(query)
+        )
+
+    def resume_position(self, hits: List[Tuple[str, float]]) -> int:
+        """Index of the first hit after the one this cursor ended on."""
+        if (
+            0 < self.position <= len(hits)
+            and hits[self.position - 1][0] == self.last_id
+        ):
+            return self.position
+        # The ranking changed underneath us: seek past (last_score, last_id)
+        for index, (chunk_id, score) in enumerate(hits):
+            if score < self.last_score or (
+                score == self.last_score and chunk_id > self.last_id
+            ):
+                return index
+        return len(hits)
+
+
+@dataclass
+class AnswerPlan:
+    """What answering a question needs: a cached answer, or the context and prompt for
+    the LLM.
+    """
+
+    question_vector: np.ndarray
+    cached: Optional[Dict[str, Any]] = None
+    cache_generation: int = 0  # the answer cache's generation before retrieval
+    context: List[ContextPassage] = field(default_factory=list)
+    source_documents: List[str] = field(default_factory=list)
+    prompt: str = ""
+
+
+def build_prompt(question: str, context: List[ContextPassage]) -> str:
+    passages = "\n\n".join(
+        f"[{index}] {passage.title}\n{passage.content}"
+        for index, passage in enumerate(context, start=1)
+    )
+    return (
+        "Answer the question using only the context from the user's documents. "
+        "If the context does not contain the answer, say so.\n\n"
+        f"Context:\n{passages}\n\n"
+        f"Question: {question}"
+    )
+
+
 class SearchService:
     """Service for semantic search and Q&A operations."""
-    
+
     def __init__(self):
-        self.embedding_cache = {}
-    
+        self.embedding_service = get_embedding_service()
+        self.vector_store = get_vector_store()
+        self.lexical_index = get_lexical_index()
+        self.candidate_cache = TTLCache(
+            settings.SEARCH_CANDIDATE_CACHE_SIZE, settings.SEARCH_CANDIDATE_TTL_SECONDS
+        )
+        self.answer_cache = get_answer_cache()
+        self.context_builder = ContextBuilder()
+        self.llm = get_llm_router()
+
     async def semantic_search(
-        self, 
-        query: str, 
-        user_id: str, 
-        limit: int = 10, 
-        offset: int = 0
+        self,
+        query: str,
+        user_id: str,
+        db: Session,
+        limit: int = 10,
+        offset: int = 0,
+        mode: SearchMode = SearchMode.HYBRID,
+        cursor: Optional[SearchCursor] = None,
     ) -> SearchResponse:
-        """Perform semantic search over user's documents."""
+        """Search the user's documents with the lexical index, the vector index, or
+        both.
+
+        Pages are cut from a short-lived cache of ranked candidates. A cursor
+        resumes after the last hit it saw, and carries the query vector so
+        the query is never re-embedded, even if the cache entry has expired.
+        """
         start_time = time.time()
-        
+
         try:
-            # In a real implementation, this would:
-            # 1. Generate query embedding
-            # 2. Search vector database
-            # 3. Return ranked results
-            
-            # Mock results for now
-            mock_results = [
-                SearchResult(
-                    id="1",
-                    title="Sample Document 1",
-                    content="This is a sample content that matches the query...",
-                    score=0.95,
-                    source_type="pdf",
-                    metadata={"page": 1}
-                ),
-                SearchResult(
-                    id="2", 
-                    title="Sample Document 2",
-                    content="Another relevant content piece...",
-                    score=0.87,
-                    source_type="markdown",
-                    metadata={"line": 42}
+            cache_key = (user_id, mode.value, query_digest(query))
+            start = cursor.position if cursor else offset
+            query_vector = cursor.vector if cursor else None
+
+            candidates = self.candidate_cache.get(cache_key)
+            if candidates is None or (
+                len(candidates.hits) < start + limit and not candidates.exhausted
+            ):
+                depth = max(
+                    settings.SEARCH_CANDIDATE_POOL,
+                    start + limit,
+                    2 * len(candidates.hits) if candidates else 0,
                 )
-            ]
-            
+                candidates = await self._rank(query, user_id, mode, depth, query_vector)
+                self.candidate_cache.put(cache_key, candidates)
+
+            hits = candidates.hits
+            if cursor:
+                start = cursor.resume_position(hits)
+            page = hits[start : start + limit]
+            results = self._load_results(page, user_id, db)
+
+            next_cursor = None
+            end = start + len(page)
+            if page and (end < len(hits) or not candidates.exhausted):
+                next_cursor = SearchCursor(
+                    user_id=user_id,
+                    mode=mode.value,
+                    digest=cache_key[2],
+                    position=end,
+                    last_id=page[-1][0],
+                    last_score=page[-1][1],
+                    vector=candidates.query_vector,
+                ).encode()
+
             response_time = int((time.time() - start_time) * 1000)
-            
+
             return SearchResponse(
-                results=mock_results[offset:offset+limit],
-                total=len(mock_results),
+                results=results,
+                total=len(hits),
                 query=query,
-                response_time_ms=response_time
+                response_time_ms=response_time,
+                next_cursor=next_cursor,
             )
-            
+
         except Exception as e:
             logger.error(f"Search error: {str(e)}")
             raise e
-    
+
+    async def _rank(
+        self,
+        query: str,
+        user_id: str,
+        mode: SearchMode,
+        depth: int,
+        query_vector: Optional[np.ndarray] = None,
+    ) -> RankedCandidates:
+        """Rank the top `depth` chunks for a query, ordered by (score desc, id)."""
+        lexical_hits, vector_hits = [], []
+        if mode != SearchMode.VECTOR:
+            lexical_hits = await asyncio.to_thread(
+                self.lexical_index.search, user_id, query, depth
+            )
+        if mode != SearchMode.LEXICAL:
+            if query_vector is None:
+                query_vector = await self.embedding_service.embed_query(query)
+            vector_hits = await asyncio.to_thread(
+                self.vector_store.search, user_id, query_vector, depth
+            )
+
+        if mode == SearchMode.LEXICAL:
+            hits = lexical_hits
+        elif mode == SearchMode.VECTOR:
+            hits = vector_hits
+        else:
+            hits = reciprocal_rank_fusion([lexical_hits, vector_hits])
+
+        hits = sorted(hits[:depth], key=lambda hit: (-hit[1], hit[0]))
+        exhausted = len(lexical_hits) < depth and len(vector_hits) < depth
+        return RankedCandidates(
+            hits=hits, exhausted=exhausted, query_vector=query_vector
+        )
+
+    def _load_results(
+        self, hits: List[Tuple[str, float]], user_id: str, db: Session
+    ) -> List[SearchResult]:
+        """Turn (chunk_id, score) hits into search results, keeping their order."""
+        if not hits:
+            return []
+
+        rows = (
+            db.query(ContentChunk, Document)
+            .join(Document, Document.id == ContentChunk.document_id)
+            .filter(
+                ContentChunk.id.in_([chunk_id for chunk_id, _ in hits]),
+                ContentChunk.user_id == user_id,
+            )
+            .all()
+        )
+        by_id = {chunk.id: (chunk, document) for chunk, document in rows}
+
+        results = []
+        for chunk_id, score in hits:
+            if chunk_id not in by_id:
+                # Index entry for a chunk that has since been removed
+                continue
+            chunk, document = by_id[chunk_id]
+            results.append(
+                SearchResult(
+                    id=chunk.id,
+                    title=document.title,
+                    content=chunk.content,
+                    score=score,
+                    source_type=document.source_type,
+                    metadata={
+                        **(chunk.chunk_metadata or {}),
+                        "document_id": document.id,
+                        "chunk_index": chunk.chunk_index,
+                    },
+                )
+            )
+        return results
+
     async def answer_question(
-        self, 
-        question: str, 
-        user_id: str, 
-        max_context: int = 5
+        self, question: str, user_id: str, db: Session, max_context: int = 5
     ) -> QnAResponse:
-        """Answer a question using RAG."""
+        """Answer a question using RAG, reusing the answer to a near-identical earlier
+        question.
+        """
         start_time = time.time()
-        
+
         try:
-            # In a real implementation, this would:
-            # 1. Retrieve relevant context
-            # 2. Format prompt with context
-            # 3. Call LLM
-            # 4. Return answer with sources
-            
-            mock_answer = f"This is a sample answer to the question: '{question}'. Based on the uploaded documents, the key information suggests..."
-            
+            plan = await self._plan_answer(question, user_id, db, max_context)
+
+            if plan.cached is not None:
+                answer, cached = plan.cached, True
+            else:
+                result = await self.llm.generate(plan.prompt)
+                answer, cached = (
+                    await self._finish_answer(
+                        user_id, plan, result.text, result.provider
+                    ),
+                    False,
+                )
+
             response_time = int((time.time() - start_time) * 1000)
-            
+
             return QnAResponse(
                 question=question,
-                answer=mock_answer,
-                source_documents=["doc1", "doc2"],
-                llm_provider="openai",
-                response_time_ms=response_time
+                **answer,
+                cached=cached,
+                response_time_ms=response_time,
             )
-            
+
         except Exception as e:
             logger.error(f"Q&A error: {str(e)}")
             raise e
-    
+
+    async def stream_answer(
+        self, question: str, user_id: str, db: Session, max_context: int = 5
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Answer a question as a stream of (event, data) pairs.
+
+        Emits `sources` as soon as retrieval is done, then one `token` event
+        per generated piece of the answer, then `done` with the full answer
+        and timings, including time to first token.
+        """
+        start_time = time.time()
+
+        plan = await self._plan_answer(question, user_id, db, max_context)
+        yield "sources", {
+            "source_documents": plan.source_documents,
+            "chunks": [
+                chunk_id for passage in plan.context for chunk_id in passage.chunk_ids
+            ],
+        }
+
+        first_token_ms = None
+        if plan.cached is not None:
+            answer, cached = plan.cached, True
+            first_token_ms = int((time.time() - start_time) * 1000)
+            yield "token", {"text": answer["answer"]}
+        else:
+            pieces = []
+            stream = await self.llm.open_stream(plan.prompt)
+            try:
+                async for piece in stream:
+                    if first_token_ms is None:
+                        first_token_ms = int((time.time() - start_time) * 1000)
+                    pieces.append(piece)
+                    yield "token", {"text": piece}
+            finally:
+                # Frees the provider slot if the client went away mid-answer
+                await stream.aclose()
+            answer, cached = (
+                await self._finish_answer(
+                    user_id, plan, "".join(pieces), stream.provider
+                ),
+                False,
+            )
+
+        if first_token_ms is not None:
+            metrics.observe("ask.time_to_first_token_ms", first_token_ms)
+
+        yield "done", {
+            "question": question,
+            **answer,
+            "cached": cached,
+            "time_to_first_token_ms": first_token_ms,
+            "response_time_ms": int((time.time() - start_time) * 1000),
+        }
+
+    async def _plan_answer(
+        self, question: str, user_id: str, db: Session, max_context: int
+    ) -> AnswerPlan:
+        """Embed the question, then either find a cached answer or retrieve context and
+        build the prompt.
+        """
+        question_vector = await self.embedding_service.embed_query(question)
+
+        cache_generation = 0
+        if self.answer_cache is not None:
+            # Read before retrieval, so invalidations from here on keep the answer out
+            # of the cache
+            cache_generation = await asyncio.to_thread(
+                self.answer_cache.generation, user_id
+            )
+            cached = await asyncio.to_thread(
+                self.answer_cache.lookup, user_id, question_vector
+            )
+            if cached is not None:
+                return AnswerPlan(
+                    question_vector,
+                    cached=cached,
+                    source_documents=cached["source_documents"],
+                )
+
+        # Over-fetch: neighbouring chunks merge into one passage and repeats are dropped
+        depth = max_context * settings.CONTEXT_CANDIDATES_PER_PASSAGE
+        candidates = await self._rank(
+            question, user_id, SearchMode.HYBRID, depth, question_vector
+        )
+        budget = (
+            settings.MAX_TOKENS
+            - settings.LLM_MAX_ANSWER_TOKENS
+            - estimate_tokens(build_prompt(question, []))
+        )
+        context = self.context_builder.build(
+            self._load_results(candidates.hits, user_id, db), max_context, budget
+        )
+        metrics.observe(
+            "ask.context_tokens", sum(passage.tokens for passage in context)
+        )
+        return AnswerPlan(
+            question_vector,
+            cache_generation=cache_generation,
+            context=context,
+            source_documents=list(
+                dict.fromkeys(passage.document_id for passage in context)
+            ),
+            prompt=build_prompt(question, context),
+        )
+
+    async def _finish_answer(
+        self, user_id: str, plan: AnswerPlan, answer_text: str, provider: str
+    ) -> Dict[str, Any]:
+        answer = {
+            "answer": answer_text,
+            "source_documents": plan.source_documents,
+            "llm_provider": provider,
+        }
+        # Answers without sources go stale silently as documents arrive; skip them
+        if self.answer_cache is not None and plan.source_documents:
+            await asyncio.to_thread(
+                self.answer_cache.store,
+                user_id,
+                plan.question_vector,
+                answer,
+                plan.source_documents,
+                plan.cache_generation,
+            )
+        return answer
+
     async def get_suggestions(self, user_id: str, limit: int = 5) -> List[str]:
         """Get content suggestions for user."""
         # Mock suggestions
@@ -103,5 +475,5 @@ class SearchService:
             "Check out your machine learning notes",
             "Review today's flashcards",
             "Explore related documents on this topic",
-            "Continue your learning session"
-        ]
\ No newline at end of file
+            "Continue your learning session",
+        ]
@@ -0,0 +1,269 @@
+import logging
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _epoch(moment: datetime) -> float:
+    # Timestamps are naive UTC; a bare .timestamp() would read them as local time
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+
+@dataclass
+class SessionCounts:
+    """Running totals of an open learning session."""
+
+    session_id: str
+    user_id: str
+    cards_reviewed: int = 0
+    correct_answers: int = 0
+    last_activity: Optional[datetime] = None
+
+
+class SessionBuffer(ABC):
+    """Counts reviews into open learning sessions without touching the database.
+
+    Each user's most recently opened session is their active one; reviews
+    count towards it unless a session is named. Sessions changed since the
+    last flush are handed out by take_dirty(). Counts are running totals,
+    so writing the same ones twice is harmless.
+    """
+
+    @abstractmethod
+    async def open(self, session_id: str, user_id: str) -> None:
+        """Start counting a session and make it the user's active one."""
+
+    @abstractmethod
+    async def record(
+        self,
+        user_id: str,
+        reviews: int,
+        correct: int,
+        at: datetime,
+        session_id: str = None,
+    ) -> Optional[SessionCounts]:
+        """Add reviews to the named or active session and return its totals, or None if
+        there is none.
+        """
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[SessionCounts]:
+        """Current totals of a session, or None if it is not buffered."""
+
+    @abstractmethod
+    async def close(self, session_id: str) -> Optional[SessionCounts]:
+        """Forget a session and return its final totals."""
+
+    @abstractmethod
+    async def take_dirty(self) -> List[SessionCounts]:
+        """Return the sessions recorded into since the last call."""
+
+    @abstractmethod
+    async def mark_dirty(self, session_ids: Sequence[str]) -> None:
+        """Queue sessions for the next flush again, e.g. after a failed write."""
+
+
+class InMemorySessionBuffer(SessionBuffer):
+    """Session counters held in this process; for single-process deployments."""
+
+    def __init__(self):
+        self._sessions: Dict[str, SessionCounts] = {}
+        self._active: Dict[str, str] = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    async def open(self, session_id, user_id):
+        with self._lock:
+            self._sessions[session_id] = SessionCounts(
+                session_id, user_id, last_activity=datetime.utcnow()
+            )
+            self._active[user_id] = session_id
+
+    async def record(self, user_id, reviews, correct, at, session_id=None):
+        with self._lock:
+            counts = self._sessions.get(session_id or self._active.get(user_id))
+            if counts is None or counts.user_id != user_id:
+                return None
+            counts.cards_reviewed += reviews
+            counts.correct_answers += correct
+            counts.last_activity = at
+            self._dirty.add(counts.session_id)
+            return replace(counts)
+
+    async def get(self, session_id):
+        with self._lock:
+            counts = self._sessions.get(session_id)
+            return replace(counts) if counts is not None else None
+
+    async def close(self, session_id):
+        with self._lock:
+            counts = self._sessions.pop(session_id, None)
+            self._dirty.discard(session_id)
+            if counts is not None and self._active.get(counts.user_id) == session_id:
+                del self._active[counts.user_id]
+            return counts
+
+    async def take_dirty(self):
+        with self._lock:
+            dirty = [
+                replace(self._sessions[session_id])
+                for session_id in self._dirty
+                if session_id in self._sessions
+            ]
+            self._dirty.clear()
+            return dirty
+
+    async def mark_dirty(self, session_ids):
+        with self._lock:
+            self._dirty.update(
+                session_id for session_id in session_ids if session_id in self._sessions
+            )
+
+
+class RedisSessionBuffer(SessionBuffer):
+    """Session counters shared by every API process through Redis.
+
+    Per session a hash of its totals; per user a key naming their active
+    session; one set of sessions awaiting a flush. Keys expire after twice
+    the idle timeout, by which time the sweeper has closed the session.
+    """
+
+    # KEYS: prefix
+    # ARGV: user_id, session_id (may be empty), reviews, correct, timestamp, ttl
+    _RECORD = """
+        local prefix, user = KEYS[1], ARGV[1]
+        local id = ARGV[2]
+        if id == '' then id = redis.call('GET', prefix .. 'active:' .. user) end
+        if not id then return nil end
+        local key = prefix .. 'session:' .. id
+        if redis.call('HGET', key, 'user_id') ~= user then return nil end
+
+        local reviewed = redis.call('HINCRBY', key, 'cards_reviewed', ARGV[3])
+        local correct = redis.call('HINCRBY', key, 'correct_answers', ARGV[4])
+        redis.call('HSET', key, 'last_activity', ARGV[5])
+        redis.call('EXPIRE', key, ARGV[6])
+        redis.call('EXPIRE', prefix .. 'active:' .. user, ARGV[6])
+        redis.call('SADD', prefix .. 'dirty', id)
+        return {id, reviewed, correct}
+    """
+
+    # KEYS: prefix | ARGV: session_id
+    _CLOSE = """
+        local prefix, id = KEYS[1], ARGV[1]
+        local key = prefix .. 'session:' .. id
+        local data = redis.call('HGETALL', key)
+        if #data == 0 then return data end
+        local user = redis.call('HGET', key, 'user_id')
+        local active = prefix .. 'active:' .. user
+        if redis.call('GET', active) == id then redis.call('DEL', active) end
+        redis.call('DEL', key)
+        redis.call('SREM', prefix .. 'dirty', id)
+        return data
+    """
+
+    def __init__(self, url: str = None, prefix: str = "sessions:"):
+        import redis.asyncio as redis
+
+        self.redis = redis.Redis.from_url(
+            url or settings.REDIS_URL, decode_responses=True
+        )
+        self.prefix = prefix
+        self.ttl_seconds = settings.SESSION_IDLE_TIMEOUT_MINUTES * 60 * 2
+        self._record_script = self.redis.register_script(self._RECORD)
+        self._close_script = self.redis.register_script(self._CLOSE)
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}session:{session_id}"
+
+    @staticmethod
+    def _counts(session_id: str, data: Dict[str, str]) -> Optional[SessionCounts]:
+        if not data:
+            return None
+        return SessionCounts(
+            session_id=session_id,
+            user_id=data["user_id"],
+            cards_reviewed=int(data.get("cards_reviewed", 0)),
+            correct_answers=int(data.get("correct_answers", 0)),
+            last_activity=(
+                datetime.utcfromtimestamp(float(data["last_activity"]))
+                if data.get("last_activity")
+                else None
+            ),
+        )
+
+    async def open(self, session_id, user_id):
+        pipe = self.redis.pipeline()
+        pipe.hset(
+            self._key(session_id),
+            mapping={
+                "user_id": user_id,
+                "cards_reviewed": 0,
+                "correct_answers": 0,
+                "last_activity": _epoch(datetime.utcnow()),
+            },
+        )
+        pipe.expire(self._key(session_id), self.ttl_seconds)
+        pipe.set(f"{self.prefix}active:{user_id}", session_id, ex=self.ttl_seconds)
+        await pipe.execute()
+
+    async def record(self, user_id, reviews, correct, at, session_id=None):
+        result = await self._record_script(
+            keys=[self.prefix],
+            args=[
+                user_id,
+                session_id or "",
+                reviews,
+                correct,
+                _epoch(at),
+                self.ttl_seconds,
+            ],
+        )
+        if not result:
+            return None
+        session_id, reviewed, correct_answers = result
+        return SessionCounts(
+            session_id, user_id, int(reviewed), int(correct_answers), at
+        )
+
+    async def get(self, session_id):
+        return self._counts(session_id, await self.redis.hgetall(self._key(session_id)))
+
+    async def close(self, session_id):
+        data = await self._close_script(keys=[self.prefix], args=[session_id])
+        return self._counts(session_id, dict(zip(data[::2], data[1::2])))
+
+    async def take_dirty(self):
+        session_ids = await self.redis.spop(f"{self.prefix}dirty", 1000) or []
+        if not session_ids:
+            return []
+        pipe = self.redis.pipeline(transaction=False)
+        for session_id in session_ids:
+            pipe.hgetall(self._key(session_id))
+        counts = [
+            self._counts(session_id, data)
+            for session_id, data in zip(session_ids, await pipe.execute())
+        ]
+        return [entry for entry in counts if entry is not None]
+
+    async def mark_dirty(self, session_ids):
+        if session_ids:
+            await self.redis.sadd(f"{self.prefix}dirty", *session_ids)
+
+
+@lru_cache()
+def get_session_buffer() -> SessionBuffer:
+    """Return the process-wide session buffer selected by SESSION_BUFFER_BACKEND."""
+    if settings.SESSION_BUFFER_BACKEND == "memory":
+        return InMemorySessionBuffer()
+    if settings.SESSION_BUFFER_BACKEND == "redis":
+        return RedisSessionBuffer()
+    raise ValueError(
+        f"Unknown session buffer backend: {settings.SESSION_BUFFER_BACKEND}"
+    )
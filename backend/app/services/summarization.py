@@ -0,0 +1,601 @@
+import asyncio
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.core.metrics import metrics
+from app.database import SessionLocal
+from app.models.user import (
+    Concept,
+    ConceptRelationship,
+    ContentChunk,
+    Document,
+    Summary,
+    SummaryCache,
+    generate_uuid,
+)
+from app.services.llm import get_llm_router
+from app.utils.text_processing import combined_hash, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Bump to invalidate cached map/reduce results after changing the prompts
+_PROMPT_VERSION = "1"
+_JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+_WORD = re.compile(r"\w+")
+# Rows per IN (...) when loading cached results
+_CACHE_LOOKUP_BATCH = 500
+
+SUMMARY_TYPES = {
+    "brief": (
+        "Write a concise summary of the whole document in under 150 words, focused "
+        "on the main ideas, key concepts and practical takeaways."
+    ),
+    "detailed": (
+        "Write a comprehensive summary of the whole document with clear sections "
+        "covering the main arguments, supporting evidence, methodology (if "
+        "applicable) and key conclusions."
+    ),
+    "bullet_points": (
+        "Rewrite the key information of the whole document as hierarchical bullet "
+        "points, with main points and sub-points, focused on actionable information "
+        "and key insights."
+    ),
+}
+CONCEPT_CATEGORIES = {"definition", "example", "process", "relationship"}
+RELATIONSHIP_TYPES = {"prerequisite", "related", "example", "contrast", "component"}
+
+
+@dataclass
+class SummaryNode:
+    """A summary of one chunk (a leaf) or of several consecutive nodes, keyed by what it
+    was built from.
+    """
+
+    key: str
+    content: str
+    extracted: Dict[str, Any] = field(default_factory=dict)
+    llm_provider: Optional[str] = None
+
+
+@dataclass
+class SummaryRun:
+    """What one summarization pass over a document needs from the database."""
+
+    document_id: str
+    user_id: str
+    title: str
+    summary_type: str
+    skip_reason: Optional[str] = None
+    version: str = ""
+    chunks: List[Any] = field(default_factory=list)
+
+
+def build_map_prompt(title: str, content: str) -> str:
+    return (
+        "You are an expert knowledge curator. Summarize the passage below from the "
+        f'document "{title}" and identify the key concepts it introduces.\n\n'
+        f"Passage:\n{content}\n\n"
+        'Respond with only a JSON object with the keys "summary" (the main ideas of '
+        'the passage in at most 100 words), "concepts" (a list of objects with '
+        '"name", "definition", "importance" from 0 to 1 and "category": definition, '
+        'example, process or relationship) and "relationships" (a list of objects '
+        'with "source" and "target" concept names and "type": prerequisite, related, '
+        "example, contrast or component)."
+    )
+
+
+def build_reduce_prompt(title: str, summaries: Sequence[str], instruction: str) -> str:
+    numbered = "\n\n".join(
+        f"[{index}] {summary}" for index, summary in enumerate(summaries, start=1)
+    )
+    return (
+        "You are an expert knowledge curator. The numbered summaries below cover "
+        f'consecutive sections of the document "{title}", in order. {instruction}\n\n'
+        f"Summaries:\n{numbered}"
+    )
+
+
+def _merge_instruction() -> str:
+    words = int(settings.SUMMARY_MAX_TOKENS * 0.6)
+    return (
+        f"Merge them into one summary of those sections in under {words} words that "
+        "keeps every main idea, key concept and conclusion, in order."
+    )
+
+
+def parse_map_reply(text: str) -> Tuple[str, Dict[str, Any]]:
+    """Split a map reply into the chunk summary and its concepts; a reply that isn't
+    JSON is taken as the summary.
+    """
+    match = _JSON_OBJECT.search(text)
+    if match:
+        try:
+            data = json.loads(match.group(0))
+        except ValueError:
+            data = None
+        if isinstance(data, dict) and isinstance(data.get("summary"), str):
+            concepts = [
+                item for item in data.get("concepts") or [] if isinstance(item, dict)
+            ]
+            relationships = [
+                item
+                for item in data.get("relationships") or []
+                if isinstance(item, dict)
+            ]
+            return data["summary"].strip(), {
+                "concepts": concepts,
+                "relationships": relationships,
+            }
+    return text.strip(), {"concepts": [], "relationships": []}
+
+
+def _concept_key(name: Any) -> str:
+    return " ".join(_WORD.findall(str(name or "").lower()))
+
+
+def _importance(value: Any) -> float:
+    try:
+        return min(1.0, max(0.0, float(value)))
+    except (TypeError, ValueError):
+        return 0.5
+
+
+def merge_concepts(
+    extractions: Sequence[Dict[str, Any]], max_concepts: int
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Combine per-chunk concepts into a document concept map.
+
+    Concepts are matched by normalized name. Each keeps the definition and
+    category given where it was rated most important; its confidence is
+    that importance plus 0.1 for every further chunk mentioning it. The
+    `max_concepts` most confident are kept, with the relationships between
+    them; a relationship's confidence grows with the chunks asserting it.
+    """
+    concepts: Dict[str, Dict[str, Any]] = {}
+    for extracted in extractions:
+        seen = set()
+        for item in extracted.get("concepts", []):
+            key = _concept_key(item.get("name"))
+            if not key:
+                continue
+            importance = _importance(item.get("importance"))
+            concept = concepts.get(key)
+            if concept is None or importance > concept["importance"]:
+                category = str(item.get("category") or "").lower()
+                concepts[key] = {
+                    "name": str(item["name"]).strip()[:255],
+                    "definition": str(item.get("definition") or "").strip() or None,
+                    "category": category if category in CONCEPT_CATEGORIES else None,
+                    "importance": importance,
+                    "mentions": concept["mentions"] if concept else 0,
+                }
+            if key not in seen:
+                concepts[key]["mentions"] += 1
+                seen.add(key)
+
+    for concept in concepts.values():
+        concept["confidence"] = min(
+            1.0, concept.pop("importance") + 0.1 * (concept["mentions"] - 1)
+        )
+    kept = dict(
+        sorted(concepts.items(), key=lambda item: (-item[1]["confidence"], item[0]))[
+            :max_concepts
+        ]
+    )
+
+    counts: Dict[Tuple[str, str, str], int] = {}
+    for extracted in extractions:
+        for item in extracted.get("relationships", []):
+            source, target = _concept_key(item.get("source")), _concept_key(
+                item.get("target")
+            )
+            kind = str(item.get("type") or "").lower()
+            if (
+                source in kept
+                and target in kept
+                and source != target
+                and kind in RELATIONSHIP_TYPES
+            ):
+                counts[(source, target, kind)] = (
+                    counts.get((source, target, kind), 0) + 1
+                )
+
+    relationships = [
+        {"source": source, "target": target, "type": kind, "confidence": 1 - 0.5**count}
+        for (source, target, kind), count in counts.items()
+    ]
+    return [{"key": key, **concept} for key, concept in kept.items()], relationships
+
+
+def _pack(nodes: List[SummaryNode], budget: int, fanin: int) -> List[List[SummaryNode]]:
+    """Group consecutive nodes so each group's summaries fit `budget` tokens and number
+    at most `fanin`.
+    """
+    groups, current, tokens = [], [], 0
+    for node in nodes:
+        cost = estimate_tokens(node.content) + 4
+        if current and (len(current) >= fanin or tokens + cost > budget):
+            groups.append(current)
+            current, tokens = [], 0
+        current.append(node)
+        tokens += cost
+    if current:
+        groups.append(current)
+    if len(groups) == len(nodes) > 1:
+        # Summaries too long to share a prompt: merge pairs so the tree still shrinks
+        groups = [nodes[index : index + 2] for index in range(0, len(nodes), 2)]
+    return groups
+
+
+class DocumentSummarizer:
+    """Summarizes documents and extracts their concept maps with a map-reduce over
+    chunks.
+
+    The map step summarizes every chunk in parallel and, in the same call,
+    extracts its concepts and relationships. The reduce steps merge
+    consecutive summaries, several per call and within MAX_TOKENS, level by
+    level until one prompt can hold them all; that last call writes the
+    requested summary type. Every step's result is cached in SummaryCache
+    under a key derived from the chunk hashes beneath it, so after an edit
+    only the changed chunks and the merges above them call the LLM again.
+    """
+
+    def __init__(self):
+        self.llm = get_llm_router()
+        self.fanin = settings.SUMMARY_REDUCE_FANIN
+        self.max_concepts = settings.SUMMARY_MAX_CONCEPTS
+
+    async def summarize_document(
+        self, document_id: str, summary_type: str = None
+    ) -> Dict[str, Any]:
+        """Build or refresh a document's summary and concept map and return counts of
+        what was done.
+        """
+        summary_type = summary_type or settings.SUMMARY_DEFAULT_TYPE
+        if summary_type not in SUMMARY_TYPES:
+            return {
+                "status": "failed",
+                "error": f"Unknown summary type: {summary_type}",
+                "retryable": False,
+            }
+
+        try:
+            # Sessions are only used on worker threads, never held across an LLM call
+            run = await asyncio.to_thread(
+                self._start_summary, document_id, summary_type
+            )
+            if run is None:
+                return {
+                    "status": "failed",
+                    "error": "Document not found",
+                    "retryable": False,
+                }
+            if run.skip_reason:
+                return {"status": "skipped", "reason": run.skip_reason}
+
+            calls = [0]
+            leaves = await self._map(run.title, run.chunks, calls)
+            root = await self._reduce(run.title, leaves, summary_type, calls)
+            concepts, relationships = merge_concepts(
+                [leaf.extracted for leaf in leaves], self.max_concepts
+            )
+            await asyncio.to_thread(
+                self._finish_summary, run, root, concepts, relationships
+            )
+
+            metrics.incr("summaries.llm_calls", calls[0])
+            logger.info(
+                f"Summarized document {document_id} ({len(run.chunks)} chunks, "
+                f"{calls[0]} LLM calls, {len(concepts)} concepts)"
+            )
+            return {
+                "status": "completed",
+                "document_id": document_id,
+                "summary_type": summary_type,
+                "llm_calls": calls[0],
+                "concepts": len(concepts),
+            }
+
+        except Exception as e:
+            logger.error(f"Error summarizing document {document_id}: {str(e)}")
+            return {"status": "failed", "error": str(e), "retryable": True}
+
+    def _start_summary(
+        self, document_id: str, summary_type: str
+    ) -> Optional[SummaryRun]:
+        """Load the document's chunks unless its summary already covers them."""
+        db = SessionLocal()
+        try:
+            document = db.query(Document).filter(Document.id == document_id).first()
+            if not document:
+                return None
+
+            run = SummaryRun(
+                document_id=document_id,
+                user_id=document.user_id,
+                title=document.title,
+                summary_type=summary_type,
+            )
+            if document.status != "completed":
+                run.skip_reason = f"document is {document.status}"
+                return run
+
+            run.chunks = (
+                db.query(ContentChunk.content, ContentChunk.content_hash)
+                .filter(ContentChunk.document_id == document_id)
+                .order_by(ContentChunk.chunk_index)
+                .all()
+            )
+            if not run.chunks:
+                run.skip_reason = "document has no content"
+                return run
+
+            run.version = combined_hash(chunk.content_hash for chunk in run.chunks)
+            source_version = (
+                db.query(Summary.source_version)
+                .filter(
+                    Summary.document_id == document_id,
+                    Summary.summary_type == summary_type,
+                )
+                .scalar()
+            )
+            if source_version == run.version:
+                run.skip_reason = "summary is up to date"
+            return run
+        finally:
+            db.close()
+
+    def _finish_summary(
+        self,
+        run: SummaryRun,
+        root: SummaryNode,
+        concepts: List[Dict[str, Any]],
+        relationships: List[Dict[str, Any]],
+    ) -> None:
+        """Save the summary and replace the concept map in one transaction."""
+        db = SessionLocal()
+        try:
+            summary = (
+                db.query(Summary)
+                .filter(
+                    Summary.document_id == run.document_id,
+                    Summary.summary_type == run.summary_type,
+                )
+                .first()
+            )
+            if summary is None:
+                summary = Summary(
+                    document_id=run.document_id,
+                    user_id=run.user_id,
+                    summary_type=run.summary_type,
+                )
+                db.add(summary)
+            summary.content = root.content
+            summary.llm_provider = root.llm_provider
+            summary.source_version = run.version
+            self._store_concepts(
+                db, run.document_id, run.user_id, concepts, relationships
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    async def _map(
+        self, title: str, chunks: List[Any], calls: List[int]
+    ) -> List[SummaryNode]:
+        """Summarize each chunk, reusing cached results for chunks seen before."""
+        keys = [
+            combined_hash(["map", _PROMPT_VERSION, chunk.content_hash])
+            for chunk in chunks
+        ]
+        nodes = await asyncio.to_thread(self._load_cached, keys)
+        missing = {key: chunk for key, chunk in zip(keys, chunks) if key not in nodes}
+
+        async def summarize(key: str, content: str) -> SummaryNode:
+            result = await self.llm.generate(
+                build_map_prompt(title, content),
+                max_tokens=settings.SUMMARY_CHUNK_TOKENS,
+            )
+            summary, extracted = parse_map_reply(result.text)
+            return SummaryNode(
+                key=key,
+                content=summary or content,
+                extracted=extracted,
+                llm_provider=result.provider,
+            )
+
+        nodes.update(
+            await self._run(
+                [summarize(key, chunk.content) for key, chunk in missing.items()],
+                calls,
+            )
+        )
+        return [nodes[key] for key in keys]
+
+    async def _reduce(
+        self,
+        title: str,
+        nodes: List[SummaryNode],
+        summary_type: str,
+        calls: List[int],
+    ) -> SummaryNode:
+        """Merge summaries level by level; the call that sees everything writes the
+        requested summary type.
+        """
+        final_instruction, merge_instruction = (
+            SUMMARY_TYPES[summary_type],
+            _merge_instruction(),
+        )
+        budget = (
+            settings.MAX_TOKENS
+            - settings.SUMMARY_MAX_TOKENS
+            - max(
+                estimate_tokens(build_reduce_prompt(title, [], final_instruction)),
+                estimate_tokens(build_reduce_prompt(title, [], merge_instruction)),
+            )
+        )
+
+        while True:
+            groups = _pack(nodes, budget, self.fanin)
+            final = len(groups) == 1
+            kind, instruction = (
+                (summary_type, final_instruction)
+                if final
+                else ("merge", merge_instruction)
+            )
+            keys = [
+                combined_hash([kind, _PROMPT_VERSION] + [node.key for node in group])
+                for group in groups
+            ]
+
+            merged = await asyncio.to_thread(self._load_cached, keys)
+            pending = []
+            for key, group in zip(keys, groups):
+                if key in merged:
+                    continue
+                if len(group) == 1 and not final:
+                    # Nothing to merge yet; the lone summary moves up a level as-is
+                    merged[key] = SummaryNode(
+                        key=key,
+                        content=group[0].content,
+                        llm_provider=group[0].llm_provider,
+                    )
+                else:
+                    pending.append(self._merge(key, title, group, instruction))
+            merged.update(await self._run(pending, calls))
+
+            nodes = [merged[key] for key in keys]
+            if final:
+                return nodes[0]
+
+    async def _merge(
+        self, key: str, title: str, group: List[SummaryNode], instruction: str
+    ) -> SummaryNode:
+        prompt = build_reduce_prompt(
+            title, [node.content for node in group], instruction
+        )
+        result = await self.llm.generate(prompt, max_tokens=settings.SUMMARY_MAX_TOKENS)
+        return SummaryNode(
+            key=key, content=result.text.strip(), llm_provider=result.provider
+        )
+
+    async def _run(self, steps: List[Any], calls: List[int]) -> Dict[str, SummaryNode]:
+        """Run LLM steps concurrently and cache every one that succeeds, even if others
+        fail.
+        """
+        results = await asyncio.gather(*steps, return_exceptions=True)
+        done = [result for result in results if isinstance(result, SummaryNode)]
+        calls[0] += len(steps)
+        if done:
+            await asyncio.to_thread(self._store_cached, done)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return {node.key: node for node in done}
+
+    def _load_cached(self, keys: List[str]) -> Dict[str, SummaryNode]:
+        unique = list(dict.fromkeys(keys))
+        nodes = {}
+        db = SessionLocal()
+        try:
+            for start in range(0, len(unique), _CACHE_LOOKUP_BATCH):
+                for row in db.query(SummaryCache).filter(
+                    SummaryCache.key.in_(unique[start : start + _CACHE_LOOKUP_BATCH])
+                ):
+                    nodes[row.key] = SummaryNode(
+                        key=row.key,
+                        content=row.content,
+                        extracted=row.extracted or {},
+                        llm_provider=row.llm_provider,
+                    )
+        finally:
+            db.close()
+        metrics.incr("summaries.cache_hits", len(nodes))
+        return nodes
+
+    def _store_cached(self, nodes: List[SummaryNode]) -> None:
+        """Insert cache rows, skipping keys another job has stored in the meantime."""
+        rows = [
+            {
+                "key": node.key,
+                "content": node.content,
+                "extracted": node.extracted or None,
+                "llm_provider": node.llm_provider,
+            }
+            for node in nodes
+        ]
+        db = SessionLocal()
+        try:
+            dialect = db.get_bind().dialect.name
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert
+            elif dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                for row in rows:
+                    db.merge(SummaryCache(**row))
+                db.commit()
+                return
+            db.execute(
+                insert(SummaryCache).on_conflict_do_nothing(index_elements=["key"]),
+                rows,
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _store_concepts(
+        self,
+        db: Session,
+        document_id: str,
+        user_id: str,
+        concepts: List[Dict[str, Any]],
+        relationships: List[Dict[str, Any]],
+    ) -> None:
+        """Replace the document's concept map."""
+        db.query(ConceptRelationship).filter(
+            ConceptRelationship.document_id == document_id
+        ).delete(synchronize_session=False)
+        db.query(Concept).filter(Concept.document_id == document_id).delete(
+            synchronize_session=False
+        )
+
+        ids = {concept["key"]: generate_uuid() for concept in concepts}
+        if concepts:
+            db.execute(
+                Concept.__table__.insert(),
+                [
+                    {
+                        "id": ids[concept["key"]],
+                        "document_id": document_id,
+                        "user_id": user_id,
+                        "name": concept["name"],
+                        "definition": concept["definition"],
+                        "category": concept["category"],
+                        "confidence": concept["confidence"],
+                        "mentions": concept["mentions"],
+                    }
+                    for concept in concepts
+                ],
+            )
+        if relationships:
+            db.execute(
+                ConceptRelationship.__table__.insert(),
+                [
+                    {
+                        "id": generate_uuid(),
+                        "document_id": document_id,
+                        "source_concept_id": ids[relationship["source"]],
+                        "target_concept_id": ids[relationship["target"]],
+                        "relationship_type": relationship["type"],
+                        "confidence": relationship["confidence"],
+                    }
+                    for relationship in relationships
+                ],
+            )
@@ -0,0 +1,173 @@
+import hashlib
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+# Preferred chunk boundaries, strongest first
+_BOUNDARY_PATTERNS = [
+    re.compile(r"\n\s*\n"),  # paragraph break
+    re.compile(r"[.!?][\"')\]]?\s"),  # sentence end
+    re.compile(r"\s"),  # any whitespace
+]
+_WHITESPACE = _BOUNDARY_PATTERNS[-1]
+_TOKEN_PIECES = re.compile(r"\w+|[^\w\s]")
+
+PDF_TYPES = {"pdf"}
+TEXT_TYPES = {"txt", "text", "md", "markdown"}
+
+
+def content_hash(text: str) -> str:
+    """Stable hash of a piece of text, used to recognise identical chunks."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def combined_hash(hashes: Iterable[Optional[str]]) -> str:
+    """Hash of an ordered sequence of content hashes, e.g. a document's chunks: its
+    content version.
+    """
+    return content_hash(":".join(value or "" for value in hashes))
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast estimate of how many LLM tokens a text costs.
+
+    Counts words and punctuation marks, charging long words for the extra
+    sub-word pieces BPE tokenizers split them into. Errs on the high side so
+    a prompt packed against the estimate still fits the real limit.
+    """
+    return sum(1 + (len(piece) - 1) // 6 for piece in _TOKEN_PIECES.findall(text))
+
+
+@dataclass
+class TextBlock:
+    """A piece of extracted text and where it came from."""
+
+    text: str
+    page: Optional[int] = None
+
+
+@dataclass
+class TextChunk:
+    """A chunk of document text ready for embedding and indexing."""
+
+    index: int
+    content: str
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+def iter_text_blocks(
+    file_path: str, source_type: str, block_size: int = 64 * 1024
+) -> Iterator[TextBlock]:
+    """Stream text out of a stored file one page or block at a time."""
+    source_type = source_type.lower()
+
+    if source_type in PDF_TYPES:
+        import pdfplumber
+
+        with pdfplumber.open(file_path) as pdf:
+            for page_number, page in enumerate(pdf.pages, start=1):
+                text = page.extract_text() or ""
+                # Drop parsed layout objects so memory stays flat across pages
+                page.flush_cache()
+                if text:
+                    yield TextBlock(text=text + "\n\n", page=page_number)
+
+    elif source_type in TEXT_TYPES:
+        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+            while True:
+                text = f.read(block_size)
+                if not text:
+                    break
+                yield TextBlock(text=text)
+
+    else:
+        raise ValueError(f"Unsupported source type for extraction: {source_type}")
+
+
+class TextChunker:
+    """Incremental chunker that splits a stream of text blocks into overlapping chunks.
+
+    Chunks end on the strongest natural boundary (paragraph, sentence, word)
+    found in the back half of the window, so an edit in one section only
+    shifts the chunks around it instead of every chunk after it.
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def _find_boundary(self, text: str, pos: int) -> int:
+        """Return the end offset of the chunk starting at pos."""
+        limit = pos + self.chunk_size
+        floor = pos + self.chunk_size // 2
+        for pattern in _BOUNDARY_PATTERNS:
+            end = -1
+            for match in pattern.finditer(text, floor, limit):
+                end = match.end()
+            if end > 0:
+                return end
+        return limit
+
+    def _next_start(self, text: str, pos: int, end: int) -> int:
+        """Return where the next chunk starts so it overlaps the previous one."""
+        start = max(end - self.chunk_overlap, pos + 1)
+        # Begin the overlap on a word boundary where possible
+        match = _WHITESPACE.search(text, start, end)
+        if match:
+            start = match.end()
+        return min(start, end)
+
+    def iter_chunks(self, blocks: Iterable[TextBlock]) -> Iterator[TextChunk]:
+        """Yield chunks as soon as enough text has been buffered."""
+        buffer = ""
+        buffer_offset = 0  # absolute offset of buffer[0]
+        emitted_until = 0  # absolute offset of the end of the last chunk
+        page_marks = []  # (absolute offset, page number)
+        index = 0
+
+        def page_at(offset: int) -> Optional[int]:
+            page = None
+            for mark_offset, mark_page in page_marks:
+                if mark_offset > offset:
+                    break
+                page = mark_page
+            return page
+
+        def make_chunk(start: int, end: int) -> Optional[TextChunk]:
+            content = buffer[start:end].strip()
+            if not content:
+                return None
+            absolute_start = buffer_offset + start
+            metadata = {"start_char": absolute_start, "end_char": buffer_offset + end}
+            page = page_at(absolute_start)
+            if page is not None:
+                metadata["page"] = page
+            return TextChunk(index=index, content=content, metadata=metadata)
+
+        for block in blocks:
+            if block.page is not None:
+                page_marks.append((buffer_offset + len(buffer), block.page))
+            buffer += block.text
+
+            pos = 0
+            while len(buffer) - pos > self.chunk_size:
+                end = self._find_boundary(buffer, pos)
+                chunk = make_chunk(pos, end)
+                if chunk:
+                    yield chunk
+                    index += 1
+                emitted_until = buffer_offset + end
+                pos = self._next_start(buffer, pos, end)
+
+            buffer = buffer[pos:]
+            buffer_offset += pos
+            # Forget page marks that can no longer be referenced
+            while len(page_marks) > 1 and page_marks[1][0] <= buffer_offset:
+                page_marks.pop(0)
+
+        if buffer_offset + len(buffer) > emitted_until:
+            chunk = make_chunk(0, len(buffer))
+            if chunk:
+                yield chunk
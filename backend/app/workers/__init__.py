@@ -1 +1 @@
-# Workers package
\ No newline at end of file
+# Workers package
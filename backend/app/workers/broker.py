@@ -0,0 +1,546 @@
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+DEAD = "dead"
+
+
+class PermanentJobError(Exception):
+    """Raised by a job handler when retrying the job cannot succeed."""
+
+
+@dataclass
+class Job:
+    """A unit of background work."""
+
+    id: str
+    kind: str
+    payload: Dict[str, Any]
+    user_id: Optional[str] = None
+    dedup_key: Optional[str] = None
+    status: str = QUEUED
+    attempts: int = 0
+    max_attempts: int = 5
+    run_at: float = field(default_factory=time.time)
+    last_error: Optional[str] = None
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter for the given number of attempts so far."""
+    delay = settings.JOB_RETRY_BACKOFF_SECONDS * (2 ** max(attempts - 1, 0))
+    delay = min(delay, settings.JOB_RETRY_BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class JobBroker(ABC):
+    """Durable job queue with retries, per-user concurrency caps and deduplication.
+
+    A job with a dedup_key is only queued once while an earlier job with the
+    same key is still queued or running; enqueueing it again returns the
+    existing job instead.
+    """
+
+    def __init__(self, user_concurrency: int = None, lease_seconds: int = None):
+        self.user_concurrency = user_concurrency or settings.JOB_USER_CONCURRENCY
+        self.lease_seconds = lease_seconds or settings.JOB_LEASE_SECONDS
+
+    @abstractmethod
+    def enqueue(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        user_id: Optional[str] = None,
+        dedup_key: Optional[str] = None,
+        max_attempts: Optional[int] = None,
+    ) -> Tuple[Job, bool]:
+        """Queue a job. Returns the job and whether it was newly created."""
+
+    @abstractmethod
+    def claim(self, limit: int) -> List[Job]:
+        """Lease up to limit ready jobs, honouring per-user concurrency caps."""
+
+    @abstractmethod
+    def renew(self, job: Job) -> bool:
+        """Extend a claimed job's lease by lease_seconds; False if the lease was already
+        lost.
+        """
+
+    @abstractmethod
+    def complete(self, job: Job) -> bool:
+        """Mark a claimed job as succeeded; False if its lease was already lost."""
+
+    @abstractmethod
+    def fail(self, job: Job, error: str, retry: bool = True) -> bool:
+        """Requeue a failed job with backoff, or bury it once out of attempts.
+
+        Returns False, changing nothing, if the job's lease was already lost.
+        """
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job by ID."""
+
+    @abstractmethod
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs in each state."""
+
+
+class SQLiteJobBroker(JobBroker):
+    """Broker backed by a local SQLite file, or ":memory:" for an in-process queue."""
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            user_id TEXT,
+            payload TEXT NOT NULL,
+            dedup_key TEXT,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_at REAL NOT NULL,
+            lease_expires_at REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_jobs_active_dedup
+            ON jobs (dedup_key) WHERE status IN ('queued', 'running');
+        CREATE INDEX IF NOT EXISTS ix_jobs_status_run_at ON jobs (status, run_at);
+        CREATE INDEX IF NOT EXISTS ix_jobs_user_status ON jobs (user_id, status);
+    """
+
+    def __init__(self, path: str = None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path or settings.JOB_BROKER_PATH
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.row_factory = sqlite3.Row
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self._SCHEMA)
+
+    def _row_to_job(self, row: sqlite3.Row) -> Job:
+        return Job(
+            id=row["id"],
+            kind=row["kind"],
+            payload=json.loads(row["payload"]),
+            user_id=row["user_id"],
+            dedup_key=row["dedup_key"],
+            status=row["status"],
+            attempts=row["attempts"],
+            max_attempts=row["max_attempts"],
+            run_at=row["run_at"],
+            last_error=row["last_error"],
+        )
+
+    def enqueue(self, kind, payload, user_id=None, dedup_key=None, max_attempts=None):
+        now = time.time()
+        job = Job(
+            id=str(uuid.uuid4()),
+            kind=kind,
+            payload=payload,
+            user_id=user_id,
+            dedup_key=dedup_key,
+            max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+            run_at=now,
+        )
+
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT INTO jobs (id, kind, user_id, payload, dedup_key, status,"
+                    " attempts, max_attempts, run_at, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?)",
+                    (
+                        job.id,
+                        kind,
+                        user_id,
+                        json.dumps(payload),
+                        dedup_key,
+                        QUEUED,
+                        job.max_attempts,
+                        now,
+                        now,
+                        now,
+                    ),
+                )
+                return job, True
+            except sqlite3.IntegrityError:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE dedup_key = ? AND status IN (?, ?)",
+                    (dedup_key, QUEUED, RUNNING),
+                ).fetchone()
+                if row is None:
+                    raise
+                return self._row_to_job(row), False
+
+    def claim(self, limit):
+        now = time.time()
+        claimed = []
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Leases that ran out belong to workers that died; requeue them
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, lease_expires_at = NULL,"
+                    " updated_at = ? WHERE status = ? AND lease_expires_at < ?",
+                    (QUEUED, now, RUNNING, now),
+                )
+
+                for _ in range(limit):
+                    row = self._conn.execute(
+                        "SELECT * FROM jobs AS j WHERE j.status = ? AND j.run_at <= ?"
+                        " AND (j.user_id IS NULL OR (SELECT COUNT(*) FROM jobs AS r"
+                        "      WHERE r.user_id = j.user_id AND r.status = ?) < ?)"
+                        " ORDER BY j.run_at LIMIT 1",
+                        (QUEUED, now, RUNNING, self.user_concurrency),
+                    ).fetchone()
+                    if row is None:
+                        break
+
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1,"
+                        " lease_expires_at = ?, updated_at = ? WHERE id = ?",
+                        (RUNNING, now + self.lease_seconds, now, row["id"]),
+                    )
+                    job = self._row_to_job(row)
+                    job.status = RUNNING
+                    job.attempts += 1
+                    claimed.append(job)
+
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        return claimed
+
+    def renew(self, job):
+        now = time.time()
+        with self._lock:
+            # The attempt count tells our lease from a later claim after it ran out
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_expires_at = ?, updated_at = ?"
+                " WHERE id = ? AND status = ? AND attempts = ?",
+                (now + self.lease_seconds, now, job.id, RUNNING, job.attempts),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job):
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, lease_expires_at = NULL, updated_at = ?"
+                " WHERE id = ? AND status = ? AND attempts = ?",
+                (SUCCEEDED, time.time(), job.id, RUNNING, job.attempts),
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job, error, retry=True):
+        now = time.time()
+        if retry and job.attempts < job.max_attempts:
+            status, run_at = QUEUED, now + retry_delay(job.attempts)
+        else:
+            status, run_at = DEAD, now
+
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, run_at = ?, last_error = ?,"
+                " lease_expires_at = NULL, updated_at = ?"
+                " WHERE id = ? AND status = ? AND attempts = ?",
+                (status, run_at, error, now, job.id, RUNNING, job.attempts),
+            )
+        return cursor.rowcount == 1
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return {status: count for status, count in rows}
+
+
+class RedisJobBroker(JobBroker):
+    """Broker backed by Redis, for running workers on several nodes.
+
+    Ready jobs wait in one sorted set per user (and one for jobs without a
+    user), and a "queues" sorted set orders the users by their oldest ready
+    job. Claiming walks users rather than jobs, so a user at their
+    concurrency cap costs one counter read however many jobs they queued.
+    A global ready set mirrors the per-user ones for counts(). Every state
+    change is a Lua script so the dedup keys, ready queues and per-user
+    running counters stay consistent across workers.
+    """
+
+    # Shared by the scripts below that put jobs back on a ready queue
+    _QUEUE_FUNCTIONS = """
+        local function reindex(prefix, user)
+            local queue = prefix .. 'ready:' .. user
+            local head = redis.call('ZRANGE', queue, 0, 0, 'WITHSCORES')
+            if #head == 0 then
+                redis.call('ZREM', prefix .. 'queues', user)
+            else
+                redis.call('ZADD', prefix .. 'queues', head[2], user)
+            end
+        end
+
+        local function push(prefix, user, id, run_at)
+            redis.call('ZADD', prefix .. 'ready:' .. user, run_at, id)
+            redis.call('ZADD', prefix .. 'ready', run_at, id)
+            reindex(prefix, user)
+        end
+    """
+
+    # KEYS: ready, prefix
+    # ARGV: id, dedup_key, kind, payload, user_id, max_attempts, run_at
+    _ENQUEUE = _QUEUE_FUNCTIONS + """
+        local prefix, id, dedup = KEYS[2], ARGV[1], ARGV[2]
+        if dedup ~= '' then
+            local existing = redis.call('GET', prefix .. 'dedup:' .. dedup)
+            if existing then
+                local key = prefix .. 'job:' .. existing
+                local status = redis.call('HGET', key, 'status')
+                if status == 'queued' or status == 'running' then return existing end
+            end
+            redis.call('SET', prefix .. 'dedup:' .. dedup, id)
+        end
+
+        redis.call('HSET', prefix .. 'job:' .. id,
+            'kind', ARGV[3], 'payload', ARGV[4], 'user_id', ARGV[5],
+            'dedup_key', dedup, 'status', 'queued', 'attempts', 0,
+            'max_attempts', ARGV[6], 'run_at', ARGV[7], 'last_error', '')
+        push(prefix, ARGV[5], id, tonumber(ARGV[7]))
+        return id
+    """
+
+    # KEYS: ready, leases, prefix | ARGV: now, limit, user_cap, lease_seconds
+    _CLAIM = _QUEUE_FUNCTIONS + """
+        local ready, leases, prefix = KEYS[1], KEYS[2], KEYS[3]
+        local now, limit = tonumber(ARGV[1]), tonumber(ARGV[2])
+        local cap, lease = tonumber(ARGV[3]), tonumber(ARGV[4])
+
+        for _, id in ipairs(redis.call('ZRANGEBYSCORE', leases, '-inf', now)) do
+            local key = prefix .. 'job:' .. id
+            local user = redis.call('HGET', key, 'user_id') or ''
+            if user ~= '' then redis.call('DECR', prefix .. 'running:' .. user) end
+            redis.call('ZREM', leases, id)
+            redis.call('HSET', key, 'status', 'queued')
+            push(prefix, user, id, now)
+        end
+
+        -- Queues are reindexed only after the walk so the page offsets stay valid
+        local claimed, touched, offset = {}, {}, 0
+        local queues = prefix .. 'queues'
+        while #claimed < limit do
+            local users = redis.call(
+                'ZRANGEBYSCORE', queues, '-inf', now, 'LIMIT', offset, 100)
+            if #users == 0 then break end
+            offset = offset + #users
+
+            for _, user in ipairs(users) do
+                if #claimed >= limit then break end
+                local room = limit - #claimed
+                local running = prefix .. 'running:' .. user
+                if user ~= '' then
+                    local used = tonumber(redis.call('GET', running) or '0')
+                    room = math.min(room, cap - used)
+                end
+                if room > 0 then
+                    local queue = prefix .. 'ready:' .. user
+                    local ids = redis.call(
+                        'ZRANGEBYSCORE', queue, '-inf', now, 'LIMIT', 0, room)
+                    for _, id in ipairs(ids) do
+                        local key = prefix .. 'job:' .. id
+                        redis.call('ZREM', queue, id)
+                        redis.call('ZREM', ready, id)
+                        redis.call('ZADD', leases, now + lease, id)
+                        redis.call('HSET', key, 'status', 'running')
+                        redis.call('HINCRBY', key, 'attempts', 1)
+                        if user ~= '' then redis.call('INCR', running) end
+                        table.insert(claimed, id)
+                    end
+                    table.insert(touched, user)
+                end
+            end
+        end
+
+        for _, user in ipairs(touched) do reindex(prefix, user) end
+        return claimed
+    """
+
+    # KEYS: ready, leases, prefix | ARGV: id, attempts, status, run_at, error
+    _FINISH = _QUEUE_FUNCTIONS + """
+        local ready, leases, prefix = KEYS[1], KEYS[2], KEYS[3]
+        local id, status = ARGV[1], ARGV[3]
+        local key = prefix .. 'job:' .. id
+        if not redis.call('ZSCORE', leases, id) then return 0 end
+        -- Only the attempt holding the lease may finish the job
+        if redis.call('HGET', key, 'attempts') ~= ARGV[2] then return 0 end
+        redis.call('ZREM', leases, id)
+
+        local user = redis.call('HGET', key, 'user_id') or ''
+        if user ~= '' then redis.call('DECR', prefix .. 'running:' .. user) end
+        redis.call('HSET', key, 'status', status, 'last_error', ARGV[5])
+
+        if status == 'queued' then
+            redis.call('HSET', key, 'run_at', ARGV[4])
+            push(prefix, user, id, tonumber(ARGV[4]))
+        else
+            local dedup = redis.call('HGET', key, 'dedup_key')
+            local dedup_key = prefix .. 'dedup:' .. (dedup or '')
+            if dedup and dedup ~= '' and redis.call('GET', dedup_key) == id then
+                redis.call('DEL', dedup_key)
+            end
+        end
+        return 1
+    """
+
+    # KEYS: leases, prefix | ARGV: id, attempts, lease_expires_at
+    _RENEW = """
+        local leases, prefix, id = KEYS[1], KEYS[2], ARGV[1]
+        if not redis.call('ZSCORE', leases, id) then return 0 end
+        -- A different attempt count means the lease ran out and the job was reclaimed
+        local attempts = redis.call('HGET', prefix .. 'job:' .. id, 'attempts')
+        if attempts ~= ARGV[2] then return 0 end
+        redis.call('ZADD', leases, tonumber(ARGV[3]), id)
+        return 1
+    """
+
+    def __init__(self, url: str = None, prefix: str = "jobs:", **kwargs):
+        super().__init__(**kwargs)
+        import redis
+
+        self.redis = redis.Redis.from_url(
+            url or settings.REDIS_URL, decode_responses=True
+        )
+        self.prefix = prefix
+        self._ready = f"{prefix}ready"
+        self._leases = f"{prefix}leases"
+        self._enqueue_script = self.redis.register_script(self._ENQUEUE)
+        self._claim_script = self.redis.register_script(self._CLAIM)
+        self._finish_script = self.redis.register_script(self._FINISH)
+        self._renew_script = self.redis.register_script(self._RENEW)
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.prefix}job:{job_id}"
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        data = self.redis.hgetall(self._job_key(job_id))
+        if not data:
+            return None
+        return Job(
+            id=job_id,
+            kind=data["kind"],
+            payload=json.loads(data["payload"]),
+            user_id=data.get("user_id") or None,
+            dedup_key=data.get("dedup_key") or None,
+            status=data["status"],
+            attempts=int(data.get("attempts", 0)),
+            max_attempts=int(data["max_attempts"]),
+            run_at=float(data["run_at"]),
+            last_error=data.get("last_error") or None,
+        )
+
+    def enqueue(self, kind, payload, user_id=None, dedup_key=None, max_attempts=None):
+        job = Job(
+            id=str(uuid.uuid4()),
+            kind=kind,
+            payload=payload,
+            user_id=user_id,
+            dedup_key=dedup_key,
+            max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+        )
+
+        job_id = self._enqueue_script(
+            keys=[self._ready, self.prefix],
+            args=[
+                job.id,
+                dedup_key or "",
+                kind,
+                json.dumps(payload),
+                user_id or "",
+                job.max_attempts,
+                job.run_at,
+            ],
+        )
+        if job_id == job.id:
+            return job, True
+        return self._load(job_id), False
+
+    def claim(self, limit):
+        ids = self._claim_script(
+            keys=[self._ready, self._leases, self.prefix],
+            args=[time.time(), limit, self.user_concurrency, self.lease_seconds],
+        )
+        return [job for job in (self._load(job_id) for job_id in ids) if job]
+
+    def _finish(self, job: Job, status: str, run_at: float, error: str) -> bool:
+        return bool(
+            self._finish_script(
+                keys=[self._ready, self._leases, self.prefix],
+                args=[job.id, job.attempts, status, run_at, error],
+            )
+        )
+
+    def renew(self, job):
+        return bool(
+            self._renew_script(
+                keys=[self._leases, self.prefix],
+                args=[job.id, job.attempts, time.time() + self.lease_seconds],
+            )
+        )
+
+    def complete(self, job):
+        return self._finish(job, SUCCEEDED, time.time(), "")
+
+    def fail(self, job, error, retry=True):
+        now = time.time()
+        if retry and job.attempts < job.max_attempts:
+            return self._finish(job, QUEUED, now + retry_delay(job.attempts), error)
+        return self._finish(job, DEAD, now, error)
+
+    def get(self, job_id):
+        return self._load(job_id)
+
+    def counts(self):
+        return {
+            QUEUED: self.redis.zcard(self._ready),
+            RUNNING: self.redis.zcard(self._leases),
+        }
+
+
+@lru_cache()
+def get_broker() -> JobBroker:
+    """Return the process-wide broker selected by JOB_BROKER."""
+    if settings.JOB_BROKER == "redis":
+        return RedisJobBroker()
+    if settings.JOB_BROKER == "sqlite":
+        return SQLiteJobBroker()
+    raise ValueError(f"Unknown job broker: {settings.JOB_BROKER}")
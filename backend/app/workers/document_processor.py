@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from typing import Any, Dict, Tuple
+
+from app.config import settings
+from app.services.document_processing import DocumentProcessor
+from app.workers.broker import Job, PermanentJobError, get_broker
+from app.workers.flashcard_generation import enqueue_flashcard_generation
+from app.workers.runner import notify_local_workers
+from app.workers.summarization import enqueue_summarization
+
+logger = logging.getLogger(__name__)
+
+PROCESS_DOCUMENT = "process_document"
+
+doc_processor = DocumentProcessor()
+
+
+async def enqueue_document_processing(
+    document_id: str, user_id: str
+) -> Tuple[Job, bool]:
+    """Queue a document for processing.
+
+    Returns the job and whether it was newly created; if the document already
+    has a queued or running job, that job is returned instead.
+    """
+    job, created = await asyncio.to_thread(
+        get_broker().enqueue,
+        PROCESS_DOCUMENT,
+        {"document_id": document_id},
+        user_id,
+        f"{PROCESS_DOCUMENT}:{document_id}",
+    )
+    if created:
+        notify_local_workers()
+    else:
+        logger.info(f"Document {document_id} already has an active job {job.id}")
+    return job, created
+
+
+async def process_document_job(payload: Dict[str, Any]) -> None:
+    """Job handler: run the ingestion pipeline for one document."""
+    result = await doc_processor.process_document(payload["document_id"])
+
+    if result["status"] == "failed":
+        if result.get("retryable"):
+            raise RuntimeError(result["error"])
+        raise PermanentJobError(result["error"])
+
+    if settings.FLASHCARD_AUTO_GENERATE:
+        await enqueue_flashcard_generation(result["document_id"], result["user_id"])
+    if settings.SUMMARY_AUTO_GENERATE:
+        await enqueue_summarization(result["document_id"], result["user_id"])
+
+
+JOB_HANDLERS = {
+    PROCESS_DOCUMENT: process_document_job,
+}
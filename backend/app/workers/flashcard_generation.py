@@ -0,0 +1,44 @@
+import asyncio
+import logging
+from typing import Any, Dict, Tuple
+
+from app.services.flashcard_generation import FlashcardGenerator
+from app.workers.broker import Job, PermanentJobError, get_broker
+from app.workers.runner import notify_local_workers
+
+logger = logging.getLogger(__name__)
+
+GENERATE_FLASHCARDS = "generate_flashcards"
+
+flashcard_generator = FlashcardGenerator()
+
+
+async def enqueue_flashcard_generation(
+    document_id: str, user_id: str
+) -> Tuple[Job, bool]:
+    """Queue flashcard generation for a processed document."""
+    job, created = await asyncio.to_thread(
+        get_broker().enqueue,
+        GENERATE_FLASHCARDS,
+        {"document_id": document_id},
+        user_id,
+        f"{GENERATE_FLASHCARDS}:{document_id}",
+    )
+    if created:
+        notify_local_workers()
+    return job, created
+
+
+async def generate_flashcards_job(payload: Dict[str, Any]) -> None:
+    """Job handler: generate the cards a document is still missing."""
+    result = await flashcard_generator.generate_for_document(payload["document_id"])
+
+    if result["status"] == "failed":
+        if result.get("retryable"):
+            raise RuntimeError(result["error"])
+        raise PermanentJobError(result["error"])
+
+
+JOB_HANDLERS = {
+    GENERATE_FLASHCARDS: generate_flashcards_job,
+}
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+from typing import Any, Dict, Tuple
+
+from app.database import SessionLocal
+from app.services.learning_stats import stats_tracker
+from app.workers.broker import Job, get_broker
+from app.workers.runner import notify_local_workers
+
+logger = logging.getLogger(__name__)
+
+REBUILD_LEARNING_STATS = "rebuild_learning_stats"
+
+
+async def enqueue_stats_rebuild(user_id: str) -> Tuple[Job, bool]:
+    """Queue a rebuild of one user's materialized learning stats from history."""
+    job, created = await asyncio.to_thread(
+        get_broker().enqueue,
+        REBUILD_LEARNING_STATS,
+        {"user_id": user_id},
+        user_id,
+        f"{REBUILD_LEARNING_STATS}:{user_id}",
+    )
+    if created:
+        notify_local_workers()
+    return job, created
+
+
+def _rebuild(user_id: str) -> None:
+    db = SessionLocal()
+    try:
+        stats_tracker.rebuild(user_id, db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def rebuild_stats_job(payload: Dict[str, Any]) -> None:
+    """Job handler: recompute a user's UserLearningStats row. The sync session
+    runs off the event loop."""
+    await asyncio.to_thread(_rebuild, payload["user_id"])
+
+
+JOB_HANDLERS = {
+    REBUILD_LEARNING_STATS: rebuild_stats_job,
+}
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from app.config import settings
+from app.workers.broker import Job, JobBroker, PermanentJobError, get_broker
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+# Workers running inside this process, woken directly on enqueue
+_local_workers: Set["JobWorker"] = set()
+
+
+def notify_local_workers() -> None:
+    """Wake in-process workers so new jobs start without waiting for a poll."""
+    for worker in _local_workers:
+        worker.notify()
+
+
+class JobWorker:
+    """Pulls jobs from a broker and runs them with bounded concurrency."""
+
+    def __init__(
+        self,
+        handlers: Dict[str, JobHandler],
+        broker: Optional[JobBroker] = None,
+        concurrency: int = None,
+        poll_interval: float = None,
+    ):
+        self.handlers = handlers
+        self.broker = broker or get_broker()
+        self.concurrency = concurrency or settings.MAX_WORKERS
+        self.poll_interval = poll_interval or settings.JOB_POLL_INTERVAL_SECONDS
+        self._active: Set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+
+    def notify(self) -> None:
+        """Wake the worker early, e.g. right after an in-process enqueue."""
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        """Claim and execute jobs until stop() is called."""
+        logger.info(f"Job worker started with concurrency {self.concurrency}")
+        _local_workers.add(self)
+
+        while not self._stopping.is_set():
+            free_slots = self.concurrency - len(self._active)
+            jobs = []
+            if free_slots > 0:
+                try:
+                    jobs = await asyncio.to_thread(self.broker.claim, free_slots)
+                except Exception as e:
+                    logger.error(f"Failed to claim jobs: {str(e)}")
+
+            for job in jobs:
+                task = asyncio.create_task(self._execute(job))
+                self._active.add(task)
+                task.add_done_callback(self._on_task_done)
+
+            if not jobs or free_slots <= 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), timeout=self.poll_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+        if self._active:
+            await asyncio.gather(*self._active, return_exceptions=True)
+        _local_workers.discard(self)
+        logger.info("Job worker stopped")
+
+    async def stop(self) -> None:
+        """Stop claiming new jobs; run() returns once active jobs finish."""
+        self._stopping.set()
+        self._wakeup.set()
+
+    def _on_task_done(self, task: asyncio.Task) -> None:
+        self._active.discard(task)
+        # A slot freed up, so there may be more work to claim
+        self._wakeup.set()
+
+    async def _heartbeat(self, job: Job) -> None:
+        """Renew the job's lease while it runs, so a long job is not handed to another
+        worker.
+        """
+        while True:
+            await asyncio.sleep(self.broker.lease_seconds / 3)
+            try:
+                if not await asyncio.to_thread(self.broker.renew, job):
+                    logger.warning(f"Job {job.id} ({job.kind}) lost its lease")
+                    return
+            except Exception as e:
+                # Try again next beat; the lease still has two beats to run
+                logger.warning(f"Failed to renew lease of job {job.id}: {str(e)}")
+
+    async def _execute(self, job: Job) -> None:
+        handler = self.handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise PermanentJobError(
+                    f"No handler registered for job kind: {job.kind}"
+                )
+
+            heartbeat = asyncio.create_task(self._heartbeat(job))
+            try:
+                await handler(job.payload)
+            finally:
+                heartbeat.cancel()
+            finished = await asyncio.to_thread(self.broker.complete, job)
+
+        except PermanentJobError as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed permanently: {str(e)}")
+            finished = await asyncio.to_thread(self.broker.fail, job, str(e), False)
+
+        except Exception as e:
+            logger.warning(
+                f"Job {job.id} ({job.kind}) attempt {job.attempts} failed: {str(e)}"
+            )
+            finished = await asyncio.to_thread(self.broker.fail, job, str(e), True)
+
+        if not finished:
+            # Another worker claimed the job after our lease ran out; its outcome stands
+            logger.warning(
+                f"Job {job.id} ({job.kind}) attempt {job.attempts} lost its lease;"
+                " result discarded"
+            )
+
+
+def build_worker(**kwargs) -> JobWorker:
+    """Create a worker with every registered job handler."""
+    from app.workers.document_processor import JOB_HANDLERS as document_handlers
+    from app.workers.flashcard_generation import JOB_HANDLERS as flashcard_handlers
+    from app.workers.learning_stats import JOB_HANDLERS as learning_stats_handlers
+    from app.workers.scheduler_fitting import JOB_HANDLERS as scheduler_fitting_handlers
+    from app.workers.summarization import JOB_HANDLERS as summarization_handlers
+
+    handlers: Dict[str, JobHandler] = {}
+    handlers.update(document_handlers)
+    handlers.update(flashcard_handlers)
+    handlers.update(learning_stats_handlers)
+    handlers.update(scheduler_fitting_handlers)
+    handlers.update(summarization_handlers)
+    return JobWorker(handlers=handlers, **kwargs)
+
+
+async def main() -> None:
+    await build_worker().run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=getattr(logging, settings.LOG_LEVEL),
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    asyncio.run(main())
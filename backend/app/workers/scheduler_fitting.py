@@ -0,0 +1,49 @@
+import asyncio
+import logging
+from typing import Any, Dict, Tuple
+
+from app.database import SessionLocal
+from app.services.scheduling import fit_user_parameters
+from app.workers.broker import Job, get_broker
+from app.workers.runner import notify_local_workers
+
+logger = logging.getLogger(__name__)
+
+FIT_SCHEDULER_PARAMS = "fit_scheduler_params"
+
+
+async def enqueue_scheduler_fit(user_id: str) -> Tuple[Job, bool]:
+    """Queue fitting one user's spaced repetition parameters to their review log."""
+    job, created = await asyncio.to_thread(
+        get_broker().enqueue,
+        FIT_SCHEDULER_PARAMS,
+        {"user_id": user_id},
+        user_id,
+        f"{FIT_SCHEDULER_PARAMS}:{user_id}",
+    )
+    if created:
+        notify_local_workers()
+    return job, created
+
+
+def _fit(user_id: str) -> None:
+    db = SessionLocal()
+    try:
+        fit_user_parameters(user_id, db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def fit_scheduler_job(payload: Dict[str, Any]) -> None:
+    """Job handler: fit a user's FSRS weights. CPU-bound, so it runs off the
+    event loop."""
+    await asyncio.to_thread(_fit, payload["user_id"])
+
+
+JOB_HANDLERS = {
+    FIT_SCHEDULER_PARAMS: fit_scheduler_job,
+}
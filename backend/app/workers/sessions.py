@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import time
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class SessionMaintenance:
+    """Periodically writes buffered session counts out and closes idle sessions.
+
+    Runs in every API process: with the in-memory buffer each process holds
+    its own counts, and with Redis the flushes share one dirty set, so
+    concurrent loops never write a session twice per change.
+    """
+
+    def __init__(
+        self, learning_service, flush_seconds: float = None, sweep_seconds: float = None
+    ):
+        self.learning_service = learning_service
+        self.flush_seconds = flush_seconds or settings.SESSION_FLUSH_SECONDS
+        self.sweep_seconds = sweep_seconds or settings.SESSION_SWEEP_SECONDS
+        self._stopping = asyncio.Event()
+
+    async def run(self) -> None:
+        """Flush and sweep until stop() is called, then flush once more."""
+        next_sweep = time.monotonic() + self.sweep_seconds
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(), timeout=self.flush_seconds
+                )
+            except asyncio.TimeoutError:
+                pass
+
+            await self._flush()
+            if time.monotonic() >= next_sweep:
+                await self._sweep()
+                next_sweep = time.monotonic() + self.sweep_seconds
+
+    async def stop(self) -> None:
+        self._stopping.set()
+
+    async def _flush(self) -> None:
+        async with AsyncSessionLocal() as db:
+            try:
+                flushed = await self.learning_service.flush_session_counts(db)
+                if flushed:
+                    logger.debug(f"Flushed counts of {flushed} learning sessions")
+            except Exception as e:
+                # The sessions were queued again and go out with the next flush
+                logger.warning(f"Session flush failed: {str(e)}")
+
+    async def _sweep(self) -> None:
+        async with AsyncSessionLocal() as db:
+            try:
+                closed = await self.learning_service.close_idle_sessions(db)
+                if closed:
+                    logger.info(f"Closed {closed} idle learning sessions")
+            except Exception as e:
+                logger.warning(f"Idle session sweep failed: {str(e)}")
@@ -0,0 +1,50 @@
+import asyncio
+import logging
+from typing import Any, Dict, Tuple
+
+from app.config import settings
+from app.services.summarization import DocumentSummarizer
+from app.workers.broker import Job, PermanentJobError, get_broker
+from app.workers.runner import notify_local_workers
+
+logger = logging.getLogger(__name__)
+
+SUMMARIZE_DOCUMENT = "summarize_document"
+
+summarizer = DocumentSummarizer()
+
+
+async def enqueue_summarization(
+    document_id: str, user_id: str, summary_type: str = None
+) -> Tuple[Job, bool]:
+    """Queue building a processed document's summary and concept map."""
+    summary_type = summary_type or settings.SUMMARY_DEFAULT_TYPE
+    job, created = await asyncio.to_thread(
+        get_broker().enqueue,
+        SUMMARIZE_DOCUMENT,
+        {"document_id": document_id, "summary_type": summary_type},
+        user_id,
+        f"{SUMMARIZE_DOCUMENT}:{document_id}:{summary_type}",
+    )
+    if created:
+        notify_local_workers()
+    return job, created
+
+
+async def summarize_document_job(payload: Dict[str, Any]) -> None:
+    """Job handler: summarize a document, re-running only the steps whose inputs
+    changed.
+    """
+    result = await summarizer.summarize_document(
+        payload["document_id"], payload.get("summary_type")
+    )
+
+    if result["status"] == "failed":
+        if result.get("retryable"):
+            raise RuntimeError(result["error"])
+        raise PermanentJobError(result["error"])
+
+
+JOB_HANDLERS = {
+    SUMMARIZE_DOCUMENT: summarize_document_job,
+}
@@ -0,0 +1,123 @@
+"""Benchmark for the embedding engine using the deterministic local backend.
+
+Embeds a synthetic document, re-embeds it after a small edit and reports
+how much of the second pass was served from cache:
+
+    python -m benchmarks.bench_embeddings --paragraphs 2000 --edit-fraction 0.02
+"""
+
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from app.config import settings
+from app.services.embeddings import (
+    EmbeddingService,
+    EmbeddingStore,
+    LocalEmbeddingBackend,
+)
+from app.utils.text_processing import TextBlock, TextChunker
+
+VOCABULARY = [
+    "memory",
+    "retrieval",
+    "neuron",
+    "synapse",
+    "gradient",
+    "vector",
+    "index",
+    "spaced",
+    "repetition",
+    "interval",
+    "recall",
+    "concept",
+    "graph",
+    "entropy",
+    "signal",
+    "model",
+    "attention",
+    "latency",
+    "cache",
+    "cluster",
+    "protein",
+    "enzyme",
+    "theorem",
+    "proof",
+]
+
+
+def make_document(paragraphs: int, rng: random.Random) -> list:
+    return [
+        " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(40, 120))) + "."
+        for _ in range(paragraphs)
+    ]
+
+
+async def embed_document(
+    service: EmbeddingService, chunker: TextChunker, paragraphs: list
+) -> tuple:
+    chunks = [
+        chunk.content
+        for chunk in chunker.iter_chunks([TextBlock("\n\n".join(paragraphs))])
+    ]
+    start = time.perf_counter()
+    # Mimic the ingestion pipeline: several concurrent workers with small batches
+    batches = [
+        chunks[i : i + settings.PIPELINE_BATCH_SIZE]
+        for i in range(0, len(chunks), settings.PIPELINE_BATCH_SIZE)
+    ]
+    await asyncio.gather(*(service.embed_texts(batch) for batch in batches))
+    return time.perf_counter() - start, len(chunks)
+
+
+async def run(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    chunker = TextChunker(settings.CHUNK_SIZE, settings.CHUNK_OVERLAP)
+    paragraphs = make_document(args.paragraphs, rng)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        service = EmbeddingService(
+            backend=LocalEmbeddingBackend(args.dimension),
+            store=EmbeddingStore(Path(tmp) / "embeddings.db"),
+            cache_size=args.cache_size,
+        )
+
+        cold_time, chunk_count = await embed_document(service, chunker, paragraphs)
+        cold = service.stats()
+
+        edited = list(paragraphs)
+        for index in rng.sample(
+            range(len(edited)), max(1, int(len(edited) * args.edit_fraction))
+        ):
+            edited[index] = edited[index].replace(".", " with a small edit.")
+
+        warm_time, _ = await embed_document(service, chunker, edited)
+        warm = service.stats()
+
+    print(f"chunks:            {chunk_count}")
+    print(
+        f"cold pass:         {cold_time * 1000:.0f} ms, "
+        f"{cold['texts_embedded']} embedded in {cold['provider_calls']} provider calls"
+    )
+    print(
+        f"edited pass:       {warm_time * 1000:.0f} ms, "
+        f"{warm['texts_embedded'] - cold['texts_embedded']} embedded, "
+        f"{warm['memory_hits'] - cold['memory_hits']} cache hits"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--paragraphs", type=int, default=2000)
+    parser.add_argument("--edit-fraction", type=float, default=0.02)
+    parser.add_argument("--dimension", type=int, default=settings.EMBEDDING_DIMENSION)
+    parser.add_argument("--cache-size", type=int, default=settings.EMBEDDING_CACHE_SIZE)
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Throughput benchmark for the background job queue.
+
+Runs against the SQLite broker (in memory by default), so no Redis is needed:
+
+    python -m benchmarks.bench_job_queue --jobs 5000 --users 50 --concurrency 8
+"""
+
+import argparse
+import asyncio
+import time
+
+from app.workers.broker import SQLiteJobBroker
+from app.workers.runner import JobWorker
+
+BENCH_JOB = "bench_noop"
+
+
+async def run(args: argparse.Namespace) -> None:
+    broker = SQLiteJobBroker(path=args.path, user_concurrency=args.user_cap)
+    done = asyncio.Event()
+    completed = 0
+
+    async def handler(payload):
+        nonlocal completed
+        if args.work_ms:
+            await asyncio.sleep(args.work_ms / 1000)
+        completed += 1
+        if completed >= args.jobs:
+            done.set()
+
+    start = time.perf_counter()
+    for i in range(args.jobs):
+        broker.enqueue(
+            BENCH_JOB, {"n": i}, user_id=f"user-{i % args.users}", dedup_key=f"job-{i}"
+        )
+    enqueue_time = time.perf_counter() - start
+
+    # Re-enqueueing the same keys must not create duplicate work
+    duplicates = sum(
+        1
+        for i in range(min(args.jobs, 1000))
+        if broker.enqueue(
+            BENCH_JOB, {"n": i}, user_id=f"user-{i % args.users}", dedup_key=f"job-{i}"
+        )[1]
+    )
+
+    worker = JobWorker(
+        {BENCH_JOB: handler},
+        broker=broker,
+        concurrency=args.concurrency,
+        poll_interval=0.01,
+    )
+    start = time.perf_counter()
+    worker_task = asyncio.create_task(worker.run())
+    await done.wait()
+    drain_time = time.perf_counter() - start
+    await worker.stop()
+    await worker_task
+
+    print(f"broker:        sqlite ({args.path})")
+    print(
+        f"jobs:          {args.jobs} across {args.users} users "
+        f"(cap {args.user_cap}/user)"
+    )
+    print(f"enqueue:       {args.jobs / enqueue_time:,.0f} jobs/s")
+    print(
+        f"drain:         {args.jobs / drain_time:,.0f} jobs/s "
+        f"with concurrency {args.concurrency}"
+    )
+    print(f"dedup leaks:   {duplicates}")
+    print(f"final counts:  {broker.counts()}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--user-cap", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--work-ms", type=float, default=0.0, help="simulated handler latency"
+    )
+    parser.add_argument(
+        "--path", default=":memory:", help="SQLite path, ':memory:' for in-process"
+    )
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
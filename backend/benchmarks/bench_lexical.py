@@ -0,0 +1,98 @@
+"""Benchmark for the BM25 lexical index on a synthetic per-user corpus.
+
+Indexes a Zipf-distributed corpus, then reports lexical query latency and
+how quickly a rare identifier is found:
+
+    python -m benchmarks.bench_lexical --chunks 100000 --queries 500
+"""
+
+import argparse
+import itertools
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from app.core.lexical_index import LexicalIndex
+
+
+def make_chunks(
+    count: int, vocabulary: list, cum_weights: list, rng: random.Random
+) -> list:
+    return [
+        " ".join(
+            rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(120, 200))
+        )
+        for _ in range(count)
+    ]
+
+
+def percentile(samples: list, fraction: float) -> float:
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    vocabulary = [f"term{i}" for i in range(args.vocabulary)]
+    # Zipfian term frequencies, like natural text
+    cum_weights = list(
+        itertools.accumulate(1.0 / (rank + 1) for rank in range(args.vocabulary))
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = LexicalIndex(Path(tmp))
+
+        start = time.perf_counter()
+        for offset in range(0, args.chunks, args.batch_size):
+            count = min(args.batch_size, args.chunks - offset)
+            texts = make_chunks(count, vocabulary, cum_weights, rng)
+            if offset <= args.chunks // 2 < offset + count:
+                texts[0] += " see ticket KOS-4711 for details"
+            index.add(
+                "bench-user", [f"chunk-{offset + i}" for i in range(count)], texts
+            )
+        build_time = time.perf_counter() - start
+
+        latencies = []
+        for _ in range(args.queries):
+            query = " ".join(
+                rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(2, 6))
+            )
+            start = time.perf_counter()
+            index.search("bench-user", query, args.k)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        hits = index.search("bench-user", "kos-4711", args.k)
+        identifier_time = time.perf_counter() - start
+
+    print(f"chunks:            {args.chunks}")
+    print(
+        f"index build:       {build_time:.1f} s "
+        f"({args.chunks / build_time:.0f} chunks/s)"
+    )
+    print(
+        f"lexical query:     p50 {percentile(latencies, 0.5) * 1000:.2f} ms, "
+        f"p95 {percentile(latencies, 0.95) * 1000:.2f} ms, "
+        f"mean {statistics.mean(latencies) * 1000:.2f} ms"
+    )
+    print(
+        f"identifier lookup: {identifier_time * 1000:.2f} ms, "
+        f"top hit {hits[0][0] if hits else None}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
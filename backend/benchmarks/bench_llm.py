@@ -0,0 +1,112 @@
+"""Load test for the LLM router using the offline local provider.
+
+Fires concurrent prompts (with a share of duplicates) through the router and
+reports throughput, latency percentiles and how many calls were coalesced.
+With --failure-rate, the primary provider fails randomly and requests fail
+over to the local provider once its circuit opens:
+
+    python -m benchmarks.bench_llm --requests 2000 --concurrency 200 --unique 400
+    python -m benchmarks.bench_llm --failure-rate 0.5
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from app.config import settings
+from app.core.metrics import metrics
+from app.services.llm import LLM_PROVIDERS, LLMRouter, LocalLLMProvider
+
+
+class FlakyLLMProvider(LocalLLMProvider):
+    """Local provider failing a fraction of calls, like an unhealthy upstream."""
+
+    name = "flaky"
+    failure_rate = 0.0
+
+    async def stream(self, prompt, max_tokens=None, temperature=None):
+        await asyncio.sleep(self.first_token_delay)
+        if random.random() < self.failure_rate:
+            raise RuntimeError("upstream error")
+        async for piece in super().stream(prompt, max_tokens, temperature):
+            yield piece
+
+
+def percentile(samples: list, fraction: float) -> float:
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+async def run(args: argparse.Namespace) -> None:
+    settings.LOCAL_LLM_FIRST_TOKEN_MS = args.first_token_ms
+    settings.LOCAL_LLM_TOKEN_MS = args.token_ms
+    settings.LLM_MAX_CONCURRENCY = args.provider_concurrency
+
+    if args.failure_rate:
+        FlakyLLMProvider.failure_rate = args.failure_rate
+        LLM_PROVIDERS["flaky"] = FlakyLLMProvider
+        router = LLMRouter(primary="flaky", fallback="local")
+    else:
+        router = LLMRouter(primary="local", fallback="")
+
+    prompts = [
+        f"Context:\nPassage {i} about topic {i % 37}. It has a few sentences. "
+        "Each one is short.\n\n"
+        f"Question: what about topic {i % 37}?"
+        for i in range(args.unique)
+    ]
+    rng = random.Random(args.seed)
+    queue = [rng.choice(prompts) for _ in range(args.requests)]
+    latencies, providers, errors = [], {}, 0
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def one(prompt: str) -> None:
+        nonlocal errors
+        async with gate:
+            start = time.perf_counter()
+            try:
+                result = await router.generate(prompt)
+                providers[result.provider] = providers.get(result.provider, 0) + 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(prompt) for prompt in queue))
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"requests:          {args.requests} ({args.unique} unique prompts, "
+        f"concurrency {args.concurrency})"
+    )
+    print(f"throughput:        {args.requests / elapsed:.0f} req/s")
+    print(
+        f"latency:           p50 {percentile(latencies, 0.5) * 1000:.0f} ms, "
+        f"p95 {percentile(latencies, 0.95) * 1000:.0f} ms, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.0f} ms"
+    )
+    print(f"coalesced:         {int(metrics.counter('llm.coalesced'))}")
+    print(f"answered by:       {providers}, errors: {errors}")
+    circuits = {
+        name: slot["circuit"] for name, slot in router.stats()["providers"].items()
+    }
+    print(f"circuits:          {circuits}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--unique", type=int, default=400)
+    parser.add_argument(
+        "--provider-concurrency", type=int, default=settings.LLM_MAX_CONCURRENCY
+    )
+    parser.add_argument("--first-token-ms", type=float, default=200)
+    parser.add_argument("--token-ms", type=float, default=2)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Bystander latency benchmark for the auth endpoints during a login storm.
+
+Registers a few users, then drives the FastAPI app in-process over httpx's
+ASGI transport with a storm of concurrent POST /auth/login requests. While
+the storm runs, one client keeps sending GET /api/v1/health, one request at
+a time. The benchmark reports p50/p95/p99 latency for that bystander, for
+the logins themselves, and how many logins were turned away with 429, for
+each password hash executor:
+
+- inline: bcrypt runs on the event loop, as the handlers did before
+- thread / process: bcrypt runs in the bounded pool from app.core.password_hashing
+
+With inline hashing every health check waits for the logins queued ahead of
+it; with a pool it should stay close to its idle latency. The cost factor
+comes from BCRYPT_ROUNDS, like the app's:
+
+    DATABASE_URL=sqlite:///./bench.db python -m benchmarks.bench_password_hashing
+    BCRYPT_ROUNDS=10 DATABASE_URL=sqlite:///./bench.db \\
+        python -m benchmarks.bench_password_hashing \\
+        --executor thread --logins 200 --concurrency 64 --queue-limit 16
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Dict, List
+
+import httpx
+import numpy as np
+
+from app.config import settings
+from app.core.password_hashing import get_password_hasher
+from app.database import Base, async_engine, engine
+from app.main import app
+
+PASSWORD = "Bench-password-1"
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    p50, p95, p99 = np.percentile(np.array(samples) * 1000, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+async def ensure_users(client: httpx.AsyncClient, users: int) -> List[str]:
+    emails = [f"bench-login-{i}@example.com" for i in range(users)]
+    for email in emails:
+        response = await client.post(
+            "/api/v1/auth/register",
+            json={"email": email, "username": "bench", "password": PASSWORD},
+        )
+        if response.status_code not in (200, 400):  # 400: registered by an earlier run
+            raise RuntimeError(
+                f"register returned {response.status_code}: {response.text}"
+            )
+    return emails
+
+
+async def storm(
+    client: httpx.AsyncClient, emails: List[str], args: argparse.Namespace
+) -> Dict[str, Dict[str, float]]:
+    login_samples: List[float] = []
+    health_samples: List[float] = []
+    outcomes: Dict[int, int] = {}
+    pending = iter(range(args.logins))
+    done = asyncio.Event()
+
+    async def login_worker():
+        for i in pending:
+            start = time.perf_counter()
+            response = await client.post(
+                "/api/v1/auth/login",
+                json={"email": emails[i % len(emails)], "password": PASSWORD},
+            )
+            outcomes[response.status_code] = outcomes.get(response.status_code, 0) + 1
+            if response.status_code == 200:
+                login_samples.append(time.perf_counter() - start)
+
+    async def bystander():
+        while not done.is_set():
+            start = time.perf_counter()
+            response = await client.get("/api/v1/health")
+            if response.status_code != 200:
+                raise RuntimeError(
+                    f"health returned {response.status_code}: {response.text}"
+                )
+            health_samples.append(time.perf_counter() - start)
+            await asyncio.sleep(args.interval_ms / 1000)
+
+    idle = []
+    for _ in range(20):
+        start = time.perf_counter()
+        await client.get("/api/v1/health")
+        idle.append(time.perf_counter() - start)
+
+    watcher = asyncio.create_task(bystander())
+    started = time.perf_counter()
+    await asyncio.gather(*(login_worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await watcher
+
+    return {
+        "health idle": summarize(idle),
+        "health in storm": summarize(health_samples),
+        "login": {
+            **summarize(login_samples),
+            "ok": outcomes.get(200, 0),
+            "429": outcomes.get(429, 0),
+            "seconds": elapsed,
+        },
+    }
+
+
+async def run(args: argparse.Namespace) -> None:
+    # Every request comes from the same client address
+    settings.RATE_LIMIT_REQUESTS = 10**9
+    Base.metadata.create_all(bind=engine)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://localhost", timeout=None
+    ) as client:
+        emails = await ensure_users(client, args.users)
+        print(
+            f"{'executor':<9} {'series':<16} {'p50 ms':>9} {'p95 ms':>9} "
+            f"{'p99 ms':>9}  notes"
+        )
+        for executor in args.executor:
+            settings.PASSWORD_HASH_EXECUTOR = executor
+            settings.PASSWORD_HASH_WORKERS = args.workers
+            settings.PASSWORD_HASH_QUEUE_LIMIT = args.queue_limit
+            get_password_hasher.cache_clear()
+            try:
+                results = await storm(client, emails, args)
+            finally:
+                get_password_hasher().shutdown()
+            for series, summary in results.items():
+                notes = ""
+                if series == "login":
+                    notes = (
+                        f"{summary['ok']} ok, {summary['429']} rejected with 429 "
+                        f"in {summary['seconds']:.1f}s"
+                    )
+                print(
+                    f"{executor:<9} {series:<16} {summary['p50']:>9.2f} "
+                    f"{summary['p95']:>9.2f} {summary['p99']:>9.2f}  {notes}"
+                )
+    await async_engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--executor",
+        nargs="+",
+        default=["inline", "thread"],
+        choices=["inline", "thread", "process"],
+    )
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument(
+        "--logins", type=int, default=64, help="login requests in the storm"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="logins in flight at once"
+    )
+    parser.add_argument("--workers", type=int, default=settings.PASSWORD_HASH_WORKERS)
+    parser.add_argument(
+        "--queue-limit", type=int, default=settings.PASSWORD_HASH_QUEUE_LIMIT
+    )
+    parser.add_argument(
+        "--interval-ms",
+        type=float,
+        default=10.0,
+        help="pause between bystander requests",
+    )
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
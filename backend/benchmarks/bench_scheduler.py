@@ -0,0 +1,183 @@
+"""Simulated comparison of the spaced repetition schedulers.
+
+Each simulated learner studies a deck for a number of days. Their memory
+follows FSRS with personal weights (the defaults perturbed per learner), and
+they review whatever the scheduler says is due. The run reports the reviews
+spent per card still retained at the end (expected recall summed over cards)
+and how often cards were recalled when reviewed, which a well-fitted FSRS
+holds near FSRS_DESIRED_RETENTION. It compares SM-2, FSRS with default
+weights, and FSRS with weights fitted to each learner's log from the
+default run. No database is used, but importing the models builds the app
+engine, so DATABASE_URL must be loadable:
+
+    DATABASE_URL=sqlite:///./bench.db python -m benchmarks.bench_scheduler \\
+        --learners 10 --cards 300 --days 365
+"""
+
+import argparse
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.services.scheduling import (
+    FSRS_DEFAULT_WEIGHTS,
+    FSRS_WEIGHT_BOUNDS,
+    CardStates,
+    Scheduler,
+    fit_fsrs_weights,
+    fsrs_memory_step,
+    fsrs_retrievability,
+    get_scheduler,
+)
+
+
+def simulate(
+    scheduler: Scheduler,
+    weights: Optional[np.ndarray],
+    true_weights: np.ndarray,
+    args: argparse.Namespace,
+    rng: np.random.Generator,
+) -> Tuple[int, float, int, List[List[int]], List[List[float]]]:
+    """Run one learner.
+
+    Returns (reviews, retained cards, reviews recalled, per-card grades,
+    per-card elapsed days).
+    """
+    cards = args.cards
+    states = CardStates(
+        review_count=np.zeros(cards, dtype=np.int64),
+        interval_days=np.zeros(cards, dtype=np.int64),
+        ease=np.full(cards, settings.INITIAL_EASE_FACTOR),
+        stability=np.full(cards, np.nan),
+        memory_difficulty=np.full(cards, np.nan),
+    )
+    true_stability, true_difficulty = np.full(cards, np.nan), np.full(cards, np.nan)
+    introduced_on = np.arange(cards) // args.new_per_day
+    due_on = introduced_on.copy()
+    last_review = np.zeros(cards)
+    grades: List[List[int]] = [[] for _ in range(cards)]
+    elapsed_log: List[List[float]] = [[] for _ in range(cards)]
+    reviews, recalls = 0, 0
+
+    for day in range(args.days):
+        due = np.flatnonzero(due_on == day)
+        if due.size == 0:
+            continue
+        first = states.review_count[due] == 0
+        elapsed = np.where(first, 0.0, day - last_review[due])
+
+        recall = fsrs_retrievability(elapsed, np.where(first, 1.0, true_stability[due]))
+        recalled = ~first & (rng.random(due.size) < recall)
+        # New cards are graded on a first look; recalled cards mostly "good",
+        # sometimes hard or easy
+        grade = np.where(
+            recalled | first,
+            rng.choice([2, 3, 4], size=due.size, p=[0.15, 0.7, 0.15]),
+            1,
+        )
+        rating = grade + 1
+
+        true_stability[due], true_difficulty[due] = fsrs_memory_step(
+            true_stability[due], true_difficulty[due], grade, elapsed, true_weights
+        )
+        states.put(due, scheduler.step(states.take(due), rating, elapsed, weights))
+        due_on[due] = day + states.interval_days[due]
+        last_review[due] = day
+        reviews += due.size
+        recalls += int(recalled.sum())
+        for card, card_grade, card_elapsed in zip(due, grade, elapsed):
+            grades[card].append(int(card_grade))
+            elapsed_log[card].append(float(card_elapsed))
+
+    seen = states.review_count > 0
+    retained = fsrs_retrievability(
+        args.days - last_review[seen], true_stability[seen]
+    ).sum()
+    return reviews, float(retained), recalls, grades, elapsed_log
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--learners", type=int, default=10)
+    parser.add_argument("--cards", type=int, default=300)
+    parser.add_argument("--new-per-day", type=int, default=10)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument(
+        "--spread",
+        type=float,
+        default=0.3,
+        help="log-normal spread of learners' true weights",
+    )
+    parser.add_argument("--iterations", type=int, default=settings.FSRS_FIT_ITERATIONS)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    totals = {name: [0, 0.0, 0] for name in ("sm2", "fsrs", "fsrs-fitted")}
+    fit_seconds, loss_before, loss_after = 0.0, [], []
+
+    for learner in range(args.learners):
+        true_weights = np.clip(
+            FSRS_DEFAULT_WEIGHTS
+            * rng.lognormal(0, args.spread, FSRS_DEFAULT_WEIGHTS.size),
+            *FSRS_WEIGHT_BOUNDS,
+        )
+        seed = int(rng.integers(1 << 31))
+        runs = {}
+        for name, scheduler in (
+            ("sm2", get_scheduler("sm2")),
+            ("fsrs", get_scheduler("fsrs")),
+        ):
+            runs[name] = simulate(
+                scheduler, None, true_weights, args, np.random.default_rng(seed)
+            )
+
+        start = time.perf_counter()
+        _, _, _, grades, elapsed = runs["fsrs"]
+        fitted, before, after = fit_fsrs_weights(
+            [card for card in grades if card],
+            [card for card in elapsed if card],
+            iterations=args.iterations,
+        )
+        fit_seconds += time.perf_counter() - start
+        loss_before.append(before)
+        loss_after.append(after)
+        runs["fsrs-fitted"] = simulate(
+            get_scheduler("fsrs"),
+            fitted,
+            true_weights,
+            args,
+            np.random.default_rng(seed),
+        )
+
+        for name, (reviews, retained, recalls, _, _) in runs.items():
+            totals[name][0] += reviews
+            totals[name][1] += retained
+            totals[name][2] += recalls
+
+    cards = args.learners * args.cards
+    print(
+        f"learners:          {args.learners} x {args.cards} cards over {args.days} days"
+    )
+    print(
+        f"fit:               log loss {np.mean(loss_before):.4f} -> "
+        f"{np.mean(loss_after):.4f}, "
+        f"{fit_seconds / args.learners:.1f} s per learner"
+    )
+    print(
+        f"{'scheduler':<14} {'reviews':>9} {'end retention':>14} "
+        f"{'recalled at review':>19} {'reviews/retained card':>22}"
+    )
+    for name, (reviews, retained, recalls) in totals.items():
+        # First looks at new cards are not recall tests
+        recall_rate = recalls / max(reviews - cards, 1)
+        print(
+            f"{name:<14} {reviews:>9} {retained / cards:>14.3f} "
+            f"{recall_rate:>19.3f} {reviews / retained:>22.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
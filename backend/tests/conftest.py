@@ -0,0 +1,4 @@
+import os
+
+# Importing the app builds its database engine; CI points this at Postgres
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
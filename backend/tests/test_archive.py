@@ -0,0 +1,144 @@
+import gzip
+import io
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.config import settings
+from app.core.lexical_index import LexicalIndex
+from app.core.vector_store import VectorStore
+from app.database import Base
+from app.models.user import ContentChunk, Document, Flashcard, Query, ReviewLog, User
+from app.services import archive
+from app.services.archive import ArchiveExporter, ArchiveImporter
+from app.services.embeddings import EmbeddingService, LocalEmbeddingBackend
+
+SOURCE, TARGET = "user-1", "user-2"
+
+
+@pytest.fixture
+def factory(monkeypatch):
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    for user_id in (SOURCE, TARGET):
+        db.add(
+            User(
+                id=user_id,
+                email=f"{user_id}@example.com",
+                username=user_id,
+                password_hash="x",
+            )
+        )
+    db.add(
+        Document(
+            id="doc-1",
+            user_id=SOURCE,
+            title="Spacing",
+            source_type="text",
+            status="completed",
+        )
+    )
+    for index in range(2):
+        db.add(
+            ContentChunk(
+                id=f"chunk-{index}",
+                document_id="doc-1",
+                user_id=SOURCE,
+                chunk_index=index,
+                content=f"Spaced repetition passage {index}",
+                content_hash=f"h{index}",
+            )
+        )
+    db.add(
+        Flashcard(
+            id="card-1",
+            user_id=SOURCE,
+            document_id="doc-1",
+            front="What is spacing?",
+            back="Reviewing over time",
+        )
+    )
+    db.add(
+        ReviewLog(
+            user_id=SOURCE,
+            flashcard_id="card-1",
+            rating=4,
+            elapsed_days=1.0,
+            scheduled_days=3,
+            reviewed_at=datetime(2026, 1, 2),
+        )
+    )
+    db.add(
+        Query(
+            user_id=SOURCE,
+            question="Why space reviews?",
+            context_sources=["doc-1"],
+        )
+    )
+    db.commit()
+    db.close()
+
+    monkeypatch.setattr(archive, "SessionLocal", factory)
+    yield factory
+    engine.dispose()
+
+
+def indexes(service, tmp_path):
+    service.vector_store = VectorStore(root=tmp_path, engine="numpy")
+    service.embedding_service = EmbeddingService(LocalEmbeddingBackend(dimension=8))
+    return service
+
+
+@pytest.mark.asyncio
+async def test_round_trip_rewrites_foreign_keys_to_new_ids(factory, tmp_path):
+    exporter = indexes(ArchiveExporter(), tmp_path)
+    importer = indexes(ArchiveImporter(), tmp_path)
+    importer.lexical_index = LexicalIndex(root=tmp_path)
+    data = b"".join(exporter.export(SOURCE))
+
+    db = factory()
+    counts = await importer.import_archive(TARGET, io.BytesIO(data), db)
+    assert counts == {
+        "documents": 1,
+        "content_chunks": 2,
+        "flashcards": 1,
+        "review_log": 1,
+        "learning_sessions": 0,
+        "queries": 1,
+    }
+
+    document = db.query(Document).filter(Document.user_id == TARGET).one()
+    chunks = db.query(ContentChunk).filter(ContentChunk.user_id == TARGET).all()
+    card = db.query(Flashcard).filter(Flashcard.user_id == TARGET).one()
+    log = db.query(ReviewLog).filter(ReviewLog.user_id == TARGET).one()
+    query = db.query(Query).filter(Query.user_id == TARGET).one()
+    assert document.id != "doc-1"
+    assert {chunk.document_id for chunk in chunks} == {document.id}
+    assert not {chunk.id for chunk in chunks} & {"chunk-0", "chunk-1"}
+    assert card.id != "card-1" and card.document_id == document.id
+    assert log.flashcard_id == card.id
+    assert query.context_sources == [document.id]
+    hits = importer.lexical_index.search(TARGET, "passage", 5)
+    assert {hit[0] for hit in hits} == {chunk.id for chunk in chunks}
+    db.close()
+
+
+@pytest.mark.parametrize(
+    "setting, lines, message",
+    [
+        ("MAX_IMPORT_RECORD_MB", [b"x" * (2 << 20)], "record is larger"),
+        ("MAX_IMPORT_UNCOMPRESSED_MB", [b"{}\n" * (1 << 20)], "uncompressed"),
+    ],
+)
+def test_reading_stops_at_the_decompression_caps(monkeypatch, setting, lines, message):
+    monkeypatch.setattr(settings, setting, 1)
+    stream = io.BytesIO(gzip.compress(b"".join(lines)))
+    with pytest.raises(ValueError, match=message):
+        list(ArchiveImporter._read_records(stream))
@@ -0,0 +1,151 @@
+import threading
+
+import pytest
+
+from app.workers.broker import (
+    DEAD,
+    QUEUED,
+    RUNNING,
+    SUCCEEDED,
+    RedisJobBroker,
+    SQLiteJobBroker,
+)
+
+
+def sqlite_broker():
+    return SQLiteJobBroker(path=":memory:", user_concurrency=2, lease_seconds=60)
+
+
+def redis_broker(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # fakeredis runs Lua scripts through lupa
+    import redis
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        redis.Redis,
+        "from_url",
+        classmethod(
+            lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs)
+        ),
+    )
+    return RedisJobBroker(url="redis://test", user_concurrency=2, lease_seconds=60)
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def broker(request, monkeypatch):
+    if request.param == "sqlite":
+        return sqlite_broker()
+    return redis_broker(monkeypatch)
+
+
+def test_dedup_returns_the_active_job(broker):
+    job, created = broker.enqueue("index", {"n": 1}, user_id="u", dedup_key="doc-1")
+    again, created_again = broker.enqueue(
+        "index", {"n": 2}, user_id="u", dedup_key="doc-1"
+    )
+    assert created and not created_again
+    assert again.id == job.id
+    assert again.payload == {"n": 1}
+
+
+def test_dedup_key_is_free_once_the_job_finishes(broker):
+    job, _ = broker.enqueue("index", {}, dedup_key="doc-1")
+    [claimed] = broker.claim(1)
+    broker.complete(claimed)
+    fresh, created = broker.enqueue("index", {}, dedup_key="doc-1")
+    assert created and fresh.id != job.id
+
+
+def test_concurrent_dedup_creates_one_job(broker):
+    results = []
+
+    def enqueue():
+        results.append(broker.enqueue("index", {}, dedup_key="race"))
+
+    threads = [threading.Thread(target=enqueue) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(created for _, created in results) == 1
+    assert len({job.id for job, _ in results}) == 1
+
+
+def test_claim_honours_user_cap_without_starving_others(broker):
+    for _ in range(50):
+        broker.enqueue("index", {}, user_id="busy")
+    for user in ("a", "b", "c"):
+        broker.enqueue("index", {}, user_id=user)
+
+    users = sorted(job.user_id for job in broker.claim(10))
+    assert users == ["a", "b", "busy", "busy", "c"]
+    assert broker.counts()[RUNNING] == 5
+
+
+def test_renew_keeps_the_lease_and_expiry_requeues(broker):
+    broker.enqueue("index", {}, user_id="u")
+    [job] = broker.claim(1)
+    assert job.status == RUNNING and job.attempts == 1
+    assert broker.renew(job)
+
+    # Let the lease lapse as if the worker had died
+    broker.lease_seconds = -1
+    assert broker.renew(job)
+    broker.lease_seconds = 60
+    [again] = broker.claim(1)
+    assert again.id == job.id and again.attempts == 2
+
+    # The dead worker's attempt no longer holds the lease
+    assert not broker.renew(job)
+    assert broker.renew(again)
+
+
+def test_fail_retries_then_gives_up(broker, monkeypatch):
+    monkeypatch.setattr("app.workers.broker.retry_delay", lambda attempts: 0)
+    job, _ = broker.enqueue("index", {}, max_attempts=2)
+
+    [claimed] = broker.claim(1)
+    broker.fail(claimed, "boom")
+    retried = broker.get(job.id)
+    assert retried.status == QUEUED and retried.last_error == "boom"
+
+    [claimed] = broker.claim(1)
+    assert claimed.attempts == 2
+    broker.fail(claimed, "boom again")
+    assert broker.get(job.id).status == DEAD
+    assert broker.claim(1) == []
+
+
+def test_permanent_failure_is_not_retried(broker):
+    job, _ = broker.enqueue("index", {})
+    [claimed] = broker.claim(1)
+    broker.fail(claimed, "bad payload", retry=False)
+    assert broker.get(job.id).status == DEAD
+
+
+def test_stale_worker_cannot_finish_a_reclaimed_job(broker):
+    job, _ = broker.enqueue("index", {}, user_id="u")
+    [stale] = broker.claim(1)
+    broker.lease_seconds = -1
+    broker.renew(stale)
+    broker.lease_seconds = 60
+    [current] = broker.claim(1)
+
+    assert not broker.complete(stale)
+    assert not broker.fail(stale, "late failure")
+    assert not broker.fail(stale, "late failure", retry=False)
+    assert broker.get(job.id).status == RUNNING
+    assert broker.claim(1) == []
+
+    assert broker.complete(current)
+    assert broker.get(job.id).status == SUCCEEDED
+    assert broker.counts().get(RUNNING, 0) == 0
+
+
+def test_finished_job_cannot_be_finished_again(broker):
+    broker.enqueue("index", {})
+    [job] = broker.claim(1)
+    assert broker.fail(job, "boom", retry=False)
+    assert not broker.complete(job)
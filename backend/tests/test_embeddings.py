@@ -0,0 +1,51 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.services.embeddings import EmbeddingService, LocalEmbeddingBackend
+
+
+class SlowBackend(LocalEmbeddingBackend):
+    def __init__(self):
+        super().__init__(dimension=8)
+        self.release = asyncio.Event()
+        self.calls = 0
+
+    async def embed(self, texts):
+        self.calls += 1
+        await self.release.wait()
+        return await super().embed(texts)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_shared_text():
+    backend = SlowBackend()
+    service = EmbeddingService(backend, batch_wait_ms=1)
+
+    first = asyncio.create_task(service.embed_texts(["shared text"]))
+    second = asyncio.create_task(service.embed_texts(["shared text"]))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    await asyncio.sleep(0)
+    # Callers arriving after the cancellation share the same batch
+    third = asyncio.create_task(service.embed_texts(["shared text"]))
+    await asyncio.sleep(0)
+    backend.release.set()
+
+    vectors = await asyncio.gather(second, third)
+    assert first.cancelled()
+    assert np.array_equal(vectors[0], vectors[1])
+    assert backend.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_identical_texts_are_embedded_once():
+    backend = SlowBackend()
+    backend.release.set()
+    service = EmbeddingService(backend, batch_wait_ms=1)
+
+    matrix = await service.embed_texts(["a", "b", "a"])
+    assert matrix.shape == (3, 8)
+    assert np.array_equal(matrix[0], matrix[2])
+    assert service.texts_embedded == 2
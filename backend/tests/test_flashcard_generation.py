@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models.user import ContentChunk, Document, Flashcard, User
+from app.services import flashcard_generation
+from app.services.flashcard_generation import FlashcardGenerator
+from app.services.llm import LLMResult
+
+USER_ID = "user-1"
+DOCUMENT_ID = "doc-1"
+REPLY = '[{"passage": 1, "front": "What is FSRS?", "back": "A review scheduler"}]'
+
+
+class FakeLLM:
+    def __init__(self):
+        self.calls = 0
+
+    async def generate(self, prompt, max_tokens=None):
+        self.calls += 1
+        return LLMResult(text=REPLY, provider="fake")
+
+
+@pytest.fixture
+def session_threads(monkeypatch):
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    db.add(
+        User(
+            id=USER_ID,
+            email="learner@example.com",
+            username="learner",
+            password_hash="x",
+        )
+    )
+    db.add(
+        Document(
+            id=DOCUMENT_ID,
+            user_id=USER_ID,
+            title="Spacing",
+            source_type="text",
+            status="completed",
+        )
+    )
+    db.add(
+        ContentChunk(
+            document_id=DOCUMENT_ID,
+            user_id=USER_ID,
+            chunk_index=0,
+            content="FSRS schedules reviews.",
+            content_hash="h0",
+        )
+    )
+    db.commit()
+    db.close()
+
+    # Threads each session is opened on
+    threads = []
+
+    def open_session():
+        threads.append(threading.get_ident())
+        return factory()
+
+    monkeypatch.setattr(flashcard_generation, "SessionLocal", open_session)
+    yield threads, factory
+    engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_generation_keeps_sessions_off_the_event_loop(session_threads):
+    threads, factory = session_threads
+    generator = FlashcardGenerator()
+    generator.llm = FakeLLM()
+
+    result = await generator.generate_for_document(DOCUMENT_ID)
+
+    assert result["status"] == "completed"
+    assert result["created"] == 1
+    assert threads and threading.get_ident() not in threads
+    db = factory()
+    assert [card.front for card in db.query(Flashcard)] == ["What is FSRS?"]
+    db.close()
+
+    again = await generator.generate_for_document(DOCUMENT_ID)
+    assert again["status"] == "skipped"
+    assert generator.llm.calls == 1
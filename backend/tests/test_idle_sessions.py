@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models.user import LearningSession, User
+from app.services.learning import LearningService
+
+USER_ID = "user-1"
+
+
+@pytest_asyncio.fixture
+async def db():
+    engine = create_async_engine(
+        "sqlite+aiosqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        session.add(
+            User(
+                id=USER_ID,
+                email="learner@example.com",
+                username="learner",
+                password_hash="x",
+            )
+        )
+        await session.commit()
+        yield session
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_long_active_sessions_do_not_starve_the_sweep(db):
+    now = datetime.utcnow()
+    # Started first but still in use, so it sorts ahead of the idle one by start
+    db.add(
+        LearningSession(
+            id="active",
+            user_id=USER_ID,
+            session_type="flashcards",
+            start_time=now - timedelta(hours=3),
+            last_activity_at=now - timedelta(minutes=1),
+        )
+    )
+    db.add(
+        LearningSession(
+            id="idle",
+            user_id=USER_ID,
+            session_type="flashcards",
+            start_time=now - timedelta(hours=2),
+            last_activity_at=now - timedelta(hours=1),
+        )
+    )
+    await db.commit()
+
+    closed = await LearningService().close_idle_sessions(db, limit=1)
+
+    assert closed == 1
+    active = await db.get(LearningSession, "active", populate_existing=True)
+    idle = await db.get(LearningSession, "idle", populate_existing=True)
+    assert active.end_time is None
+    assert idle.end_time == now - timedelta(hours=1)
@@ -0,0 +1,20 @@
+from app.config import settings
+from app.core.lexical_index import LexicalIndex
+
+
+def test_idle_reader_sees_another_writers_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "LEXICAL_SNAPSHOT_ROWS", 2)
+    # Two indexes over one directory stand in for two processes
+    writer = LexicalIndex(root=tmp_path)
+    reader = LexicalIndex(root=tmp_path)
+
+    writer.add("u1", ["c1", "c2", "c3"], ["apple pie", "banana bread", "cherry tart"])
+    assert [hit[0] for hit in reader.search("u1", "apple", 5)] == ["c1"]
+
+    # Lands in a new generation whose files the reader has never looked at
+    writer.delete("u1", ["c1"])
+    writer.add("u1", ["c4", "c5", "c6"], ["damson jam", "elderflower", "fig roll"])
+
+    assert reader.search("u1", "apple", 5) == []
+    assert [hit[0] for hit in reader.search("u1", "damson", 5)] == ["c4"]
+    assert reader.count("u1") == 5
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.services.llm import LLMRouter
+
+PROMPT = "Context: Leases expire. Workers renew them. Question: what do workers renew?"
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MAX_CONCURRENCY", 2)
+    monkeypatch.setattr(settings, "LLM_TIMEOUT_SECONDS", 0.5)
+    router = LLMRouter(primary="local", fallback="")
+    slot = router._slot("local")
+    slot.provider.first_token_delay = 0
+    slot.provider.token_delay = 0.01
+    return router
+
+
+@pytest.mark.asyncio
+async def test_abandoned_streams_give_their_slot_back(router):
+    slot = router._slot("local")
+    async with asyncio.timeout(2):
+        # More abandoned streams than slots: each must be released for the next to open
+        for _ in range(5):
+            stream = await router.open_stream(PROMPT)
+            async for _ in stream:
+                break
+            await stream.aclose()
+            await stream.aclose()
+    assert slot.in_flight == 0
+    assert slot.semaphore._value == settings.LLM_MAX_CONCURRENCY
+    assert slot.breaker.failures == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_read_to_the_end_releases_its_slot(router):
+    slot = router._slot("local")
+    stream = await router.open_stream(PROMPT)
+    text = "".join([piece async for piece in stream])
+    assert "renew" in text
+    assert slot.in_flight == 0
+    assert slot.semaphore._value == settings.LLM_MAX_CONCURRENCY
+
+
+@pytest.mark.asyncio
+async def test_stalled_stream_fails_and_releases(router):
+    slot = router._slot("local")
+    slot.provider.token_delay = 1
+    stream = await router.open_stream(PROMPT)
+    with pytest.raises(TimeoutError):
+        async for _ in stream:
+            pass
+    assert slot.in_flight == 0
+    assert slot.breaker.failures == 1
+
+
+@pytest.mark.asyncio
+async def test_waiting_for_a_slot_is_not_a_timeout(router):
+    slot = router._slot("local")
+    held = [
+        await router.open_stream(PROMPT) for _ in range(settings.LLM_MAX_CONCURRENCY)
+    ]
+
+    async def release_later():
+        await asyncio.sleep(settings.LLM_TIMEOUT_SECONDS * 2)
+        for stream in held:
+            await stream.aclose()
+
+    releasing = asyncio.create_task(release_later())
+    result = await router.generate(PROMPT)
+    await releasing
+    assert result.provider == "local"
+    assert slot.breaker.failures == 0
+    assert slot.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_coalesced_prompt(router):
+    slot = router._slot("local")
+    slot.provider.first_token_delay = 0.05
+    first = asyncio.create_task(router.generate(PROMPT))
+    second = asyncio.create_task(router.generate(PROMPT))
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    result = await second
+    assert first.cancelled()
+    assert "renew" in result.text
+    assert router._inflight == {}
+
+
+@pytest.mark.asyncio
+async def test_call_is_cancelled_once_every_caller_left(router):
+    slot = router._slot("local")
+    slot.provider.first_token_delay = 0.2
+    callers = [asyncio.create_task(router.generate(PROMPT)) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    [call] = router._inflight.values()
+    for caller in callers:
+        caller.cancel()
+    await asyncio.gather(*callers, return_exceptions=True)
+    await asyncio.sleep(0)
+
+    assert call.task.cancelled()
+    assert router._inflight == {}
+    assert slot.in_flight == 0
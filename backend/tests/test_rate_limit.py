@@ -0,0 +1,67 @@
+import pytest
+
+from app.core.rate_limit import RateLimit, _decide
+
+PER_SECOND = RateLimit(3, 3)  # one request per second, bursts of three
+
+
+def hit(checks, tats, now):
+    decision, new_tats = _decide(checks, tats, now)
+    return decision, new_tats or tats
+
+
+def test_burst_then_reject():
+    checks = [("user", PER_SECOND)]
+    tats = [0.0]
+    for remaining in (2, 1, 0):
+        decision, tats = hit(checks, tats, 0.0)
+        assert decision.allowed
+        assert decision.remaining == remaining
+
+    decision, new_tats = _decide(checks, tats, 0.0)
+    assert not decision.allowed
+    assert new_tats == []
+    assert decision.retry_after == pytest.approx(1.0)
+    assert decision.reset_after == pytest.approx(3.0)
+
+
+def test_allowed_again_after_retry_after():
+    checks = [("user", PER_SECOND)]
+    tats = [3000.0]  # three requests at t=0
+    assert not _decide(checks, tats, 999.0)[0].allowed
+    decision, new_tats = _decide(checks, tats, 1000.0)
+    assert decision.allowed
+    assert decision.remaining == 0
+    assert new_tats == [4000.0]
+
+
+def test_idle_key_is_fully_replenished():
+    decision, new_tats = _decide([("user", PER_SECOND)], [500.0], 60000.0)
+    assert decision.allowed
+    assert decision.remaining == 2
+    assert new_tats == [61000.0]
+    assert decision.reset_after == pytest.approx(1.0)
+
+
+def test_tightest_limit_is_reported():
+    route = RateLimit(2, 10)
+    checks = [("user", RateLimit(100, 60)), ("user|/api/v1/qna", route)]
+    decision, new_tats = _decide(checks, [0.0, 0.0], 0.0)
+    assert decision.allowed
+    assert decision.limit == route
+    assert decision.remaining == 1
+    assert len(new_tats) == 2
+
+
+def test_rejection_by_one_limit_charges_none():
+    checks = [("user", RateLimit(100, 60)), ("user|/api/v1/qna", RateLimit(1, 10))]
+    decision, new_tats = _decide(checks, [600.0, 10000.0], 0.0)
+    assert not decision.allowed
+    assert new_tats == []
+    assert decision.retry_after == pytest.approx(10.0)
+
+
+@pytest.mark.parametrize("rule", ["20", "0/60", "20/0", "a/b"])
+def test_parse_rejects_bad_rules(rule):
+    with pytest.raises(ValueError):
+        RateLimit.parse(rule)
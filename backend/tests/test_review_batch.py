@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models.user import Flashcard, ReviewLog, User
+from app.schemas.learning import BatchReviewItem, ReviewStatus
+from app.services.learning import LearningService
+
+USER_ID = "user-1"
+
+
+@pytest.fixture
+def db():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(
+        User(
+            id=USER_ID,
+            email="learner@example.com",
+            username="learner",
+            password_hash="x",
+        )
+    )
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def add_card(db, card_id, last_review=None):
+    db.add(
+        Flashcard(
+            id=card_id,
+            user_id=USER_ID,
+            front=f"Question {card_id}",
+            back="Answer",
+            last_review=last_review,
+        )
+    )
+    db.commit()
+
+
+def review(card_id, rating, reviewed_at):
+    return BatchReviewItem(flashcard_id=card_id, rating=rating, reviewed_at=reviewed_at)
+
+
+def test_reviews_replay_in_timestamp_order(db):
+    add_card(db, "a")
+    now = datetime.utcnow()
+    first, second = now - timedelta(days=2), now - timedelta(days=1)
+    # Submitted newest first; the older review must be applied first
+    reviews = [review("a", 4, second), review("a", 1, first)]
+
+    results, card_ids, _ = LearningService()._write_reviews(USER_ID, reviews, db)
+    db.commit()
+
+    assert [result.status for result in results] == [ReviewStatus.APPLIED] * 2
+    # Results come back in request order: the lapse (applied first) is due after a day
+    assert results[1].interval_days == 1
+    assert results[0].next_review == second + timedelta(days=results[0].interval_days)
+    assert card_ids == ["a"]
+
+    card = db.get(Flashcard, "a")
+    assert card.review_count == 2
+    assert card.last_review == second
+    logged = db.query(ReviewLog.rating).order_by(ReviewLog.reviewed_at).all()
+    assert [rating for rating, in logged] == [1, 4]
+
+
+def test_rounds_advance_each_card_once_per_review(db):
+    add_card(db, "a")
+    add_card(db, "b")
+    start = datetime.utcnow() - timedelta(days=3)
+    reviews = [
+        review("a", 4, start),
+        review("b", 4, start + timedelta(hours=1)),
+        review("a", 4, start + timedelta(days=1)),
+        review("a", 4, start + timedelta(days=2)),
+    ]
+
+    results, _, _ = LearningService()._write_reviews(USER_ID, reviews, db)
+    db.commit()
+
+    assert all(result.status == ReviewStatus.APPLIED for result in results)
+    assert db.get(Flashcard, "a").review_count == 3
+    assert db.get(Flashcard, "b").review_count == 1
+
+
+def test_stale_missing_and_invalid_reviews_are_reported(db):
+    now = datetime.utcnow()
+    add_card(db, "a", last_review=now - timedelta(hours=1))
+    reviews = [
+        review("a", 4, now - timedelta(days=1)),
+        review("missing", 4, now),
+        review("a", 9, now),
+    ]
+
+    results, card_ids, _ = LearningService()._write_reviews(USER_ID, reviews, db)
+
+    assert [result.status for result in results] == [
+        ReviewStatus.STALE,
+        ReviewStatus.NOT_FOUND,
+        ReviewStatus.INVALID,
+    ]
+    assert card_ids == []
+    assert db.get(Flashcard, "a").review_count == 0
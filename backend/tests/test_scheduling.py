@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.services.scheduling import (
+    FSRS_DEFAULT_WEIGHTS,
+    CardStates,
+    FSRSScheduler,
+    SM2Scheduler,
+    fsrs_grade,
+    fsrs_retrievability,
+)
+
+
+def new_cards(count: int) -> CardStates:
+    return CardStates(
+        review_count=np.zeros(count, dtype=np.int64),
+        interval_days=np.zeros(count, dtype=np.int64),
+        ease=np.full(count, settings.INITIAL_EASE_FACTOR),
+        stability=np.full(count, np.nan),
+        memory_difficulty=np.full(count, np.nan),
+    )
+
+
+def test_sm2_intervals_grow_one_six_then_by_ease():
+    scheduler = SM2Scheduler()
+    states = new_cards(1)
+    intervals = []
+    for _ in range(3):
+        states = scheduler.step(states, np.array([4]), np.zeros(1))
+        intervals.append(int(states.interval_days[0]))
+    assert intervals == [1, 6, int(6 * settings.INITIAL_EASE_FACTOR)]
+    assert states.ease[0] == pytest.approx(settings.INITIAL_EASE_FACTOR)
+
+
+def test_sm2_lapse_resets_interval_and_floors_ease():
+    scheduler = SM2Scheduler()
+    states = CardStates(
+        review_count=np.array([5]),
+        interval_days=np.array([40]),
+        ease=np.array([settings.MIN_EASE_FACTOR + 0.1]),
+        stability=np.array([np.nan]),
+        memory_difficulty=np.array([np.nan]),
+    )
+    states = scheduler.step(states, np.array([1]), np.zeros(1))
+    assert states.interval_days[0] == 1
+    assert states.ease[0] == settings.MIN_EASE_FACTOR
+    assert states.review_count[0] == 6
+
+
+def test_sm2_is_elementwise():
+    states = SM2Scheduler().step(new_cards(3), np.array([1, 3, 5]), np.zeros(3))
+    ease = settings.INITIAL_EASE_FACTOR
+    assert states.ease == pytest.approx([ease - 0.2, ease - 0.14, ease + 0.1])
+
+
+def test_fsrs_grade_mapping():
+    assert fsrs_grade(np.array([1, 2, 3, 4, 5])).tolist() == [1, 1, 2, 3, 4]
+
+
+def test_fsrs_first_review_uses_initial_stability():
+    states = FSRSScheduler().step(new_cards(4), np.array([2, 3, 4, 5]), np.zeros(4))
+    assert states.stability == pytest.approx(FSRS_DEFAULT_WEIGHTS[:4])
+    # At 90% retention the interval is the stability, rounded and at least a day
+    expected = np.clip(np.rint(FSRS_DEFAULT_WEIGHTS[:4]), 1, None)
+    assert states.interval_days.tolist() == expected.astype(int).tolist()
+    assert np.all(np.diff(states.memory_difficulty) < 0)
+
+
+def test_fsrs_retrievability_is_retention_at_stability():
+    assert fsrs_retrievability(np.array([7.0]), np.array([7.0]))[0] == pytest.approx(
+        0.9
+    )
+
+
+def test_fsrs_recall_grows_and_lapse_shrinks_stability():
+    scheduler = FSRSScheduler()
+    states = scheduler.step(new_cards(2), np.array([4, 4]), np.zeros(2))
+    elapsed = states.interval_days.astype(np.float64)
+    after = scheduler.step(states, np.array([4, 1]), elapsed)
+    assert after.stability[0] > states.stability[0]
+    assert after.stability[1] < states.stability[1]
+    assert after.interval_days[0] > after.interval_days[1]
+
+
+def test_fsrs_seeds_cards_scheduled_by_sm2():
+    states = CardStates(
+        review_count=np.array([3]),
+        interval_days=np.array([15]),
+        ease=np.array([settings.INITIAL_EASE_FACTOR]),
+        stability=np.array([np.nan]),
+        memory_difficulty=np.array([np.nan]),
+    )
+    states = FSRSScheduler().step(states, np.array([4]), np.array([15.0]))
+    assert states.stability[0] > 15
+    assert not np.isnan(states.memory_difficulty[0])
@@ -0,0 +1,73 @@
+import base64
+import json
+from datetime import timedelta
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from app.core.security import create_access_token, create_cursor_token
+from app.schemas.search import SearchMode
+from app.services.search import SearchCursor, query_digest
+
+
+def make_cursor(**overrides) -> SearchCursor:
+    fields = dict(
+        user_id="user-1",
+        mode=SearchMode.HYBRID.value,
+        digest=query_digest("spaced repetition"),
+        position=10,
+        last_id="chunk-10",
+        last_score=0.5,
+    )
+    fields.update(overrides)
+    return SearchCursor(**fields)
+
+
+def rejected(token: str) -> bool:
+    with pytest.raises(HTTPException) as error:
+        SearchCursor.decode(token)
+    return error.value.status_code == 400
+
+
+def test_round_trip():
+    vector = np.array([0.25, -0.5, 1.0], dtype=np.float32)
+    cursor = SearchCursor.decode(make_cursor(vector=vector).encode())
+    assert cursor.position == 10 and cursor.last_id == "chunk-10"
+    assert np.allclose(cursor.vector, vector)
+    assert cursor.matches("user-1", "  Spaced Repetition ", SearchMode.HYBRID)
+
+
+def test_tampered_payload_is_rejected():
+    header, payload, signature = make_cursor().encode().split(".")
+    data = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    data["uid"] = "someone-else"
+    forged = base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+    assert rejected(f"{header}.{forged}.{signature}")
+
+
+def test_garbage_is_rejected():
+    assert rejected("not-a-cursor")
+
+
+def test_expired_cursor_is_rejected():
+    assert rejected(create_cursor_token({"uid": "user-1"}, timedelta(seconds=-1)))
+
+
+def test_access_token_is_not_a_cursor():
+    assert rejected(create_access_token({"sub": "user-1"}))
+
+
+def test_cursor_only_matches_its_own_search():
+    cursor = make_cursor()
+    assert not cursor.matches("user-2", "spaced repetition", SearchMode.HYBRID)
+    assert not cursor.matches("user-1", "other query", SearchMode.HYBRID)
+    assert not cursor.matches("user-1", "spaced repetition", SearchMode.LEXICAL)
+
+
+def test_resume_position_seeks_when_ranking_changed():
+    hits = [("chunk-1", 0.9), ("chunk-7", 0.6), ("chunk-10", 0.5), ("chunk-11", 0.5)]
+    assert make_cursor(position=3).resume_position(hits) == 3
+    # The hit the page ended on moved: resume after (last_score, last_id)
+    assert make_cursor(position=2).resume_position(hits) == 3
+    assert make_cursor(position=2, last_score=0.1).resume_position(hits) == 4
@@ -0,0 +1,108 @@
+import json
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models.user import Concept, ContentChunk, Document, Summary, User
+from app.services import summarization
+from app.services.llm import LLMResult
+from app.services.summarization import DocumentSummarizer
+
+USER_ID = "user-1"
+DOCUMENT_ID = "doc-1"
+MAP_REPLY = json.dumps(
+    {
+        "summary": "Spacing reviews out improves recall.",
+        "concepts": [{"name": "Spacing effect", "importance": 0.9}],
+        "relationships": [],
+    }
+)
+
+
+class FakeLLM:
+    def __init__(self):
+        self.calls = 0
+
+    async def generate(self, prompt, max_tokens=None):
+        self.calls += 1
+        if "Passage:" in prompt:
+            return LLMResult(text=MAP_REPLY, provider="fake")
+        return LLMResult(
+            text="Reviews spaced over time are remembered.", provider="fake"
+        )
+
+
+@pytest.fixture
+def session_threads(monkeypatch):
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    db.add(
+        User(
+            id=USER_ID,
+            email="learner@example.com",
+            username="learner",
+            password_hash="x",
+        )
+    )
+    db.add(
+        Document(
+            id=DOCUMENT_ID,
+            user_id=USER_ID,
+            title="Spacing",
+            source_type="text",
+            status="completed",
+        )
+    )
+    for index in range(2):
+        db.add(
+            ContentChunk(
+                document_id=DOCUMENT_ID,
+                user_id=USER_ID,
+                chunk_index=index,
+                content=f"Passage {index} about spaced repetition.",
+                content_hash=f"h{index}",
+            )
+        )
+    db.commit()
+    db.close()
+
+    # Threads each session is opened on
+    threads = []
+
+    def open_session():
+        threads.append(threading.get_ident())
+        return factory()
+
+    monkeypatch.setattr(summarization, "SessionLocal", open_session)
+    yield threads, factory
+    engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_summarizing_keeps_sessions_off_the_event_loop(session_threads):
+    threads, factory = session_threads
+    summarizer = DocumentSummarizer()
+    summarizer.llm = FakeLLM()
+
+    result = await summarizer.summarize_document(DOCUMENT_ID, "brief")
+
+    assert result["status"] == "completed"
+    assert result["concepts"] == 1
+    assert threads and threading.get_ident() not in threads
+    db = factory()
+    summary = db.query(Summary).one()
+    assert summary.content == "Reviews spaced over time are remembered."
+    assert [concept.name for concept in db.query(Concept)] == ["Spacing effect"]
+    db.close()
+
+    again = await summarizer.summarize_document(DOCUMENT_ID, "brief")
+    assert again == {"status": "skipped", "reason": "summary is up to date"}
+    assert summarizer.llm.calls == 3